@@ -0,0 +1,911 @@
+"""Simulated Waveforms SDK (dwf) library for hardware-free testing & benchmarking.
+
+    Drop-in replacement for the 'dwf' object from ad2_tools.load_dwf():
+    implements the FDwf* calls used in this repo with the same ctypes
+    pass-by-reference arguments (byref(), ctypes arrays, plain ints), so the
+    acquisition scripts run unchanged on a plain PC with no Analog Discovery 2.
+
+    Select it with:
+        dwf = ad2.load_dwf(backend='sim')
+    or for existing scripts, set an environment variable:
+        AD2_BACKEND=sim python my_custom_trigger_16bit_2ch.py -f <folder>
+
+    Optional environment variables (see SimDwf for details):
+        AD2_SIM_TRIGGER_RATE    external trigger rate (Hz) when the wavegen is not running (default 100)
+        AD2_SIM_CALL_LATENCY    extra latency per SDK status/data call (sec, default 20e-6)
+        AD2_SIM_N_DEVICES       number of simulated devices (default 1); devices without a running
+                                wavegen trigger on the pulses of the one that has it (pulse tee'd
+                                into every ch1 / wired to every trigger input)
+
+    What is simulated:
+        - triggered single acquisitions (acqmodeSingle): triggers every TR
+          (wavegen run + wait time, or AD2_SIM_TRIGGER_RATE), each acquisition is an
+          excitation pulse + a few decaying echoes + noise, with slow echo motion
+          (so M-mode images show something). Triggers that arrive before the
+          scope is re-armed are missed, like the real device.
+        - record mode (acqmodeRecord): continuous wavegen sine; samples are lost
+          (and flagged corrupted) if the sample rate is more than the USB link can carry.
+        - USB transfer time for the data of each acquisition, re-arm time & per-call latency.
+        - FDwfAnalogInStatusTime timestamps (host wall clock at the trigger).
+
+    Everything else (most 'Set' calls) is just stored, and 'Get' calls return it.
+
+    NOTE: the timing model is rough; it is for comparing loop versions against each other
+    (and catching regressions), not for predicting exact hardware numbers.
+"""
+
+# TODO digital in/out, AnalogIO, multiple wavegen nodes (AM/FM) are not simulated
+
+
+from ctypes import *
+import numpy as np
+import time
+import os
+
+
+# DWF constants used here (values from dwfconstants.py; plain ints here)
+STATE_READY = 0
+STATE_ARMED = 1
+STATE_DONE = 2
+STATE_TRIGGERED = 3     # aka. DwfStateRunning
+STATE_CONFIG = 4
+
+ACQMODE_SINGLE = 0
+ACQMODE_RECORD = 3
+
+FUNC_SINE = 1
+FUNC_SQUARE = 2
+FUNC_CUSTOM = 30
+
+DECI_ANALOG_IN_CHANNEL_COUNT = 1
+DECI_ANALOG_OUT_CHANNEL_COUNT = 2
+DECI_ANALOG_IN_BUFFER_SIZE = 7
+DECI_ANALOG_OUT_BUFFER_SIZE = 8
+
+# Analog Discovery 2 device configurations (FDwfDeviceConfigOpen index):
+#   (scope buffer size, wavegen buffer size)
+# TODO only the first few configs; use FDwfEnumConfigInfo on real hardware for the full list
+AD2_CONFIGS = [
+    (8192, 4096),
+    (16384, 1024),
+    (2048, 16384),
+    (512, 256),
+    ]
+
+AD2_MAX_SAMPLE_RATE = 100e6     # Hz
+AD2_N_SCOPE_CHANNELS = 2
+AD2_N_WAVEGEN_CHANNELS = 2
+
+SIM_VERSION = b'3.17.1-sim'
+
+C_WATER = 1482.3    # m/s, speed of sound for the simulated echoes
+
+
+# ctypes argument helpers:
+# (the SDK is called with c_int(...), plain Python ints, byref(...), ctypes arrays, etc.)
+
+def _val(arg):
+    """Return the Python value of a ctypes scalar or plain Python number."""
+    return getattr(arg, 'value', arg)
+
+
+def _addr(arg):
+    """Return the memory address of a pass-by-reference argument.
+
+        Handles byref() (including byte offsets), ctypes arrays/scalars,
+        pointers, c_void_p and plain integer addresses.
+    """
+    if isinstance(arg, int):
+        return arg
+    if isinstance(arg, c_void_p):
+        return arg.value
+    if isinstance(arg, (Array, Structure, c_int, c_uint, c_byte, c_ubyte, c_double, c_short,
+                        c_ushort, c_long, c_ulong, c_float, c_bool, c_char)):
+        return addressof(arg)
+    return cast(arg, c_void_p).value    # byref() and pointers
+
+
+def _put(arg, ctype, value):
+    """Write a scalar value through a pass-by-reference argument, as the given C type."""
+    ctype.from_address(_addr(arg)).value = value
+
+
+class SimDevice():
+    """State of 1 simulated Analog Discovery 2 (1 open device handle)."""
+
+    def __init__(self, index, config, rng):
+        self.index = index
+        self.config = config
+        self.rng = rng
+
+        self.ain_buffer_max, self.aout_buffer_max = AD2_CONFIGS[config]
+
+        # scope settings:
+        self.ain_frequency = 20e6
+        self.ain_buffer_size = self.ain_buffer_max
+        self.ain_enabled = [True] * AD2_N_SCOPE_CHANNELS
+        self.ain_range = [5.0] * AD2_N_SCOPE_CHANNELS
+        self.ain_offset = [0.0] * AD2_N_SCOPE_CHANNELS
+        self.ain_attenuation = [1.0] * AD2_N_SCOPE_CHANNELS
+        self.ain_filter = [1] * AD2_N_SCOPE_CHANNELS      # filterAverage is the SDK default
+        self.ain_acqmode = ACQMODE_SINGLE
+        self.ain_record_length = 0.
+        self.trigger_position = 0.
+        self.trigger_holdoff = 0.
+        self.trigger_timeout = 1.
+        self.trigger_level = 0.
+        self.settings = {}          # everything else that is only stored (name -> args)
+
+        # wavegen settings (per channel):
+        self.aout_enabled = [False] * AD2_N_WAVEGEN_CHANNELS
+        self.aout_function = [FUNC_SINE] * AD2_N_WAVEGEN_CHANNELS
+        self.aout_frequency = [1e3] * AD2_N_WAVEGEN_CHANNELS
+        self.aout_amplitude = [1.0] * AD2_N_WAVEGEN_CHANNELS
+        self.aout_offset = [0.0] * AD2_N_WAVEGEN_CHANNELS
+        self.aout_data = [None] * AD2_N_WAVEGEN_CHANNELS
+        self.aout_run = [0.0] * AD2_N_WAVEGEN_CHANNELS
+        self.aout_wait = [0.0] * AD2_N_WAVEGEN_CHANNELS
+        self.aout_repeat = [0] * AD2_N_WAVEGEN_CHANNELS
+        self.aout_running = [False] * AD2_N_WAVEGEN_CHANNELS
+        self.aout_start_time = [0.0] * AD2_N_WAVEGEN_CHANNELS
+
+        # acquisition state:
+        self.ain_running = False
+        self.state = STATE_READY
+        self.start_time = 0.        # perf_counter time of first trigger period
+        self.period = 0.            # trigger period (TR)
+        self.max_triggers = None    # None = unlimited
+        self.next_trigger = 0       # index of next trigger to acquire
+        self.armed_time = 0.        # time the scope is (re-)armed
+        self.last_trigger_time = 0.
+        self.n_acquired = 0
+        self.n_missed = 0           # triggers that came before the scope was re-armed
+
+        self.last_data = [np.zeros(self.ain_buffer_size, dtype=np.int16) for ch in range(AD2_N_SCOPE_CHANNELS)]
+        self._template_key = None
+
+        # record mode state:
+        self.record_start = 0.
+        self.record_last = 0.
+        self.record_fifo = 0.       # samples waiting in the device
+        self.record_pos = 0         # sample index of the next sample to read
+        self.record_available = 0
+        self.record_done = False
+
+
+class SimDwf():
+    """Simulated Waveforms SDK library object (see module docstring).
+
+        Use the same way as the real 'dwf' object, ie. dwf.FDwfAnalogInStatus(hdwf, c_int(1), byref(sts))
+    """
+
+    def __init__(self,
+                 n_devices=1,
+                 trigger_rate=100.,
+                 call_latency=20e-6,
+                 rearm_time=50e-6,
+                 usb_bytes_per_sec=20e6,
+                 echo_depths_mm=(10., 25., 40.),
+                 echo_amplitudes=(0.3, 0.12, 0.05),
+                 motion_mm=0.5,
+                 motion_hz=0.25,
+                 noise_volts=0.005,
+                 ticks_per_sec=1000,
+                 spin_latency=False,
+                 seed=None,
+                 ):
+        """
+            n_devices = number of simulated devices (for FDwfEnum/FDwfDeviceOpen)
+            trigger_rate = trigger rate (Hz) if the wavegen is not running (ie. external/MRI triggers)
+                            if the wavegen is running, TR = wavegen run time + wait time
+            call_latency = latency added to each status/data call (sec)
+            rearm_time = time after an acquisition is done before the next trigger is accepted (sec)
+            usb_bytes_per_sec = USB transfer rate, for acquisition data transfer time
+                                & record mode lost samples (README: ~1-2 MHz record rate, ie. 2-4 MB/s)
+            echo_depths_mm, echo_amplitudes = simulated reflectors (depth in mm, amplitude relative to pulse)
+            motion_mm, motion_hz = slow sinusoidal motion of the reflectors
+            noise_volts = std. dev. of additive noise
+            ticks_per_sec = FDwfAnalogInStatusTime tick resolution
+            spin_latency = busy-wait for latencies instead of sleep
+                            (more precise, but holds the GIL, unlike a real SDK call)
+            seed = random seed for repeatable noise
+        """
+        self.n_devices = n_devices
+        self.trigger_rate = trigger_rate
+        self.call_latency = call_latency
+        self.rearm_time = rearm_time
+        self.usb_bytes_per_sec = usb_bytes_per_sec
+        self.echo_depths_mm = echo_depths_mm
+        self.echo_amplitudes = echo_amplitudes
+        self.motion_mm = motion_mm
+        self.motion_hz = motion_hz
+        self.noise_volts = noise_volts
+        self.ticks_per_sec = ticks_per_sec
+        self.spin_latency = spin_latency
+
+        self.rng = np.random.default_rng(seed)
+        self._noise_bank = None
+        self.devices = {}       # handle -> SimDevice
+        self.last_error = b''
+        self.n_calls = 0        # number of status/data calls (for benchmarks)
+        self.unimplemented_calls = set()
+
+        # offset between perf_counter() and wall-clock time (for StatusTime)
+        self._wall_offset = time.time() - time.perf_counter()
+
+    @classmethod
+    def from_env(cls, **kwargs):
+        """Create SimDwf with settings from AD2_SIM_* environment variables (kwargs take priority)."""
+        env_settings = [('AD2_SIM_TRIGGER_RATE', 'trigger_rate', float),
+                        ('AD2_SIM_CALL_LATENCY', 'call_latency', float),
+                        ('AD2_SIM_N_DEVICES', 'n_devices', int),
+                        ]
+        for env_name, arg_name, conv in env_settings:
+            if env_name in os.environ and arg_name not in kwargs:
+                kwargs[arg_name] = conv(os.environ[env_name])
+        return cls(**kwargs)
+
+    def __getitem__(self, name):
+        """dwf['FDwfAnalogInStatus'] - same as CDLL item access."""
+        return getattr(self, name)
+
+    def __getattr__(self, name):
+        """Any other FDwf* call: accept & ignore (recorded in unimplemented_calls)."""
+        if not name.startswith('FDwf'):
+            raise AttributeError(name)
+
+        def not_simulated(*args):
+            self.unimplemented_calls.add(name)
+            return 1
+        return not_simulated
+
+
+    # timing helpers
+
+    def _wait(self, seconds):
+        """Block for a (short) time, ie. SDK call latency or USB transfer time."""
+        if seconds <= 0:
+            return
+        if self.spin_latency:
+            t_end = time.perf_counter() + seconds
+            while time.perf_counter() < t_end:
+                pass
+        else:
+            time.sleep(seconds)
+
+    def _call(self):
+        """Per-call overhead for status/data calls."""
+        self.n_calls += 1
+        self._wait(self.call_latency)
+
+    def _dev(self, hdwf):
+        return self.devices[_val(hdwf)]
+
+
+    # General / device
+
+    def FDwfGetVersion(self, szVersion):
+        memmove(_addr(szVersion), SIM_VERSION + b'\0', len(SIM_VERSION) + 1)
+        return 1
+
+    def FDwfGetLastErrorMsg(self, szError):
+        memmove(_addr(szError), self.last_error + b'\0', len(self.last_error) + 1)
+        return 1
+
+    def FDwfParamSet(self, param, value):
+        return 1
+
+    def FDwfEnum(self, enumfilter, pcDevice):
+        _put(pcDevice, c_int, self.n_devices)
+        return 1
+
+    def FDwfEnumDeviceName(self, idxDevice, szDeviceName):
+        name = b'Analog Discovery 2 (sim)'
+        memmove(_addr(szDeviceName), name + b'\0', len(name) + 1)
+        return 1
+
+    def FDwfEnumSN(self, idxDevice, szSN):
+        sn = b'SN:SIM%06d' % _val(idxDevice)
+        memmove(_addr(szSN), sn + b'\0', len(sn) + 1)
+        return 1
+
+    def FDwfEnumDeviceIsOpened(self, idxDevice, pfIsUsed):
+        is_open = any(dev.index == _val(idxDevice) for dev in self.devices.values())
+        _put(pfIsUsed, c_int, int(is_open))
+        return 1
+
+    def FDwfEnumConfig(self, idxDevice, pcConfig):
+        _put(pcConfig, c_int, len(AD2_CONFIGS))
+        return 1
+
+    def FDwfEnumConfigInfo(self, idxConfig, info, pv):
+        scope_buffer, wavegen_buffer = AD2_CONFIGS[_val(idxConfig)]
+        values = {DECI_ANALOG_IN_CHANNEL_COUNT: AD2_N_SCOPE_CHANNELS,
+                  DECI_ANALOG_OUT_CHANNEL_COUNT: AD2_N_WAVEGEN_CHANNELS,
+                  DECI_ANALOG_IN_BUFFER_SIZE: scope_buffer,
+                  DECI_ANALOG_OUT_BUFFER_SIZE: wavegen_buffer,
+                  }
+        _put(pv, c_int, values.get(_val(info), 0))
+        return 1
+
+    def FDwfDeviceOpen(self, idxDevice, phdwf):
+        return self.FDwfDeviceConfigOpen(idxDevice, 0, phdwf)
+
+    def FDwfDeviceConfigOpen(self, idxDevice, idxCfg, phdwf):
+        index = _val(idxDevice)
+        if index < 0:
+            # first device that is not open yet
+            opened = [dev.index for dev in self.devices.values()]
+            free = [i for i in range(self.n_devices) if i not in opened]
+            index = free[0] if free else self.n_devices
+
+        if index >= self.n_devices or any(dev.index == index for dev in self.devices.values()):
+            self.last_error = b'Simulated device not found or already open'
+            _put(phdwf, c_int, 0)   # hdwfNone
+            return 0
+
+        handle = index + 1      # 0 is hdwfNone
+        self.devices[handle] = SimDevice(index, _val(idxCfg), self.rng)
+        _put(phdwf, c_int, handle)
+        return 1
+
+    def FDwfDeviceClose(self, hdwf):
+        self.devices.pop(_val(hdwf), None)
+        return 1
+
+    def FDwfDeviceCloseAll(self):
+        self.devices.clear()
+        return 1
+
+    def FDwfDeviceAutoConfigureSet(self, hdwf, fAutoConfigure):
+        return 1
+
+    def FDwfDeviceReset(self, hdwf):
+        return 1
+
+
+    # AnalogIn (scope) settings
+
+    def FDwfAnalogInReset(self, hdwf):
+        return 1
+
+    def FDwfAnalogInFrequencySet(self, hdwf, hzFrequency):
+        self._dev(hdwf).ain_frequency = min(float(_val(hzFrequency)), AD2_MAX_SAMPLE_RATE)
+        return 1
+
+    def FDwfAnalogInFrequencyGet(self, hdwf, phzFrequency):
+        _put(phzFrequency, c_double, self._dev(hdwf).ain_frequency)
+        return 1
+
+    def FDwfAnalogInBufferSizeSet(self, hdwf, nSize):
+        dev = self._dev(hdwf)
+        dev.ain_buffer_size = int(min(max(_val(nSize), 16), dev.ain_buffer_max))
+        return 1
+
+    def FDwfAnalogInBufferSizeGet(self, hdwf, pnSize):
+        _put(pnSize, c_int, self._dev(hdwf).ain_buffer_size)
+        return 1
+
+    def FDwfAnalogInBufferSizeInfo(self, hdwf, pnSizeMin, pnSizeMax):
+        _put(pnSizeMin, c_int, 16)
+        _put(pnSizeMax, c_int, self._dev(hdwf).ain_buffer_max)
+        return 1
+
+    def FDwfAnalogInChannelCount(self, hdwf, pcChannel):
+        _put(pcChannel, c_int, AD2_N_SCOPE_CHANNELS)
+        return 1
+
+    def FDwfAnalogInChannelEnableSet(self, hdwf, idxChannel, fEnable):
+        self._dev(hdwf).ain_enabled[_val(idxChannel)] = bool(_val(fEnable))
+        return 1
+
+    def FDwfAnalogInChannelRangeSet(self, hdwf, idxChannel, voltsRange):
+        # like the real AD2: only 2 gain settings, & the exact range is slightly larger than requested
+        exact_range = 5.538410 if _val(voltsRange) <= 5.5 else 55.38410
+        self._dev(hdwf).ain_range[_val(idxChannel)] = exact_range
+        return 1
+
+    def FDwfAnalogInChannelRangeGet(self, hdwf, idxChannel, pvoltsRange):
+        _put(pvoltsRange, c_double, self._dev(hdwf).ain_range[_val(idxChannel)])
+        return 1
+
+    def FDwfAnalogInChannelRangeInfo(self, hdwf, pvoltsMin, pvoltsMax, pnSteps):
+        _put(pvoltsMin, c_double, 5.538410)
+        _put(pvoltsMax, c_double, 55.38410)
+        _put(pnSteps, c_double, 2)
+        return 1
+
+    def FDwfAnalogInChannelOffsetSet(self, hdwf, idxChannel, voltOffset):
+        self._dev(hdwf).ain_offset[_val(idxChannel)] = float(_val(voltOffset))
+        return 1
+
+    def FDwfAnalogInChannelOffsetGet(self, hdwf, idxChannel, pvoltOffset):
+        _put(pvoltOffset, c_double, self._dev(hdwf).ain_offset[_val(idxChannel)])
+        return 1
+
+    def FDwfAnalogInChannelOffsetInfo(self, hdwf, pvoltsMin, pvoltsMax, pnSteps):
+        _put(pvoltsMin, c_double, -25.)
+        _put(pvoltsMax, c_double, 25.)
+        _put(pnSteps, c_double, 65536)
+        return 1
+
+    def FDwfAnalogInChannelAttenuationGet(self, hdwf, idxChannel, pxAttenuation):
+        _put(pxAttenuation, c_double, self._dev(hdwf).ain_attenuation[_val(idxChannel)])
+        return 1
+
+    def FDwfAnalogInAcquisitionModeSet(self, hdwf, acqmode):
+        self._dev(hdwf).ain_acqmode = _val(acqmode)
+        return 1
+
+    def FDwfAnalogInAcquisitionModeGet(self, hdwf, pacqmode):
+        _put(pacqmode, c_int, self._dev(hdwf).ain_acqmode)
+        return 1
+
+    def FDwfAnalogInRecordLengthSet(self, hdwf, sLength):
+        self._dev(hdwf).ain_record_length = float(_val(sLength))
+        return 1
+
+    def FDwfAnalogInTriggerPositionSet(self, hdwf, secPosition):
+        self._dev(hdwf).trigger_position = float(_val(secPosition))
+        return 1
+
+    def FDwfAnalogInTriggerPositionGet(self, hdwf, psecPosition):
+        _put(psecPosition, c_double, self._dev(hdwf).trigger_position)
+        return 1
+
+    def FDwfAnalogInTriggerPositionInfo(self, hdwf, psecMin, psecMax, pnSteps):
+        dev = self._dev(hdwf)
+        _put(psecMin, c_double, -dev.ain_buffer_size / dev.ain_frequency)
+        _put(psecMax, c_double, 1e9)
+        _put(pnSteps, c_double, 1e9)
+        return 1
+
+    def FDwfAnalogInTriggerHoldOffSet(self, hdwf, secHoldOff):
+        self._dev(hdwf).trigger_holdoff = float(_val(secHoldOff))
+        return 1
+
+    def FDwfAnalogInTriggerHoldOffGet(self, hdwf, psecHoldOff):
+        _put(psecHoldOff, c_double, self._dev(hdwf).trigger_holdoff)
+        return 1
+
+    def FDwfAnalogInTriggerHoldOffInfo(self, hdwf, psecMin, psecMax, pnSteps):
+        _put(psecMin, c_double, 0.)
+        _put(psecMax, c_double, 10.)
+        _put(pnSteps, c_double, 1e9)
+        return 1
+
+    def FDwfAnalogInTriggerAutoTimeoutSet(self, hdwf, secTimeout):
+        self._dev(hdwf).trigger_timeout = float(_val(secTimeout))
+        return 1
+
+    def FDwfAnalogInTriggerAutoTimeoutGet(self, hdwf, psecTimeout):
+        _put(psecTimeout, c_double, self._dev(hdwf).trigger_timeout)
+        return 1
+
+    def FDwfAnalogInTriggerAutoTimeoutInfo(self, hdwf, psecMin, psecMax, pnSteps):
+        _put(psecMin, c_double, 0.)
+        _put(psecMax, c_double, 10.)
+        _put(pnSteps, c_double, 1000)
+        return 1
+
+    def FDwfAnalogInTriggerLevelSet(self, hdwf, voltsLevel):
+        self._dev(hdwf).trigger_level = float(_val(voltsLevel))
+        return 1
+
+    def FDwfAnalogInTriggerFilterSet(self, hdwf, idxChannel, filter):
+        self._dev(hdwf).ain_filter[_val(idxChannel)] = _val(filter)
+        return 1
+
+    def FDwfAnalogInTriggerFilterGet(self, hdwf, idxChannel, pfilter):
+        _put(pfilter, c_int, self._dev(hdwf).ain_filter[_val(idxChannel)])
+        return 1
+
+    def _store_setting(name):
+        """Make an SDK 'Set' call that only stores its arguments (no effect on the simulation)."""
+        def setter(self, hdwf, *args):
+            self._dev(hdwf).settings[name] = [_val(arg) for arg in args]
+            return 1
+        setter.__name__ = name
+        return setter
+
+    FDwfAnalogInTriggerSourceSet = _store_setting('FDwfAnalogInTriggerSourceSet')
+    FDwfAnalogInTriggerTypeSet = _store_setting('FDwfAnalogInTriggerTypeSet')
+    FDwfAnalogInTriggerChannelSet = _store_setting('FDwfAnalogInTriggerChannelSet')
+    FDwfAnalogInTriggerConditionSet = _store_setting('FDwfAnalogInTriggerConditionSet')
+    FDwfAnalogInTriggerHysteresisSet = _store_setting('FDwfAnalogInTriggerHysteresisSet')
+    FDwfAnalogInSamplingDelaySet = _store_setting('FDwfAnalogInSamplingDelaySet')
+    FDwfAnalogOutIdleSet = _store_setting('FDwfAnalogOutIdleSet')
+    del _store_setting
+
+
+    # AnalogIn (scope) acquisition
+
+    def FDwfAnalogInConfigure(self, hdwf, fReconfigure, fStart):
+        dev = self._dev(hdwf)
+        self._call()
+        if not _val(fStart):
+            dev.ain_running = False
+            dev.state = STATE_READY
+            return 1
+
+        now = time.perf_counter()
+        dev.ain_running = True
+        dev.n_acquired = 0
+        dev.n_missed = 0
+
+        if dev.ain_acqmode == ACQMODE_RECORD:
+            dev.state = STATE_TRIGGERED
+            dev.record_start = now
+            dev.record_last = now
+            dev.record_fifo = 0.
+            dev.record_pos = 0
+            dev.record_available = 0
+            dev.record_done = False
+        else:
+            dev.state = STATE_ARMED
+            dev.armed_time = now
+            self._schedule_triggers(dev, now)
+        return 1
+
+    @staticmethod
+    def _pulse_channel(dev):
+        """Wavegen channel of dev that is generating pulses, or None."""
+        for ch in range(AD2_N_WAVEGEN_CHANNELS):
+            if dev.aout_running[ch] and (dev.aout_run[ch] + dev.aout_wait[ch]) > 0:
+                return ch
+        return None
+
+    def _pulse_source(self, dev):
+        """(device, wavegen channel) whose pulses trigger dev: its own wavegen, else another
+            open device's (the same pulse is wired to every device), or None (external trigger rate)."""
+        for source in [dev] + [other for other in self.devices.values() if other is not dev]:
+            ch = self._pulse_channel(source)
+            if ch is not None:
+                return source, ch
+        return None
+
+    def _schedule_triggers(self, dev, now):
+        """(Re)start the trigger schedule: from a running wavegen (see _pulse_source()), or the external trigger rate."""
+        pulse_source = self._pulse_source(dev)
+        if pulse_source is not None:
+            source, ch = pulse_source
+            dev.period = source.aout_run[ch] + source.aout_wait[ch]
+            first_pulse = source.aout_start_time[ch] + source.aout_wait[ch]
+            if source is dev:
+                n_before = 0
+                dev.start_time = max(first_pulse, dev.armed_time)
+            else:
+                # same pulse times as the source device, from the first pulse after dev was armed
+                n_before = max(int(np.ceil((dev.armed_time - first_pulse) / dev.period)), 0)
+                dev.start_time = first_pulse + n_before * dev.period
+            dev.max_triggers = max(source.aout_repeat[ch] - n_before, 0) if source.aout_repeat[ch] > 0 else None
+        else:
+            dev.period = 1. / self.trigger_rate
+            dev.start_time = now + dev.period
+            dev.max_triggers = None
+        dev.next_trigger = 0
+
+    def _post_trigger_time(self, dev):
+        """Time from trigger to the end of the acquisition buffer (sec)."""
+        dt = 1. / dev.ain_frequency
+        trigger_index = 0.5 * dev.ain_buffer_size - dev.trigger_position / dt
+        trigger_index = min(max(trigger_index, 0), dev.ain_buffer_size)
+        return (dev.ain_buffer_size - trigger_index) * dt
+
+    def FDwfAnalogInStatus(self, hdwf, fReadData, psts):
+        dev = self._dev(hdwf)
+        self._call()
+        now = time.perf_counter()
+
+        if not dev.ain_running:
+            _put(psts, c_ubyte, dev.state)
+            return 1
+
+        if dev.ain_acqmode == ACQMODE_RECORD:
+            self._record_update(dev, now)
+            _put(psts, c_ubyte, STATE_DONE if dev.record_done else STATE_TRIGGERED)
+            return 1
+
+        if dev.state == STATE_DONE:
+            # last call returned Done: the scope re-arms for the next trigger
+            dev.state = STATE_ARMED
+            dev.armed_time = now + self.rearm_time
+
+        # next trigger that comes after the scope was armed (earlier triggers are missed):
+        next_trigger = max(dev.next_trigger,
+                           int(np.ceil((dev.armed_time - dev.start_time) / dev.period)))
+        dev.n_missed += next_trigger - dev.next_trigger
+        dev.next_trigger = next_trigger
+
+        if dev.max_triggers is not None and dev.next_trigger >= dev.max_triggers:
+            _put(psts, c_ubyte, STATE_ARMED)    # wavegen is done; no more triggers
+            return 1
+
+        trigger_time = dev.start_time + dev.next_trigger * dev.period
+        if now < trigger_time:
+            _put(psts, c_ubyte, STATE_ARMED)
+        elif now < trigger_time + self._post_trigger_time(dev):
+            _put(psts, c_ubyte, STATE_TRIGGERED)
+        else:
+            dev.state = STATE_DONE
+            dev.last_trigger_time = trigger_time
+            dev.next_trigger += 1
+            dev.n_acquired += 1
+            if _val(fReadData):
+                self._generate_acquisition(dev, trigger_time)
+                n_enabled = sum(dev.ain_enabled)
+                self._wait(2 * n_enabled * dev.ain_buffer_size / self.usb_bytes_per_sec)
+            _put(psts, c_ubyte, STATE_DONE)
+        return 1
+
+    def FDwfAnalogInStatusData16(self, hdwf, idxChannel, rgu16Data, idxData, cdData):
+        dev = self._dev(hdwf)
+        self._call()
+        first = _val(idxData)
+        n = _val(cdData)
+        if n <= 0:
+            return 1
+        src = dev.last_data[_val(idxChannel)][first:first+n]
+        memmove(_addr(rgu16Data), src.ctypes.data, src.nbytes)
+        return 1
+
+    def FDwfAnalogInStatusData(self, hdwf, idxChannel, rgdVoltData, cdData):
+        return self.FDwfAnalogInStatusData2(hdwf, idxChannel, rgdVoltData, 0, cdData)
+
+    def FDwfAnalogInStatusData2(self, hdwf, idxChannel, rgdVoltData, idxData, cdData):
+        dev = self._dev(hdwf)
+        self._call()
+        ch = _val(idxChannel)
+        first = _val(idxData)
+        n = _val(cdData)
+        if n <= 0:
+            return 1
+        volts = dev.last_data[ch][first:first+n] * (dev.ain_range[ch] / 65536) + dev.ain_offset[ch]
+        memmove(_addr(rgdVoltData), volts.ctypes.data, volts.nbytes)
+        return 1
+
+    def FDwfAnalogInStatusSample(self, hdwf, idxChannel, pdVoltSample):
+        dev = self._dev(hdwf)
+        ch = _val(idxChannel)
+        _put(pdVoltSample, c_double, float(dev.last_data[ch][-1]) * (dev.ain_range[ch] / 65536) + dev.ain_offset[ch])
+        return 1
+
+    def FDwfAnalogInStatusTime(self, hdwf, psecUtc, ptick, pticksPerSecond):
+        dev = self._dev(hdwf)
+        self._call()
+        t = dev.last_trigger_time + self._wall_offset
+        sec = int(t)
+        _put(psecUtc, c_uint, sec)
+        _put(ptick, c_uint, int((t - sec) * self.ticks_per_sec))
+        _put(pticksPerSecond, c_uint, self.ticks_per_sec)
+        return 1
+
+    def FDwfAnalogInStatusRecord(self, hdwf, pdataAvailable, pdataLost, pdataCorrupt):
+        dev = self._dev(hdwf)
+        self._call()
+        available, lost = self._record_read(dev)
+        _put(pdataAvailable, c_int, available)
+        _put(pdataLost, c_int, lost)
+        _put(pdataCorrupt, c_int, available if lost else 0)    # data next to a gap is suspect
+        return 1
+
+
+    # synthetic signals:
+
+    def _templates(self, dev):
+        """Return (pulse, echoes) templates in int16 units for the current settings (cached)."""
+        ch = 0
+        fs = dev.ain_frequency
+        n = dev.ain_buffer_size
+        dt = 1. / fs
+        trigger_index = int(round(min(max(0.5 * n - dev.trigger_position / dt, 0), n)))
+
+        key = (fs, n, trigger_index, tuple(dev.ain_range), tuple(dev.ain_offset),
+               dev.aout_function[ch], dev.aout_frequency[ch], dev.aout_amplitude[ch], dev.aout_run[ch],
+               id(dev.aout_data[ch]))
+        if key == dev._template_key:
+            return dev._templates
+
+        # excitation pulse (from wavegen ch1 settings):
+        amplitude = dev.aout_amplitude[ch] if dev.aout_enabled[ch] else 5.0
+        if dev.aout_function[ch] == FUNC_SQUARE or dev.aout_frequency[ch] <= 0:
+            width = dev.aout_run[ch] if dev.aout_run[ch] > 0 else 0.5e-6
+            pulse = np.ones(max(int(round(width * fs)), 1))
+        elif dev.aout_function[ch] == FUNC_CUSTOM and dev.aout_data[ch] is not None:
+            # custom buffer, played once per period of the node frequency
+            freq = dev.aout_frequency[ch]
+            data = dev.aout_data[ch]
+            run = dev.aout_run[ch] if dev.aout_run[ch] > 0 else 1. / freq
+            t = np.arange(int(round(run * fs))) * dt
+            pulse = data[(np.mod(t * freq, 1.) * data.shape[0]).astype(int)]
+        else:
+            freq = dev.aout_frequency[ch]
+            run = dev.aout_run[ch] if dev.aout_run[ch] > 0 else 3. / freq
+            t = np.arange(int(round(run * fs))) * dt
+            pulse = np.sin(2 * np.pi * freq * t)
+        pulse = amplitude * pulse
+
+        pulse_line = np.zeros(n)
+        end = min(trigger_index + pulse.shape[0], n)
+        pulse_line[trigger_index:end] = pulse[:end - trigger_index]
+
+        echo_line = np.zeros(n)
+        for depth_mm, echo_amplitude in zip(self.echo_depths_mm, self.echo_amplitudes):
+            start = trigger_index + int(round(2e-3 * depth_mm / C_WATER * fs))    # round trip
+            if start >= n:
+                continue
+            end = min(start + pulse.shape[0], n)
+            echo_line[start:end] += echo_amplitude * pulse[:end - start]
+
+        templates = []
+        for ch in range(AD2_N_SCOPE_CHANNELS):
+            to_int16 = 65536. / dev.ain_range[ch]
+            templates.append(((pulse_line - dev.ain_offset[ch]) * to_int16,
+                              echo_line * to_int16,
+                              self.noise_volts * to_int16,
+                              ))
+
+        dev._template_key = key
+        dev._templates = templates
+        return templates
+
+    def _generate_acquisition(self, dev, trigger_time):
+        """Fill dev.last_data with 1 simulated acquisition for each enabled channel."""
+        templates = self._templates(dev)
+        n = dev.ain_buffer_size
+
+        # slow motion of the reflectors -> shift echoes by a few samples
+        motion = self.motion_mm * np.sin(2 * np.pi * self.motion_hz * trigger_time)
+        shift = int(round(2e-3 * motion / C_WATER * dev.ain_frequency))
+
+        for ch in range(AD2_N_SCOPE_CHANNELS):
+            if not dev.ain_enabled[ch]:
+                continue
+            pulse_line, echo_line, noise = templates[ch]
+            line = pulse_line + np.roll(echo_line, shift)
+            line += noise * self._noise(n)
+            if dev.last_data[ch].shape[0] != n:
+                dev.last_data[ch] = np.zeros(n, dtype=np.int16)
+            np.clip(line, -32768, 32767, out=line)
+            dev.last_data[ch][:] = line
+
+    def _record_update(self, dev, now):
+        """Record mode: move samples into the device FIFO, and out over USB."""
+        elapsed = now - dev.record_last
+        dev.record_last = now
+
+        fs = dev.ain_frequency
+        n_enabled = max(sum(dev.ain_enabled), 1)
+        usb_samples_per_sec = self.usb_bytes_per_sec / (2 * n_enabled)
+
+        if dev.ain_record_length > 0:
+            total = int(dev.ain_record_length * fs)
+            produced = min(elapsed * fs, total - dev.record_pos - dev.record_fifo - dev.record_available)
+            if now - dev.record_start >= dev.ain_record_length and dev.record_fifo < 1:
+                dev.record_done = True
+        else:
+            produced = elapsed * fs
+
+        dev.record_fifo += max(produced, 0)
+        # at most 1 device buffer per status read; the rest waits in the device (& may overflow)
+        transferred = min(dev.record_fifo, elapsed * usb_samples_per_sec, dev.ain_buffer_max - dev.record_available)
+        dev.record_fifo -= transferred
+        dev.record_available += int(transferred)
+
+    def _noise(self, n):
+        """Return n samples of unit gaussian noise (random slice of a precomputed bank; much faster than rng.normal)."""
+        if self._noise_bank is None or self._noise_bank.shape[0] < 2 * n:
+            self._noise_bank = self.rng.normal(0., 1., max(2 * n, 1 << 17))
+        start = self.rng.integers(0, self._noise_bank.shape[0] - n + 1)
+        return self._noise_bank[start:start + n]
+
+    def _record_read(self, dev):
+        """Return (available, lost) for the last record status & prepare the data."""
+        lost = 0
+        if dev.record_fifo > dev.ain_buffer_max:
+            # device buffer overflowed: the oldest samples are gone
+            lost = int(dev.record_fifo - dev.ain_buffer_max)
+            dev.record_fifo -= lost
+
+        available = dev.record_available
+        dev.record_available = 0
+
+        # continuous wavegen signal for the available samples (after any lost ones):
+        dev.record_pos += lost
+        ch = 0
+        amplitude = dev.aout_amplitude[ch] if dev.aout_running[ch] else 0.
+        freq = dev.aout_frequency[ch]
+        t = (dev.record_pos + np.arange(available)) / dev.ain_frequency
+        signal = dev.aout_offset[ch] + amplitude * np.sin(2 * np.pi * freq * t)
+        for ain_ch in range(AD2_N_SCOPE_CHANNELS):
+            if not dev.ain_enabled[ain_ch]:
+                continue
+            volts = signal + self.noise_volts * self._noise(available)
+            codes = (volts - dev.ain_offset[ain_ch]) * (65536. / dev.ain_range[ain_ch])
+            dev.last_data[ain_ch] = np.clip(codes, -32768, 32767).astype(np.int16)
+        dev.record_pos += available
+
+        return available, lost
+
+
+    # AnalogOut (wavegen)
+
+    def FDwfAnalogOutReset(self, hdwf, idxChannel):
+        dev = self._dev(hdwf)
+        ch = _val(idxChannel)
+        channels = range(AD2_N_WAVEGEN_CHANNELS) if ch < 0 else [ch]
+        for ch in channels:
+            dev.aout_running[ch] = False
+        return 1
+
+    def FDwfAnalogOutConfigure(self, hdwf, idxChannel, fStart):
+        dev = self._dev(hdwf)
+        ch = _val(idxChannel)
+        start = bool(_val(fStart))
+        dev.aout_running[ch] = start
+        if start:
+            dev.aout_enabled[ch] = True
+            dev.aout_start_time[ch] = time.perf_counter()
+            # this device & every armed device triggered by these pulses
+            for other in self.devices.values():
+                if (other.ain_running and other.ain_acqmode == ACQMODE_SINGLE
+                        and self._pulse_source(other) == (dev, ch)):
+                    self._schedule_triggers(other, dev.aout_start_time[ch])
+        return 1
+
+    def FDwfAnalogOutEnableSet(self, hdwf, idxChannel, fEnable):
+        self._dev(hdwf).aout_enabled[_val(idxChannel)] = bool(_val(fEnable))
+        return 1
+
+    def FDwfAnalogOutNodeEnableSet(self, hdwf, idxChannel, node, fEnable):
+        self._dev(hdwf).aout_enabled[_val(idxChannel)] = bool(_val(fEnable))
+        return 1
+
+    def FDwfAnalogOutNodeFunctionSet(self, hdwf, idxChannel, node, func):
+        self._dev(hdwf).aout_function[_val(idxChannel)] = _val(func)
+        return 1
+
+    def FDwfAnalogOutNodeFrequencySet(self, hdwf, idxChannel, node, hzFrequency):
+        self._dev(hdwf).aout_frequency[_val(idxChannel)] = float(_val(hzFrequency))
+        return 1
+
+    def FDwfAnalogOutNodeAmplitudeSet(self, hdwf, idxChannel, node, vAmplitude):
+        self._dev(hdwf).aout_amplitude[_val(idxChannel)] = float(_val(vAmplitude))
+        return 1
+
+    def FDwfAnalogOutNodeOffsetSet(self, hdwf, idxChannel, node, vOffset):
+        self._dev(hdwf).aout_offset[_val(idxChannel)] = float(_val(vOffset))
+        return 1
+
+    def FDwfAnalogOutNodeDataSet(self, hdwf, idxChannel, node, rgdData, cdData):
+        n = _val(cdData)
+        data = np.array((c_double * n).from_address(_addr(rgdData)))   # copy, like the real device
+        self._dev(hdwf).aout_data[_val(idxChannel)] = data
+        return 1
+
+    def FDwfAnalogOutNodeDataInfo(self, hdwf, idxChannel, node, pnSamplesMin, pnSamplesMax):
+        _put(pnSamplesMin, c_int, 1)
+        _put(pnSamplesMax, c_int, self._dev(hdwf).aout_buffer_max)
+        return 1
+
+    def FDwfAnalogOutRunSet(self, hdwf, idxChannel, secRun):
+        self._dev(hdwf).aout_run[_val(idxChannel)] = float(_val(secRun))
+        return 1
+
+    def FDwfAnalogOutWaitSet(self, hdwf, idxChannel, secWait):
+        self._dev(hdwf).aout_wait[_val(idxChannel)] = float(_val(secWait))
+        return 1
+
+    def FDwfAnalogOutRepeatSet(self, hdwf, idxChannel, cRepeat):
+        self._dev(hdwf).aout_repeat[_val(idxChannel)] = int(_val(cRepeat))
+        return 1
+
+
+    # Simulation stats
+
+    def print_stats(self):
+        """Print simulated device counters (ie. missed triggers)."""
+        for handle, dev in self.devices.items():
+            print('Sim device %d: %d acquisitions, %d missed triggers' % (dev.index, dev.n_acquired, dev.n_missed))
+        if self.unimplemented_calls:
+            print('Not simulated (ignored): %s' % ', '.join(sorted(self.unimplemented_calls)))
@@ -16,12 +16,63 @@ import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
 import datetime
+import threading
+import asyncio
+import struct
+import queue
+import time
+import wave
 import sys
+import os
+
+from dwfconstants import acqmodeRecord, DwfStateConfig, DwfStatePrefill, DwfStateArmed, DwfStateDone
+from dwfconstants import trigsrcNone, DECIAnalogInChannelCount, DECIAnalogInBufferSize, DECIAnalogOutBufferSize
+from ad2_tools_basic import SpinWait, SpinYieldWait, PredictiveWait, WAIT_STRATEGIES, make_waiter     # trigger wait strategies
+from ad2_tools_basic import TimestampBuffer
 
 # contstants
 
 NAN = float('nan')      # for initializing test values
 
+# Binary int16 session file format (see write_int16_bin() / load_int16_bin()):
+BIN_MAGIC = b'AD2B'
+BIN_VERSION = 1
+BIN_HEADER_FMT = '<4sHHHHdIQ'  # magic, version, n_channels, layout, reserved, sample_rate, samples_per_acq, n_acquisitions
+BIN_CHANNEL_FMT = '<dd'        # per channel: v_range, v_offset
+BIN_LAYOUT_CHANNEL_MAJOR = 0   # all of ch1, then all of ch2, ... (ie. one block per channel)
+BIN_LAYOUT_ACQ_MAJOR = 1       # acq0 ch1, acq0 ch2, acq1 ch1, ... (ie. streamed to disk as acquired)
+
+VOLTS_BLOCK_SIZE = 32768        # samples per block for int16 -> volts conversion (fits in L1/L2 cache)
+
+RECORD_N_CHUNKS = 64            # RecordEngine ring size (chunks of 1 device buffer each)
+
+# Min/max level-of-detail pyramids for plotting (see MinMaxPyramid):
+LOD_BASE_BLOCK = 64             # samples per min/max block of the finest level
+LOD_FACTOR = 8                  # blocks merged per coarser level
+LOD_MAX_POINTS = 4000           # max. points drawn per line (raw samples are drawn below this)
+LOD_BUILD_CHUNK = LOD_BASE_BLOCK * 65536    # samples read from disk at a time while building
+LOD_SUFFIX = '.lod.npz'         # sidecar cache file (<data file>.lod.npz)
+
+# Envelope detection for M-mode display (see envelope()):
+ENVELOPE_BLOCK_BYTES = 2**21    # complex spectrum bytes per block of A-lines (fits in L2/L3 cache)
+DYNAMIC_RANGE_DB = 60.          # default log compression dynamic range
+
+# Echo tracking / time of flight (see find_echoes()):
+# speed of sound values from https://itis.swiss/virtual-population/tissue-properties/database/acoustic-properties/speed-of-sound/
+C_WATER = 1482.3    # m/s
+C_AIR = 343.0       # m/s
+C_TISSUE = 1540.    # m/s (soft tissue average, as used by clinical scanners)
+ECHO_MIN_SEPARATION = 100       # samples between 2 echoes of the same acquisition
+ECHO_THRESHOLD_FRACTION = 0.5   # default threshold, relative to the max of each acquisition
+
+ALIGN_FIRST_WINDOW = 1024       # timestamps in the first clock offset/drift fit (see TimestampAlignment)
+
+# Binary timestamp records from timestamp_logger2.py -b (see ad2_tools_basic.TimestampBuffer):
+TIMESTAMP_DTYPE = np.dtype([('trig_utc_sec', '<u4'),
+                            ('trig_ticks', '<u4'),
+                            ('ticks_per_sec', '<u4'),
+                            ])
+
 
 # Scope Settings Class
 # To get and store oscilloscope intput parameters
@@ -147,14 +198,28 @@ class ScopeParams():
 
 # General Waveforms/DWF setup:
 
-def load_dwf():
+def load_dwf(backend=None, **sim_kwargs):
     """Find and load platform-specific DWF (Waveforms SDK) library.
 
         from Digilent example code.
 
+        backend = 'hw' for the real Waveforms SDK library,
+                  'sim' for the simulated library (ad2_sim.py; no hardware needed)
+                  None = use AD2_BACKEND environment variable (default 'hw')
+        sim_kwargs = settings passed to ad2_sim.SimDwf (ie. trigger_rate=50.)
+
         Returns dwf object.
     """
 
+    if backend is None:
+        backend = os.environ.get('AD2_BACKEND', 'hw')
+
+    if backend == 'sim':
+        import ad2_sim      # only needed for simulation (requires numpy)
+        return ad2_sim.SimDwf.from_env(**sim_kwargs)
+    elif backend != 'hw':
+        raise ValueError("Unknown DWF backend '%s' (use 'hw' or 'sim')" % backend)
+
     if sys.platform.startswith("win"):
         dwf = cdll.dwf
     elif sys.platform.startswith("darwin"):
@@ -198,17 +263,43 @@ def check_and_print_error(dwf, throw=False):
             raise(RuntimeError, s)
 
 
+def enumerate_devices(dwf):
+    """List all attached devices (FDwfEnum).
+
+        Returns list of dicts: index (for FDwfDeviceConfigOpen), name, serial, is_open
+    """
+    n_devices = c_int()
+    dwf.FDwfEnum(c_int(0), byref(n_devices))   # 0 = enumfilterAll
+
+    devices = []
+    name = create_string_buffer(64)
+    serial = create_string_buffer(16)
+    is_open = c_int()
+    for i in range(n_devices.value):
+        dwf.FDwfEnumDeviceName(c_int(i), name)
+        dwf.FDwfEnumSN(c_int(i), serial)
+        dwf.FDwfEnumDeviceIsOpened(c_int(i), byref(is_open))
+        devices.append({'index': i,
+                        'name': name.value.decode(errors='replace'),
+                        'serial': serial.value.decode(errors='replace'),
+                        'is_open': bool(is_open.value),
+                        })
+    return devices
+
+
 
 
 
 # scope setup & value conversion:
 
-def int16signal2voltage(data_int16, v_range, v_offset, verbose=False):
+def int16signal2voltage(data_int16, v_range, v_offset, verbose=False, out=None, dtype=np.float64):
     """Math-only int16 to volts conversion.
 
         See get_volts_from_int16() for getting the exact values from the scope.
 
         data_int16 = ctypes c_int16 array of raw oscilloscope data
+                        (or int16 Numpy array/memmap, or pandas Series)
+                        ctypes arrays are wrapped in place (no copy)
         v_range = scope voltage range
         v_offset = scope voltage offset
             These can both be passed as regular Python floats
@@ -218,42 +309,67 @@ def int16signal2voltage(data_int16, v_range, v_offset, verbose=False):
                 so using v_range=5.0 V and v_offset=0.0 will only give an approximate voltage!
 
         verbose: print intermediate values during type conversions for sanity check. (bool)
+        out = optional preallocated output array (same shape as data_int16)
+                ie. to reuse the same output buffer for every file/acquisition
+        dtype = output datatype if out is not given (np.float64 or np.float32)
+                float32 is half the memory & still has plenty of precision for 14-bit ADC values
         
-        Returns float64 array of proper (or approximate) voltage values.
-
-        # TODO datatype input arg
+        Returns float array of proper (or approximate) voltage values.
+            (this is 'out' if it was given)
     """
 
+    # wrap the raw memory as Numpy int16, no copy & no per-sample Python loop
+    # (previously used np.fromiter() - 1 Python iteration per sample, then 4 full-size temporaries)
+    raw = _as_int16_array(data_int16)
+
     if verbose:
         print('int16 conversion range, offset: %f, %f (both volts)' % (v_range, v_offset))
         print('Raw int16 min, max:')
-        print('min: %d' % min(data_int16))
-        print('max: %d' % max(data_int16))
-
-    # TODO - maybe this implicit int16 -> float conversion is wrong? maybe we need to have an intermediate Numpy-int16 array to make sure bytes are copied correctly (endianness, signed/unsigned, etc...)???
-    # TODO - above is unlikely; bug was more likely because scope was not enabled during this call.
-    #       - TODO streamline this conversion; avoid unnecessary intermediate steps/array copies
-    #voltage_signal = np.fromiter(data_int16, dtype=float)
-    tmp = np.fromiter(data_int16, dtype=np.int16)
+        print('min: %d' % np.min(raw))
+        print('max: %d' % np.max(raw))
+
+    if out is None:
+        out = np.empty(raw.shape, dtype=dtype)
+    elif out.shape != raw.shape:
+        raise ValueError('out shape %s does not match data shape %s' % (out.shape, raw.shape))
+
+    scale = v_range / 65536
+
+    if raw.flags.c_contiguous and out.flags.c_contiguous:
+        # fused scale + offset, 1 cache-sized block at a time:
+        # each block is still in cache for the add, so this is effectively 1 pass over memory
+        raw_flat = raw.reshape(-1)
+        out_flat = out.reshape(-1)
+        for i in range(0, raw_flat.shape[0], VOLTS_BLOCK_SIZE):
+            block = out_flat[i:i+VOLTS_BLOCK_SIZE]
+            np.multiply(raw_flat[i:i+VOLTS_BLOCK_SIZE], scale, out=block, dtype=out.dtype)
+            np.add(block, v_offset, out=block)
+    else:
+        # strided views (ie. 1 channel of an acquisition-major file): whole array, still in-place
+        np.multiply(raw, scale, out=out, dtype=out.dtype)
+        np.add(out, v_offset, out=out)
 
     if verbose:
-        print('Numpy int16 min/max:')
-        print('min: %d' % np.min(data_int16))
-        print('max: %d' % np.max(data_int16))
+        print('Numpy float min/max:')
+        print('min: %f' % np.min(out))
+        print('max: %f' % np.max(out))
 
-    voltage_signal = tmp.astype(np.float64, casting='safe') # TODO may be able to reduce to float32
+    return out
 
-    if verbose:
-        print('Numpy float min/max:')
-        print('min: %d' % np.min(voltage_signal))
-        print('max: %d' % np.max(voltage_signal))
 
-    voltage_signal = (voltage_signal * v_range / 65536) + v_offset
+def _as_int16_array(data_int16):
+    """Return a Numpy view of raw int16 data without copying (if possible).
 
-    return voltage_signal 
+        data_int16 = ctypes c_int16 array, Numpy array/memmap or pandas Series
+    """
+    if isinstance(data_int16, Array):
+        return np.ctypeslib.as_array(data_int16)   # shares memory with the ctypes buffer
+    if isinstance(data_int16, pd.Series):
+        return data_int16.to_numpy()
+    return np.asarray(data_int16)
 
 
-def get_volts_from_int16(dwf, hdwf, channel, data_int16, v_range=None, v_offset=None):
+def get_volts_from_int16(dwf, hdwf, channel, data_int16, v_range=None, v_offset=None, out=None, dtype=np.float64):
     """Convert raw oscilloscope 16-bit int data back to proper voltages.
 
         Wrapper for int16signal2voltage - this will poll the AD2 scope for 
@@ -276,6 +392,7 @@ def get_volts_from_int16(dwf, hdwf, channel, data_int16, v_range=None, v_offset=
         v_offset = scope voltage offset (optional)
             These can both be passed as regular Python floats and will be
             cast to ctypes c_double internally here.
+        out, dtype = optional output buffer/datatype (see int16signal2voltage())
 
         Returns numpy array of floats/doubles.
     """
@@ -302,7 +419,7 @@ def get_volts_from_int16(dwf, hdwf, channel, data_int16, v_range=None, v_offset=
     else:
         v_offset = c_double(v_offset) 
 
-    return int16signal2voltage(data_int16, v_range.value, v_offset.value)
+    return int16signal2voltage(data_int16, v_range.value, v_offset.value, out=out, dtype=dtype)
 
 
 
@@ -536,7 +653,7 @@ def load_2ch_int16_csv(filepath):
     return data
 
 
-def conv_volts_2ch_int16(data, v_range_ch1, v_offset_ch1, v_range_ch2, v_offset_ch2):
+def conv_volts_2ch_int16(data, v_range_ch1, v_offset_ch1, v_range_ch2, v_offset_ch2, dtype=np.float64):
     """Convert int16 values to volts and add columns to dataframe.
 
         WARNING - This modifies the input dataframe!
@@ -544,18 +661,1516 @@ def conv_volts_2ch_int16(data, v_range_ch1, v_offset_ch1, v_range_ch2, v_offset_
 
         data = 2 channel, int16 dataframe from load_2ch_int16_csv()
         v_range, v_offset = scope settings (use exact settings for exact voltages)
+        dtype = datatype of the new volts columns (np.float64 or np.float32)
     """
     data['ch1_volts'] = int16signal2voltage(data.ch1_int16, 
                                             v_range_ch1,
-                                            v_offset_ch1
+                                            v_offset_ch1,
+                                            dtype=dtype,
                                             )
 
     data['ch2_volts'] = int16signal2voltage(data.ch2_int16, 
                                             v_range_ch2,
-                                            v_offset_ch2
+                                            v_offset_ch2,
+                                            dtype=dtype,
                                             )
 
 
+### Binary int16 format:
+# Fixed header followed by raw int16 sample blocks (little-endian), ie:
+#   BIN_HEADER_FMT (32 bytes)
+#   BIN_CHANNEL_FMT x n_channels (16 bytes each: v_range, v_offset)
+#   int16 samples: n_channels * n_acquisitions * samples_per_acq
+# Much smaller & faster than the per-row CSV files (no text formatting/parsing),
+# and the int16 blocks can be written straight from the ctypes acquisition buffers.
+
+class SessionHeader():
+    """Header of a binary int16 session file.
+
+        Everything is stored as regular Python types.
+        See write_int16_bin() and load_int16_bin().
+    """
+
+    def __init__(self, n_channels, sample_rate, samples_per_acq, n_acquisitions,
+                 v_ranges, v_offsets, layout=BIN_LAYOUT_CHANNEL_MAJOR):
+        self.n_channels = int(n_channels)
+        self.sample_rate = float(sample_rate)
+        self.samples_per_acq = int(samples_per_acq)
+        self.n_acquisitions = int(n_acquisitions)
+        self.v_ranges = [float(v) for v in v_ranges]
+        self.v_offsets = [float(v) for v in v_offsets]
+        self.layout = int(layout)
+
+        if len(self.v_ranges) != self.n_channels or len(self.v_offsets) != self.n_channels:
+            raise ValueError('Need 1 v_range and 1 v_offset per channel (%d channels)' % self.n_channels)
+
+    @property
+    def data_offset(self):
+        """Byte offset of the first int16 sample in the file."""
+        return struct.calcsize(BIN_HEADER_FMT) + self.n_channels * struct.calcsize(BIN_CHANNEL_FMT)
+
+    @property
+    def sample_period(self):
+        """Seconds per sample (aka. sample dt)."""
+        return 1. / self.sample_rate
+
+    def pack(self):
+        """Return header as bytes (ready to write to file)."""
+        header = struct.pack(BIN_HEADER_FMT,
+                             BIN_MAGIC,
+                             BIN_VERSION,
+                             self.n_channels,
+                             self.layout,
+                             0,     # reserved
+                             self.sample_rate,
+                             self.samples_per_acq,
+                             self.n_acquisitions,
+                             )
+        for v_range, v_offset in zip(self.v_ranges, self.v_offsets):
+            header += struct.pack(BIN_CHANNEL_FMT, v_range, v_offset)
+        return header
+
+    @classmethod
+    def read(cls, f):
+        """Read header from an open (binary mode) file object.
+
+            Leaves the file positioned at the first int16 sample.
+        """
+        raw = f.read(struct.calcsize(BIN_HEADER_FMT))
+        (magic, version, n_channels, layout, _,
+         sample_rate, samples_per_acq, n_acquisitions) = struct.unpack(BIN_HEADER_FMT, raw)
+
+        if magic != BIN_MAGIC:
+            raise ValueError('Not an AD2 binary session file (magic = %r)' % magic)
+        if version > BIN_VERSION:
+            raise ValueError('Unsupported AD2 binary file version: %d' % version)
+
+        v_ranges = []
+        v_offsets = []
+        for i in range(n_channels):
+            v_range, v_offset = struct.unpack(BIN_CHANNEL_FMT, f.read(struct.calcsize(BIN_CHANNEL_FMT)))
+            v_ranges.append(v_range)
+            v_offsets.append(v_offset)
+
+        header = cls(n_channels, sample_rate, samples_per_acq, n_acquisitions,
+                     v_ranges, v_offsets, layout=layout)
+
+        if n_acquisitions == 0 and samples_per_acq > 0:
+            # streamed file that was never closed properly (see StreamingSessionWriter)
+            # -> use however many complete acquisitions made it to disk
+            n_data_bytes = os.fstat(f.fileno()).st_size - header.data_offset
+            header.n_acquisitions = n_data_bytes // (2 * n_channels * samples_per_acq)
+
+        return header
+
+
+def write_int16_bin(filepath, channel_data, sample_rate, samples_per_acq, v_ranges, v_offsets):
+    """Write a binary int16 session file (header + raw sample blocks).
+
+        filepath = full path including filename & extension (should be .bin)
+        channel_data = list of ctypes c_int16 arrays (or int16 Numpy arrays), 1 per channel,
+                        each holding all acquisitions back to back (ie. 1 long buffer)
+        sample_rate = scope sample rate (Hz)
+        samples_per_acq = number of samples in 1 acquisition (ie. INPUT_SAMPLE_SIZE)
+        v_ranges, v_offsets = exact scope range/offset for each channel (see ScopeParams)
+
+        Each channel buffer is written in one bulk call (no per-sample Python loop).
+    """
+    n_samples = len(channel_data[0])
+    for buf in channel_data:
+        if len(buf) != n_samples:
+            raise ValueError('All channels must have the same number of samples')
+    n_acquisitions = assert_int(n_samples / samples_per_acq)
+
+    header = SessionHeader(len(channel_data), sample_rate, samples_per_acq, n_acquisitions,
+                           v_ranges, v_offsets, layout=BIN_LAYOUT_CHANNEL_MAJOR)
+
+    with open(filepath, 'wb') as f:
+        f.write(header.pack())
+        for buf in channel_data:
+            f.write(memoryview(buf).cast('B'))  # raw bytes of the c_int16 buffer; no copy
+
+
+def load_int16_bin(filepath):
+    """Load a binary int16 session file (see write_int16_bin()).
+
+        Returns (header, data):
+            header = SessionHeader object
+            data = list of int16 Numpy arrays, 1 per channel,
+                    each shaped (n_acquisitions, samples_per_acq)
+                    (these are views into a single array read straight from the file)
+    """
+    with open(filepath, 'rb') as f:
+        header = SessionHeader.read(f)
+        samples = np.fromfile(f, dtype='<i2')
+
+    return header, _split_channels(header, samples)
+
+
+def _split_channels(header, samples):
+    """Return per-channel views of the flat int16 sample array, based on header layout."""
+    n_total = header.n_channels * header.n_acquisitions * header.samples_per_acq
+    samples = samples[:n_total]
+
+    if header.layout == BIN_LAYOUT_CHANNEL_MAJOR:
+        samples = samples.reshape(header.n_channels, header.n_acquisitions, header.samples_per_acq)
+        return [samples[i] for i in range(header.n_channels)]
+    elif header.layout == BIN_LAYOUT_ACQ_MAJOR:
+        samples = samples.reshape(header.n_acquisitions, header.n_channels, header.samples_per_acq)
+        return [samples[:, i, :] for i in range(header.n_channels)]   # strided views
+    else:
+        raise ValueError('Unknown binary file layout: %d' % header.layout)
+
+
+class SessionReader():
+    """Memory-mapped (lazy) reader for binary int16 session files.
+
+        Nothing is read from disk until it is used; indexing/plotting
+        a few acquisitions only pages in those acquisitions.
+        (unlike load_int16_bin() or load_2ch_int16_csv() which load everything into RAM)
+
+        Usage:
+            session = SessionReader('20220119-120000_test_data.bin')
+            ch1 = session.channel(0)        # int16, shape (n_acquisitions, samples_per_acq)
+            v = session.volts(1, slice(100, 200))   # only acquisitions 100-199 of ch2, as volts
+            M = session.m_mode(0)           # (samples_per_acq, n_acquisitions) view, see reshape_to_M_mode()
+    """
+
+    def __init__(self, filepath):
+        self.filepath = filepath
+
+        with open(filepath, 'rb') as f:
+            self.header = SessionHeader.read(f)
+
+        n_total = self.header.n_channels * self.header.n_acquisitions * self.header.samples_per_acq
+        if n_total > 0:
+            self._samples = np.memmap(filepath,
+                                      dtype='<i2',
+                                      mode='r',
+                                      offset=self.header.data_offset,
+                                      shape=(n_total,),
+                                      )
+        else:
+            self._samples = np.zeros(0, dtype='<i2')   # memmap can't map an empty file
+
+        self.channels = _split_channels(self.header, self._samples)
+
+    @property
+    def n_channels(self):
+        return self.header.n_channels
+
+    @property
+    def n_acquisitions(self):
+        return self.header.n_acquisitions
+
+    @property
+    def samples_per_acq(self):
+        return self.header.samples_per_acq
+
+    def channel(self, ch):
+        """Return raw int16 data for 1 channel (0-based), shaped (n_acquisitions, samples_per_acq).
+
+            This is a memory-mapped view; no data is read until it is indexed.
+        """
+        return self.channels[ch]
+
+    def volts(self, ch, acquisitions=slice(None), out=None, dtype=np.float64):
+        """Convert (only) the selected acquisitions of 1 channel to volts.
+
+            ch = channel index (0-based)
+            acquisitions = slice/index array of acquisitions to convert (default = all!)
+            out, dtype = optional output buffer/datatype (see int16signal2voltage())
+
+            Uses the exact range/offset stored in the file header.
+            Returns float array shaped (n_selected, samples_per_acq).
+        """
+        return int16signal2voltage(self.channels[ch][acquisitions],
+                                   self.header.v_ranges[ch],
+                                   self.header.v_offsets[ch],
+                                   out=out,
+                                   dtype=dtype,
+                                   )
+
+    def m_mode(self, ch):
+        """Return 1 channel as an M-mode matrix (samples_per_acq, n_acquisitions).
+
+            This is a transposed view of the memory-mapped data (no copy),
+            in the same orientation as reshape_to_M_mode(us_data, samples_per_acq, 0).
+        """
+        return self.channels[ch].T
+
+    def lod_pyramids(self, cache=True):
+        """Return a MinMaxPyramid (raw int16) per channel, cached in <file>.lod.npz (see load_lod_pyramids()).
+
+            Use with plot_lod(..., dx=header.sample_period, *int16_volts_scale(v_range, v_offset))
+        """
+        return load_lod_pyramids(self.filepath, self.channels, cache=cache)
+
+    def pseudotimescale(self, n_acquisitions=1):
+        """Return sample times (sec) for n_acquisitions back-to-back acquisitions.
+
+            NOTE this does NOT include the dead time between acquisitions (TR waits)
+        """
+        return self.header.sample_period * np.arange(n_acquisitions * self.header.samples_per_acq)
+
+
+class StreamingSessionWriter():
+    """Stream acquisitions to a binary session file from a background writer thread.
+
+        Memory use is bounded by a fixed ring of acquisition slots (n_slots), so
+        sessions can run indefinitely. The acquisition loop fills a free slot
+        directly from the SDK (see ptr()), then commits it; the writer thread
+        drains committed slots to disk in bulk while the next triggers are serviced.
+
+        If the writer falls behind and every slot is full, get_slot() returns None
+        and that acquisition is dropped (counted in n_dropped) - the acquisition
+        loop itself never waits on the disk.
+        If writing fails (disk full, I/O error), the writer thread stops & keeps the
+        exception (error); get_slot() (once the ring is full) and close() raise OSError.
+
+        File layout is BIN_LAYOUT_ACQ_MAJOR (see load_int16_bin() / SessionReader).
+
+        Usage (in the trigger loop):
+            slot = writer.get_slot()
+            if slot is not None:
+                dwf.FDwfAnalogInStatusData16(hdwf, c_int(0), writer.ptr(slot, 0), 0, n_samples)
+                dwf.FDwfAnalogInStatusData16(hdwf, c_int(1), writer.ptr(slot, 1), 0, n_samples)
+                writer.commit_slot(slot)
+            ...
+            writer.close()
+    """
+
+    def __init__(self, filepath, n_channels, sample_rate, samples_per_acq, v_ranges, v_offsets, n_slots=64):
+        """
+            filepath = output file (should be .bin)
+            n_channels = number of scope channels per acquisition
+            sample_rate = scope sample rate (Hz)
+            samples_per_acq = number of samples per acquisition (per channel)
+            v_ranges, v_offsets = exact scope range/offset for each channel (see ScopeParams)
+            n_slots = number of acquisitions that can be waiting to be written
+                        (ring size = n_slots * n_channels * samples_per_acq * 2 bytes)
+        """
+        self.filepath = filepath
+        self.n_channels = n_channels
+        self.samples_per_acq = samples_per_acq
+        self.n_slots = n_slots
+
+        self.header = SessionHeader(n_channels, sample_rate, samples_per_acq, 0,
+                                    v_ranges, v_offsets, layout=BIN_LAYOUT_ACQ_MAJOR)
+
+        # 1 contiguous ring buffer, so consecutive slots can be written in 1 call:
+        self.slot_len = n_channels * samples_per_acq       # samples per slot
+        self.slot_bytes = self.slot_len * sizeof(c_int16)
+        self.ring = (c_int16 * (n_slots * self.slot_len))()
+        self._ring_bytes = memoryview(self.ring).cast('B')
+
+        # precomputed SDK destination pointers for every slot/channel (avoids byref() in the loop)
+        self._ptrs = [[byref(self.ring, slot * self.slot_bytes + ch * samples_per_acq * sizeof(c_int16))
+                       for ch in range(n_channels)]
+                      for slot in range(n_slots)]
+
+        self._free = queue.Queue()
+        for slot in range(n_slots):
+            self._free.put(slot)
+        self._filled = queue.Queue()
+
+        # stats:
+        self.n_committed = 0    # acquisitions handed to the writer
+        self.n_written = 0      # acquisitions written to disk
+        self.n_dropped = 0      # acquisitions dropped because the writer fell behind (backpressure)
+        self.max_backlog = 0    # most slots waiting to be written at once
+        self.error = None       # exception that stopped the writer thread
+
+        self._file = open(filepath, 'wb')
+        self._file.write(self.header.pack())    # n_acquisitions gets updated in close()
+
+        self._thread = threading.Thread(target=self._writer_loop, daemon=True)
+        self._thread.start()
+
+    def get_slot(self):
+        """Return index of a free slot, or None if all slots are waiting to be written (dropped).
+
+            Raises OSError if the writer thread failed (no slot will ever be freed).
+        """
+        try:
+            return self._free.get_nowait()
+        except queue.Empty:
+            self._raise_error()
+            self.n_dropped += 1
+            return None
+
+    def _raise_error(self):
+        if self.error is not None:
+            raise OSError('Writing %s failed: %s' % (self.filepath, self.error)) from self.error
+
+    def ptr(self, slot, ch):
+        """Return SDK destination pointer (byref) for 1 channel of a slot, ie. for FDwfAnalogInStatusData16()."""
+        return self._ptrs[slot][ch]
+
+    def slot_array(self, slot):
+        """Return Numpy int16 view of a slot, shaped (n_channels, samples_per_acq)."""
+        start = slot * self.slot_len
+        return np.ctypeslib.as_array(self.ring)[start:start+self.slot_len].reshape(self.n_channels, self.samples_per_acq)
+
+    def commit_slot(self, slot):
+        """Hand a filled slot to the writer thread."""
+        self.n_committed += 1
+        self._filled.put(slot)
+
+    def _writer_loop(self):
+        """Writer thread: drain filled slots to disk, writing consecutive slots in 1 call."""
+        done = False
+        while not done:
+            slots = [self._filled.get()]    # wait for at least 1
+            while True:
+                try:
+                    slots.append(self._filled.get_nowait())
+                except queue.Empty:
+                    break
+
+            if slots[-1] is None:   # close() was called
+                slots.pop()
+                done = True
+
+            self.max_backlog = max(self.max_backlog, len(slots))
+
+            # slots are used in FIFO order, so they come back as runs of consecutive
+            # indexes (wrapping around at the end of the ring):
+            run_start = 0
+            for i in range(1, len(slots) + 1):
+                if i == len(slots) or slots[i] != slots[i-1] + 1:
+                    first = slots[run_start]
+                    n = i - run_start
+                    try:
+                        self._file.write(self._ring_bytes[first * self.slot_bytes:(first + n) * self.slot_bytes])
+                    except Exception as e:
+                        self.error = e      # slots are not freed: get_slot() raises once the ring is full
+                        return
+                    self.n_written += n
+                    run_start = i
+
+            for slot in slots:
+                self._free.put(slot)
+
+    def close(self):
+        """Write any remaining slots, update the header & close the file.
+
+            Returns SessionHeader of the finished file.
+            Raises OSError if the writer thread failed (the header still counts the acquisitions written).
+        """
+        self._filled.put(None)
+        self._thread.join()
+
+        self.header.n_acquisitions = self.n_written
+        try:
+            self._file.seek(0)
+            self._file.write(self.header.pack())
+        finally:
+            self._file.close()
+        self._raise_error()
+        return self.header
+
+    def print_stats(self):
+        """Print writer/backpressure stats."""
+        print('Streamed acquisitions written: %d' % self.n_written)
+        print('Dropped acquisitions (writer fell behind): %d' % self.n_dropped)
+        print('Max writer backlog: %d of %d slots' % (self.max_backlog, self.n_slots))
+
+
+def convert_2ch_int16_csv(csv_filepath, bin_filepath, samples_per_acq, v_ranges, v_offsets,
+                          chunk_acquisitions=64):
+    """Convert a 2-channel int16 CSV file (see load_2ch_int16_csv()) to the binary format.
+
+        The CSV is read in chunks so the full session never has to fit in RAM;
+        the binary file is then usable with SessionReader.
+
+        csv_filepath = input CSV file
+        bin_filepath = output binary file (should be .bin)
+        samples_per_acq = number of samples per acquisition (ie. INPUT_SAMPLE_SIZE from _settings.csv)
+        v_ranges, v_offsets = exact scope range/offset for each channel (ie. from _vconv.csv)
+        chunk_acquisitions = number of acquisitions to convert at a time
+
+        Returns SessionHeader of the new file.
+    """
+    # sample rate from the first 2 time values (Time column = index * sample period):
+    first_rows = pd.read_csv(csv_filepath, names=['Index', 'Time', 'ch1_int16', 'ch2_int16'], nrows=2)
+    sample_rate = 1. / (first_rows.Time[1] - first_rows.Time[0])
+
+    header = SessionHeader(2, sample_rate, samples_per_acq, 0,
+                           v_ranges, v_offsets, layout=BIN_LAYOUT_ACQ_MAJOR)
+
+    n_acquisitions = 0
+    with open(bin_filepath, 'wb') as f:
+        f.write(header.pack())  # n_acquisitions gets updated at the end
+
+        for chunk in pd.read_csv(csv_filepath,
+                                 names=['Index', 'Time', 'ch1_int16', 'ch2_int16'],
+                                 usecols=['ch1_int16', 'ch2_int16'],
+                                 dtype=np.int16,
+                                 chunksize=chunk_acquisitions * samples_per_acq,
+                                 ):
+            n_acq = len(chunk) // samples_per_acq  # any trailing partial acquisition is dropped
+            block = np.empty((n_acq, 2, samples_per_acq), dtype='<i2')
+            block[:, 0, :] = chunk.ch1_int16.to_numpy()[:n_acq * samples_per_acq].reshape(n_acq, samples_per_acq)
+            block[:, 1, :] = chunk.ch2_int16.to_numpy()[:n_acq * samples_per_acq].reshape(n_acq, samples_per_acq)
+            f.write(block.tobytes())
+            n_acquisitions += n_acq
+
+        header.n_acquisitions = n_acquisitions
+        f.seek(0)
+        f.write(header.pack())
+
+    return header
+
+
+
+### Fast SDK calls (hot loops):
+
+# Signatures (dwf.h) of the SDK calls used in acquisition hot loops.
+# Pointer args are c_void_p so byref() of any ctypes type (ie. c_byte status) is accepted.
+DWF_HOT_LOOP_ARGTYPES = {
+    'FDwfAnalogInStatus':       [c_int, c_int, c_void_p],                   # hdwf, fReadData, *sts
+    'FDwfAnalogInStatusData16': [c_int, c_int, c_void_p, c_int, c_int],     # hdwf, idxChannel, *rgu16Data, idxData, cdData
+    'FDwfAnalogInStatusTime':   [c_int, c_void_p, c_void_p, c_void_p],      # hdwf, *secUtc, *tick, *ticksPerSecond
+    'FDwfAnalogInStatusRecord': [c_int, c_void_p, c_void_p, c_void_p],      # hdwf, *cdDataAvailable, *cdDataLost, *cdDataCorrupt
+    }
+
+def bind_dwf_function(dwf, name, checked=False):
+    """Return a pre-resolved SDK function for a hot loop (call it through a local variable).
+
+        dwf[name] gives a new function pointer object, so restype/argtypes set here
+        do not affect dwf.<name> used by the rest of the program.
+
+        checked = declare argtypes (DWF_HOT_LOOP_ARGTYPES) so ctypes type-checks every call.
+                  Measured ~40% slower per call than passing pre-built ctypes args without
+                  argtypes (from_param() runs on every arg), so off by default.
+
+        Simulated dwf (ad2_sim) methods are returned as-is.
+    """
+    func = dwf[name]
+    if hasattr(func, 'argtypes'):   # real ctypes function (not simulated)
+        func.restype = c_int        # BOOL
+        if checked:
+            func.argtypes = DWF_HOT_LOOP_ARGTYPES[name]
+    return func
+
+
+def slot_pointers(buffer, n_slots, slot_samples):
+    """Precompute byref() pointers to each acquisition slot of a big ctypes buffer.
+
+        buffer = ctypes array (ie. c_int16 * (n_slots * slot_samples))
+        Returns list of n_slots pointers; slot i starts at sample i * slot_samples.
+    """
+    slot_bytes = slot_samples * sizeof(buffer._type_)
+    return [byref(buffer, i * slot_bytes) for i in range(n_slots)]
+
+
+class FastDwf():
+    """Pre-resolved SDK functions & pre-built constant arguments for acquisition hot loops.
+
+        Avoids per-call attribute lookups and c_int()/byref() construction;
+        copy what the loop needs into local variables first:
+
+            fast = ad2.FastDwf(dwf, hdwf, INPUT_SAMPLE_SIZE)
+            status = fast.status
+            data16 = fast.status_data16
+            sts_ptr = byref(scope_status)
+            ch1_ptrs = ad2.slot_pointers(acquisition_data_ch1, n_acq, INPUT_SAMPLE_SIZE)
+            for i in range(n_acq):
+                while True:
+                    status(hdwf, fast.read_data, sts_ptr)
+                    if scope_status.value == DONE:
+                        break
+                data16(hdwf, fast.ch[0], ch1_ptrs[i], fast.zero, fast.n_samples)
+    """
+
+    def __init__(self, dwf, hdwf, n_samples=0, checked=False):
+        """
+            dwf
+            hdwf
+            n_samples = samples per acquisition (for n_samples arg)
+            checked = declare argtypes (see bind_dwf_function())
+        """
+        self.hdwf = hdwf
+        self.status = bind_dwf_function(dwf, 'FDwfAnalogInStatus', checked)
+        self.status_data16 = bind_dwf_function(dwf, 'FDwfAnalogInStatusData16', checked)
+        self.status_time = bind_dwf_function(dwf, 'FDwfAnalogInStatusTime', checked)
+        self.status_record = bind_dwf_function(dwf, 'FDwfAnalogInStatusRecord', checked)
+
+        # constant arguments:
+        self.read_data = c_int(1)   # fReadData for FDwfAnalogInStatus
+        self.no_data = c_int(0)
+        self.ch = [c_int(0), c_int(1)]
+        self.zero = c_int(0)
+        self.n_samples = c_int(n_samples)
+
+
+
+### Record mode (continuous) acquisition:
+
+class RecordEngine():
+    """Continuous record-mode (acqmodeRecord) acquisition to a 16-bit WAV file.
+
+        Samples from each FDwfAnalogInStatusRecord read are copied by the SDK straight into
+        one preallocated ring of fixed-size chunks (no per-read buffer allocation);
+        full chunks are written to the WAV file by a background writer thread.
+
+        Every gap is logged with its exact position (see events / save_events()):
+            'lost'      = samples the device dropped before a read (FIFO overflow; USB too slow)
+            'corrupted' = samples the device flagged as possibly corrupted
+                          (SDK gives a count per read; logged at the start of that read's data)
+            'dropped'   = samples read but not stored because the writer fell behind (ring full)
+        Each event is [kind, stream_offset, n_samples, file_offset]:
+            stream_offset = sample index in the continuous signal (counting lost/dropped samples)
+            file_offset = sample (frame) index in the WAV file where the gap is / starts
+
+        Usage (after setting up channel ranges/offsets & wavegen):
+            recorder = RecordEngine(dwf, hdwf, channels=[0], filepath='record.wav')
+            recorder.run(sample_rate=8e6, duration=2.)     # or duration=None, Ctrl+C to stop
+            recorder.print_stats()
+            recorder.save_events('record_events.csv')
+    """
+
+    def __init__(self, dwf, hdwf, channels=(0,), filepath=None, chunk_samples=None, n_chunks=RECORD_N_CHUNKS):
+        """
+            dwf
+            hdwf
+            channels = list of scope channels to record (0, 1); WAV channels in the same order
+                       (other channels are disabled by run())
+            filepath = output WAV file (None = don't save; ie. for throughput tests)
+            chunk_samples = ring chunk size (samples per channel); default = device buffer size
+            n_chunks = number of chunks in the ring
+        """
+        self.dwf = dwf
+        self.hdwf = hdwf
+        self.channels = list(channels)
+        self.filepath = filepath
+
+        if chunk_samples is None:
+            buffer_min = c_int()
+            buffer_max = c_int()
+            dwf.FDwfAnalogInBufferSizeInfo(hdwf, byref(buffer_min), byref(buffer_max))
+            chunk_samples = buffer_max.value
+        self.chunk_samples = chunk_samples
+        self.n_chunks = n_chunks
+
+        # 1 contiguous ring per channel; chunk i = samples [i*chunk_samples, (i+1)*chunk_samples)
+        self.rings = [(c_int16 * (n_chunks * chunk_samples))() for ch in self.channels]
+        self._ring_arrays = [np.ctypeslib.as_array(ring) for ring in self.rings]
+        self._ring_bytes = memoryview(self.rings[0]).cast('B')
+        self._channel_args = [c_int(ch) for ch in self.channels]
+
+        self._free = queue.Queue()
+        self._filled = queue.Queue()
+        for chunk in range(n_chunks):
+            self._free.put(chunk)
+        self._chunk = None          # chunk being filled
+        self._chunk_fill = 0        # samples in current chunk
+
+        self.sample_rate = NAN
+        self.n_samples = 0          # position in the continuous signal (stored + lost + dropped)
+        self.n_stored = 0           # samples stored in the ring (== WAV file position)
+        self.n_written = 0          # samples written to file (by the writer thread)
+        self.n_lost = 0
+        self.n_corrupted = 0
+        self.n_dropped = 0
+        self.n_reads = 0            # number of status reads with new data
+        self.max_backlog = 0        # max. number of filled chunks waiting for the writer
+        self.events = []
+
+    def _log(self, kind, n):
+        """Log a gap of n samples at the current stream/file position (merging contiguous spans)."""
+        if self.events:
+            last = self.events[-1]
+            if last[0] == kind and last[1] + last[2] == self.n_samples:
+                last[2] += n
+                return
+        self.events.append([kind, self.n_samples, n, self.n_stored])
+
+    def _store(self, n_available):
+        """Copy n_available samples of the last status read into the ring (splitting across chunks)."""
+        dwf = self.dwf
+        hdwf = self.hdwf
+        index = 0
+        while index < n_available:
+            if self._chunk is None:
+                try:
+                    self._chunk = self._free.get_nowait()
+                    self._chunk_fill = 0
+                except queue.Empty:
+                    # writer fell behind: drop the rest of this read
+                    dropped = n_available - index
+                    self._log('dropped', dropped)
+                    self.n_dropped += dropped
+                    self.n_samples += dropped
+                    return
+
+            n = min(n_available - index, self.chunk_samples - self._chunk_fill)
+            offset = 2 * (self._chunk * self.chunk_samples + self._chunk_fill)   # bytes
+            for channel, ring in zip(self._channel_args, self.rings):
+                dwf.FDwfAnalogInStatusData16(hdwf, channel, byref(ring, offset), c_int(index), c_int(n))
+
+            index += n
+            self._chunk_fill += n
+            self.n_samples += n
+            self.n_stored += n
+            if self._chunk_fill == self.chunk_samples:
+                self._commit()
+
+    def _commit(self):
+        """Hand the current chunk to the writer thread."""
+        self._filled.put((self._chunk, self._chunk_fill))
+        self.max_backlog = max(self.max_backlog, self._filled.qsize())
+        self._chunk = None
+
+    def _writer_loop(self, wav):
+        """Writer thread: write filled chunks to the WAV file & return them to the free list."""
+        if len(self.channels) > 1:
+            interleaved = np.empty((self.chunk_samples, len(self.channels)), dtype=np.int16)
+        while True:
+            item = self._filled.get()
+            if item is None:
+                break
+            chunk, n = item
+            start = chunk * self.chunk_samples
+
+            if wav is not None:
+                if len(self.channels) == 1:
+                    wav.writeframesraw(self._ring_bytes[2 * start:2 * (start + n)])
+                else:
+                    # WAV frames are interleaved: ch1, ch2, ch1, ch2, ...
+                    for i, ring_array in enumerate(self._ring_arrays):
+                        interleaved[:n, i] = ring_array[start:start + n]
+                    wav.writeframesraw(interleaved[:n])
+
+            self.n_written += n
+            self._free.put(chunk)
+
+    def run(self, sample_rate=None, duration=None):
+        """Configure record mode, start the scope & record until duration or Ctrl+C.
+
+            sample_rate = Hz (None = keep current setting)
+            duration = seconds of signal to record, including lost samples (None = until Ctrl+C)
+
+            Returns number of samples written to file (per channel).
+        """
+        dwf = self.dwf
+        hdwf = self.hdwf
+
+        # only the recorded channels go over USB (both are enabled by default, halving the max. rate)
+        n_device_channels = c_int()
+        dwf.FDwfAnalogInChannelCount(hdwf, byref(n_device_channels))
+        for ch in range(n_device_channels.value):
+            dwf.FDwfAnalogInChannelEnableSet(hdwf, c_int(ch), c_bool(ch in self.channels))
+
+        if sample_rate is not None:
+            dwf.FDwfAnalogInFrequencySet(hdwf, c_double(sample_rate))
+        dwf.FDwfAnalogInAcquisitionModeSet(hdwf, acqmodeRecord)
+        dwf.FDwfAnalogInRecordLengthSet(hdwf, c_double(-1))     # infinite; stopped here after 'duration'
+
+        actual_rate = c_double()
+        dwf.FDwfAnalogInFrequencyGet(hdwf, byref(actual_rate))
+        self.sample_rate = actual_rate.value
+        n_target = None if duration is None else int(round(duration * self.sample_rate))
+
+        wav = None
+        if self.filepath is not None:
+            wav = wave.open(self.filepath, 'wb')
+            wav.setnchannels(len(self.channels))
+            wav.setsampwidth(2)     # 16 bit / sample
+            wav.setframerate(int(round(self.sample_rate)))
+            wav.setcomptype('NONE', 'No compression')
+        writer = threading.Thread(target=self._writer_loop, args=(wav,), daemon=True)
+        writer.start()
+
+        sts = c_byte()
+        available = c_int()
+        lost = c_int()
+        corrupted = c_int()
+        not_started = (DwfStateConfig.value, DwfStatePrefill.value, DwfStateArmed.value)
+
+        dwf.FDwfAnalogInConfigure(hdwf, c_int(0), c_int(1))
+        try:
+            # acquisition not yet started:
+            while True:
+                dwf.FDwfAnalogInStatus(hdwf, c_int(1), byref(sts))
+                if sts.value not in not_started:
+                    break
+
+            while True:
+                dwf.FDwfAnalogInStatusRecord(hdwf, byref(available), byref(lost), byref(corrupted))
+
+                if lost.value:
+                    self._log('lost', lost.value)
+                    self.n_lost += lost.value
+                    self.n_samples += lost.value
+                if corrupted.value:
+                    self._log('corrupted', corrupted.value)
+                    self.n_corrupted += corrupted.value
+
+                n = available.value
+                if n_target is not None:
+                    # clamp to the end of the recording (lost samples count towards it; never negative)
+                    n = max(min(n, n_target - self.n_samples), 0)
+                if n > 0:
+                    self._store(n)
+                    self.n_reads += 1
+
+                if n_target is not None and self.n_samples >= n_target:
+                    break
+                dwf.FDwfAnalogInStatus(hdwf, c_int(1), byref(sts))
+
+        except KeyboardInterrupt:
+            print('Stopped by user.')
+
+        finally:
+            dwf.FDwfAnalogInConfigure(hdwf, c_int(0), c_int(0))    # stop recording
+            if self._chunk is not None and self._chunk_fill > 0:
+                self._commit()      # partial last chunk
+            self._filled.put(None)
+            writer.join()
+            if wav is not None:
+                wav.close()
+
+        return self.n_written
+
+    def print_stats(self):
+        """Print sample counts & gap summary."""
+        n = max(self.n_samples, 1)
+        print('Recorded %d samples at %.0f Hz (%.3f sec) in %d reads' % (self.n_samples, self.sample_rate,
+                                                                      self.n_samples / self.sample_rate, self.n_reads))
+        print('Written to file: %d samples' % self.n_written)
+        print('Lost (device)  : %d samples (%.2f%%)' % (self.n_lost, 100. * self.n_lost / n))
+        print('Corrupted      : %d samples (%.2f%%)' % (self.n_corrupted, 100. * self.n_corrupted / n))
+        print('Dropped (host) : %d samples (%.2f%%)' % (self.n_dropped, 100. * self.n_dropped / n))
+        print('Max writer backlog: %d of %d chunks' % (self.max_backlog, self.n_chunks))
+        if self.n_lost or self.n_corrupted:
+            print('Reduce sample rate for a gap-free recording.')
+
+    def save_events(self, filepath):
+        """Save gap events as CSV: kind,stream_offset,n_samples,file_offset (see class docstring)."""
+        with open(filepath, 'w') as f:
+            f.write('kind,stream_offset,n_samples,file_offset\n')
+            for kind, stream_offset, n, file_offset in self.events:
+                f.write('%s,%d,%d,%d\n' % (kind, stream_offset, n, file_offset))
+
+
+### Triggered acquisition (settings shared by multi_device.py & TriggeredAcquisition)
+
+# defaults (same as my_custom_trigger_16bit_2ch.py):
+ACQ_SAMPLE_RATE = 10e6
+ACQ_SAMPLE_SIZE = 16384
+ACQ_TRIGGER_POSITION_INDEX = 10
+ACQ_N_ACQUISITIONS = 10
+ACQ_TRIGGER_LEVEL = 1.0
+ACQ_V_RANGE = 5.0
+ACQ_TRIGGER_TIMEOUT = 5.0       # sec without a trigger before the acquisition loop gives up
+ACQ_DEVICE_CONFIG = 1           # FDwfDeviceConfigOpen config index (16k scope buffer)
+
+PULSE_WAIT_TIME = 0.02          # TR (sec)
+PULSE_SINE_N_CYCLES = 3
+PULSE_FREQUENCY = 1e6
+PULSE_AMPLITUDE = 5.0
+PULSE_CHANNEL = 0               # wavegen channel
+
+
+class AcquisitionConfig():
+    """Triggered windowed acquisition settings (2 scope channels), see configure_triggered_acquisition().
+
+        n_acquisitions = number of triggers to acquire (None = until stopped; TriggeredAcquisition only)
+        trigger_source = 'ch1' (scope ch1 edge, ie. tee'd from the pulse) or 'external' (Trigger 1 input)
+        pulse_device = device index that generates the pulses (multi_device.py);
+                       None = external pulses only (no wavegen)
+        trigger_timeout = sec without a trigger before the loop gives up
+    """
+
+    def __init__(self, sample_rate=ACQ_SAMPLE_RATE, samples_per_acq=ACQ_SAMPLE_SIZE, n_acquisitions=ACQ_N_ACQUISITIONS,
+                 trigger_source='ch1', trigger_level=ACQ_TRIGGER_LEVEL, trigger_position_index=ACQ_TRIGGER_POSITION_INDEX,
+                 v_range=ACQ_V_RANGE, pulse_device=0, pulse_wait=PULSE_WAIT_TIME, pulse_n_cycles=PULSE_SINE_N_CYCLES,
+                 pulse_frequency=PULSE_FREQUENCY, pulse_amplitude=PULSE_AMPLITUDE, trigger_timeout=ACQ_TRIGGER_TIMEOUT,
+                 device_config=ACQ_DEVICE_CONFIG):
+        if trigger_source not in ('ch1', 'external'):
+            raise ValueError("trigger_source must be 'ch1' or 'external' (not %r)" % trigger_source)
+        self.sample_rate = float(sample_rate)
+        self.samples_per_acq = int(samples_per_acq)
+        self.n_acquisitions = None if n_acquisitions is None else int(n_acquisitions)
+        self.trigger_source = trigger_source
+        self.trigger_level = trigger_level
+        self.trigger_position_index = trigger_position_index
+        self.v_range = v_range
+        self.pulse_device = pulse_device
+        self.pulse_wait = pulse_wait
+        self.pulse_n_cycles = pulse_n_cycles
+        self.pulse_frequency = pulse_frequency
+        self.pulse_amplitude = pulse_amplitude
+        self.trigger_timeout = trigger_timeout
+        self.device_config = device_config
+
+    def as_dict(self):
+        return dict(vars(self))
+
+
+def configure_triggered_acquisition(dwf, hdwf, config, pulse=False):
+    """Scope (& wavegen pulses) setup as in my_custom_trigger_16bit_2ch.py, then arm the scope.
+
+        The wavegen is configured but not started; start the pulses after every scope is armed:
+            dwf.FDwfAnalogOutConfigure(hdwf, c_int(PULSE_CHANNEL), c_bool(True))
+        config = AcquisitionConfig
+        pulse = also set up the wavegen (N sine cycles every config.pulse_wait)
+
+        Returns ScopeParams (exact ranges/offsets for the int16 -> volts conversion).
+    """
+    import waveforms
+    from dwfconstants import trigsrcDetectorAnalogIn, trigsrcExternal1, trigtypeEdge, DwfTriggerSlopeRise
+
+    dwf.FDwfDeviceAutoConfigureSet(hdwf, c_int(0))
+
+    if pulse:
+        channel = c_int(PULSE_CHANNEL)
+        waveforms.set_custom_waveform(dwf, hdwf, PULSE_CHANNEL, waveforms.sine_period(1024, endpoint=True),
+                                      config.pulse_frequency, config.pulse_amplitude)
+        dwf.FDwfAnalogOutRunSet(hdwf, channel, c_double(config.pulse_n_cycles / config.pulse_frequency))
+        dwf.FDwfAnalogOutWaitSet(hdwf, channel, c_double(config.pulse_wait))
+        n_pulses = 0 if config.n_acquisitions is None else config.n_acquisitions + 1    # 0 = repeat until stopped
+        dwf.FDwfAnalogOutRepeatSet(hdwf, channel, c_int(n_pulses))
+
+    dwf.FDwfAnalogInFrequencySet(hdwf, c_double(config.sample_rate))
+    dwf.FDwfAnalogInBufferSizeSet(hdwf, c_int(config.samples_per_acq))
+    for ch in range(2):
+        dwf.FDwfAnalogInChannelEnableSet(hdwf, c_int(ch), c_bool(True))
+        dwf.FDwfAnalogInChannelRangeSet(hdwf, c_int(ch), c_double(config.v_range))
+
+    dwf.FDwfAnalogInTriggerAutoTimeoutSet(hdwf, c_double(0))
+    if config.trigger_source == 'external':
+        dwf.FDwfAnalogInTriggerSourceSet(hdwf, trigsrcExternal1)
+    else:
+        dwf.FDwfAnalogInTriggerSourceSet(hdwf, trigsrcDetectorAnalogIn)
+        dwf.FDwfAnalogInTriggerChannelSet(hdwf, c_int(0))
+        dwf.FDwfAnalogInTriggerLevelSet(hdwf, c_double(config.trigger_level))
+    dwf.FDwfAnalogInTriggerTypeSet(hdwf, trigtypeEdge)
+    dwf.FDwfAnalogInTriggerConditionSet(hdwf, DwfTriggerSlopeRise)
+    sample_period = 1. / config.sample_rate
+    dwf.FDwfAnalogInTriggerPositionSet(hdwf, c_double(calc_trigger_pos_from_index(config.trigger_position_index,
+                                                                                  sample_period,
+                                                                                  config.samples_per_acq * sample_period)))
+
+    dwf.FDwfAnalogInConfigure(hdwf, c_bool(False), c_bool(True))    # arm
+    scope_params = ScopeParams(dwf, hdwf)
+    scope_params.get_scope_params()
+    return scope_params
+
+
+### asyncio acquisition API
+
+ASYNC_BLOCK_ACQUISITIONS = 16   # acquisitions per AcquisitionBlock
+ASYNC_N_BUFFERS = 8             # preallocated blocks; acquisitions are dropped if consumers hold all of them
+
+class AcquisitionBlock():
+    """Block of consecutive acquisitions from TriggeredAcquisition (shared by all consumers, no copies).
+
+        index = acquisition number of the first acquisition in the block
+        n = number of acquisitions (the last block may be short)
+        data = int16 array (2, n, samples_per_acq), a view of a preallocated buffer
+        timestamps_usec = int64 device trigger times (n,) (usec since Unix Epoch)
+        n_dropped = acquisitions dropped before this block (no free buffer)
+
+        The buffer is reused once every consumer has released the block (consumers'
+        iterators release it automatically when they fetch the next block; see
+        TriggeredAcquisition.subscribe()). Copy what you need to keep longer, or
+        iterate with auto_release=False & call release() when done.
+    """
+
+    def __init__(self, source, buffer_index, index, n, data, timestamps_usec, n_dropped, n_refs):
+        self.source = source
+        self.buffer_index = buffer_index
+        self.index = index
+        self.n = n
+        self.data = data
+        self.timestamps_usec = timestamps_usec
+        self.n_dropped = n_dropped
+        self._n_refs = n_refs
+        self._lock = threading.Lock()
+
+    def volts(self, ch, dtype=np.float32):
+        """Channel ch in volts (n, samples_per_acq) (new array)."""
+        return int16signal2voltage(self.data[ch], self.source.v_ranges[ch], self.source.v_offsets[ch], dtype=dtype)
+
+    def release(self):
+        """Done with this block (1 call per consumer; safe from any thread)."""
+        with self._lock:
+            self._n_refs -= 1
+            last = self._n_refs == 0
+        if last:
+            self.source._free.put(self.buffer_index)
+
+
+class AcquisitionStream():
+    """Async iterator over the AcquisitionBlocks of 1 consumer (see TriggeredAcquisition.subscribe())."""
+
+    def __init__(self, source, auto_release=True):
+        self.source = source
+        self.auto_release = auto_release
+        self.queue = asyncio.Queue(maxsize=source.n_buffers + 1)   # never full: at most n_buffers blocks + end marker
+        self._last = None
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self._last is not None and self.auto_release:
+            self._last.release()
+        self._last = None
+        if not self.source.running and self.source._future is None:
+            self.source.start()
+        block = await self.queue.get()
+        if block is None:
+            await self.source.join()    # raises the acquisition thread's exception, if any
+            raise StopAsyncIteration
+        self._last = block
+        return block
+
+
+class TriggeredAcquisition():
+    """asyncio API for the triggered windowed acquisition loop (2 scope channels, 1 device).
+
+        The blocking SDK calls run in a dedicated executor thread (same loop as
+        my_custom_trigger_16bit_2ch.py: ad2.FastDwf, preset destination pointers); acquisitions
+        go straight into a small pool of preallocated NumPy blocks, which are handed to the
+        event loop & shared by every consumer without copies.
+
+            async for block in ad2.TriggeredAcquisition(config):
+                print(block.index, block.data.shape)    # int16 (2, n, samples_per_acq)
+
+        Several consumers (subscribe before start(); each gets every block):
+            acq = ad2.TriggeredAcquisition(config)
+            writer = acq.subscribe()
+            stats = acq.subscribe()
+            async with acq:                     # start(); stop() & join() on exit
+                await asyncio.gather(write(writer), live_stats(stats))
+
+        config = AcquisitionConfig (n_acquisitions=None: until stop())
+        dwf = DWF library (default load_dwf()); device_index = FDwfDeviceConfigOpen index (-1 = first free)
+        pulse = generate the pulses on this device's wavegen (default: config.pulse_device is not None)
+        block_size = acquisitions per block; n_buffers = blocks in the pool
+        Stats after join(): n_acquired, n_dropped, n_blocks, elapsed
+    """
+
+    def __init__(self, config, dwf=None, device_index=-1, pulse=None, block_size=ASYNC_BLOCK_ACQUISITIONS,
+                 n_buffers=ASYNC_N_BUFFERS):
+        self.config = config
+        self.dwf = dwf if dwf is not None else load_dwf()
+        self.device_index = device_index
+        self.pulse = config.pulse_device is not None if pulse is None else pulse
+        self.block_size = block_size
+        self.n_buffers = n_buffers
+
+        spa = config.samples_per_acq
+        self._buffers = [(c_int16 * (2 * block_size * spa))() for i in range(n_buffers)]
+        self._arrays = [np.ctypeslib.as_array(buffer).reshape(2, block_size, spa) for buffer in self._buffers]
+        self._ptrs = [slot_pointers(buffer, 2 * block_size, spa) for buffer in self._buffers]
+        self._timestamps = [TimestampBuffer(block_size) for i in range(n_buffers)]
+        self._free = queue.Queue()
+        for i in range(n_buffers):
+            self._free.put(i)
+
+        self._streams = []
+        self._stop = threading.Event()
+        self._executor = None
+        self._future = None
+        self._loop = None
+        self.v_ranges = [NAN, NAN]
+        self.v_offsets = [NAN, NAN]
+        self.n_acquired = 0
+        self.n_dropped = 0
+        self.n_blocks = 0
+        self.timed_out = False
+        self.elapsed = NAN
+
+    def subscribe(self, auto_release=True):
+        """New consumer: async iterator of every block from now on (see AcquisitionBlock)."""
+        stream = AcquisitionStream(self, auto_release)
+        self._streams.append(stream)
+        return stream
+
+    def __aiter__(self):
+        return self.subscribe()
+
+    @property
+    def running(self):
+        return self._future is not None and not self._future.done()
+
+    def start(self):
+        """Start the acquisition thread (call from the event loop)."""
+        if self._future is not None:
+            return
+        from concurrent.futures import ThreadPoolExecutor
+        self._loop = asyncio.get_running_loop()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='ad2-acquisition')
+        self._future = self._loop.run_in_executor(self._executor, self._run)
+
+    def stop(self):
+        """Ask the acquisition thread to stop (after the current acquisition); consumers get the rest."""
+        self._stop.set()
+
+    async def join(self):
+        """Wait for the acquisition thread to end (raises its exception, if any)."""
+        if self._future is None:
+            return
+        try:
+            await asyncio.shield(self._future)
+        finally:
+            self._executor.shutdown(wait=False)
+
+    async def __aenter__(self):
+        self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.stop()
+        await self.join()
+
+    def _dispatch(self, buffer_index, index, n, n_dropped):
+        """(event loop thread) hand a filled buffer to every consumer."""
+        if not self._streams:
+            self._free.put(buffer_index)
+            return
+        records = np.frombuffer(self._timestamps[buffer_index].buffer, dtype=TIMESTAMP_DTYPE)[:n]
+        block = AcquisitionBlock(self, buffer_index, index, n, self._arrays[buffer_index][:, :n],
+                                 timestamps_to_usec(records), n_dropped, len(self._streams))
+        for stream in self._streams:
+            stream.queue.put_nowait(block)
+
+    def _end(self):
+        for stream in self._streams:
+            stream.queue.put_nowait(None)
+
+    def _run(self):
+        """(executor thread) open, configure & run the acquisition loop."""
+        dwf = self.dwf
+        config = self.config
+        hdwf = c_int()
+        dwf.FDwfDeviceConfigOpen(c_int(self.device_index), c_int(config.device_config), byref(hdwf))
+        if hdwf.value == 0:
+            self._loop.call_soon_threadsafe(self._end)
+            raise RuntimeError('failed to open device: ' + get_error(dwf))
+        try:
+            scope_params = configure_triggered_acquisition(dwf, hdwf, config, self.pulse)
+            self.v_ranges = [scope_params.ch1_v_range, scope_params.ch2_v_range]
+            self.v_offsets = [scope_params.ch1_v_offset, scope_params.ch2_v_offset]
+            if self.pulse:
+                dwf.FDwfAnalogOutConfigure(hdwf, c_int(PULSE_CHANNEL), c_bool(True))
+            t0 = time.perf_counter()
+            self._acquire(hdwf)
+            self.elapsed = time.perf_counter() - t0
+        finally:
+            if self.pulse:
+                dwf.FDwfAnalogOutConfigure(hdwf, c_int(PULSE_CHANNEL), c_bool(False))
+            dwf.FDwfAnalogInConfigure(hdwf, c_bool(False), c_bool(False))
+            dwf.FDwfDeviceClose(hdwf)
+            self._loop.call_soon_threadsafe(self._end)
+
+    def _acquire(self, hdwf):
+        """The triggered-window loop; fills pooled blocks & dispatches them to the event loop."""
+        config = self.config
+        fast_dwf = FastDwf(self.dwf, hdwf, config.samples_per_acq)
+        analog_in_status = fast_dwf.status
+        analog_in_status_data16 = fast_dwf.status_data16
+        analog_in_status_time = fast_dwf.status_time
+        READ_DATA = fast_dwf.read_data
+        CH1, CH2 = fast_dwf.ch
+        ZERO = fast_dwf.zero
+        N_SAMPLES = fast_dwf.n_samples
+        DONE = DwfStateDone.value
+        scope_status = c_byte()
+        scope_status_ptr = byref(scope_status)
+        perf_counter = time.perf_counter
+        stop_is_set = self._stop.is_set
+        call_soon_threadsafe = self._loop.call_soon_threadsafe
+        free = self._free
+        block_size = self.block_size
+        timeout = config.trigger_timeout
+        n_total = config.n_acquisitions
+
+        buffer_index = None
+        n_in_block = 0
+        block_start = 0
+        i = 0
+        deadline = perf_counter() + timeout
+        while n_total is None or i < n_total:
+            analog_in_status(hdwf, READ_DATA, scope_status_ptr)
+            if scope_status.value != DONE:
+                if stop_is_set():
+                    break
+                if perf_counter() > deadline:
+                    self.timed_out = True
+                    break
+                continue
+            deadline = perf_counter() + timeout
+
+            if buffer_index is None:
+                try:
+                    buffer_index = free.get_nowait()
+                except queue.Empty:
+                    self.n_dropped += 1     # consumers hold every buffer
+                    i += 1
+                    continue
+                ptrs = self._ptrs[buffer_index]
+                ts_ptrs = self._timestamps[buffer_index].ptrs
+                block_start = i
+            analog_in_status_data16(hdwf, CH1, ptrs[n_in_block], ZERO, N_SAMPLES)
+            analog_in_status_data16(hdwf, CH2, ptrs[block_size + n_in_block], ZERO, N_SAMPLES)
+            p_sec, p_ticks, p_tps = ts_ptrs[n_in_block]
+            analog_in_status_time(hdwf, p_sec, p_ticks, p_tps)
+            n_in_block += 1
+            i += 1
+            self.n_acquired += 1
+            if n_in_block == block_size:
+                call_soon_threadsafe(self._dispatch, buffer_index, block_start, n_in_block, self.n_dropped)
+                self.n_blocks += 1
+                buffer_index = None
+                n_in_block = 0
+
+        if buffer_index is not None:
+            call_soon_threadsafe(self._dispatch, buffer_index, block_start, n_in_block, self.n_dropped)
+            self.n_blocks += 1
+
+
+### Trigger timestamp files (timestamp_logger2.py):
+
+def load_timestamps_bin(filepath):
+    """Load binary timestamp file (timestamp_logger2.py -b) as a numpy structured array.
+
+        Fields: trig_utc_sec, trig_ticks, ticks_per_sec (uint32, see TIMESTAMP_DTYPE)
+        A partial last record (ie. from a crash mid-write) is ignored.
+    """
+    n_records = os.path.getsize(filepath) // TIMESTAMP_DTYPE.itemsize
+    return np.fromfile(filepath, dtype=TIMESTAMP_DTYPE, count=n_records)
+
+
+def load_timestamps(filepath):
+    """Load timestamp file (ASCII .csv or binary .bin) as a DataFrame.
+
+        Columns: trig_utc_sec, trig_ticks, ticks_per_sec (as float, same as the CSV readers)
+                 and time = trig_utc_sec + trig_ticks/ticks_per_sec  (seconds since Unix Epoch)
+    """
+    if filepath.endswith('.bin'):
+        records = load_timestamps_bin(filepath)
+        data = pd.DataFrame({name: records[name].astype(np.float64) for name in TIMESTAMP_DTYPE.names})
+    else:
+        data = pd.read_csv(filepath,
+                           sep=',',
+                           header=None,
+                           names=list(TIMESTAMP_DTYPE.names),
+                           dtype=float,
+                           )
+
+    data['time'] = data.trig_utc_sec + data.trig_ticks/data.ticks_per_sec
+    return data
+
+
+def timestamps_to_usec(data):
+    """Trigger times as int64 microseconds since Unix Epoch (full precision, no float seconds).
+
+        data = DataFrame from load_timestamps() or structured array from load_timestamps_bin()
+    """
+    utc_sec = np.asarray(data['trig_utc_sec']).astype(np.int64)
+    ticks = np.asarray(data['trig_ticks']).astype(np.int64)
+    ticks_per_sec = np.asarray(data['ticks_per_sec']).astype(np.int64)
+    return utc_sec * 1000000 + (ticks * 1000000 + ticks_per_sec // 2) // ticks_per_sec
+
+
+def nearest_indices(t_sorted, t_query):
+    """Index of the nearest t_sorted value for every t_query value (searchsorted, O(M log N)).
+
+        t_sorted = reference times, sorted ascending (ie. camera frames)
+        t_query  = times to match (ie. AD2 triggers), any order
+        Returns index array (same shape as t_query); ties go to the earlier reference time.
+    """
+    t_sorted = np.asarray(t_sorted)
+    t_query = np.asarray(t_query)
+    right = np.clip(np.searchsorted(t_sorted, t_query), 1, len(t_sorted) - 1)
+    left = right - 1
+    use_right = np.abs(t_sorted[right] - t_query) < np.abs(t_query - t_sorted[left])
+    return np.where(use_right, right, left) if len(t_sorted) > 1 else np.zeros(t_query.shape, dtype=np.intp)
+
+
+class TimestampAlignment():
+    """Match every query timestamp (ie. AD2 trigger) to its nearest reference timestamp (ie. camera frame),
+        and estimate the offset & linear drift between the 2 clocks.
+
+        Times are int64 microseconds (see timestamps_to_usec()).
+        Clock model:   t_ref = t_query + offset_usec + drift * (t_query - t0_usec)
+        Both series are sorted once, so every match is a searchsorted() (O((N+M) log M) total).
+        The model is fit on the first ALIGN_FIRST_WINDOW queries, then on a window that doubles
+        until it covers the whole session (so drift never adds up to more than ~1/2 frame period
+        between fits), then n_iterations times on everything. Pairs further than outlier_mads
+        median absolute deviations from the fit (ie. missed frames/triggers) are left out of the fit.
+
+        t_query, t_ref = int64 usec arrays (any order)
+        offset_guess_usec = initial offset, if the clocks differ by more than ~1/2 frame period
+        max_diff_usec = pairs further apart than this (after correction) are not matched (None = match all)
+        fit_drift = also fit the drift (False = offset only)
+
+        Results (per query, in the original query order):
+            index   = index into t_ref of the matched frame (-1 = not matched)
+            diff_usec = t_ref[index] - corrected t_query
+            inliers = pairs used for the final fit
+        and offset_usec, drift (sec/sec; drift_ppm), n_matched, n_duplicates (frames matched more than once)
+    """
+
+    def __init__(self, t_query, t_ref, offset_guess_usec=0, max_diff_usec=None, fit_drift=True,
+                 n_iterations=2, outlier_mads=5.):
+        self.t_query = np.asarray(t_query, dtype=np.int64)
+        self.t_ref = np.asarray(t_ref, dtype=np.int64)
+        if len(self.t_query) == 0 or len(self.t_ref) == 0:
+            raise ValueError('Need at least 1 query and 1 reference timestamp')
+
+        query_order = np.argsort(self.t_query, kind='stable')
+        ref_order = np.argsort(self.t_ref, kind='stable')
+        self.t0_usec = int(self.t_query[query_order[0]])
+        query_rel = (self.t_query[query_order] - self.t0_usec).astype(np.float64)   # float64 is exact for < ~285 years of usec
+        ref_rel = (self.t_ref[ref_order] - self.t0_usec).astype(np.float64)
+
+        self.offset_usec = float(offset_guess_usec)
+        self.drift = 0.
+        n = len(query_rel)
+        window = min(n, ALIGN_FIRST_WINDOW)
+        n_full = 0
+        while n_full < max(1, n_iterations):
+            q = query_rel[:window]
+            diff = self._match(ref_rel, q)[1]
+
+            # robust fit: ignore pairs far from the median (missed frames/triggers)
+            median = np.median(diff)
+            mad = np.median(np.abs(diff - median))
+            inliers = np.abs(diff - median) <= outlier_mads * max(mad, 1.)
+            q_in = q[inliers]
+            if fit_drift and len(q_in) > 2 and q_in[-1] > q_in[0]:
+                # least squares line through (q, q + offset + drift*q + diff), closed form
+                y = (1. + self.drift) * q_in + self.offset_usec + diff[inliers] - q_in
+                q_mean = q_in.mean()
+                self.drift = float(np.dot(q_in - q_mean, y - y.mean()) / np.dot(q_in - q_mean, q_in - q_mean))
+                self.offset_usec = float(y.mean() - self.drift * q_mean)
+            else:
+                self.offset_usec += float(np.mean(diff[inliers]))
+
+            if window == n:
+                n_full += 1
+            window = min(n, 2 * window)
+
+        sorted_index, diff = self._match(ref_rel, query_rel)
+        self.index = np.empty(n, dtype=np.int64)
+        self.index[query_order] = ref_order[sorted_index]
+        self.diff_usec = np.empty(n)
+        self.diff_usec[query_order] = diff
+        self.inliers = np.empty(n, dtype=bool)
+        self.inliers[query_order] = inliers
+        if max_diff_usec is not None:
+            self.index[np.abs(self.diff_usec) > max_diff_usec] = -1
+
+    def _match(self, ref_rel, query_rel):
+        """Nearest (sorted) reference index & difference for sorted, t0-relative queries."""
+        corrected = query_rel + self.offset_usec + self.drift * query_rel
+        sorted_index = nearest_indices(ref_rel, corrected)
+        return sorted_index, ref_rel[sorted_index] - corrected
+
+    @property
+    def drift_ppm(self):
+        return 1e6 * self.drift
+
+    @property
+    def matched(self):
+        return self.index >= 0
+
+    @property
+    def n_matched(self):
+        return int(np.count_nonzero(self.matched))
+
+    @property
+    def n_duplicates(self):
+        """Number of extra matches to reference times already matched by another query."""
+        return self.n_matched - len(np.unique(self.index[self.matched]))
+
+    def to_ref_time(self, t_query):
+        """Convert query clock times (int64 usec) to the reference clock (float usec)."""
+        t_rel = np.asarray(t_query, dtype=np.int64) - self.t0_usec
+        return self.t0_usec + t_rel + self.offset_usec + self.drift * t_rel
+
+    def to_frame(self):
+        """DataFrame with 1 row per query: t_query, index, t_ref (matched), diff_usec, inlier."""
+        t_ref = np.where(self.matched, self.t_ref[np.maximum(self.index, 0)], -1)
+        return pd.DataFrame({'t_query': self.t_query,
+                             'index': self.index,
+                             't_ref': t_ref,
+                             'diff_usec': self.diff_usec,
+                             'inlier': self.inliers,
+                             })
+
+    def print_summary(self):
+        diff = self.diff_usec[self.matched]
+        print('Matched %d of %d timestamps to %d reference times (%d duplicate matches)'
+              % (self.n_matched, len(self.t_query), len(self.t_ref), self.n_duplicates))
+        print('Clock offset: %.1f usec, drift: %.3f ppm (%.1f usec/hour)'
+              % (self.offset_usec, self.drift_ppm, 3600e6 * self.drift))
+        if diff.size:
+            print('Residual (usec): mean %.1f, std %.1f, max abs %.1f'
+                  % (np.mean(diff), np.std(diff), np.max(np.abs(diff))))
+
+
+
+### Acquisition loop timing:
+
+# Per-trigger metrics recorded by LoopTimer (name: unit):
+LOOP_TIMER_METRICS = [('polls', 'count'),     # FDwfAnalogInStatus calls until Done
+                      ('wait', 'sec'),        # armed -> start of the Done poll (waiting for trigger + post-trigger samples)
+                      ('transfer', 'sec'),    # the status poll that returned Done (includes USB data transfer)
+                      ('copy', 'sec'),        # Done -> data copied (StatusData16/StatusTime calls)
+                      ('rearm', 'sec'),       # data copied -> scope armed again (first status poll of next trigger)
+                      ('period', 'sec'),      # Done -> next Done (actual trigger period seen by the loop)
+                      ]
+
+class LoopTimer():
+    """Record per-trigger timing of a busy-wait acquisition loop.
+
+        Arrays are preallocated for n_triggers, so recording is just a few
+        array stores per trigger; all statistics are computed afterwards.
+
+        Usage (time.perf_counter() timestamps):
+            timer = LoopTimer(n_triggers)
+            for i in range(n_triggers):
+                dwf.FDwfAnalogInStatus(hdwf, c_int(1), byref(sts))  # 1st poll re-arms after last Done
+                t_armed = t_poll = time.perf_counter()
+                n_polls = 1
+                while sts.value != DwfStateDone.value:
+                    t_poll = time.perf_counter()
+                    dwf.FDwfAnalogInStatus(hdwf, c_int(1), byref(sts))
+                    n_polls += 1
+                t_done = time.perf_counter()
+                ... copy data ...
+                timer.record(i, n_polls, t_armed, t_poll, t_done, time.perf_counter())
+            timer.print_summary()
+            timer.save('loop_timing.npz')
+    """
+
+    def __init__(self, n_triggers):
+        self.n_polls = np.zeros(n_triggers, dtype=np.int64)
+        self.t_armed = np.full(n_triggers, NAN)
+        self.t_poll = np.full(n_triggers, NAN)
+        self.t_done = np.full(n_triggers, NAN)
+        self.t_copied = np.full(n_triggers, NAN)
+        self.n_recorded = 0
+
+    def record(self, i, n_polls, t_armed, t_poll, t_done, t_copied):
+        """Store timing of trigger i (perf_counter() seconds).
+
+            t_armed = after the first status poll (scope re-armed); with a waiter (see make_waiter()):
+                      before waiter.wait(), whose 1st poll re-arms (t_poll = waiter.t_seen, t_done = waiter.t_done)
+            t_poll = start of the status poll that returned Done
+            t_done = after the status poll that returned Done
+            t_copied = after the data/time calls
+        """
+        self.n_polls[i] = n_polls
+        self.t_armed[i] = t_armed
+        self.t_poll[i] = t_poll
+        self.t_done[i] = t_done
+        self.t_copied[i] = t_copied
+        self.n_recorded = i + 1
+
+    def metrics(self):
+        """Return dict of per-trigger metric arrays (see LOOP_TIMER_METRICS)."""
+        n = self.n_recorded
+        t_armed = self.t_armed[:n]
+        t_poll = self.t_poll[:n]
+        t_done = self.t_done[:n]
+        t_copied = self.t_copied[:n]
+        return {'polls': self.n_polls[:n].astype(np.float64),
+                'wait': t_poll - t_armed,
+                'transfer': t_done - t_poll,
+                'copy': t_copied - t_done,
+                'rearm': t_armed[1:] - t_copied[:-1],
+                'period': np.diff(t_done),
+                }
+
+    def summary(self):
+        """Return dict of metric name -> (p50, p99, max)."""
+        summary = {}
+        for name, values in self.metrics().items():
+            if values.shape[0] == 0:
+                summary[name] = (NAN, NAN, NAN)
+            else:
+                p50, p99 = np.percentile(values, [50, 99])
+                summary[name] = (p50, p99, np.max(values))
+        return summary
+
+    def print_summary(self):
+        """Print p50/p99/max of each metric."""
+        print('Loop timing over %d triggers:' % self.n_recorded)
+        print('%-8s %12s %12s %12s' % ('', 'p50', 'p99', 'max'))
+        summary = self.summary()
+        for name, unit in LOOP_TIMER_METRICS:
+            p50, p99, pmax = summary[name]
+            if unit == 'sec':
+                print('%-8s %9.1f us %9.1f us %9.1f us' % (name, 1e6*p50, 1e6*p99, 1e6*pmax))
+            else:
+                print('%-8s %12.0f %12.0f %12.0f' % (name, p50, p99, pmax))
+
+    def save(self, filepath, n_bins=64, keep_raw=False, **meta):
+        """Save histograms + p50/p99/max of each metric as a compressed .npz file.
+
+            Histograms use log-spaced bins (latencies have long tails).
+            n_bins = number of histogram bins per metric
+            keep_raw = also save the raw per-trigger arrays (much larger for long runs)
+            meta = extra values to save (ie. sample_rate=10e6, tr=0.02)
+
+            Load with load_loop_timing().
+        """
+        fields = {'n_triggers': self.n_recorded}
+        summary = self.summary()
+        for name, values in self.metrics().items():
+            positive = values[values > 0]
+            if positive.shape[0] > 0:
+                lo, hi = np.min(positive), np.max(positive)
+                if hi <= lo:
+                    hi = 2 * lo
+                edges = np.geomspace(lo, hi, n_bins + 1)
+                counts, edges = np.histogram(np.clip(values, lo, hi), bins=edges)
+            else:
+                edges = np.zeros(n_bins + 1)
+                counts = np.zeros(n_bins, dtype=np.int64)
+            fields[name + '_hist'] = counts.astype(np.int32)
+            fields[name + '_edges'] = edges
+            fields[name + '_summary'] = np.array(summary[name])     # p50, p99, max
+            if keep_raw:
+                fields[name + '_raw'] = values
+        for key, value in meta.items():
+            fields['meta_' + key] = value
+        np.savez_compressed(filepath, **fields)
+
+
+def load_loop_timing(filepath):
+    """Load a LoopTimer.save() file.
+
+        Returns dict of metric name -> dict with 'hist', 'edges', 'p50', 'p99', 'max' (and 'raw' if saved),
+        plus 'n_triggers' and 'meta' (dict of the extra saved values).
+    """
+    timing = {'meta': {}}
+    with np.load(filepath) as f:
+        timing['n_triggers'] = int(f['n_triggers'])
+        for name, unit in LOOP_TIMER_METRICS:
+            p50, p99, pmax = f[name + '_summary']
+            timing[name] = {'hist': f[name + '_hist'],
+                            'edges': f[name + '_edges'],
+                            'p50': p50, 'p99': p99, 'max': pmax,
+                            'unit': unit,
+                            }
+            if name + '_raw' in f:
+                timing[name]['raw'] = f[name + '_raw']
+        for key in f.files:
+            if key.startswith('meta_'):
+                timing['meta'][key[len('meta_'):]] = f[key][()]
+    return timing
+
+
 
 ### Convert to M-Mode
 
@@ -563,6 +2178,7 @@ def reshape_to_M_mode(us_data, tr_len, firstpeak):
     """Reshape 1-D signal array to M-mode matrix.
 
         us_data = 1D Numpy array of A-mode (voltage) signals
+                  (or anything np.asarray() can view without a copy, ie. memmap, Pandas Series)
         tr_len  = number of samples (int) for 1 pulse/echo acquisition period
         firstpeak = index into us_data to use as first M-mode data point
                     e.g. the first peak of the excitation or sync pulse
@@ -578,31 +2194,226 @@ def reshape_to_M_mode(us_data, tr_len, firstpeak):
         See original Matlab version for more details.
 
         Returns numpy 2-D array/matrix (TODO proper terminology here?)
+            This is a strided VIEW of us_data (no copy, see m_mode_view()),
+            so writing to it writes to us_data. Use .copy() if needed.
     """
+    return m_mode_view(us_data, tr_len, firstpeak)
 
-    #print('tr_len: ', tr_len)
-    #print('firstpeak: ', firstpeak)
 
+def m_mode_view(us_data, tr_len, firstpeak=0):
+    """Return a zero-copy M-mode view (tr_len, n_periods) of a 1D signal.
+
+        Column j is us_data[firstpeak + j*tr_len : firstpeak + (j+1)*tr_len],
+        same as reshape_to_M_mode() (Fortran-order reshape), but the result always
+        shares memory with us_data, for any 1D stride (ie. 1 channel of an
+        interleaved buffer), so M-mode images of long/memory-mapped sessions
+        cost no extra memory.
+
+        us_data = 1D array (ndarray, memmap, ctypes array, Pandas Series...)
+        tr_len = samples per acquisition period (int)
+        firstpeak = index of the first M-mode sample (int)
+    """
     tr_len = assert_int(tr_len)
     firstpeak = assert_int(firstpeak)
 
-    #new_len = us_data.Voltage.shape[0] - firstpeak + 1
-    new_len = us_data.shape[0] - firstpeak + 1
+    us_data = np.asarray(us_data)   # no copy for ndarray/memmap/ctypes/numeric Series
+    if us_data.ndim != 1:
+        raise ValueError('m_mode_view(): expected 1D data, got shape %s' % (us_data.shape,))
 
-    #print('tr_len: ',tr_len)
-    #print('firstpeak: ', firstpeak)
-    #print('new_len: ', new_len)
-    
-    n_periods = assert_int(np.floor(new_len // tr_len))
+    n_periods = max(us_data.shape[0] - firstpeak, 0) // tr_len
+    step = us_data.strides[0]
+    return np.lib.stride_tricks.as_strided(us_data[firstpeak:],
+                                           shape=(tr_len, n_periods),
+                                           strides=(step, step * tr_len),
+                                           )
+
+
+class MModeBuilder():
+    """Build an M-mode matrix one acquisition (column) at a time, while acquiring.
+
+        Columns are stored as contiguous rows of a preallocated buffer, and
+        m_mode() returns a transposed view (no copy), same orientation as
+        reshape_to_M_mode(). Each append is 1 contiguous copy (or none,
+        if the SDK writes straight into next_column()/ptr()).
+
+        capacity = max. number of columns kept
+        ring = False: stop at capacity (append() returns False when full)
+               True: keep the last capacity columns (scrolling M-mode, ie. live display).
+                     Each column is also written to a mirror copy so the window is
+                     always 1 contiguous view (2x capacity memory, no copy on read).
+
+        Usage:
+            builder = ad2.MModeBuilder(INPUT_SAMPLE_SIZE, 1000, dtype=np.int16, ring=True)
+            ...
+            dwf.FDwfAnalogInStatusData16(hdwf, c_int(1), builder.ptr(), 0, INPUT_SAMPLE_SIZE)
+            builder.commit()                # or builder.append(acq)
+            ...
+            ad2.plot_m_mode(builder.m_mode())
+    """
 
-    last_index = firstpeak + n_periods*tr_len - 1
-    #print('new shape: ', tr_len, n_periods)
+    def __init__(self, tr_len, capacity, dtype=np.float64, ring=False):
+        self.tr_len = assert_int(tr_len)
+        self.capacity = assert_int(capacity)
+        self.ring = ring
+        n_rows = 2 * self.capacity if ring else self.capacity
+        self.buffer = np.zeros((n_rows, self.tr_len), dtype=dtype)
+        self.n_columns = 0      # total columns appended (including overwritten ring columns)
+
+    def __len__(self):
+        """Number of columns in m_mode()."""
+        return min(self.n_columns, self.capacity)
+
+    @property
+    def full(self):
+        return not self.ring and self.n_columns >= self.capacity
+
+    def next_column(self):
+        """Return the (writable, contiguous) array for the next column; call commit() after filling it."""
+        return self.buffer[self.n_columns % self.capacity]
+
+    def ptr(self):
+        """Return a ctypes pointer to the next column (ie. for FDwfAnalogInStatusData16)."""
+        return self.next_column().ctypes.data_as(c_void_p)
+
+    def commit(self):
+        """Add the column written via next_column()/ptr(). Returns False (and drops it) if full."""
+        if self.full:
+            return False
+        if self.ring:
+            i = self.n_columns % self.capacity
+            self.buffer[i + self.capacity] = self.buffer[i]    # mirror
+        self.n_columns += 1
+        return True
+
+    def append(self, acq):
+        """Copy 1 acquisition (tr_len samples) in as the next column. Returns False if full."""
+        if self.full:
+            return False
+        self.next_column()[:] = acq
+        return self.commit()
+
+    def m_mode(self):
+        """Return the M-mode matrix (tr_len, n_columns) as a view; oldest column first."""
+        if not self.ring or self.n_columns <= self.capacity:
+            return self.buffer[:min(self.n_columns, self.capacity)].T
+        start = self.n_columns % self.capacity
+        return self.buffer[start:start + self.capacity].T
+
+
+class CoherentAverager():
+    """Running average of the last n_average triggered acquisitions (same echo window), per channel.
+
+        Updated as each acquisition lands (1 pass over tr_len samples per channel):
+        mode = 'window': exact mean of the last n_average acquisitions; integer running sums
+                         (int32, or int64 if n_average * 32768 could overflow) + a ring of the
+                         last n_average+1 raw int16 acquisitions to subtract the oldest one
+               'ema':    exponential moving average, avg += alpha * (acq - avg)
+                         alpha defaults to 2 / (n_average + 1) (same center of mass as the window)
+        Averages are in int16 units (float); see volts() / int16_volts_scale().
+
+        commit() returns True every n_average acquisitions (a block of all-new acquisitions),
+        ie. to save only the averages: n_average x less data to store/stream.
+
+        Usage:
+            averager = ad2.CoherentAverager(2, INPUT_SAMPLE_SIZE, 16)
+            ...
+            ptrs = averager.ptrs(n_acquisitions)    # SDK writes straight into the ring
+            dwf.FDwfAnalogInStatusData16(hdwf, c_int(0), ptrs[i][0], 0, INPUT_SAMPLE_SIZE)
+            dwf.FDwfAnalogInStatusData16(hdwf, c_int(1), ptrs[i][1], 0, INPUT_SAMPLE_SIZE)
+            if averager.commit():                   # or averager.commit([acq_ch1, acq_ch2]) to copy in
+                averager.average_int16(0, out=...)
+    """
+
+    def __init__(self, n_channels, tr_len, n_average, mode='window', alpha=None):
+        if mode not in ('window', 'ema'):
+            raise ValueError("mode must be 'window' or 'ema' (not %r)" % mode)
+        self.n_channels = assert_int(n_channels)
+        self.tr_len = assert_int(tr_len)
+        self.n_average = assert_int(n_average)
+        if self.n_average < 1:
+            raise ValueError('n_average must be >= 1')
+        self.mode = mode
+        self.alpha = 2. / (self.n_average + 1) if alpha is None else float(alpha)
+        self.n_added = 0
+
+        # raw acquisitions land here (window: last n_average+1 acquisitions; ema: just the newest)
+        self.n_slots = self.n_average + 1 if mode == 'window' else 1
+        self.ring = np.zeros((self.n_slots, self.n_channels, self.tr_len), dtype=np.int16)
+        if mode == 'window':
+            sum_dtype = np.int32 if self.n_average * 32768 < 2**31 else np.int64
+            self.sums = np.zeros((self.n_channels, self.tr_len), dtype=sum_dtype)
+        else:
+            self.ema = np.zeros((self.n_channels, self.tr_len), dtype=np.float64)
+            self._delta = np.empty_like(self.ema)
+
+    def __len__(self):
+        """Number of acquisitions in the current average (window mode; all of them for ema)."""
+        return min(self.n_added, self.n_average) if self.mode == 'window' else self.n_added
+
+    @property
+    def n_blocks(self):
+        """Number of completed blocks of n_average acquisitions (ie. averages to save)."""
+        return self.n_added // self.n_average
+
+    def ptrs(self, n):
+        """Return SDK destination pointers [ch0, ch1, ...] for each of the next n acquisitions."""
+        slot_bytes = self.n_channels * self.tr_len * sizeof(c_int16)
+        ch_bytes = self.tr_len * sizeof(c_int16)
+        base = self.ring.ctypes.data
+        return [[c_void_p(base + ((self.n_added + i) % self.n_slots) * slot_bytes + ch * ch_bytes)
+                 for ch in range(self.n_channels)]
+                for i in range(n)]
+
+    def commit(self, acqs=None):
+        """Add the next acquisition to the average. Returns True when a block of n_average is complete.
+
+            acqs = None if the SDK already wrote it via ptrs(),
+                   or 1 int16 array per channel (tr_len samples each) to copy in
+        """
+        slot = self.ring[self.n_added % self.n_slots]
+        if acqs is not None:
+            for ch in range(self.n_channels):
+                slot[ch] = acqs[ch]
+
+        if self.mode == 'window':
+            np.add(self.sums, slot, out=self.sums)
+            if self.n_added >= self.n_average:
+                np.subtract(self.sums, self.ring[(self.n_added - self.n_average) % self.n_slots], out=self.sums)
+        elif self.n_added == 0:
+            self.ema[:] = slot      # start at the 1st acquisition (no bias towards 0)
+        else:
+            np.subtract(slot, self.ema, out=self._delta)
+            self._delta *= self.alpha
+            self.ema += self._delta
+
+        self.n_added += 1
+        return self.n_added % self.n_average == 0
+
+    def average(self, ch, out=None):
+        """Averaged A-line of channel ch (int16 units, float64)."""
+        if self.n_added == 0:
+            raise ValueError('No acquisitions averaged yet')
+        if self.mode == 'ema':
+            if out is None:
+                return self.ema[ch].copy()
+            out[:] = self.ema[ch]
+            return out
+        return np.divide(self.sums[ch], len(self), out=out)
+
+    def average_int16(self, ch, out=None):
+        """Averaged A-line rounded to int16 (ie. to save with write_int16_bin() / StreamingSessionWriter).
+
+            NOTE: rounding adds ~0.29 LSB rms of quantization noise (small vs. the ADC noise being averaged out)
+        """
+        if out is None:
+            out = np.empty(self.tr_len, dtype=np.int16)
+        np.rint(self.average(ch), out=out, casting='unsafe')
+        return out
 
-    # note +1 on last_index because python end-indexes are not inclusive!
-    #return np.reshape(np.array(us_data.Voltage[firstpeak:last_index+1]), 
-    return np.reshape(np.array(us_data[firstpeak:last_index+1]), 
-                      (tr_len, n_periods),
-                      order='F')    # note Fortran index order
+    def volts(self, ch, v_range, v_offset):
+        """Averaged A-line of channel ch in volts (exact scope range/offset, see ScopeParams)."""
+        scale, offset = int16_volts_scale(v_range, v_offset)
+        return self.average(ch) * scale + offset
 
 
 def assert_int(i):
@@ -653,29 +2464,516 @@ def bland_altman(y1, y2):
     plt.show()
 
 
-def plot_m_mode(data_m, title='M-Mode', ignore_rows=30):
+def envelope(data_m, dtype=np.float64, out=None):
+    """Envelope (magnitude of the analytic signal) of every A-line of an M-mode matrix.
+
+        FFT-based Hilbert transform along the fast-time axis (rows), computed for a
+        block of A-lines at a time (ENVELOPE_BLOCK_BYTES of spectrum, ie. stays in cache),
+        each block in 1 vectorized pass (no per-line loop).
+
+        data_m = 2D M-mode matrix (samples_per_acq, n_acquisitions), see reshape_to_M_mode()
+                    int16 or volts; Numpy array, strided view or memmap (read 1 block at a time)
+        dtype = np.float64 or np.float32 (half the memory, ~2x faster FFTs)
+        out = optional preallocated output (same shape as data_m)
+
+        Returns envelope, same shape & units as data_m.
+    """
+    data_m = np.asarray(data_m)
+    n_samples, n_lines = data_m.shape
+    if out is None:
+        out = np.empty(data_m.shape, dtype=dtype)
+    lines = data_m.T        # (n_lines, n_samples): A-lines are contiguous for M-mode views
+    out_lines = out.T
+
+    complex_bytes = 2 * np.dtype(dtype).itemsize
+    block = max(1, ENVELOPE_BLOCK_BYTES // (n_samples * complex_bytes))
+
+    # analytic signal spectrum: DC & Nyquist x1, positive frequencies x2, negative frequencies 0
+    n_half = n_samples // 2 + 1
+    weights = np.zeros(n_half, dtype=dtype)
+    weights[0] = 1.
+    weights[1:(n_samples + 1) // 2] = 2.
+    if n_samples % 2 == 0:
+        weights[n_samples // 2] = 1.
+    spectrum = np.zeros((min(block, n_lines), n_samples), dtype=np.result_type(dtype, np.complex64))
+
+    for i in range(0, n_lines, block):
+        chunk = np.asarray(lines[i:i+block], dtype=dtype)
+        n = chunk.shape[0]
+        spectrum[:n, :n_half] = np.fft.rfft(chunk, axis=1)
+        spectrum[:n, :n_half] *= weights
+        np.abs(np.fft.ifft(spectrum[:n], axis=1), out=out_lines[i:i+n])
+    return out
+
+
+def log_compress(env, dynamic_range_db=DYNAMIC_RANGE_DB, ref=None, out=None):
+    """Log compression of an envelope for display: dB relative to ref, clipped to [-dynamic_range_db, 0].
+
+        env = envelope (see envelope())
+        dynamic_range_db = dB below ref that are still shown (everything lower is black)
+        ref = 0 dB reference value (default: max of env)
+        out = optional preallocated output (can be env itself, ie. in place)
+    """
+    if ref is None:
+        ref = np.max(env)
+    floor = ref * 10 ** (-dynamic_range_db / 20.)
+    out = np.maximum(env, floor, out=out)
+    np.log10(out, out=out)
+    out *= 20.
+    out -= 20. * np.log10(ref)
+    return out
+
+
+def _parabolic_peak(y, rows, peak):
+    """Sub-sample peak position & height of a parabola through y[peak-1], y[peak], y[peak+1] (per row)."""
+    inner = np.clip(peak, 1, y.shape[1] - 2)
+    a = y[rows, inner - 1].astype(np.float64)
+    b = y[rows, inner].astype(np.float64)
+    c = y[rows, inner + 1].astype(np.float64)
+    denom = a - 2 * b + c
+    with np.errstate(divide='ignore', invalid='ignore'):
+        delta = np.where((denom < 0) & (inner == peak), 0.5 * (a - c) / denom, 0.)
+    return peak + delta, b - 0.25 * (a - c) * delta
+
+
+def _threshold_crossing(y, rows, first, threshold):
+    """Sub-sample threshold crossing (linear interpolation between first-1 and first, per row)."""
+    prev = np.maximum(first - 1, 0)
+    y0 = y[rows, prev].astype(np.float64)
+    y1 = y[rows, first].astype(np.float64)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        frac = np.where((first > 0) & (y1 > y0), (threshold - y0) / (y1 - y0), 1.)
+    return prev + np.clip(frac, 0., 1.) * (first > 0), y1
+
+
+def find_echoes(data_m, method='threshold', n_echoes=1, threshold=None, start_index=0, stop_index=None,
+                min_separation=ECHO_MIN_SEPARATION, refine=True, dtype=np.float32):
+    """Echo arrival sample indexes (time of flight) for every acquisition of an M-mode matrix at once.
+
+        data_m = 2D M-mode matrix (samples_per_acq, n_acquisitions), see reshape_to_M_mode()
+                    int16 or volts; Numpy array, strided view or memmap (read 1 block of acquisitions at a time)
+        method = 'threshold': first samples where |signal| crosses threshold (echo onset),
+                              then the next crossing at least min_separation samples later, ...
+                 'peak':      the n_echoes largest envelope peaks (see envelope()), min_separation apart
+                              (and >= threshold if given), in order of arrival
+        n_echoes = echoes per acquisition (1st echo, 2nd echo, ...)
+        threshold = absolute threshold (data units), or None for ECHO_THRESHOLD_FRACTION x the max of each acquisition
+        start_index, stop_index = only search this sample range, ie. skip the excitation pulse & its ringing
+        refine = sub-sample position: linear interpolation of the threshold crossing,
+                 or parabolic interpolation of the envelope peak
+        dtype = working precision
+
+        Returns (echo_index, echo_amplitude), both (n_acquisitions, n_echoes) arrays:
+            echo_index = sample index within the acquisition (float; NaN = no echo found)
+            echo_amplitude = |signal| at the crossing or envelope peak height
+        See echo_depth_mm() to convert to distance.
+    """
+    if method not in ('threshold', 'peak'):
+        raise ValueError("method must be 'threshold' or 'peak' (not %r)" % method)
+    data_m = np.asarray(data_m)
+    n_samples, n_lines = data_m.shape
+    stop_index = n_samples if stop_index is None else min(stop_index, n_samples)
+    window = data_m[start_index:stop_index]
+    window_len = window.shape[0]
+
+    echo_index = np.full((n_lines, n_echoes), np.nan)
+    echo_amplitude = np.full((n_lines, n_echoes), np.nan, dtype=np.float32)
+    block = max(1, ENVELOPE_BLOCK_BYTES // (window_len * 2 * np.dtype(dtype).itemsize))
+    columns = np.arange(window_len)
+
+    for i in range(0, n_lines, block):
+        if method == 'peak':
+            lines = envelope(window[:, i:i+block], dtype=dtype).T
+        else:
+            lines = np.abs(np.asarray(window[:, i:i+block].T, dtype=dtype))
+        n = lines.shape[0]
+        rows = np.arange(n)
+
+        if threshold is None:
+            line_threshold = (ECHO_THRESHOLD_FRACTION * np.max(lines, axis=1)) if method == 'threshold' else np.zeros(n)
+        else:
+            line_threshold = np.full(n, threshold, dtype=np.float64)
+
+        for k in range(n_echoes):
+            if method == 'threshold':
+                above = lines >= line_threshold[:, None]
+                first = np.argmax(above, axis=1)
+                found = above[rows, first] & (line_threshold > 0)
+                if refine:
+                    position, amplitude = _threshold_crossing(lines, rows, first, line_threshold)
+                else:
+                    position, amplitude = first, lines[rows, first]
+                # next echo: only after this one + min_separation
+                lines[columns < (first + min_separation)[:, None]] = 0
+            else:
+                first = np.argmax(lines, axis=1)
+                found = (lines[rows, first] > 0) & (lines[rows, first] >= line_threshold)
+                if refine:
+                    position, amplitude = _parabolic_peak(lines, rows, first)
+                else:
+                    position, amplitude = first, lines[rows, first]
+                # next echo: blank this one (+/- min_separation)
+                lines[np.abs(columns - first[:, None]) < min_separation] = 0
+
+            echo_index[i:i+n, k] = np.where(found, position + start_index, np.nan)
+            echo_amplitude[i:i+n, k] = np.where(found, amplitude, np.nan)
+
+    if method == 'peak' and n_echoes > 1:
+        order = np.argsort(echo_index, axis=1)      # order of arrival (NaN last)
+        echo_index = np.take_along_axis(echo_index, order, axis=1)
+        echo_amplitude = np.take_along_axis(echo_amplitude, order, axis=1)
+    return echo_index, echo_amplitude
+
+
+def echo_depth_mm(echo_index, sample_rate, c=C_WATER, t0_index=0, round_trip=True):
+    """Convert echo sample indexes (see find_echoes()) to distance in mm.
+
+        sample_rate = scope sample rate (Hz)
+        c = speed of sound (m/s), ie. C_WATER, C_AIR, C_TISSUE
+        t0_index = sample index of the excitation (ie. INPUT_TRIGGER_POSITION_INDEX)
+        round_trip = True for pulse-echo (distance = c * t / 2); False for 1-way (ie. pitch-catch)
+    """
+    distance_mm = 1000. * c * (np.asarray(echo_index) - t0_index) / sample_rate
+    return 0.5 * distance_mm if round_trip else distance_mm
+
+
+### Acquisition planning
+
+AD2_BASE_SAMPLE_RATE = 100e6     # Hz; scope sample rates are 100 MHz / integer divider
+USB_BYTES_PER_SEC = 10e6         # conservative scope data rate over USB (measure with measure_transfer())
+LOOP_OVERHEAD_SEC = 1e-3         # per-trigger status/copy/re-arm time of the acquisition loop (not counting data transfer)
+PLAN_MARGIN = 1.25               # service time x margin must fit in TR
+PLAN_PRE_TRIGGER_SAMPLES = 10    # samples kept before the trigger (INPUT_TRIGGER_POSITION_INDEX)
+TRANSFER_MEASURE_REPEATS = 50    # acquisitions per buffer size in measure_transfer()
+TRANSFER_MEASURE_WARMUP = 3      # first acquisitions per buffer size not counted (first-call USB/driver setup)
+
+
+class TransferModel():
+    """Time to service 1 trigger in the acquisition loop: overhead_sec + n_bytes / bytes_per_sec.
+
+        bytes_per_sec = scope data rate over USB (2 bytes per sample per channel)
+        overhead_sec = status/copy/re-arm time per trigger (not counting data transfer)
+        source = where the numbers came from (printed with the plan)
+    """
+
+    def __init__(self, bytes_per_sec=USB_BYTES_PER_SEC, overhead_sec=LOOP_OVERHEAD_SEC, source='default'):
+        self.bytes_per_sec = float(bytes_per_sec)
+        self.overhead_sec = float(overhead_sec)
+        self.source = source
+
+    def service_time(self, n_samples, n_channels):
+        """Seconds from the end of an acquisition until the scope is armed again."""
+        return self.overhead_sec + 2 * n_channels * n_samples / self.bytes_per_sec
+
+    @classmethod
+    def from_loop_timing(cls, filepath):
+        """From a bench_acquisition_loop.py trigger loop timing file (p99 values).
+
+            The file must have been saved with the n_bytes meta value (data bytes per trigger).
+        """
+        timing = load_loop_timing(filepath)
+        if 'n_bytes' not in timing['meta']:
+            raise ValueError('%s has no n_bytes (re-run bench_acquisition_loop.py)' % filepath)
+        n_bytes = float(timing['meta']['n_bytes'])
+        return cls(n_bytes / timing['transfer']['p99'],
+                   timing['copy']['p99'] + timing['rearm']['p99'],
+                   source=os.path.basename(filepath))
+
+    def __repr__(self):
+        return 'TransferModel(%.2f MB/s, %.3f ms overhead, %s)' % (1e-6 * self.bytes_per_sec, 1e3 * self.overhead_sec, self.source)
+
+
+def list_device_configs(dwf, device_index=0):
+    """Device memory configurations (FDwfDeviceConfigOpen index) of an attached device.
+
+        Returns list of dicts: index, scope_buffer (samples per channel), wavegen_buffer, scope_channels
+    """
+    n_devices = c_int()
+    dwf.FDwfEnum(c_int(0), byref(n_devices))
+    if device_index >= n_devices.value:
+        raise RuntimeError('No device %d (%d attached)' % (device_index, n_devices.value))
+
+    n_configs = c_int()
+    dwf.FDwfEnumConfig(c_int(device_index), byref(n_configs))
+    value = c_int()
+    configs = []
+    for i in range(n_configs.value):
+        config = {'index': i}
+        for key, info in (('scope_buffer', DECIAnalogInBufferSize),
+                          ('wavegen_buffer', DECIAnalogOutBufferSize),
+                          ('scope_channels', DECIAnalogInChannelCount)):
+            dwf.FDwfEnumConfigInfo(c_int(i), info, byref(value))
+            config[key] = value.value
+        configs.append(config)
+    return configs
+
+
+def measure_transfer(dwf, hdwf, n_channels=2, sample_rate=10e6, n_samples=None, n_repeats=TRANSFER_MEASURE_REPEATS,
+                     n_warmup=TRANSFER_MEASURE_WARMUP):
+    """Measure the acquisition loop's data transfer rate & per-trigger overhead on an open device.
+
+        Runs the trigger-script loop (see LoopTimer) without a trigger (trigsrcNone) at
+        2 buffer sizes, and fits the median transfer time = latency + n_bytes / bytes_per_sec;
+        the overhead is latency + median copy & re-arm time.
+        Medians only: the first n_warmup acquisitions of each size are not counted, and the
+        occasional OS/USB hiccup is left to the plan margin (PLAN_MARGIN), so a single
+        outlier can't make the settings look impossible.
+        Leaves the scope stopped; configure it again afterwards.
+
+        n_samples = largest buffer size to measure (default: max of the open config)
+        Returns TransferModel.
+    """
+    if n_samples is None:
+        size_min, size_max = c_int(), c_int()
+        dwf.FDwfAnalogInBufferSizeInfo(hdwf, byref(size_min), byref(size_max))
+        n_samples = size_max.value
+    sizes = [max(n_samples // 4, 16), n_samples]
+    buffer = (c_int16 * n_samples)()
+    scope_status = c_byte()
+    perf_counter = time.perf_counter
+
+    dwf.FDwfAnalogInFrequencySet(hdwf, c_double(sample_rate))
+    for ch in range(n_channels):
+        dwf.FDwfAnalogInChannelEnableSet(hdwf, c_int(ch), c_bool(True))
+    dwf.FDwfAnalogInTriggerSourceSet(hdwf, trigsrcNone)
+    dwf.FDwfAnalogInTriggerAutoTimeoutSet(hdwf, c_double(0))
+
+    transfer = []       # median of the status poll that returned Done
+    other = []          # median copy + re-arm
+    for size in sizes:
+        dwf.FDwfAnalogInBufferSizeSet(hdwf, c_int(size))
+        dwf.FDwfAnalogInConfigure(hdwf, c_bool(False), c_bool(True))
+        timer = LoopTimer(n_warmup + n_repeats)
+        for i in range(n_warmup + n_repeats):
+            dwf.FDwfAnalogInStatus(hdwf, c_int(1), byref(scope_status))
+            t_armed = t_poll = perf_counter()
+            n_polls = 1
+            while scope_status.value != DwfStateDone.value:
+                t_poll = perf_counter()
+                dwf.FDwfAnalogInStatus(hdwf, c_int(1), byref(scope_status))
+                n_polls += 1
+            t_done = perf_counter()
+            for ch in range(n_channels):
+                dwf.FDwfAnalogInStatusData16(hdwf, c_int(ch), buffer, 0, size)
+            timer.record(i, n_polls, t_armed, t_poll, t_done, perf_counter())
+        metrics = timer.metrics()
+        transfer.append(np.median(metrics['transfer'][n_warmup:]))
+        other.append(np.median(metrics['copy'][n_warmup:]) + np.median(metrics['rearm'][n_warmup:]))
+    dwf.FDwfAnalogInConfigure(hdwf, c_bool(False), c_bool(False))
+
+    n_bytes = [2 * n_channels * size for size in sizes]
+    slope = (transfer[1] - transfer[0]) / (n_bytes[1] - n_bytes[0])
+    if slope > 0:
+        bytes_per_sec = 1. / slope
+        latency = max(transfer[1] - n_bytes[1] * slope, 0.)
+    else:
+        bytes_per_sec = n_bytes[1] / transfer[1]     # too noisy to separate latency & rate
+        latency = 0.
+    return TransferModel(bytes_per_sec, latency + max(other), source='measured')
+
+
+class AcquisitionPlan():
+    """Triggered acquisition settings & whether the loop can service every trigger.
+
+        Made by plan_acquisition() (or check_acquisition() for hand-set values).
+        Attributes:
+            config_index = FDwfDeviceConfigOpen memory configuration
+            sample_rate, samples_per_acq, trigger_position_index, trigger_position_time (for FDwfAnalogInTriggerPositionSet)
+            n_channels, tr
+            acq_time = 1 acquisition (sec); service_time = data transfer + loop overhead (sec)
+            cycle_time = acq_time + service_time (x margin must be <= tr)
+            max_depth_mm = deepest echo inside the window (after the pre-trigger samples)
+            problems = list of strings (empty if OK); ok = no problems
+            warnings = list of strings (don't make the plan invalid), ie. the cycle fits in TR but not with the margin
+    """
+
+    def __init__(self, config_index, sample_rate, samples_per_acq, trigger_position_index, n_channels, tr,
+                 transfer, c=C_WATER, buffer_max=None, margin=PLAN_MARGIN):
+        self.config_index = config_index
+        self.sample_rate = float(sample_rate)
+        self.samples_per_acq = int(samples_per_acq)
+        self.trigger_position_index = int(trigger_position_index)
+        self.n_channels = n_channels
+        self.tr = tr
+        self.transfer = transfer
+        self.c = c
+        self.buffer_max = buffer_max
+        self.margin = margin
+        self.depth_mm = None        # requested depth (plan_acquisition())
+
+        self.acq_time = self.samples_per_acq / self.sample_rate
+        self.trigger_position_time = calc_trigger_pos_from_index(self.trigger_position_index, 1. / self.sample_rate, self.acq_time)
+        self.service_time = transfer.service_time(self.samples_per_acq, n_channels)
+        self.cycle_time = self.acq_time + self.service_time
+        self.max_depth_mm = 500. * c * (self.samples_per_acq - self.trigger_position_index) / self.sample_rate
+        self.problems = []
+        self.warnings = []
+        self._check()
+
+    def _check(self):
+        if self.sample_rate > AD2_BASE_SAMPLE_RATE:
+            self.problems.append('sample rate %.3g Hz > %.3g Hz' % (self.sample_rate, AD2_BASE_SAMPLE_RATE))
+        if self.buffer_max is not None and self.samples_per_acq > self.buffer_max:
+            self.problems.append('buffer %d samples > %d (config %s)' % (self.samples_per_acq, self.buffer_max, self.config_index))
+        if self.cycle_time > self.tr:
+            self.problems.append('acquisition + transfer %.2f ms > TR %.2f ms: triggers will be missed'
+                                 % (1e3 * self.cycle_time, 1e3 * self.tr))
+        elif self.cycle_time * self.margin > self.tr:
+            # the transfer model is a median: with less than the margin left, some triggers may be missed
+            self.warnings.append('acquisition + transfer %.2f ms (x%.2f margin) > TR %.2f ms: some triggers may be missed'
+                                 % (1e3 * self.cycle_time, self.margin, 1e3 * self.tr))
+
+    @property
+    def ok(self):
+        return not self.problems
+
+    @property
+    def max_trigger_rate(self):
+        """Highest trigger rate (Hz) the loop can keep up with (with margin)."""
+        return 1. / (self.cycle_time * self.margin)
+
+    def validate(self, dwf, hdwf):
+        """Check the plan against the configured (not yet armed) device.
+
+            Reads back the actual sample rate & buffer size (the device may round or clamp them).
+            Returns list of problems (also added to self.problems).
+        """
+        sample_rate = c_double()
+        buffer_size = c_int()
+        size_min, size_max = c_int(), c_int()
+        dwf.FDwfAnalogInFrequencyGet(hdwf, byref(sample_rate))
+        dwf.FDwfAnalogInBufferSizeGet(hdwf, byref(buffer_size))
+        dwf.FDwfAnalogInBufferSizeInfo(hdwf, byref(size_min), byref(size_max))
+        problems = []
+        if abs(sample_rate.value - self.sample_rate) > 1e-6 * self.sample_rate:
+            problems.append('device sample rate %.6g Hz != planned %.6g Hz' % (sample_rate.value, self.sample_rate))
+        if buffer_size.value != self.samples_per_acq:
+            problems.append('device buffer %d samples != planned %d (max %d for this config)'
+                            % (buffer_size.value, self.samples_per_acq, size_max.value))
+        self.problems += problems
+        return problems
+
+    def print_summary(self):
+        print('Acquisition plan (%s):' % ('INVALID' if not self.ok else 'OK, with warnings' if self.warnings else 'OK'))
+        print('\tdevice config %s, %d channel(s)' % (self.config_index, self.n_channels))
+        print('\tsample rate %.4g MHz, %d samples (%.1f us), trigger at index %d'
+              % (1e-6 * self.sample_rate, self.samples_per_acq, 1e6 * self.acq_time, self.trigger_position_index))
+        if self.depth_mm is not None:
+            print('\tdepth %.1f mm requested, %.1f mm in window (C = %.1f m/s)' % (self.depth_mm, self.max_depth_mm, self.c))
+        else:
+            print('\tdepth %.1f mm in window (C = %.1f m/s)' % (self.max_depth_mm, self.c))
+        print('\tTR %.2f ms: acquisition + transfer %.2f ms (%s), max trigger rate %.1f Hz'
+              % (1e3 * self.tr, 1e3 * self.cycle_time, self.transfer, self.max_trigger_rate))
+        for problem in self.problems:
+            print('\tPROBLEM: %s' % problem)
+        for warning in self.warnings:
+            print('\tWARNING: %s' % warning)
+
+
+def check_acquisition(sample_rate, samples_per_acq, tr, n_channels=2, trigger_position_index=PLAN_PRE_TRIGGER_SAMPLES,
+                      transfer=None, config=None, c=C_WATER, margin=PLAN_MARGIN):
+    """Check hand-set acquisition settings (see AcquisitionPlan).
+
+        config = dict from list_device_configs() (checks the buffer size), or None
+    """
+    return AcquisitionPlan(config['index'] if config else None, sample_rate, samples_per_acq, trigger_position_index,
+                           n_channels, tr, transfer or TransferModel(), c=c,
+                           buffer_max=config['scope_buffer'] if config else None, margin=margin)
+
+
+def plan_acquisition(depth_mm, tr, configs, n_channels=2, c=C_WATER, transfer=None,
+                     pre_trigger_samples=PLAN_PRE_TRIGGER_SAMPLES, max_sample_rate=AD2_BASE_SAMPLE_RATE, margin=PLAN_MARGIN):
+    """Pick device config, sample rate, buffer size & trigger position for an echo depth & TR.
+
+        Highest sample rate (100 MHz / integer divider) whose window reaches depth_mm (round trip)
+        and whose acquisition + data transfer still fits in TR (with margin), over all device
+        memory configs; ties go to the config with the larger wavegen buffer.
+
+        depth_mm = deepest echo to record (mm)
+        tr = trigger period (sec)
+        configs = list_device_configs(dwf)
+        transfer = TransferModel (ie. measure_transfer() or TransferModel.from_loop_timing()); default: conservative defaults
+        Returns AcquisitionPlan (check .ok; if nothing fits, the least-bad plan with its problems).
+    """
+    if not depth_mm > 0:
+        raise ValueError('depth_mm must be > 0 (not %r)' % depth_mm)
+    if not tr > 0:
+        raise ValueError('tr must be > 0 (not %r)' % tr)
+    transfer = transfer or TransferModel()
+    echo_time = 2e-3 * depth_mm / c
+    # samples the loop can move per trigger within TR:
+    budget = (tr / margin - echo_time - transfer.overhead_sec) * transfer.bytes_per_sec / (2 * n_channels)
+
+    def make_plan(config, rate):
+        divider = int(np.ceil(AD2_BASE_SAMPLE_RATE / rate - 1e-9))
+        rate = AD2_BASE_SAMPLE_RATE / max(divider, 1)
+        n_samples = pre_trigger_samples + int(np.ceil(echo_time * rate))
+        n_samples = min(n_samples + n_samples % 2, config['scope_buffer'])
+        return AcquisitionPlan(config['index'], rate, n_samples, pre_trigger_samples, n_channels, tr, transfer,
+                               c=c, buffer_max=config['scope_buffer'], margin=margin)
+
+    best = None
+    for config in configs:
+        n_max = min(config['scope_buffer'], int(budget))
+        if n_max <= pre_trigger_samples:
+            continue
+        plan = make_plan(config, min((n_max - pre_trigger_samples) / echo_time, max_sample_rate))
+        key = (plan.ok, not plan.warnings, plan.sample_rate, config['wavegen_buffer'])
+        if best is None or key > best[0]:
+            best = (key, plan)
+
+    if best is None:
+        # nothing fits in TR; show the largest-buffer config (its problems say why)
+        config = max(configs, key=lambda config: config['scope_buffer'])
+        plan = make_plan(config, min((config['scope_buffer'] - pre_trigger_samples) / echo_time, max_sample_rate))
+    else:
+        plan = best[1]
+    plan.depth_mm = depth_mm
+    if plan.max_depth_mm < depth_mm:
+        plan.problems.append('window reaches %.1f mm < %.1f mm requested' % (plan.max_depth_mm, depth_mm))
+    return plan
+
+
+
+def plot_m_mode(data_m, title='M-Mode', ignore_rows=30, mode='rf', dynamic_range_db=DYNAMIC_RANGE_DB, dtype=np.float32):
     """Plot M-mode data
     
         data_m = 2D M-mode matrix (see reshape_to_M_mode())
         title = optional title string
         ignore_rows = number of rows to ignore for colormap limits
                         ie. so that excitation pulse doesn't subdue everything else
+        mode = 'rf'       raw signal, symmetric grayscale limits
+               'envelope' envelope (see envelope())
+               'log'      log-compressed envelope in dB (see log_compress())
+        dynamic_range_db = dB shown in 'log' mode
+        dtype = envelope precision ('envelope' & 'log' modes)
     """
     # TODO - print timescale or tissue depth on Y axis (needs more input information)
 
     # TODO extents to fill window?
     # https://stackoverflow.com/questions/13384653/imshow-extent-and-aspect/13390798#13390798
 
-    #clim_min = np.min(data_m[30:][:])
-    #clim_max = np.max(data_m[30:][:])
-    clim_max = np.max(np.abs(data_m[ignore_rows:, :]))   # abs should make it centered on zero
+    if mode == 'rf':
+        clim_max = np.max(np.abs(data_m[ignore_rows:, :]))   # abs should make it centered on zero
+        clim = (-clim_max, clim_max)
+        label = None
+    elif mode in ('envelope', 'log'):
+        data_m = envelope(data_m, dtype=dtype)
+        clim = (0, np.max(data_m[ignore_rows:, :]))
+        label = None
+        if mode == 'log':
+            data_m = log_compress(data_m, dynamic_range_db, ref=clim[1], out=data_m)
+            clim = (-dynamic_range_db, 0)
+            label = 'dB'
+    else:
+        raise ValueError("mode must be 'rf', 'envelope' or 'log' (not %r)" % mode)
 
     # TODO colormap is still not great...
 
 
     plt.imshow(data_m, cmap='gray', aspect='auto')
-    plt.clim(-clim_max, clim_max)
-    plt.colorbar()
+    plt.clim(*clim)
+    plt.colorbar(label=label)
     plt.title(title)
     plt.xlabel('Repetition Index')
     plt.ylabel('Sample Index')  # TODO change to timescale/tissue depth
@@ -684,6 +2982,235 @@ def plot_m_mode(data_m, title='M-Mode', ignore_rows=30):
 
 
 
+### Level of detail (LOD) plotting for long sessions
+
+def _read_flat(source, i0, i1):
+    """Return samples i0:i1 of a 1D source, or of a 2D (n_acquisitions, samples_per_acq) source read row after row."""
+    if source.ndim == 1:
+        return source[i0:i1]
+    n = source.shape[1]
+    r0 = i0 // n
+    r1 = -(-i1 // n)
+    return source[r0:r1].reshape(-1)[i0 - r0*n:i1 - r0*n]
+
+
+def _block_min_max(data, block):
+    """Return (mins, maxs) of consecutive blocks of data (last block may be partial)."""
+    n_full = data.shape[0] // block
+    full = data[:n_full * block].reshape(n_full, block)
+    mins = full.min(axis=1)
+    maxs = full.max(axis=1)
+    if n_full * block < data.shape[0]:
+        tail = data[n_full * block:]
+        mins = np.append(mins, tail.min())
+        maxs = np.append(maxs, tail.max())
+    return mins, maxs
+
+
+class MinMaxPyramid():
+    """Multi-resolution min/max envelope of a long signal, for plotting.
+
+        Level k stores the min & max of every LOD_BASE_BLOCK * LOD_FACTOR**k samples
+        (~3% of the source size for all levels together, int16 stays int16).
+        get() returns the coarsest level that still has ~max_points points for the
+        requested range, or the raw samples once zoomed in far enough, so every
+        redraw is at most a few thousand points no matter how long the session is.
+
+        Build once from a 1D array (or 2D acquisitions x samples, read as 1 long signal),
+        ie. a memmap: the source is read in chunks (LOD_BUILD_CHUNK), never all at once.
+        Use load_lod_pyramids() to cache pyramids in a sidecar file, and
+        plot_lod() to draw one with automatic reloading on zoom/pan.
+    """
+
+    def __init__(self, source, levels, base=LOD_BASE_BLOCK, factor=LOD_FACTOR):
+        """
+            source = raw samples (1D, or 2D n_acquisitions x samples_per_acq)
+            levels = list of (mins, maxs) arrays, finest first
+        """
+        self.source = source
+        self.levels = levels
+        self.base = base
+        self.factor = factor
+        self.n_samples = source.shape[0] if source.ndim == 1 else source.shape[0] * source.shape[1]
+
+    @classmethod
+    def build(cls, source, base=LOD_BASE_BLOCK, factor=LOD_FACTOR, min_points=LOD_MAX_POINTS):
+        """Compute all levels of a source (see class doc)."""
+        source = np.asarray(source) if not isinstance(source, np.ndarray) else source
+        n_samples = source.shape[0] if source.ndim == 1 else source.shape[0] * source.shape[1]
+
+        chunk = LOD_BUILD_CHUNK - LOD_BUILD_CHUNK % base    # chunks are whole blocks
+        mins, maxs = [], []
+        for i in range(0, n_samples, chunk):
+            chunk_min, chunk_max = _block_min_max(_read_flat(source, i, min(i + chunk, n_samples)), base)
+            mins.append(chunk_min)
+            maxs.append(chunk_max)
+        if n_samples == 0:
+            mins, maxs = [np.zeros(0, source.dtype)], [np.zeros(0, source.dtype)]
+        levels = [(np.concatenate(mins), np.concatenate(maxs))]
+
+        while levels[-1][0].shape[0] > min_points:
+            coarse_min = _block_min_max(levels[-1][0], factor)[0]
+            coarse_max = _block_min_max(levels[-1][1], factor)[1]
+            levels.append((coarse_min, coarse_max))
+
+        return cls(source, levels, base, factor)
+
+    def block_size(self, level):
+        return self.base * self.factor**level
+
+    def get(self, i0, i1, max_points=LOD_MAX_POINTS):
+        """Return (x, y, is_raw) for samples i0:i1 (float indexes ok; clipped to the signal).
+
+            x = sample indexes
+            y = raw samples (is_raw) or min/max pairs of each block (drawn as vertical strokes)
+        """
+        i0 = int(min(max(np.floor(i0), 0), self.n_samples))
+        i1 = int(min(max(np.ceil(i1), i0), self.n_samples))
+
+        if i1 - i0 <= max_points:
+            return np.arange(i0, i1), _read_flat(self.source, i0, i1), True
+
+        # coarsest level with enough detail (2 points per block), else the coarsest available:
+        level = len(self.levels) - 1
+        for k in range(len(self.levels)):
+            if (i1 - i0) / self.block_size(k) <= max_points // 2:
+                level = k
+                break
+        block = self.block_size(level)
+        j0 = i0 // block
+        j1 = -(-i1 // block)
+        mins, maxs = self.levels[level]
+
+        x = np.repeat(np.arange(j0, j1) * block + 0.5 * block, 2)
+        y = np.empty(2 * (j1 - j0), dtype=mins.dtype)
+        y[0::2] = mins[j0:j1]
+        y[1::2] = maxs[j0:j1]
+        return x, y, False
+
+
+def _lod_cache_key(filepath):
+    st = os.stat(filepath)
+    return np.array([st.st_size, st.st_mtime_ns], dtype=np.int64)
+
+
+def load_lod_pyramids(filepath, sources, cache=True):
+    """Return a MinMaxPyramid for each source (ie. each channel) of a data file, using a sidecar cache.
+
+        filepath = data file the sources come from (ie. .bin session or .wav)
+                   the cache is <filepath>.lod.npz; it is rebuilt if the data file
+                   size/modification time changed
+        sources = list of 1D/2D arrays (ie. memmapped channels)
+        cache = False: always build, don't read/write the sidecar file
+
+        Loading a cached pyramid only reads the envelope (~3% of the data), not the samples.
+    """
+    lod_filepath = filepath + LOD_SUFFIX
+    key = _lod_cache_key(filepath)
+
+    if cache:
+        try:
+            with np.load(lod_filepath) as f:
+                if (np.array_equal(f['key'], key) and int(f['n_sources']) == len(sources)
+                        and int(f['base']) == LOD_BASE_BLOCK and int(f['factor']) == LOD_FACTOR):
+                    pyramids = []
+                    for i, source in enumerate(sources):
+                        levels = [(f['s%d_min%d' % (i, k)], f['s%d_max%d' % (i, k)])
+                                  for k in range(int(f['s%d_n_levels' % i]))]
+                        pyramids.append(MinMaxPyramid(source, levels))
+                    return pyramids
+        except (OSError, KeyError, ValueError):
+            pass    # no (valid) cache yet
+
+    pyramids = [MinMaxPyramid.build(source) for source in sources]
+
+    if cache:
+        arrays = {'key': key, 'n_sources': len(sources), 'base': LOD_BASE_BLOCK, 'factor': LOD_FACTOR}
+        for i, pyramid in enumerate(pyramids):
+            arrays['s%d_n_levels' % i] = len(pyramid.levels)
+            for k, (mins, maxs) in enumerate(pyramid.levels):
+                arrays['s%d_min%d' % (i, k)] = mins
+                arrays['s%d_max%d' % (i, k)] = maxs
+        try:
+            with open(lod_filepath, 'wb') as f:
+                np.savez(f, **arrays)   # uncompressed: fast to load
+        except OSError as e:
+            print('Could not save LOD cache %s (%s)' % (lod_filepath, e))
+
+    return pyramids
+
+
+class LodLine():
+    """A plotted line that redraws its MinMaxPyramid level whenever the x axis is zoomed/panned.
+
+        x (plot units) = x0 + sample_index * dx
+        y (plot units) = y_offset + sample * y_scale   (ie. int16 -> volts, see int16_volts_scale())
+    """
+
+    def __init__(self, ax, pyramid, dx=1., x0=0., y_scale=1., y_offset=0.,
+                 max_points=LOD_MAX_POINTS, raw_marker='.', **plot_kwargs):
+        """
+            ax = matplotlib axes
+            pyramid = MinMaxPyramid
+            raw_marker = marker for raw samples when zoomed in (like the old '.-' plots)
+            plot_kwargs = passed to ax.plot() (label, color, ...)
+        """
+        self.ax = ax
+        self.pyramid = pyramid
+        self.dx = dx
+        self.x0 = x0
+        self.y_scale = y_scale
+        self.y_offset = y_offset
+        self.max_points = max_points
+        self.raw_marker = raw_marker
+
+        self.line, = ax.plot([], [], **plot_kwargs)
+        self.update(x0, x0 + pyramid.n_samples * dx)
+        ax.update_datalim([[x0, y] for y in self._y_limits()] + [[x0 + pyramid.n_samples * dx, 0.]])
+        ax.autoscale_view()
+        ax.callbacks.connect('xlim_changed', self._on_xlim_changed)
+
+    def _y_limits(self):
+        mins, maxs = self.pyramid.levels[-1]
+        if mins.shape[0] == 0:
+            return [0., 0.]
+        return [self.y_offset + self.y_scale * float(np.min(mins)), self.y_offset + self.y_scale * float(np.max(maxs))]
+
+    def update(self, x_start, x_stop):
+        """Redraw the line for the x range (plot units)."""
+        x, y, is_raw = self.pyramid.get((x_start - self.x0) / self.dx, (x_stop - self.x0) / self.dx, self.max_points)
+        self.line.set_data(self.x0 + x * self.dx, self.y_offset + y * self.y_scale)
+        self.line.set_marker(self.raw_marker if is_raw else '')
+
+    def _on_xlim_changed(self, ax):
+        self.update(*ax.get_xlim())
+        ax.figure.canvas.draw_idle()
+
+
+def int16_volts_scale(v_range, v_offset):
+    """Return (y_scale, y_offset) so that volts = y_offset + int16 * y_scale (same as int16signal2voltage())."""
+    return v_range / 65536, v_offset
+
+
+def plot_lod(ax, data, dx=1., x0=0., y_scale=1., y_offset=0., **plot_kwargs):
+    """Plot a long signal as a LodLine (only the points visible at the current zoom are drawn).
+
+        ax = matplotlib axes (ie. plt.gca())
+        data = MinMaxPyramid, or 1D/2D array (a pyramid is built in memory; see load_lod_pyramids() to cache)
+        dx, x0 = x axis: x0 + sample_index * dx  (ie. dx = sample period, or mm per sample)
+        y_scale, y_offset = y axis: y_offset + sample * y_scale
+        plot_kwargs = ax.plot() args (label, color...)
+
+        Returns the LodLine (keep a reference while the plot is open).
+    """
+    pyramid = data if isinstance(data, MinMaxPyramid) else MinMaxPyramid.build(_as_int16_array(data)
+                                                                               if isinstance(data, Array) else
+                                                                               np.asarray(data))
+    return LodLine(ax, pyramid, dx=dx, x0=x0, y_scale=y_scale, y_offset=y_offset, **plot_kwargs)
+
+
+
+
 # General Utilities
 
 def get_timestamp():
@@ -22,12 +22,18 @@ from ctypes import *
 #import matplotlib.pyplot as plt
 #import numpy as np
 #import pandas as pd
+from array import array
 import datetime
+import time
 import sys
+import os
+
+from dwfconstants import DwfStateDone
 
 # contstants
 
 NAN = float('nan')      # for initializing test values
+DONE = DwfStateDone.value
 
 
 # Scope Settings Class
@@ -154,14 +160,28 @@ class ScopeParams():
 
 # General Waveforms/DWF setup:
 
-def load_dwf():
+def load_dwf(backend=None, **sim_kwargs):
     """Find and load platform-specific DWF (Waveforms SDK) library.
 
         from Digilent example code.
 
+        backend = 'hw' for the real Waveforms SDK library,
+                  'sim' for the simulated library (ad2_sim.py; no hardware needed)
+                  None = use AD2_BACKEND environment variable (default 'hw')
+        sim_kwargs = settings passed to ad2_sim.SimDwf (ie. trigger_rate=50.)
+
         Returns dwf object.
     """
 
+    if backend is None:
+        backend = os.environ.get('AD2_BACKEND', 'hw')
+
+    if backend == 'sim':
+        import ad2_sim      # only needed for simulation (requires numpy)
+        return ad2_sim.SimDwf.from_env(**sim_kwargs)
+    elif backend != 'hw':
+        raise ValueError("Unknown DWF backend '%s' (use 'hw' or 'sim')" % backend)
+
     if sys.platform.startswith("win"):
         dwf = cdll.dwf
     elif sys.platform.startswith("darwin"):
@@ -476,6 +496,312 @@ def print_array(arr, line_len=10):
 #   - double-type voltages vs. int16 raw ADC values
 
 
+### Binary timestamp format:
+# Fixed-width records, no header/separators (little-endian uint32 x 3):
+#   AAAABBBBCCCCAAAABBBBCCCC...
+#   A = trig_utc_sec, B = trig_ticks, C = ticks_per_sec (same values as the ASCII CSV files)
+# Load with ad2_tools.load_timestamps_bin() (np.fromfile).
+
+TIMESTAMP_RECORD_FMT = '<III'
+TIMESTAMP_RECORD_SIZE = 12          # bytes
+TIMESTAMP_BLOCK_RECORDS = 1024      # records per file write (~2 sec at 2ms TR)
+
+class TimestampBuffer():
+    """Preallocated block of binary timestamp records.
+
+        FDwfAnalogInStatusTime writes straight into the buffer through the
+        precomputed pointers (no Python int/str conversion per trigger):
+
+            p_sec, p_ticks, p_tps = ts_buffer.ptrs[ts_index]
+            dwf.FDwfAnalogInStatusTime(hdwf, p_sec, p_ticks, p_tps)
+
+        and the block is written to file with flush() when full.
+
+        The buffer is used as a ring: record number r is at index (r % n_records).
+    """
+
+    def __init__(self, n_records=TIMESTAMP_BLOCK_RECORDS):
+        self.n_records = n_records
+        self.buffer = (c_uint32 * (3 * n_records))()
+        self.ptrs = [(byref(self.buffer, TIMESTAMP_RECORD_SIZE*i),
+                      byref(self.buffer, TIMESTAMP_RECORD_SIZE*i + 4),
+                      byref(self.buffer, TIMESTAMP_RECORD_SIZE*i + 8)) for i in range(n_records)]
+        self.bytes = memoryview(self.buffer).cast('B')
+
+    def flush(self, f, n_total):
+        """Write records up to n_total (total acquired so far) that are not yet in file f.
+
+            Uses f.tell() to find what is already written, so calling this again
+            (ie. from the Ctrl+C handler right after a block flush) never duplicates records.
+            f = file opened in binary mode (timestamp records only)
+            n_total = total number of records acquired
+
+            Returns number of records written.
+        """
+        first = f.tell() // TIMESTAMP_RECORD_SIZE
+        count = min(n_total - first, self.n_records)
+        if count <= 0:
+            return 0
+
+        start = first % self.n_records
+        end = start + count
+        if end <= self.n_records:
+            f.write(self.bytes[TIMESTAMP_RECORD_SIZE*start:TIMESTAMP_RECORD_SIZE*end])
+        else:
+            # wraps around end of ring:
+            f.write(self.bytes[TIMESTAMP_RECORD_SIZE*start:])
+            f.write(self.bytes[:TIMESTAMP_RECORD_SIZE*(end - self.n_records)])
+        return count
+
+
+### Trigger wait strategies (FDwfAnalogInStatus polling)
+
+WAIT_STATS_SAMPLES = 4096       # last N waits kept for the poll count & latency percentiles
+SPIN_TIME = 100e-6              # SpinYieldWait: spin this long before yielding (sec)
+PREDICT_GUARD_TIME = 1e-3       # PredictiveWait: wake up this long before the expected Done (sec)
+PREDICT_WARMUP = 4              # PredictiveWait: waits (spinning) to measure TR if it is not given
+PREDICT_TR_TOLERANCE = 0.25     # PredictiveWait: intervals further than this fraction from TR are missed/late triggers
+
+class SpinWait():
+    """Busy-wait on FDwfAnalogInStatus until the acquisition is Done (lowest latency, 100% CPU).
+
+        Base class of the wait strategies (see WAIT_STRATEGIES & make_waiter()):
+            waiter = ad2b.SpinWait(dwf, hdwf)
+            for i in range(n):
+                waiter.wait()       # returns when the status is Done
+                ... copy data/time ...
+            waiter.print_summary()
+
+        Every wait records its number of status polls, its wake-up latency (time between the starts
+        of the last not-Done poll & the Done poll, ie. the most the loop can have been late in
+        seeing Done; excludes the data transfer) and the CPU time spent waiting.
+        A wait that is Done on its first poll is counted as 'late': the acquisition ended before
+        wait() was called (ie. slow processing, or a PredictiveWait that overslept).
+
+        dwf, hdwf = device
+        read_data = FDwfAnalogInStatus fReadData (True = transfer the acquisition data)
+        status = status function (ie. ad2.FastDwf.status); default dwf.FDwfAnalogInStatus
+        n_samples = number of last waits kept for percentiles
+    """
+
+    name = 'spin'
+
+    def __init__(self, dwf, hdwf, read_data=True, status=None, n_samples=WAIT_STATS_SAMPLES):
+        self.hdwf = hdwf
+        self.status = status if status is not None else dwf.FDwfAnalogInStatus
+        self.read_data = c_int(1 if read_data else 0)
+        self.scope_status = c_byte()
+        self.scope_status_ptr = byref(self.scope_status)
+
+        self.n_samples = n_samples
+        self.latencies = array('d', bytes(8 * n_samples))
+        self.polls = array('q', bytes(8 * n_samples))
+        self.n_waits = 0
+        self.n_polls = 0
+        self.n_late = 0
+        self.wait_time = 0.     # wall time in wait() (sec)
+        self.cpu_time = 0.      # CPU time of this thread in wait() (sec)
+        self.t_done = None      # perf_counter() when the last wait returned
+        self.t_seen = None      # perf_counter() at the start of the last Done poll (before its data transfer)
+
+    def wait(self):
+        """Poll until Done. Returns number of polls."""
+        status = self.status
+        hdwf = self.hdwf
+        read_data = self.read_data
+        scope_status = self.scope_status
+        scope_status_ptr = self.scope_status_ptr
+        perf_counter = time.perf_counter
+
+        t_cpu = time.thread_time()
+        t_start = t_last = perf_counter()
+        n_polls = 0
+        while True:
+            t_poll = perf_counter()
+            status(hdwf, read_data, scope_status_ptr)
+            n_polls += 1
+            if scope_status.value == DONE:
+                break
+            t_last = t_poll
+        return self._record(t_start, t_last, t_poll, n_polls, t_cpu)
+
+    def _record(self, t_start, t_last, t_poll, n_polls, t_cpu):
+        t_done = time.perf_counter()
+        i = self.n_waits % self.n_samples
+        self.latencies[i] = t_poll - t_last
+        self.polls[i] = n_polls
+        self.n_waits += 1
+        self.n_polls += n_polls
+        if n_polls == 1:
+            self.n_late += 1
+        self.wait_time += t_done - t_start
+        self.cpu_time += time.thread_time() - t_cpu
+        self.t_done = t_done
+        self.t_seen = t_poll
+        return n_polls
+
+    def summary(self):
+        """Returns dict: n_waits, n_late, polls & latency (p50, p99, max) over the last n_samples waits,
+           polls_mean, cpu_fraction (CPU time / wall time while waiting).
+        """
+        n = min(self.n_waits, self.n_samples)
+        polls = sorted(self.polls[:n])
+        latencies = sorted(self.latencies[:n])
+        return {'n_waits': self.n_waits,
+                'n_late': self.n_late,
+                'polls_mean': self.n_polls / self.n_waits if self.n_waits else NAN,
+                'polls': (_percentile(polls, 50), _percentile(polls, 99), polls[-1] if n else NAN),
+                'latency': (_percentile(latencies, 50), _percentile(latencies, 99), latencies[-1] if n else NAN),
+                'cpu_fraction': self.cpu_time / self.wait_time if self.wait_time > 0 else NAN,
+                }
+
+    def print_summary(self):
+        summary = self.summary()
+        print('Trigger wait (%s): %d waits, %d late (Done on 1st poll), %.0f%% CPU while waiting'
+              % (self.name, summary['n_waits'], summary['n_late'], 100 * summary['cpu_fraction']))
+        print('\tpolls:   p50 %d, p99 %d, max %d (mean %.1f)' % (summary['polls'] + (summary['polls_mean'],)))
+        print('\tlatency: p50 %.1f us, p99 %.1f us, max %.1f us' % tuple(1e6 * t for t in summary['latency']))
+
+
+class SpinYieldWait(SpinWait):
+    """Spin for spin_time, then yield the CPU between polls (time.sleep(0)).
+
+        Lets the writer/viewer threads run during long waits, at the cost of ~1 scheduler
+        time slice of latency when another thread is ready to run.
+
+        spin_time = seconds to spin before yielding
+    """
+
+    name = 'yield'
+
+    def __init__(self, dwf, hdwf, read_data=True, status=None, n_samples=WAIT_STATS_SAMPLES, spin_time=SPIN_TIME):
+        super().__init__(dwf, hdwf, read_data, status, n_samples)
+        self.spin_time = spin_time
+
+    def wait(self):
+        status = self.status
+        hdwf = self.hdwf
+        read_data = self.read_data
+        scope_status = self.scope_status
+        scope_status_ptr = self.scope_status_ptr
+        perf_counter = time.perf_counter
+        sleep = time.sleep
+
+        t_cpu = time.thread_time()
+        t_start = t_last = perf_counter()
+        spin_until = t_start + self.spin_time
+        n_polls = 0
+        while True:
+            t_poll = perf_counter()
+            status(hdwf, read_data, scope_status_ptr)
+            n_polls += 1
+            if scope_status.value == DONE:
+                break
+            t_last = t_poll
+            if t_poll > spin_until:
+                sleep(0)
+        return self._record(t_start, t_last, t_poll, n_polls, t_cpu)
+
+
+class PredictiveWait(SpinWait):
+    """Poll once (re-arms the scope), sleep until guard_time before the expected Done
+        (start of the last Done poll + TR), then spin.
+
+        Lowest CPU use for long TRs. TR is given, or measured over the first warmup waits
+        (spinning) & then tracked from the Done intervals (missed/late triggers are ignored).
+        If the first poll after sleeping is already Done (overslept), the guard time is doubled
+        (up to TR / 2).
+
+        tr = expected trigger period (sec), ie. WAVEGEN_WAIT_TIME; None = measure it
+        guard_time = wake up this long before the expected Done (sec); covers sleep & USB jitter
+        warmup = waits used to measure TR (if tr is None)
+    """
+
+    name = 'predict'
+
+    def __init__(self, dwf, hdwf, read_data=True, status=None, n_samples=WAIT_STATS_SAMPLES, tr=None,
+                 guard_time=PREDICT_GUARD_TIME, warmup=PREDICT_WARMUP):
+        super().__init__(dwf, hdwf, read_data, status, n_samples)
+        self.tr = tr
+        self.guard_time = guard_time
+        self.warmup = warmup
+        self.intervals = []     # warmup Done intervals
+        self.n_slept = 0
+        self.n_overslept = 0
+
+    def wait(self):
+        status = self.status
+        hdwf = self.hdwf
+        read_data = self.read_data
+        scope_status = self.scope_status
+        scope_status_ptr = self.scope_status_ptr
+        perf_counter = time.perf_counter
+        t_last_seen = self.t_seen
+
+        t_cpu = time.thread_time()
+        t_start = t_last = t_poll = perf_counter()
+        status(hdwf, read_data, scope_status_ptr)     # 1st poll re-arms the scope after the last Done
+        n_polls = 1
+        slept = False
+        if scope_status.value != DONE:
+            if self.tr is not None and t_last_seen is not None:
+                sleep_time = t_last_seen + self.tr - self.guard_time - perf_counter()
+                if sleep_time > 0:
+                    time.sleep(sleep_time)
+                    self.n_slept += 1
+                    slept = True
+            while True:
+                t_last = t_poll
+                t_poll = perf_counter()
+                status(hdwf, read_data, scope_status_ptr)
+                n_polls += 1
+                if scope_status.value == DONE:
+                    break
+            if n_polls == 2 and slept:
+                self.n_overslept += 1      # Done on the 1st poll after sleeping: wake up earlier
+                self.guard_time = min(2 * self.guard_time, 0.5 * self.tr)
+        self._record(t_start, t_last, t_poll, n_polls, t_cpu)
+
+        if t_last_seen is not None:
+            self._update_tr(self.t_seen - t_last_seen)
+        return n_polls
+
+    def _update_tr(self, interval):
+        if self.tr is None:
+            self.intervals.append(interval)
+            if len(self.intervals) >= self.warmup:
+                self.tr = sorted(self.intervals)[len(self.intervals) // 2]
+        elif abs(interval - self.tr) < PREDICT_TR_TOLERANCE * self.tr:
+            self.tr += 0.1 * (interval - self.tr)
+
+    def print_summary(self):
+        SpinWait.print_summary(self)
+        print('\tTR %.3f ms, guard %.3f ms, slept in %d of %d waits, overslept %d'
+              % (1e3 * (self.tr or NAN), 1e3 * self.guard_time, self.n_slept, self.n_waits, self.n_overslept))
+
+
+def _percentile(sorted_values, q):
+    if not sorted_values:
+        return NAN
+    return sorted_values[min(int(round(0.01 * q * (len(sorted_values) - 1))), len(sorted_values) - 1)]
+
+
+WAIT_STRATEGIES = {'spin': SpinWait,
+                   'yield': SpinYieldWait,
+                   'predict': PredictiveWait,
+                   }
+
+def make_waiter(name, dwf, hdwf, read_data=True, status=None, tr=None):
+    """Wait strategy by name (see WAIT_STRATEGIES), ie. from a --wait command line option.
+
+        tr = expected trigger period (sec) for 'predict' (None = measure it)
+    """
+    if name not in WAIT_STRATEGIES:
+        raise ValueError('Unknown wait strategy %r (use %s)' % (name, ', '.join(WAIT_STRATEGIES)))
+    if name == 'predict':
+        return PredictiveWait(dwf, hdwf, read_data, status, tr=tr)
+    return WAIT_STRATEGIES[name](dwf, hdwf, read_data, status)
+
 
 
 ### Convert to M-Mode
@@ -520,8 +846,10 @@ def reshape_to_M_mode(us_data, tr_len, firstpeak):
     #print('new shape: ', tr_len, n_periods)
 
     # note +1 on last_index because python end-indexes are not inclusive!
+    # np.asarray (not np.array): for contiguous data the Fortran-order reshape is a view (no copy)
+    #   - see ad2_tools.m_mode_view() for a view of any 1D stride
     #return np.reshape(np.array(us_data.Voltage[firstpeak:last_index+1]), 
-    return np.reshape(np.array(us_data[firstpeak:last_index+1]), 
+    return np.reshape(np.asarray(us_data[firstpeak:last_index+1]), 
                       (tr_len, n_periods),
                       order='F')    # note Fortran index order
 
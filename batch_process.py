@@ -0,0 +1,319 @@
+"""Batch process a whole data folder of sessions in parallel (process pool).
+
+    Each session's data file (_data.bin or legacy _data.csv) goes through a
+    configurable processing chain, 1 session per worker process:
+
+        load      = raw int16 channels (binary files are memory-mapped)
+        volts     = int16 -> volts (float32, exact range/offset from the file header or _vconv.csv)
+        mmode     = M-mode matrix per channel (zero-copy view, see ad2.reshape_to_M_mode())
+        envelope  = M-mode envelope per channel (float32, see ad2.envelope()); thumbnails are then log-compressed
+        thumbnail = M-mode PNG per channel (<session>_ch<N>_mmode.png, reduced to THUMBNAIL_SIZE)
+        stats     = summary stats per channel (<session>_summary.json; also collected in batch_summary.csv)
+
+    Sessions whose outputs are newer than their input files (and were made with the
+    same chain) are skipped, so re-running on a folder only processes new/changed recordings.
+    Prints throughput (sessions/s, MB/s, samples/s) and time spent per step.
+
+    USAGE:
+    python batch_process.py <folder> [-o OUTPUT_FOLDER] [-j N_WORKERS] [--chain load,volts,mmode,thumbnail,stats] [--force]
+    python batch_process.py <folder> --chain load,volts,mmode,envelope,thumbnail     # log-compressed (dB) thumbnails
+"""
+
+# TODO per-acquisition stats (ie. rms per TR) as a separate output
+
+
+import matplotlib
+matplotlib.use('Agg')   # no GUI in worker processes (must be before ad2_tools imports pyplot)
+from matplotlib.figure import Figure
+
+import numpy as np
+import concurrent.futures
+import json
+import time
+import sys
+import os
+
+import ad2_tools as ad2
+import session_catalog
+
+
+DEFAULT_CHAIN = ['load', 'volts', 'mmode', 'thumbnail', 'stats']
+THUMBNAIL_SIZE = (800, 400)     # max. M-mode thumbnail columns (acquisitions) x rows (samples)
+THUMBNAIL_DPI = 100
+MANIFEST_SUFFIX = '_batch.json'     # written last; marks a session as done (with its chain)
+SUMMARY_FILENAME = 'batch_summary.csv'
+
+# fallback scope range/offset for legacy CSV sessions without a _vconv.csv (see plot_csv_2ch.py)
+DEFAULT_V_RANGES = [5.538410, 5.546847]
+DEFAULT_V_OFFSETS = [0.000291, -0.000028]
+
+
+
+# Processing steps: each takes & updates the per-session context dict.
+
+def step_load(ctx):
+    """Raw int16 channels, shaped (n_acquisitions, samples_per_acq)."""
+    task = ctx['task']
+    if task['data_file'].endswith('.bin'):
+        session = ad2.SessionReader(task['data_file'])
+        ctx['raw'] = [session.channel(ch) for ch in range(session.n_channels)]
+        ctx['sample_rate'] = session.header.sample_rate
+        ctx['v_ranges'] = session.header.v_ranges
+        ctx['v_offsets'] = session.header.v_offsets
+    else:
+        data = ad2.load_2ch_int16_csv(task['data_file'])
+        samples_per_acq = int(task['samples_per_acq'] or data.shape[0])
+        n_acq = data.shape[0] // samples_per_acq
+        ctx['raw'] = [data[column].to_numpy(dtype=np.int16)[:n_acq * samples_per_acq].reshape(n_acq, samples_per_acq)
+                      for column in ['ch1_int16', 'ch2_int16']]
+        ctx['sample_rate'] = task['sample_rate']
+        ctx['v_ranges'] = [task['ch%d_v_range' % (ch + 1)] or DEFAULT_V_RANGES[ch] for ch in range(2)]
+        ctx['v_offsets'] = [task['ch%d_v_offset' % (ch + 1)] or DEFAULT_V_OFFSETS[ch] for ch in range(2)]
+    ctx['n_samples'] = sum(raw.size for raw in ctx['raw'])
+
+
+def step_volts(ctx):
+    """Volts (float32) per channel, same shape as raw."""
+    ctx['volts'] = [ad2.int16signal2voltage(raw, ctx['v_ranges'][ch], ctx['v_offsets'][ch], dtype=np.float32)
+                    for ch, raw in enumerate(ctx['raw'])]
+
+
+def step_mmode(ctx):
+    """M-mode (samples_per_acq, n_acquisitions) per channel: transposed views, no copy."""
+    signals = ctx.get('volts', ctx['raw'])
+    ctx['mmode'] = [signal.T for signal in signals]
+
+
+def step_envelope(ctx):
+    """Envelope of every A-line of the M-mode (float32), replaces the RF M-mode for thumbnails."""
+    ctx['envelope'] = [ad2.envelope(mmode, dtype=np.float32) for mmode in ctx['mmode']]
+
+
+def _reduce_max_abs(data, n_out, axis):
+    """Reduce data along axis to at most n_out points (signed max-abs of each block)."""
+    n = data.shape[axis]
+    factor = max(1, -(-n // n_out))
+    if factor == 1:
+        return data
+    n_blocks = n // factor
+    data = np.moveaxis(data, axis, 0)[:n_blocks * factor]
+    blocks = data.reshape((n_blocks, factor) + data.shape[1:])
+    index = np.expand_dims(np.argmax(np.abs(blocks), axis=1), 1)
+    return np.moveaxis(np.take_along_axis(blocks, index, axis=1)[:, 0], 0, axis)
+
+
+def step_thumbnail(ctx):
+    """M-mode PNG per channel (gray, symmetric color limits like ad2.plot_m_mode(), or dB after the envelope step)."""
+    task = ctx['task']
+    unit = 'V' if 'volts' in ctx else 'int16'
+    for ch, mmode in enumerate(ctx.get('envelope', ctx['mmode'])):
+        small = _reduce_max_abs(_reduce_max_abs(np.asarray(mmode), THUMBNAIL_SIZE[1], 0), THUMBNAIL_SIZE[0], 1)
+        clim = float(np.max(np.abs(small))) if small.size else 1.
+        if 'envelope' in ctx:
+            small = ad2.log_compress(small, ref=clim if clim > 0 else 1.)
+            vmin, vmax, unit = -ad2.DYNAMIC_RANGE_DB, 0., 'dB'
+        else:
+            vmin, vmax = -clim, clim
+        fig = Figure(figsize=(THUMBNAIL_SIZE[0] / THUMBNAIL_DPI, THUMBNAIL_SIZE[1] / THUMBNAIL_DPI), dpi=THUMBNAIL_DPI)
+        ax = fig.add_subplot()
+        image = ax.imshow(small, cmap='gray', aspect='auto', vmin=vmin, vmax=vmax,
+                          extent=(0, mmode.shape[1], mmode.shape[0], 0))
+        fig.colorbar(image, ax=ax, label=unit)
+        ax.set_title('%s Ch%d' % (task['session'], ch + 1), fontsize=8)
+        ax.set_xlabel('Repetition Index')
+        ax.set_ylabel('Sample Index')
+        fig.subplots_adjust(left=0.1, right=0.98, bottom=0.13, top=0.92)
+        filepath = os.path.join(task['output_folder'], '%s_ch%d_mmode.png' % (task['session'], ch + 1))
+        fig.savefig(filepath)
+        ctx['outputs'].append(filepath)
+
+
+def step_stats(ctx):
+    """Summary stats JSON: per channel min/max/mean/rms (volts if converted, else int16)."""
+    task = ctx['task']
+    signals = ctx.get('volts', ctx['raw'])
+    summary = {'session': task['session'],
+               'data_file': task['data_file'],
+               'sample_rate': ctx['sample_rate'],
+               'n_acquisitions': int(signals[0].shape[0]) if signals else 0,
+               'samples_per_acq': int(signals[0].shape[1]) if signals else 0,
+               'unit': 'V' if 'volts' in ctx else 'int16',
+               }
+    for ch, signal in enumerate(signals):
+        signal = np.asarray(signal, dtype=np.float64) if signal.dtype != np.float64 else signal
+        summary['ch%d_min' % (ch + 1)] = float(signal.min()) if signal.size else None
+        summary['ch%d_max' % (ch + 1)] = float(signal.max()) if signal.size else None
+        summary['ch%d_mean' % (ch + 1)] = float(signal.mean()) if signal.size else None
+        summary['ch%d_rms' % (ch + 1)] = float(np.sqrt(np.mean(np.square(signal)))) if signal.size else None
+    filepath = os.path.join(task['output_folder'], task['session'] + '_summary.json')
+    with open(filepath, 'w') as f:
+        json.dump(summary, f, indent=1)
+    ctx['outputs'].append(filepath)
+
+
+STEPS = {'load': step_load,
+         'volts': step_volts,
+         'mmode': step_mmode,
+         'envelope': step_envelope,
+         'thumbnail': step_thumbnail,
+         'stats': step_stats,
+         }
+
+STEP_REQUIRES = {'load': [],
+                 'volts': ['load'],
+                 'mmode': ['load'],
+                 'envelope': ['mmode'],
+                 'thumbnail': ['mmode'],
+                 'stats': ['load'],
+                 }
+
+
+def check_chain(chain):
+    """Raise ValueError if a step is unknown or comes before a step it needs."""
+    for i, step in enumerate(chain):
+        if step not in STEPS:
+            raise ValueError('Unknown step %r (steps: %s)' % (step, ', '.join(STEPS)))
+        for required in STEP_REQUIRES[step]:
+            if required not in chain[:i]:
+                raise ValueError('Step %r needs %r before it' % (step, required))
+
+
+
+def manifest_path(task):
+    return os.path.join(task['output_folder'], task['session'] + MANIFEST_SUFFIX)
+
+
+def is_up_to_date(task):
+    """True if the session was already processed with this chain after its input files last changed."""
+    try:
+        with open(manifest_path(task)) as f:
+            manifest = json.load(f)
+        manifest_mtime = os.path.getmtime(manifest_path(task))
+    except (OSError, ValueError):
+        return False
+    if manifest.get('chain') != task['chain']:
+        return False
+    if any(os.path.getmtime(path) > manifest_mtime for path in task['inputs']):
+        return False
+    return all(os.path.exists(path) for path in manifest.get('outputs', []))
+
+
+def process_session(task):
+    """Run the chain on 1 session (in a worker process). Returns result dict (timings, sizes)."""
+    ctx = {'task': task, 'outputs': []}
+    timings = {}
+    t_start = time.perf_counter()
+    cpu_start = time.process_time()
+    try:
+        for step in task['chain']:
+            t0 = time.perf_counter()
+            STEPS[step](ctx)
+            timings[step] = time.perf_counter() - t0
+    except Exception as e:     # report & carry on with the other sessions
+        return {'session': task['session'], 'error': '%s: %s' % (type(e).__name__, e)}
+
+    with open(manifest_path(task), 'w') as f:
+        json.dump({'chain': task['chain'], 'inputs': task['inputs'], 'outputs': ctx['outputs']}, f, indent=1)
+
+    return {'session': task['session'],
+            'timings': timings,
+            'seconds': time.perf_counter() - t_start,
+            'cpu_seconds': time.process_time() - cpu_start,
+            'n_samples': ctx.get('n_samples', 0),
+            'n_bytes': os.path.getsize(task['data_file']),
+            }
+
+
+def make_tasks(folder, output_folder, chain):
+    """Return a task (picklable dict) for every session with a data file, from the folder's session catalog."""
+    catalog = session_catalog.SessionCatalog(folder)
+    catalog.update(stats=False, verbose=False)     # only settings/vconv/headers; data files are read by the workers
+    columns = catalog.columns()
+    wanted = ['session', 'data_file', 'vconv_file', 'settings_file', 'sample_rate', 'samples_per_acq',
+              'ch1_v_range', 'ch2_v_range', 'ch1_v_offset', 'ch2_v_offset', 'INPUT_SAMPLE_RATE', 'INPUT_SAMPLE_SIZE']
+    sessions = catalog.find(where='data_file IS NOT NULL', columns=[c for c in wanted if c in columns])
+    catalog.close()
+
+    tasks = []
+    for row in sessions.to_dict('records'):
+        task = {column: None for column in wanted}
+        task.update({key: (None if isinstance(value, float) and np.isnan(value) else value) for key, value in row.items()})
+        task['sample_rate'] = task['sample_rate'] or task['INPUT_SAMPLE_RATE']
+        task['samples_per_acq'] = task['samples_per_acq'] or task['INPUT_SAMPLE_SIZE']
+        task['inputs'] = [path for path in [task['data_file'], task['vconv_file']] if path]
+        task['output_folder'] = output_folder
+        task['chain'] = chain
+        tasks.append(task)
+    return tasks
+
+
+def write_summary_csv(output_folder):
+    """Collect all <session>_summary.json files into 1 CSV table."""
+    import pandas as pd
+    rows = []
+    for entry in sorted(os.scandir(output_folder), key=lambda e: e.name):
+        if entry.name.endswith('_summary.json'):
+            with open(entry.path) as f:
+                rows.append(json.load(f))
+    if rows:
+        pd.DataFrame(rows).to_csv(os.path.join(output_folder, SUMMARY_FILENAME), index=False)
+    return len(rows)
+
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Analog Discovery 2 - batch process a data folder')
+    parser.add_argument('folder', help='data folder (sessions from my_custom_trigger_16bit_2ch.py)')
+    parser.add_argument('-o', '--output', default=None, help='output folder (default: <folder>/processed)')
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count(), help='worker processes (default: all cores)')
+    parser.add_argument('--chain', default=','.join(DEFAULT_CHAIN), help='processing steps, comma separated')
+    parser.add_argument('--force', action='store_true', help='reprocess sessions that are already up to date')
+    args = parser.parse_args()
+
+    chain = args.chain.split(',')
+    try:
+        check_chain(chain)
+    except ValueError as e:
+        print('ERROR - %s' % e)
+        sys.exit(1)
+
+    output_folder = args.output or os.path.join(args.folder, 'processed')
+    os.makedirs(output_folder, exist_ok=True)
+
+    tasks = make_tasks(args.folder, output_folder, chain)
+    todo = tasks if args.force else [task for task in tasks if not is_up_to_date(task)]
+    print('%d sessions, %d to process (%d up to date), %d workers'
+          % (len(tasks), len(todo), len(tasks) - len(todo), args.jobs))
+
+    t0 = time.perf_counter()
+    results = []
+    errors = []
+    if todo:
+        # largest first: keeps all workers busy until the end
+        todo.sort(key=lambda task: os.path.getsize(task['data_file']), reverse=True)
+        with concurrent.futures.ProcessPoolExecutor(max_workers=args.jobs) as pool:
+            for result in pool.map(process_session, todo):
+                if 'error' in result:
+                    errors.append(result)
+                    print('FAILED %s: %s' % (result['session'], result['error']))
+                else:
+                    results.append(result)
+    wall = time.perf_counter() - t0
+
+    if 'stats' in chain:
+        write_summary_csv(output_folder)
+
+    n_bytes = sum(r['n_bytes'] for r in results)
+    n_samples = sum(r['n_samples'] for r in results)
+    print('\nProcessed %d sessions in %.2f s (%d failed)' % (len(results), wall, len(errors)))
+    if results and wall > 0:
+        print('Throughput: %.2f sessions/s, %.1f MB/s, %.2e samples/s'
+              % (len(results) / wall, 1e-6 * n_bytes / wall, n_samples / wall))
+        cpu_seconds = sum(r['cpu_seconds'] for r in results)
+        print('Parallel speedup: %.2fx (%.1f worker CPU seconds / %.1f s wall)' % (cpu_seconds / wall, cpu_seconds, wall))
+        print('Time per step (sum over sessions):')
+        for step in chain:
+            print('  %-10s %8.2f s' % (step, sum(r['timings'].get(step, 0.) for r in results)))
+    print('Outputs: %s' % output_folder)
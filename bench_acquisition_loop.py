@@ -0,0 +1,277 @@
+"""Benchmark the triggered acquisition busy-wait loops (per-trigger latency).
+
+    Runs the same hot loops as my_custom_trigger_16bit_2ch.py (2ch int16 data copy;
+    'stream' = its -s loop, into a StreamingSessionWriter ring & temp. file) and
+    timestamp_logger2.py (trigger timestamp only) against a real or simulated AD2 -
+    same ad2.FastDwf calls, slot pointers & --wait strategy (ad2.make_waiter) as the
+    scripts - and records per trigger (see ad2_tools.LoopTimer):
+        - number of FDwfAnalogInStatus polls until Done (the 1st one re-arms the scope)
+        - duration of the poll that returned Done (includes the USB data transfer)
+        - time from Done to data copied (stream: incl. getting & committing the ring slot)
+        - loop time between data copied & the next wait (the 'rearm' metric)
+        - actual trigger period seen by the loop
+    Results are printed as p50/p99/max and saved as compact histogram files
+    (<prefix>_<loop>_timing.npz, load with ad2_tools.load_loop_timing()).
+
+    Use the printed 'minimum TR' to set WAVEGEN_WAIT_TIME in my_custom_trigger_16bit_2ch.py,
+    or pass the trigger loop file to its planner (--timing <prefix>_trigger_timing.npz).
+
+    The wavegen (ch1) generates square trigger pulses every --tr seconds and the scope
+    triggers on it internally (trigsrcAnalogOut1), so no cables are needed.
+
+    USAGE:
+    python bench_acquisition_loop.py [-n N_TRIGGERS] [--tr TR] [--loop trigger|stream|timestamp|all] [--wait spin] [-o PREFIX]
+
+    Without hardware:
+    python bench_acquisition_loop.py --backend sim
+"""
+
+# TODO time the --live & --average variants of the trigger loop
+
+
+from ctypes import *
+from dwfconstants import *
+import numpy as np
+import tempfile
+import time
+import sys
+import os
+import argparse
+
+import ad2_tools as ad2
+import ad2_tools_basic as ad2b
+
+
+# Loop settings (same as the scripts being benchmarked):
+TRIGGER_LOOP_SAMPLE_RATE = 10e6     # my_custom_trigger_16bit_2ch.py
+TRIGGER_LOOP_SAMPLE_SIZE = 16384
+TRIGGER_LOOP_CONFIG = 1             # 16k scope buffer config
+
+TIMESTAMP_LOOP_SAMPLE_RATE = 100e6  # timestamp_logger2.py
+TIMESTAMP_LOOP_SAMPLE_SIZE = 16
+TIMESTAMP_LOOP_CONFIG = 0
+
+TRIGGER_PULSE_WIDTH = 10e-6         # wavegen trigger pulse (sec)
+TRIGGER_PULSE_AMPLITUDE = 2.0       # volts
+SCOPE_TRIGGER_VOLTAGE = 1.0
+
+COPY_RING_SLOTS = 16                # data is copied into a small ring (memory use independent of n_triggers)
+STREAM_RING_SLOTS = 64              # StreamingSessionWriter slots (as in my_custom_trigger_16bit_2ch.py -s)
+
+TR_MARGIN = 1.2                     # safety margin for the suggested minimum TR
+
+
+parser = argparse.ArgumentParser(description='Analog Discovery 2 - Acquisition Loop Benchmark')
+parser.add_argument('-n', '--n-triggers', type=int, default=1000, help='number of triggers per loop')
+parser.add_argument('--tr', type=float, default=0.005, help='trigger period (sec)')
+parser.add_argument('--loop', choices=['trigger', 'stream', 'timestamp', 'all'], default='all', help='which loop to benchmark')
+parser.add_argument('--wait', choices=list(ad2.WAIT_STRATEGIES), default='spin', help='trigger wait strategy (as the scripts\' --wait)')
+parser.add_argument('--backend', choices=['hw', 'sim'], default=None, help='dwf backend (default: AD2_BACKEND env. variable or hw)')
+parser.add_argument('-o', '--output', default='bench', help='output file prefix (<prefix>_<loop>_timing.npz)')
+parser.add_argument('--keep-raw', action='store_true', help='also save raw per-trigger values')
+args = parser.parse_args()
+
+
+
+def open_device(dwf, config, sample_rate, sample_size, n_channels, tr):
+    """Open & configure device: wavegen trigger pulses every tr, scope triggered by the wavegen.
+
+        Returns hdwf.
+    """
+    hdwf = c_int()
+    dwf.FDwfDeviceConfigOpen(c_int(-1), c_int(config), byref(hdwf))
+    if hdwf.value == hdwfNone.value:
+        print('failed to open device\n' + ad2.get_error(dwf))
+        sys.exit(1)
+
+    dwf.FDwfDeviceAutoConfigureSet(hdwf, c_int(0))
+
+    dwf.FDwfAnalogInFrequencySet(hdwf, c_double(sample_rate))
+    dwf.FDwfAnalogInBufferSizeSet(hdwf, c_int(sample_size))
+    for ch in range(n_channels):
+        dwf.FDwfAnalogInChannelEnableSet(hdwf, c_int(ch), c_bool(True))
+        dwf.FDwfAnalogInChannelRangeSet(hdwf, c_int(ch), c_double(5.0))
+
+    dwf.FDwfAnalogInTriggerAutoTimeoutSet(hdwf, c_double(0))
+    dwf.FDwfAnalogInTriggerSourceSet(hdwf, trigsrcAnalogOut1)
+    dwf.FDwfAnalogInTriggerTypeSet(hdwf, trigtypeEdge)
+    dwf.FDwfAnalogInTriggerLevelSet(hdwf, c_double(SCOPE_TRIGGER_VOLTAGE))
+    dwf.FDwfAnalogInTriggerConditionSet(hdwf, DwfTriggerSlopeRise)
+    dwf.FDwfAnalogInTriggerPositionSet(hdwf, c_double(ad2.calc_trigger_pos_from_index(10,
+                                                                                      1. / sample_rate,
+                                                                                      sample_size / sample_rate)))
+
+    # square trigger pulses, repeated until stopped:
+    dwf.FDwfAnalogOutNodeEnableSet(hdwf, c_int(0), AnalogOutNodeCarrier, c_bool(True))
+    dwf.FDwfAnalogOutNodeFunctionSet(hdwf, c_int(0), AnalogOutNodeCarrier, funcSquare)
+    dwf.FDwfAnalogOutNodeFrequencySet(hdwf, c_int(0), AnalogOutNodeCarrier, c_double(0.5 / TRIGGER_PULSE_WIDTH))
+    dwf.FDwfAnalogOutNodeAmplitudeSet(hdwf, c_int(0), AnalogOutNodeCarrier, c_double(TRIGGER_PULSE_AMPLITUDE))
+    dwf.FDwfAnalogOutRunSet(hdwf, c_int(0), c_double(TRIGGER_PULSE_WIDTH))
+    dwf.FDwfAnalogOutWaitSet(hdwf, c_int(0), c_double(tr - TRIGGER_PULSE_WIDTH))
+    dwf.FDwfAnalogOutRepeatSet(hdwf, c_int(0), c_int(0))   # 0 = repeat forever
+
+    ad2.check_and_print_error(dwf)
+    return hdwf
+
+
+def start(dwf, hdwf):
+    dwf.FDwfAnalogInConfigure(hdwf, c_bool(False), c_bool(True))
+    dwf.FDwfAnalogOutConfigure(hdwf, c_int(0), c_bool(True))
+
+
+def stop(dwf, hdwf):
+    dwf.FDwfAnalogOutConfigure(hdwf, c_int(0), c_bool(False))
+    dwf.FDwfDeviceClose(hdwf)
+
+
+def bench_trigger_loop(dwf, n_triggers, tr, wait):
+    """my_custom_trigger_16bit_2ch.py loop: wait for Done, copy 2ch int16 data.
+
+        Returns LoopTimer, acquisition time (sec), data bytes per trigger.
+    """
+    hdwf = open_device(dwf, TRIGGER_LOOP_CONFIG, TRIGGER_LOOP_SAMPLE_RATE, TRIGGER_LOOP_SAMPLE_SIZE, 2, tr)
+
+    ring_ch1 = (c_int16 * (COPY_RING_SLOTS * TRIGGER_LOOP_SAMPLE_SIZE))()
+    ring_ch2 = (c_int16 * (COPY_RING_SLOTS * TRIGGER_LOOP_SAMPLE_SIZE))()
+    ch1_ptrs = ad2.slot_pointers(ring_ch1, COPY_RING_SLOTS, TRIGGER_LOOP_SAMPLE_SIZE)
+    ch2_ptrs = ad2.slot_pointers(ring_ch2, COPY_RING_SLOTS, TRIGGER_LOOP_SAMPLE_SIZE)
+
+    fast_dwf = ad2.FastDwf(dwf, hdwf, TRIGGER_LOOP_SAMPLE_SIZE)
+    analog_in_status_data16 = fast_dwf.status_data16
+    CH1, CH2 = fast_dwf.ch
+    ZERO = fast_dwf.zero
+    N_SAMPLES = fast_dwf.n_samples
+    waiter = ad2.make_waiter(wait, dwf, hdwf, status=fast_dwf.status, tr=tr)
+    wait_for_done = waiter.wait
+
+    timer = ad2.LoopTimer(n_triggers)
+    perf_counter = time.perf_counter
+
+    start(dwf, hdwf)
+    for iTrigger in range(n_triggers):
+        t_armed = perf_counter()
+        n_polls = wait_for_done()
+
+        slot = iTrigger % COPY_RING_SLOTS
+        analog_in_status_data16(hdwf, CH1, ch1_ptrs[slot], ZERO, N_SAMPLES)
+        analog_in_status_data16(hdwf, CH2, ch2_ptrs[slot], ZERO, N_SAMPLES)
+
+        timer.record(iTrigger, n_polls, t_armed, waiter.t_seen, waiter.t_done, perf_counter())
+    stop(dwf, hdwf)
+    waiter.print_summary()
+
+    return timer, TRIGGER_LOOP_SAMPLE_SIZE / TRIGGER_LOOP_SAMPLE_RATE, 2 * 2 * TRIGGER_LOOP_SAMPLE_SIZE
+
+
+def bench_stream_loop(dwf, n_triggers, tr, wait):
+    """my_custom_trigger_16bit_2ch.py -s loop: wait for Done, copy 2ch int16 data into a
+        StreamingSessionWriter slot (written to a temp. file by its thread, deleted afterwards).
+
+        Returns LoopTimer, acquisition time (sec), data bytes per trigger.
+    """
+    hdwf = open_device(dwf, TRIGGER_LOOP_CONFIG, TRIGGER_LOOP_SAMPLE_RATE, TRIGGER_LOOP_SAMPLE_SIZE, 2, tr)
+
+    fd, filepath = tempfile.mkstemp(prefix='ad2_bench_', suffix='.bin')
+    os.close(fd)
+    stream_writer = ad2.StreamingSessionWriter(filepath, 2, TRIGGER_LOOP_SAMPLE_RATE, TRIGGER_LOOP_SAMPLE_SIZE,
+                                               [5., 5.], [0., 0.], n_slots=STREAM_RING_SLOTS)
+    get_slot = stream_writer.get_slot
+    commit_slot = stream_writer.commit_slot
+    slot_ptr = stream_writer.ptr
+
+    fast_dwf = ad2.FastDwf(dwf, hdwf, TRIGGER_LOOP_SAMPLE_SIZE)
+    analog_in_status_data16 = fast_dwf.status_data16
+    CH1, CH2 = fast_dwf.ch
+    ZERO = fast_dwf.zero
+    N_SAMPLES = fast_dwf.n_samples
+    waiter = ad2.make_waiter(wait, dwf, hdwf, status=fast_dwf.status, tr=tr)
+    wait_for_done = waiter.wait
+
+    timer = ad2.LoopTimer(n_triggers)
+    perf_counter = time.perf_counter
+
+    start(dwf, hdwf)
+    try:
+        for iTrigger in range(n_triggers):
+            t_armed = perf_counter()
+            n_polls = wait_for_done()
+
+            slot = get_slot()
+            if slot is not None:    # else dropped (writer fell behind; see stats)
+                analog_in_status_data16(hdwf, CH1, slot_ptr(slot, 0), ZERO, N_SAMPLES)
+                analog_in_status_data16(hdwf, CH2, slot_ptr(slot, 1), ZERO, N_SAMPLES)
+                commit_slot(slot)
+
+            timer.record(iTrigger, n_polls, t_armed, waiter.t_seen, waiter.t_done, perf_counter())
+    finally:
+        stop(dwf, hdwf)
+        try:
+            stream_writer.close()
+        finally:
+            os.remove(filepath)
+    waiter.print_summary()
+    stream_writer.print_stats()
+
+    return timer, TRIGGER_LOOP_SAMPLE_SIZE / TRIGGER_LOOP_SAMPLE_RATE, 2 * 2 * TRIGGER_LOOP_SAMPLE_SIZE
+
+
+def bench_timestamp_loop(dwf, n_triggers, tr, wait):
+    """timestamp_logger2.py loop (binary mode): wait for Done, trigger time into a TimestampBuffer.
+
+        Returns LoopTimer, acquisition time (sec), data bytes per trigger.
+    """
+    hdwf = open_device(dwf, TIMESTAMP_LOOP_CONFIG, TIMESTAMP_LOOP_SAMPLE_RATE, TIMESTAMP_LOOP_SAMPLE_SIZE, 1, tr)
+
+    ts_buffer = ad2b.TimestampBuffer()
+    ts_ptrs = ts_buffer.ptrs
+    ts_block_len = ts_buffer.n_records
+    waiter = ad2b.make_waiter(wait, dwf, hdwf, tr=tr)
+    wait_for_done = waiter.wait
+
+    timer = ad2.LoopTimer(n_triggers)
+    perf_counter = time.perf_counter
+
+    start(dwf, hdwf)
+    for iTrigger in range(n_triggers):
+        t_armed = perf_counter()
+        n_polls = wait_for_done()
+
+        p_sec, p_ticks, p_tps = ts_ptrs[iTrigger % ts_block_len]
+        dwf.FDwfAnalogInStatusTime(hdwf, p_sec, p_ticks, p_tps)
+
+        timer.record(iTrigger, n_polls, t_armed, waiter.t_seen, waiter.t_done, perf_counter())
+    stop(dwf, hdwf)
+    waiter.print_summary()
+
+    return timer, TIMESTAMP_LOOP_SAMPLE_SIZE / TIMESTAMP_LOOP_SAMPLE_RATE, 2 * TIMESTAMP_LOOP_SAMPLE_SIZE
+
+
+
+dwf = ad2.load_dwf(args.backend)
+
+loops = {'trigger': bench_trigger_loop, 'stream': bench_stream_loop, 'timestamp': bench_timestamp_loop}
+names = list(loops) if args.loop == 'all' else [args.loop]
+
+for name in names:
+    print('\nBenchmarking %s loop: %d triggers, TR = %.3f ms (~%.1f sec), wait: %s...'
+          % (name, args.n_triggers, 1e3 * args.tr, args.n_triggers * args.tr, args.wait))
+    timer, acq_time, n_bytes = loops[name](dwf, args.n_triggers, args.tr, args.wait)
+    timer.print_summary()
+
+    # the scope needs a full buffer (pre- + post-trigger samples) after re-arming,
+    # plus the worst-case transfer, copy & re-arm time of the loop:
+    summary = timer.summary()
+    min_tr = acq_time + summary['transfer'][1] + summary['copy'][1] + summary['rearm'][1]
+    print('Acquisition time: %.1f us' % (1e6 * acq_time))
+    print('Minimum TR (acq. time + p99 transfer + copy + re-arm): %.3f ms (suggest WAVEGEN_WAIT_TIME >= %.3f ms)'
+          % (1e3 * min_tr, 1e3 * TR_MARGIN * min_tr))
+    if summary['period'][0] > 1.5 * args.tr:
+        print('WARNING: median trigger period %.3f ms > TR; the loop is missing triggers' % (1e3 * summary['period'][0]))
+
+    filepath = '%s_%s_timing.npz' % (args.output, name)
+    timer.save(filepath, keep_raw=args.keep_raw, tr=args.tr, acq_time=acq_time, min_tr=min_tr, n_bytes=n_bytes,
+               wait=args.wait)
+    print('Saved: %s' % filepath)
+
+if hasattr(dwf, 'print_stats'):
+    dwf.print_stats()     # simulated device only
@@ -0,0 +1,146 @@
+"""Benchmark the per-iteration ctypes overhead of the trigger loop (before/after ad2_tools.FastDwf).
+
+    Times the body of the my_custom_trigger_16bit_2ch.py acquisition loop
+    (1 FDwfAnalogInStatus poll + 2 FDwfAnalogInStatusData16 copies), written:
+        - 'before':  dwf.<name>(...) lookups, c_int()/byref() built on every call
+        - 'after':   ad2.FastDwf pre-resolved functions, pre-built constant args,
+                     precomputed per-acquisition destination pointers (ad2.slot_pointers)
+        - 'checked': same as 'after', with declared argtypes (ad2.FastDwf(checked=True))
+    It does not wait for triggers; the loop body runs back-to-back.
+
+    Backends:
+        standin = every SDK call goes to a C function that does nothing (libc labs),
+                  so only the Python/ctypes overhead is measured (no device needed)
+        hw      = real AD2 (includes the USB status/data transfers)
+        sim     = ad2_sim (mostly measures the simulator itself)
+
+    USAGE:
+    python bench_fast_calls.py [-n N_ITERATIONS] [--samples N] [--backend standin|hw|sim]
+"""
+
+
+from ctypes import *
+from dwfconstants import *
+import ctypes.util
+import time
+import sys
+import argparse
+
+import ad2_tools as ad2
+
+
+N_REPEATS = 5       # best of N_REPEATS runs is reported
+
+
+parser = argparse.ArgumentParser(description='Analog Discovery 2 - ctypes call overhead benchmark')
+parser.add_argument('-n', '--n-iterations', type=int, default=20000, help='loop iterations per run')
+parser.add_argument('--samples', type=int, default=256, help='samples per acquisition (per channel)')
+parser.add_argument('--backend', choices=['standin', 'hw', 'sim'], default='standin', help='SDK calls backend')
+args = parser.parse_args()
+
+
+
+class StandInDwf():
+    """Fake dwf: every FDwf* function is a C function that ignores its args (libc labs).
+
+        Attribute lookups are cached like ctypes.CDLL; dwf[name] returns a new function pointer.
+    """
+
+    def __init__(self):
+        if sys.platform.startswith('win'):
+            self._lib = cdll.msvcrt
+        else:
+            self._lib = CDLL(ctypes.util.find_library('c'))
+
+    def __getitem__(self, name):
+        return self._lib['labs']
+
+    def __getattr__(self, name):
+        func = self._lib['labs']
+        setattr(self, name, func)
+        return func
+
+
+def loop_before(dwf, hdwf, n_iterations, n_samples, buf_ch1, buf_ch2, scope_status):
+    """Loop body as written before FastDwf (one poll per iteration)."""
+    acquisition_data_index = 0
+    acquisition_data_stride = n_samples * sizeof(c_int16)
+    for iTrigger in range(n_iterations):
+        dwf.FDwfAnalogInStatus(hdwf, c_int(1), byref(scope_status))
+        if scope_status.value == DwfStateDone.value:
+            pass
+        dwf.FDwfAnalogInStatusData16(hdwf, c_int(0), byref(buf_ch1, acquisition_data_index), 0, n_samples)
+        dwf.FDwfAnalogInStatusData16(hdwf, c_int(1), byref(buf_ch2, acquisition_data_index), 0, n_samples)
+        acquisition_data_index += acquisition_data_stride
+
+
+def setup_after(dwf, hdwf, n_iterations, n_samples, buf_ch1, buf_ch2, scope_status, checked=False):
+    """Everything FastDwf moves out of the loop (done before arming; not timed)."""
+    fast_dwf = ad2.FastDwf(dwf, hdwf, n_samples, checked=checked)
+    return (fast_dwf,
+            byref(scope_status),
+            ad2.slot_pointers(buf_ch1, n_iterations, n_samples),
+            ad2.slot_pointers(buf_ch2, n_iterations, n_samples),
+            )
+
+
+def loop_after(hdwf, n_iterations, scope_status, fast_dwf, scope_status_ptr, ch1_ptrs, ch2_ptrs):
+    """Loop body as written with FastDwf (one poll per iteration)."""
+    analog_in_status = fast_dwf.status
+    analog_in_status_data16 = fast_dwf.status_data16
+    READ_DATA = fast_dwf.read_data
+    CH1, CH2 = fast_dwf.ch
+    ZERO = fast_dwf.zero
+    N_SAMPLES = fast_dwf.n_samples
+    DONE = DwfStateDone.value
+
+    for iTrigger in range(n_iterations):
+        analog_in_status(hdwf, READ_DATA, scope_status_ptr)
+        if scope_status.value == DONE:
+            pass
+        analog_in_status_data16(hdwf, CH1, ch1_ptrs[iTrigger], ZERO, N_SAMPLES)
+        analog_in_status_data16(hdwf, CH2, ch2_ptrs[iTrigger], ZERO, N_SAMPLES)
+
+
+def time_loop(loop, *loop_args):
+    """Return best time per iteration (sec) of N_REPEATS runs."""
+    best = float('inf')
+    for i in range(N_REPEATS):
+        t0 = time.perf_counter()
+        loop(*loop_args)
+        best = min(best, time.perf_counter() - t0)
+    return best / args.n_iterations
+
+
+
+if args.backend == 'standin':
+    dwf = StandInDwf()
+    hdwf = c_int(1)
+else:
+    dwf = ad2.load_dwf(args.backend, call_latency=0.) if args.backend == 'sim' else ad2.load_dwf('hw')
+    hdwf = c_int()
+    dwf.FDwfDeviceConfigOpen(c_int(-1), c_int(1), byref(hdwf))
+    if hdwf.value == hdwfNone.value:
+        print('failed to open device\n' + ad2.get_error(dwf))
+        sys.exit(1)
+    dwf.FDwfAnalogInFrequencySet(hdwf, c_double(10e6))
+    dwf.FDwfAnalogInBufferSizeSet(hdwf, c_int(args.samples))
+    dwf.FDwfAnalogInConfigure(hdwf, c_bool(False), c_bool(True))
+
+buf_ch1 = (c_int16 * (args.n_iterations * args.samples))()
+buf_ch2 = (c_int16 * (args.n_iterations * args.samples))()
+scope_status = c_byte()
+
+loop_args = (dwf, hdwf, args.n_iterations, args.samples, buf_ch1, buf_ch2, scope_status)
+t_before = time_loop(loop_before, *loop_args)
+t_after = time_loop(loop_after, hdwf, args.n_iterations, scope_status, *setup_after(*loop_args))
+t_checked = time_loop(loop_after, hdwf, args.n_iterations, scope_status, *setup_after(*loop_args, checked=True))
+
+if args.backend != 'standin':
+    dwf.FDwfDeviceClose(hdwf)
+
+print('Backend: %s, %d iterations x 3 SDK calls (best of %d)' % (args.backend, args.n_iterations, N_REPEATS))
+print('%-10s %12s %12s %14s' % ('loop', 'us/iter', 'us/call', 'iter/sec'))
+for name, t in [('before', t_before), ('after', t_after), ('checked', t_checked)]:
+    print('%-10s %12.3f %12.3f %14.0f' % (name, 1e6 * t, 1e6 * t / 3, 1. / t))
+print('after vs. before: %.2fx faster' % (t_before / t_after))
@@ -0,0 +1,87 @@
+"""Benchmark int16 -> volts conversion (ad2_tools.int16signal2voltage).
+
+    Compares the original np.fromiter() conversion against the current
+    zero-copy/in-place version, on ctypes c_int16 buffers the same size as a
+    long triggered session (16k samples x 1000 acquisitions by default).
+
+    USAGE:
+    python bench_int16_conversion.py [n_acquisitions] [samples_per_acq]
+
+    No hardware needed.
+"""
+
+from ctypes import *
+import numpy as np
+import time
+import sys
+
+import ad2_tools as ad2
+
+
+N_REPEATS = 3
+
+V_RANGE = 5.538410      # typical exact values (see plot_csv_2ch.py)
+V_OFFSET = 0.000291
+
+
+def int16signal2voltage_fromiter(data_int16, v_range, v_offset):
+    """Original conversion (before zero-copy version), for comparison.
+
+        1 Python iteration per sample (np.fromiter), then astype + 3 full-size temporaries.
+    """
+    tmp = np.fromiter(data_int16, dtype=np.int16)
+    voltage_signal = tmp.astype(np.float64, casting='safe')
+    voltage_signal = (voltage_signal * v_range / 65536) + v_offset
+    return voltage_signal
+
+
+def best_time(f, n_repeats=N_REPEATS):
+    """Return the best (min) wall time of n_repeats calls to f() (seconds)."""
+    times = []
+    for i in range(n_repeats):
+        t0 = time.perf_counter()
+        f()
+        times.append(time.perf_counter() - t0)
+    return min(times)
+
+
+try:
+    n_acquisitions = int(sys.argv[1])
+except IndexError:
+    n_acquisitions = 1000
+
+try:
+    samples_per_acq = int(sys.argv[2])
+except IndexError:
+    samples_per_acq = 16384
+
+n_samples = n_acquisitions * samples_per_acq
+
+print('Buffer: %d acquisitions x %d samples = %d samples (%.1f MB int16)'
+      % (n_acquisitions, samples_per_acq, n_samples, 2e-6 * n_samples))
+
+# fill a ctypes buffer w/ random ADC-like values (same type as the acquisition buffers)
+data_int16 = (c_int16 * n_samples)()
+np.ctypeslib.as_array(data_int16)[:] = np.random.randint(-8192, 8192, size=n_samples, dtype=np.int16)
+
+out_f64 = np.empty(n_samples, dtype=np.float64)
+out_f32 = np.empty(n_samples, dtype=np.float32)
+
+# sanity check: same answer as the original version
+reference = int16signal2voltage_fromiter(data_int16, V_RANGE, V_OFFSET)
+print('max abs. error (float64): %e V' % np.max(np.abs(ad2.int16signal2voltage(data_int16, V_RANGE, V_OFFSET) - reference)))
+print('max abs. error (float32): %e V' % np.max(np.abs(ad2.int16signal2voltage(data_int16, V_RANGE, V_OFFSET, dtype=np.float32) - reference)))
+print()
+
+results = [
+    ('fromiter (original)',      best_time(lambda: int16signal2voltage_fromiter(data_int16, V_RANGE, V_OFFSET), n_repeats=1)),
+    ('zero-copy float64',        best_time(lambda: ad2.int16signal2voltage(data_int16, V_RANGE, V_OFFSET))),
+    ('zero-copy float64, out=',  best_time(lambda: ad2.int16signal2voltage(data_int16, V_RANGE, V_OFFSET, out=out_f64))),
+    ('zero-copy float32',        best_time(lambda: ad2.int16signal2voltage(data_int16, V_RANGE, V_OFFSET, dtype=np.float32))),
+    ('zero-copy float32, out=',  best_time(lambda: ad2.int16signal2voltage(data_int16, V_RANGE, V_OFFSET, out=out_f32))),
+    ]
+
+t_original = results[0][1]
+print('%-26s %10s %12s %8s' % ('method', 'time (s)', 'Msamples/s', 'speedup'))
+for name, t in results:
+    print('%-26s %10.4f %12.1f %7.1fx' % (name, t, 1e-6 * n_samples / t, t_original / t))
@@ -1,3 +1,5 @@
+# NOTE: one-shot example (records once & serves 1 PNG). For live data while acquiring see ../stream_server.py
+
 # In the project directory, create a file called main.py and open in with a text editor.
 # At th etop of the file, declare the imports like so:
 from ctypes import *
@@ -0,0 +1,357 @@
+"""Live A-mode / M-mode viewer for the triggered acquisition loop.
+
+    The acquisition loop publishes its latest acquisition into a small shared-memory
+    slot (LivePublisher); this viewer runs in a separate process and samples that
+    slot at display rate (LiveReader), so plotting never runs in the trigger loop.
+
+    Shared slot = memory-mapped file (works on Python 3.7, Windows & Linux):
+        header (LIVE_HEADER_DTYPE) + int16 data, n_channels x samples_per_acq
+    The slot is protected by a seqlock: the publisher makes the sequence number odd,
+    copies the data, then makes it even again. The publisher never waits for the
+    viewer; if the viewer reads while the slot is being overwritten (sequence changed),
+    that frame is dropped (counted) and the next one is used instead.
+
+    The publisher is rate-limited (LIVE_PUBLISH_RATE), so the trigger loop pays for
+    at most a few memcpy()s per display frame, not one per trigger.
+
+    A slot file created by the publisher (temp. file) is deleted by the publisher at exit
+    if no viewer is attached (or starting, see LivePublisher.start_viewer()), else by the
+    last viewer when it exits after the acquisition ended.
+
+    Display (matplotlib blitting - only the changed artists are redrawn):
+        top:    current A-line (both channels, volts)
+        bottom: scrolling M-mode image (1 column per displayed frame, see ad2.MModeBuilder)
+        text:   display fps, frames shown, acquisitions not shown, torn reads
+
+    USAGE:
+        python my_custom_trigger_16bit_2ch.py -f <folder> --live     # starts this viewer
+        python live_viewer.py SLOT_FILE [--fps 30] [--columns 400] [--rows 512] [--channel 1]
+                                                                       # (re)attach to a running acquisition
+"""
+
+# TODO envelope/log display mode for the M-mode image
+# TODO depth (mm) axis
+
+
+import numpy as np
+import tempfile
+import atexit
+import subprocess
+import ctypes
+import time
+import mmap
+import sys
+import os
+
+import ad2_tools as ad2
+
+
+LIVE_MAGIC = b'AD2L'
+LIVE_PUBLISH_RATE = 60.     # max. publishes per second (acquisition side)
+LIVE_DISPLAY_FPS = 30.      # viewer frame rate
+LIVE_M_MODE_COLUMNS = 400   # M-mode width (displayed frames)
+LIVE_M_MODE_ROWS = 512      # max. M-mode rows (A-line is reduced by max-abs blocks to fit)
+
+LIVE_MAX_CHANNELS = 2
+LIVE_HEADER_DTYPE = np.dtype([('magic', 'S4'),
+                              ('n_channels', '<u4'),
+                              ('samples_per_acq', '<u4'),
+                              ('closed', '<u4'),                    # set by the publisher when acquisition ends
+                              ('temporary', '<u4'),                 # slot file created by the publisher (deleted after use)
+                              ('n_readers', '<u4'),                 # attached viewers
+                              ('sample_rate', '<f8'),
+                              ('v_ranges', '<f8', (LIVE_MAX_CHANNELS,)),
+                              ('v_offsets', '<f8', (LIVE_MAX_CHANNELS,)),
+                              ('seq', '<u8'),                       # seqlock sequence (odd = write in progress)
+                              ('acq_index', '<u8'),                 # trigger index of the published acquisition
+                              ('n_published', '<u8'),
+                              ])
+# seq, acq_index, n_published are also accessed as 1 plain uint64 array
+# (structured field access costs ~3 us; too slow for the acquisition side)
+LIVE_COUNTERS_OFFSET = LIVE_HEADER_DTYPE.fields['seq'][1]
+LIVE_SEQ, LIVE_ACQ_INDEX, LIVE_N_PUBLISHED = range(3)
+
+
+class LivePublisher():
+    """Acquisition side: copy the latest acquisition into the shared slot (never blocks).
+
+        Usage (in the trigger loop, after the data is copied from the SDK):
+            if LIVE_MODE and perf_counter() >= live.next_publish_time:
+                live.publish([ch1_ptr, ch2_ptr], iTrigger)
+    """
+
+    def __init__(self, n_channels, samples_per_acq, sample_rate, v_ranges, v_offsets,
+                 filepath=None, publish_rate=LIVE_PUBLISH_RATE):
+        """
+            n_channels, samples_per_acq, sample_rate = acquisition settings
+            v_ranges, v_offsets = scope range/offset per channel (for volts display; see ScopeParams)
+            filepath = shared slot file (default: new ad2_live_*.bin temp. file, deleted after use)
+            publish_rate = max. publishes per second
+        """
+        if n_channels > LIVE_MAX_CHANNELS:
+            raise ValueError('LivePublisher: max. %d channels' % LIVE_MAX_CHANNELS)
+
+        self.temporary = filepath is None
+        self.viewer = None
+        if self.temporary:
+            fd, filepath = tempfile.mkstemp(prefix='ad2_live_', suffix='.bin')
+            os.close(fd)
+            atexit.register(self._remove_if_unused)
+        self.filepath = filepath
+        self.n_channels = n_channels
+        self.samples_per_acq = samples_per_acq
+        self.channel_bytes = samples_per_acq * ctypes.sizeof(ctypes.c_int16)
+        self.publish_interval = 1. / publish_rate
+        self.next_publish_time = 0.
+
+        size = LIVE_HEADER_DTYPE.itemsize + n_channels * self.channel_bytes
+        with open(self.filepath, 'wb') as f:
+            f.write(b'\0' * size)
+        self._file = open(self.filepath, 'r+b')
+        self._mm = mmap.mmap(self._file.fileno(), size)
+
+        self.header = np.ndarray((), dtype=LIVE_HEADER_DTYPE, buffer=self._mm)
+        self.header['n_channels'] = n_channels
+        self.header['samples_per_acq'] = samples_per_acq
+        self.header['sample_rate'] = sample_rate
+        self.header['v_ranges'][:n_channels] = v_ranges
+        self.header['v_offsets'][:n_channels] = v_offsets
+        self.header['temporary'] = self.temporary
+        self.header['magic'] = LIVE_MAGIC     # last: readers wait for the magic
+
+        # raw destination addresses for ctypes.memmove (precomputed, no per-publish ctypes objects)
+        self._data_ref = ctypes.c_char.from_buffer(self._mm, LIVE_HEADER_DTYPE.itemsize)
+        data_addr = ctypes.addressof(self._data_ref)
+        self._dest = [data_addr + ch * self.channel_bytes for ch in range(n_channels)]
+        self._counters = (ctypes.c_uint64 * 3).from_buffer(self._mm, LIVE_COUNTERS_OFFSET)
+
+    def publish(self, src_ptrs, acq_index):
+        """Copy 1 acquisition into the slot.
+
+            src_ptrs = SDK data pointer (byref/address) for each channel, ie. the same
+                       pointers passed to FDwfAnalogInStatusData16 (samples_per_acq int16 each)
+            acq_index = trigger index (for the viewer's 'not shown' counter)
+        """
+        counters = self._counters
+        counters[LIVE_SEQ] += 1             # odd: write in progress
+        for dest, src in zip(self._dest, src_ptrs):
+            ctypes.memmove(dest, src, self.channel_bytes)
+        counters[LIVE_ACQ_INDEX] = acq_index
+        counters[LIVE_N_PUBLISHED] += 1
+        counters[LIVE_SEQ] += 1             # even: consistent
+        self.next_publish_time = time.perf_counter() + self.publish_interval
+
+    def close(self):
+        """Tell the viewer the acquisition has ended (the viewer window stays open)."""
+        self.header['closed'] = 1
+        del self.header
+        del self._data_ref
+        del self._counters
+        self._mm.close()
+        self._file.close()
+
+    def start_viewer(self, fps=LIVE_DISPLAY_FPS, channel=1):
+        """Start the viewer process on this slot (see start_viewer()); returns the Popen."""
+        self.viewer = start_viewer(self.filepath, fps=fps, channel=channel)
+        return self.viewer
+
+    def _remove_if_unused(self):
+        """atexit: delete the temp. slot file unless a viewer is attached or still starting (that viewer deletes it)."""
+        if self.viewer is not None and self.viewer.poll() is None:
+            return
+        try:
+            header = np.fromfile(self.filepath, dtype=LIVE_HEADER_DTYPE, count=1)
+            if len(header) == 0 or header[0]['n_readers'] == 0:
+                os.remove(self.filepath)
+        except OSError:
+            pass    # already deleted by the viewer (or still mapped, Windows)
+
+
+class LiveReader():
+    """Viewer side: read a consistent copy of the latest published acquisition."""
+
+    def __init__(self, filepath, timeout=10.):
+        """Attach to a slot file (waits up to timeout sec. for the publisher to fill in the header)."""
+        t_end = time.perf_counter() + timeout
+        while True:
+            try:
+                self._file = open(filepath, 'r+b')     # writable: n_readers
+                self._mm = mmap.mmap(self._file.fileno(), 0)
+                self.header = np.ndarray((), dtype=LIVE_HEADER_DTYPE, buffer=self._mm)
+                if self.header['magic'] == LIVE_MAGIC:
+                    break
+                self.header = None
+                self._mm.close()
+                self._file.close()
+            except (OSError, ValueError):
+                pass    # not created yet (or empty)
+            if time.perf_counter() > t_end:
+                raise TimeoutError('No live acquisition slot at %s' % filepath)
+            time.sleep(0.1)
+
+        self.filepath = filepath
+        self.header['n_readers'] += 1
+        self.n_channels = int(self.header['n_channels'])
+        self.samples_per_acq = int(self.header['samples_per_acq'])
+        self.sample_rate = float(self.header['sample_rate'])
+        self.v_ranges = self.header['v_ranges'][:self.n_channels].copy()
+        self.v_offsets = self.header['v_offsets'][:self.n_channels].copy()
+        self._counters = np.ndarray(3, dtype='<u8', buffer=self._mm, offset=LIVE_COUNTERS_OFFSET)
+        self.data = np.ndarray((self.n_channels, self.samples_per_acq), dtype='<i2',
+                               buffer=self._mm, offset=LIVE_HEADER_DTYPE.itemsize)
+
+        self.latest = np.zeros((self.n_channels, self.samples_per_acq), dtype=np.int16)
+        self.last_seq = 0
+        self.last_acq_index = None
+        self.n_frames = 0       # new acquisitions read
+        self.n_not_shown = 0    # acquisitions (triggers) that were never displayed
+        self.n_torn = 0         # reads dropped because the publisher overwrote the slot meanwhile
+
+    @property
+    def closed(self):
+        return bool(self.header['closed'])
+
+    def read(self):
+        """Copy the latest acquisition into self.latest.
+
+            Returns True if it is new & consistent, False if nothing new (or torn; try again next frame).
+        """
+        counters = self._counters
+        seq = int(counters[LIVE_SEQ])
+        if seq == self.last_seq or seq & 1:
+            return False
+        acq_index = int(counters[LIVE_ACQ_INDEX])
+        np.copyto(self.latest, self.data)
+        if int(counters[LIVE_SEQ]) != seq:
+            self.n_torn += 1
+            return False
+
+        if self.last_acq_index is not None:
+            self.n_not_shown += max(acq_index - self.last_acq_index - 1, 0)
+        self.last_acq_index = acq_index
+        self.last_seq = seq
+        self.n_frames += 1
+        return True
+
+    def volts(self, ch):
+        return ad2.int16signal2voltage(self.latest[ch], self.v_ranges[ch], self.v_offsets[ch])
+
+    def close(self):
+        """Detach; the last viewer deletes a temp. slot file once the acquisition has ended."""
+        self.header['n_readers'] -= 1
+        remove = self.closed and bool(self.header['temporary']) and int(self.header['n_readers']) == 0
+        del self.header
+        del self.data
+        del self._counters
+        self._mm.close()
+        self._file.close()
+        if remove:
+            try:
+                os.remove(self.filepath)
+            except OSError:
+                pass    # already deleted by the publisher
+
+
+def reduce_rows(a_line, n_rows):
+    """Reduce an A-line to at most n_rows samples (signed max-abs of each block) for the M-mode image."""
+    factor = max(1, int(np.ceil(a_line.shape[0] / n_rows)))
+    n = a_line.shape[0] // factor
+    blocks = a_line[:n * factor].reshape(n, factor)
+    return blocks[np.arange(n), np.argmax(np.abs(blocks), axis=1)]
+
+
+def start_viewer(filepath, fps=LIVE_DISPLAY_FPS, channel=1):
+    """Start the viewer (this file) in a separate, low priority process; returns the Popen.
+
+        A new interpreter is used (not multiprocessing), so the calling acquisition
+        script is never re-imported by the viewer process.
+    """
+    cmd = [sys.executable, os.path.abspath(__file__),
+           filepath,
+           '--fps', str(fps),
+           '--channel', str(channel),
+           ]
+    if sys.platform.startswith('win'):
+        return subprocess.Popen(cmd, creationflags=subprocess.BELOW_NORMAL_PRIORITY_CLASS)
+    return subprocess.Popen(cmd, preexec_fn=lambda: os.nice(10))
+
+
+def run_viewer(reader, fps=LIVE_DISPLAY_FPS, n_columns=LIVE_M_MODE_COLUMNS, n_rows=LIVE_M_MODE_ROWS, channel=1):
+    """Show the live display until the window is closed."""
+    import matplotlib.pyplot as plt
+    import matplotlib.animation as animation
+
+    channel = min(channel, reader.n_channels - 1)
+    t_us = 1e6 / reader.sample_rate * np.arange(reader.samples_per_acq)
+    v_max = float(np.max(0.5 * reader.v_ranges + np.abs(reader.v_offsets)))
+
+    fig, (ax_a, ax_m) = plt.subplots(2, 1, figsize=(10, 8))
+    lines = []
+    for ch in range(reader.n_channels):
+        line, = ax_a.plot(t_us, np.zeros(reader.samples_per_acq), lw=0.8, label='Ch. %d (V)' % (ch + 1), animated=True)
+        lines.append(line)
+    ax_a.set_xlim(t_us[0], t_us[-1])
+    ax_a.set_ylim(-v_max, v_max)
+    ax_a.set_xlabel('Time [us]')
+    ax_a.set_ylabel('Volts')
+    ax_a.legend(loc='upper right')
+    ax_a.set_title('Live A-line')
+    stats_text = ax_a.text(0.01, 0.97, '', transform=ax_a.transAxes, va='top', family='monospace', animated=True)
+
+    # M-mode ring (prefilled with zeros, so the image size never changes):
+    m_rows = reduce_rows(np.zeros(reader.samples_per_acq), n_rows).shape[0]
+    m_mode = ad2.MModeBuilder(m_rows, n_columns, dtype=np.float32, ring=True)
+    for i in range(n_columns):
+        m_mode.commit()
+    clim = 0.5 * float(reader.v_ranges[channel])
+    image = ax_m.imshow(m_mode.m_mode(), cmap='gray', aspect='auto', animated=True,
+                        extent=(-n_columns, 0, t_us[-1], 0), vmin=-clim, vmax=clim)
+    ax_m.set_title('Ch. %d M-Mode (1 column per frame)' % (channel + 1))
+    ax_m.set_xlabel('Frames ago')
+    ax_m.set_ylabel('Time [us]')
+    fig.tight_layout()
+
+    fps_state = {'t': time.perf_counter(), 'frames': 0, 'fps': 0.}
+
+    def update(frame):
+        if reader.read():
+            for ch, line in enumerate(lines):
+                line.set_ydata(reader.volts(ch))
+            m_mode.append(reduce_rows(reader.volts(channel), n_rows))
+            image.set_data(m_mode.m_mode())
+            fps_state['frames'] += 1
+
+        now = time.perf_counter()
+        if now - fps_state['t'] >= 1.:
+            fps_state['fps'] = fps_state['frames'] / (now - fps_state['t'])
+            fps_state['t'] = now
+            fps_state['frames'] = 0
+
+        stats_text.set_text('%5.1f fps | shown %d | not shown %d | torn %d%s'
+                            % (fps_state['fps'], reader.n_frames, reader.n_not_shown, reader.n_torn,
+                               ' | ACQUISITION ENDED' if reader.closed else ''))
+        return lines + [image, stats_text]
+
+    anim = animation.FuncAnimation(fig, update, interval=1000. / fps, blit=True, cache_frame_data=False)
+    plt.show()
+    return anim
+
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Analog Discovery 2 - Live A-mode/M-mode viewer')
+    parser.add_argument('slot', help='shared slot file (printed by the acquisition script)')
+    parser.add_argument('--fps', type=float, default=LIVE_DISPLAY_FPS, help='display frame rate')
+    parser.add_argument('--columns', type=int, default=LIVE_M_MODE_COLUMNS, help='M-mode width (frames)')
+    parser.add_argument('--rows', type=int, default=LIVE_M_MODE_ROWS, help='max. M-mode rows')
+    parser.add_argument('--channel', type=int, default=1, help='M-mode channel (0-based; default ch2)')
+    args = parser.parse_args()
+
+    reader = LiveReader(args.slot)
+    print('Live viewer: %d ch x %d samples @ %.2e Hz' % (reader.n_channels, reader.samples_per_acq, reader.sample_rate))
+    run_viewer(reader, fps=args.fps, n_columns=args.columns, n_rows=args.rows, channel=args.channel)
+    print('Frames shown: %d, acquisitions not shown: %d, torn reads: %d'
+          % (reader.n_frames, reader.n_not_shown, reader.n_torn))
+    reader.close()
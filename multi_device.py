@@ -0,0 +1,345 @@
+"""Triggered windowed acquisition on several Analog Discovery 2 devices at once (2 scope channels each).
+
+    Enumerates all attached devices (ad2.enumerate_devices()) and opens each one in its own
+    worker thread, running the same triggered-window loop as my_custom_trigger_16bit_2ch.py
+    (ad2.FastDwf, precomputed destination pointers). ctypes releases the GIL during every
+    SDK call, so the devices' USB status/data transfers overlap and each device keeps its own
+    trigger rate.
+
+    Every worker configures & arms its scope, then all wait on a barrier before the pulse
+    device starts its wavegen, so no device misses the first trigger.
+    Triggers:
+        'ch1'      = each device triggers on its own scope ch1 (tee the same pulse into every ch1)
+        'external' = each device triggers on its Trigger 1 input (ie. pulse device trigger out / MRI sync)
+
+    Each acquisition is timestamped on its device (FDwfAnalogInStatusTime). The per-device
+    acquisitions are merged into 1 session, indexed by trigger number: the device with the most
+    acquisitions is the reference & the others are matched to it by timestamp
+    (ad2.TimestampAlignment), so a missed trigger on 1 device doesn't shift the others.
+    Saved files (same naming as my_custom_trigger_16bit_2ch.py):
+        <prefix>_data.bin      2 channels per device (dev0 ch1, dev0 ch2, dev1 ch1, ...), 1 acquisition per trigger
+                               (zeros where a device missed the trigger)
+        <prefix>_triggers.csv  per trigger: each device's acquisition index (-1 = missed) & timestamp (usec)
+        <prefix>_devices.csv   per device: index, name, serial, acquisitions, trigger rate, missed triggers,
+                               unmatched acquisitions (no trigger, or a closer duplicate was kept)
+        <prefix>_settings.csv  acquisition settings
+
+    USAGE:
+    python multi_device.py -f <folder> [-d DESCRIPTION] [-n N_ACQUISITIONS] [--devices 0,1] [--trigger ch1|external]
+"""
+
+# TODO per-device streaming (ad2.StreamingSessionWriter) for long sessions
+# TODO record mode (RecordEngine) per device
+
+
+from ctypes import *
+from dwfconstants import *
+import numpy as np
+import datetime
+import threading
+import time
+import sys
+import os
+
+import ad2_tools as ad2
+import ad2_tools_basic as ad2b
+
+
+# settings: ad2.AcquisitionConfig (defaults as in my_custom_trigger_16bit_2ch.py)
+START_TIMEOUT = 30.     # sec. for every device to be opened, configured & armed
+
+
+
+class DeviceWorker(threading.Thread):
+    """Open 1 device & run the triggered-window acquisition loop in this thread.
+
+        Results (after join()): n_acquired, data (2 c_int16 buffers), timestamps (ad2b.TimestampBuffer),
+        v_ranges, v_offsets, error (None if OK)
+    """
+
+    def __init__(self, dwf, device, config, start_barrier, stop_event):
+        super().__init__(name='ad2-dev%d' % device['index'], daemon=True)
+        self.dwf = dwf
+        self.device = device
+        self.config = config
+        self.start_barrier = start_barrier
+        self.stop_event = stop_event
+
+        n = config.n_acquisitions
+        self.data = [(c_int16 * (n * config.samples_per_acq))() for ch in range(2)]
+        self.timestamps = ad2b.TimestampBuffer(n)
+        self.n_acquired = 0
+        self.timed_out = False
+        self.v_ranges = [ad2.NAN, ad2.NAN]
+        self.v_offsets = [ad2.NAN, ad2.NAN]
+        self.error = None
+
+    def run(self):
+        dwf = self.dwf
+        config = self.config
+        hdwf = c_int()
+        dwf.FDwfDeviceConfigOpen(c_int(self.device['index']), c_int(config.device_config), byref(hdwf))
+        if hdwf.value == hdwfNone.value:
+            self.error = 'failed to open device: ' + ad2.get_error(dwf)
+            self.start_barrier.abort()
+            return
+
+        try:
+            try:
+                self._configure(hdwf)
+            except Exception as e:
+                self.error = 'configuration failed: %s' % e
+                self.start_barrier.abort()
+                return
+            try:
+                self.start_barrier.wait(START_TIMEOUT)   # every device armed
+            except threading.BrokenBarrierError:
+                self.error = self.error or 'another device failed to start (or timed out)'
+                return
+            if self.device['index'] == config.pulse_device:
+                dwf.FDwfAnalogOutConfigure(hdwf, c_int(ad2.PULSE_CHANNEL), c_bool(True))     # start pulses
+            self._acquire(hdwf)
+        finally:
+            if self.device['index'] == config.pulse_device:
+                dwf.FDwfAnalogOutConfigure(hdwf, c_int(ad2.PULSE_CHANNEL), c_bool(False))
+            dwf.FDwfDeviceClose(hdwf)
+
+    def _configure(self, hdwf):
+        """Scope (& wavegen on the pulse device) setup; arms the scope."""
+        scope_params = ad2.configure_triggered_acquisition(self.dwf, hdwf, self.config,
+                                                           pulse=self.device['index'] == self.config.pulse_device)
+        self.v_ranges = [scope_params.ch1_v_range, scope_params.ch2_v_range]
+        self.v_offsets = [scope_params.ch1_v_offset, scope_params.ch2_v_offset]
+
+    def _acquire(self, hdwf):
+        """The triggered-window loop (see my_custom_trigger_16bit_2ch.py) + 1 timestamp per acquisition."""
+        config = self.config
+        fast_dwf = ad2.FastDwf(self.dwf, hdwf, config.samples_per_acq)
+        analog_in_status = fast_dwf.status
+        analog_in_status_data16 = fast_dwf.status_data16
+        analog_in_status_time = fast_dwf.status_time
+        READ_DATA = fast_dwf.read_data
+        CH1, CH2 = fast_dwf.ch
+        ZERO = fast_dwf.zero
+        N_SAMPLES = fast_dwf.n_samples
+        DONE = DwfStateDone.value
+        scope_status = c_byte()
+        scope_status_ptr = byref(scope_status)
+        ch1_ptrs = ad2.slot_pointers(self.data[0], config.n_acquisitions, config.samples_per_acq)
+        ch2_ptrs = ad2.slot_pointers(self.data[1], config.n_acquisitions, config.samples_per_acq)
+        ts_ptrs = self.timestamps.ptrs
+        perf_counter = time.perf_counter
+        stop_event = self.stop_event
+        timeout = config.trigger_timeout
+
+        deadline = perf_counter() + timeout
+        for iTrigger in range(config.n_acquisitions):
+            while True:
+                analog_in_status(hdwf, READ_DATA, scope_status_ptr)
+                if scope_status.value == DONE:
+                    break
+                if perf_counter() > deadline or stop_event.is_set():
+                    self.timed_out = not stop_event.is_set()
+                    return
+
+            analog_in_status_data16(hdwf, CH1, ch1_ptrs[iTrigger], ZERO, N_SAMPLES)
+            analog_in_status_data16(hdwf, CH2, ch2_ptrs[iTrigger], ZERO, N_SAMPLES)
+            p_sec, p_ticks, p_tps = ts_ptrs[iTrigger]
+            analog_in_status_time(hdwf, p_sec, p_ticks, p_tps)
+            self.n_acquired = iTrigger + 1
+            deadline = perf_counter() + timeout
+
+    def times_usec(self):
+        """Device timestamps (int64 usec since Unix Epoch) of the acquired triggers."""
+        records = np.frombuffer(self.timestamps.buffer, dtype=ad2.TIMESTAMP_DTYPE)[:self.n_acquired]
+        return ad2.timestamps_to_usec(records)
+
+    def acquisitions(self, ch):
+        """int16 view (n_acquired, samples_per_acq) of 1 channel."""
+        data = np.ctypeslib.as_array(self.data[ch])
+        return data[:self.n_acquired * self.config.samples_per_acq].reshape(self.n_acquired, self.config.samples_per_acq)
+
+
+
+class MultiDeviceAcquisition():
+    """Run 1 DeviceWorker per device & merge their acquisitions (see module docstring).
+
+        dwf = DWF library (ad2.load_dwf())
+        config = ad2.AcquisitionConfig
+        device_indexes = devices to use (None = all that are not already open)
+    """
+
+    def __init__(self, dwf, config, device_indexes=None):
+        self.dwf = dwf
+        self.config = config
+        devices = ad2.enumerate_devices(dwf)
+        if device_indexes is not None:
+            devices = [device for device in devices if device['index'] in device_indexes]
+        self.devices = [device for device in devices if not device['is_open']]
+        if not self.devices:
+            raise RuntimeError('No Analog Discovery devices available')
+        self.stop_event = threading.Event()
+        self.start_barrier = None
+        self.workers = []
+        self.trigger_index = None   # per device: trigger number of each acquisition (after merge())
+        self.ref_times_usec = None
+
+    def run(self):
+        """Acquire on all devices (blocks until every worker is done; Ctrl+C stops all)."""
+        self.start_barrier = threading.Barrier(len(self.devices))
+        self.workers = [DeviceWorker(self.dwf, device, self.config, self.start_barrier, self.stop_event)
+                        for device in self.devices]
+        for worker in self.workers:
+            worker.start()
+        try:
+            for worker in self.workers:
+                while worker.is_alive():
+                    worker.join(0.1)
+        except KeyboardInterrupt:
+            print('Stopped by user.')
+            self.stop_event.set()
+            self.start_barrier.abort()      # workers still waiting for the others to start
+            for worker in self.workers:
+                worker.join()
+        for worker in self.workers:
+            if worker.error:
+                print('Device %d: ERROR - %s' % (worker.device['index'], worker.error))
+
+    def merge(self):
+        """Assign a trigger number to every acquisition of every device (timestamp matching).
+
+            Returns list (per worker) of int arrays: trigger number of each acquisition (-1 = unmatched).
+        """
+        reference = max(self.workers, key=lambda worker: worker.n_acquired)
+        self.ref_times_usec = reference.times_usec()
+        if len(self.ref_times_usec) > 1:
+            tr_usec = float(np.median(np.diff(self.ref_times_usec)))
+        else:
+            tr_usec = 1e6 * self.config.pulse_wait
+        self.trigger_index = []
+        for worker in self.workers:
+            if worker is reference or worker.n_acquired == 0:
+                self.trigger_index.append(np.arange(worker.n_acquired))
+                continue
+            alignment = ad2.TimestampAlignment(worker.times_usec(), self.ref_times_usec,
+                                               max_diff_usec=0.5 * tr_usec, fit_drift=worker.n_acquired > 2)
+            self.trigger_index.append(self._drop_duplicates(alignment.index, alignment.diff_usec))
+        return self.trigger_index
+
+    @staticmethod
+    def _drop_duplicates(index, diff_usec):
+        """Keep only the closest acquisition per trigger: the others matched to the same trigger become -1 (unmatched)."""
+        index = index.copy()
+        matched = np.flatnonzero(index >= 0)
+        order = matched[np.lexsort((np.abs(diff_usec[matched]), index[matched]))]
+        first = np.ones(len(order), dtype=bool)
+        first[1:] = index[order][1:] != index[order][:-1]
+        index[order[~first]] = -1
+        return index
+
+    def device_stats(self):
+        """Per device: acquisitions, trigger rate (Hz, from device timestamps) & missed triggers."""
+        rows = []
+        n_triggers = len(self.ref_times_usec)
+        for worker, trigger_index in zip(self.workers, self.trigger_index):
+            times = worker.times_usec()
+            rate = (len(times) - 1) / (1e-6 * (times[-1] - times[0])) if len(times) > 1 and times[-1] > times[0] else ad2.NAN
+            rows.append({'device': worker.device['index'],
+                         'name': worker.device['name'],
+                         'serial': worker.device['serial'],
+                         'n_acquired': worker.n_acquired,
+                         'trigger_rate_hz': rate,
+                         'missed_triggers': n_triggers - len(np.unique(trigger_index[trigger_index >= 0])),
+                         'unmatched': int(np.count_nonzero(trigger_index < 0)),
+                         'timed_out': worker.timed_out,
+                         'error': worker.error or '',
+                         })
+        return rows
+
+    def save(self, fname_prefix):
+        """Write the merged session (see module docstring). Returns the data file path."""
+        import pandas as pd
+
+        config = self.config
+        n_triggers = len(self.ref_times_usec)
+        channel_data = []
+        v_ranges = []
+        v_offsets = []
+        triggers = {'trigger': np.arange(n_triggers)}
+        for worker, trigger_index in zip(self.workers, self.trigger_index):
+            valid = trigger_index >= 0
+            for ch in range(2):
+                merged = np.zeros((n_triggers, config.samples_per_acq), dtype=np.int16)
+                merged[trigger_index[valid]] = worker.acquisitions(ch)[valid]
+                channel_data.append(merged.reshape(-1))
+            v_ranges += worker.v_ranges
+            v_offsets += worker.v_offsets
+
+            acq_index = np.full(n_triggers, -1)
+            acq_index[trigger_index[valid]] = np.flatnonzero(valid)
+            dev_times = np.full(n_triggers, -1, dtype=np.int64)
+            dev_times[trigger_index[valid]] = worker.times_usec()[valid]
+            triggers['dev%d_acq' % worker.device['index']] = acq_index
+            triggers['dev%d_time_usec' % worker.device['index']] = dev_times
+
+        data_filename = fname_prefix + '_data.bin'
+        ad2.write_int16_bin(data_filename, channel_data, config.sample_rate, config.samples_per_acq, v_ranges, v_offsets)
+        pd.DataFrame(triggers).to_csv(fname_prefix + '_triggers.csv', index=False)
+        pd.DataFrame(self.device_stats()).to_csv(fname_prefix + '_devices.csv', index=False)
+        settings = config.as_dict()
+        settings.update({'INPUT_SAMPLE_RATE': config.sample_rate,
+                         'INPUT_SAMPLE_SIZE': config.samples_per_acq,
+                         'WAVEGEN_WAIT_TIME': config.pulse_wait,
+                         'n_devices': len(self.workers),
+                         })
+        pd.DataFrame([settings]).to_csv(fname_prefix + '_settings.csv', index=False)
+        return data_filename
+
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Analog Discovery 2 - triggered acquisition on several devices')
+    parser.add_argument('-f', '--folder', required=True, help='directory to save files')
+    parser.add_argument('-d', '--desc', default='untitled', help='short description for filename (no underscores)')
+    parser.add_argument('-n', '--n-acquisitions', type=int, default=ad2.ACQ_N_ACQUISITIONS, help='acquisitions per device')
+    parser.add_argument('--devices', default=None, help='device indexes to use, ie. 0,1 (default: all)')
+    parser.add_argument('--trigger', choices=['ch1', 'external'], default='ch1', help='trigger source of every device')
+    parser.add_argument('--pulse-device', type=int, default=0, help='device that generates the pulses (-1: none)')
+    args = parser.parse_args()
+
+    if '_' in args.desc:
+        print("ERROR - File Description cannot contain underscores '_' - Quitting.\n")
+        sys.exit(1)
+
+    config = ad2.AcquisitionConfig(n_acquisitions=args.n_acquisitions,
+                                   trigger_source=args.trigger,
+                                   pulse_device=args.pulse_device if args.pulse_device >= 0 else None,
+                                   )
+    device_indexes = [int(i) for i in args.devices.split(',')] if args.devices else None
+
+    dwf = ad2.load_dwf()
+    dwf.FDwfParamSet(DwfParamOnClose, c_int(0))
+    acquisition = MultiDeviceAcquisition(dwf, config, device_indexes)
+    for device in acquisition.devices:
+        print('Device %d: %s %s' % (device['index'], device['name'], device['serial']))
+
+    fname_prefix = os.path.join(args.folder, '%s_%s' % (datetime.datetime.now().strftime("%Y%m%d-%H%M%S"), args.desc))
+    t0 = time.perf_counter()
+    acquisition.run()
+    elapsed = time.perf_counter() - t0
+    if not any(worker.n_acquired for worker in acquisition.workers):
+        print('No acquisitions - nothing saved.')
+        sys.exit(1)
+
+    acquisition.merge()
+    data_filename = acquisition.save(fname_prefix)
+
+    print('\n%d devices, %d channels, %d triggers in %.2f s' % (len(acquisition.workers), 2 * len(acquisition.workers),
+                                                               len(acquisition.ref_times_usec), elapsed))
+    for row in acquisition.device_stats():
+        print('Device %d (%s): %d acquisitions, %.2f Hz trigger rate, %d missed, %d unmatched%s'
+              % (row['device'], row['serial'], row['n_acquired'], row['trigger_rate_hz'], row['missed_triggers'],
+                 row['unmatched'], ', TIMED OUT' if row['timed_out'] else ''))
+    print('Saved: %s' % data_filename)
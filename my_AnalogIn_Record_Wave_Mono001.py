@@ -23,16 +23,15 @@ import datetime
 import os
 import array
 
-if sys.platform.startswith("win"):
-    dwf = cdll.dwf
-elif sys.platform.startswith("darwin"):
-    dwf = cdll.LoadLibrary("/Library/Frameworks/dwf.framework/dwf")
-else:
-    dwf = cdll.LoadLibrary("libdwf.so")
+import ad2_tools as ad2
+
+dwf = ad2.load_dwf()    # AD2_BACKEND=sim to run without hardware
 
 
 # Set output frequency, relative sampling frequency, and recording time:
-# TODO sampling_factor > 8 seems to cause index error (rollover due to int16 type?) @ 200usec
+# DONE sampling_factor > 8 seems to cause index error (rollover due to int16 type?) @ 200usec
+#   - was a negative sample count: lost samples pushed cSamples past nSamples before the clamp
+#     (fixed in ad2.RecordEngine, which also logs where every lost/corrupted span is)
 output_freq = 1e6       # Hz
 sampling_factor = 8     # mulitplier for sampling rate (eg. 2 for Nyquist)
 sampling_time = 2    # time to record (seconds) - seems to work up to at least 10 sec. 
@@ -105,12 +104,6 @@ hzSignal = c_double(output_freq)
 hzAcq = c_double(output_freq * sampling_factor)
 nSamples = int(output_freq * sampling_factor * sampling_time) # avoiding ctypes math here
 
-cAvailable = c_int()
-cLost = c_int()
-cCorrupted = c_int()
-fLost = 0
-fCorrupted = 0
-
 #print(DWF version
 version = create_string_buffer(16)
 dwf.FDwfGetVersion(version)
@@ -154,99 +147,37 @@ dwf.FDwfAnalogOutConfigure(hdwf, c_int(0), c_bool(True))
 dwf.FDwfAnalogInChannelEnableSet(hdwf, c_int(0), c_bool(True))
 dwf.FDwfAnalogInChannelRangeSet(hdwf, c_int(0), c_double(2.0*vAmplitude.value))
 dwf.FDwfAnalogInChannelOffsetSet(hdwf, c_int(0), vOffset)
-dwf.FDwfAnalogInAcquisitionModeSet(hdwf, acqmodeRecord)
-dwf.FDwfAnalogInFrequencySet(hdwf, hzAcq)
-dwf.FDwfAnalogInRecordLengthSet(hdwf, c_double(-1)) # -1 infinite record length
+# record mode, sample rate & record length are set by ad2.RecordEngine.run()
 
 #wait at least 2 seconds for the offset to stabilize
 print("2 sec Delay for warmup...")
 time.sleep(2)
 
-print("Starting oscilloscope")
-dwf.FDwfAnalogInConfigure(hdwf, c_int(0), c_int(1))
-
-cSamples = 0
-
-print("Generating "+str(hzSignal.value)+"Hz, recording "+str(hzAcq.value)+"Hz for "+str(nSamples/hzAcq.value)+"s, press Ctrl+C to stop...");
 #get the proper file name
-
-#open WAV file
 starttime = datetime.datetime.now();
 startfilename = "%s-%.2eMhz%dx%.2esec" % (starttime.strftime("%Y%m%d-%H%M%S"), output_freq, sampling_factor, sampling_time)
 startfilename = startfilename.replace('.', 'p') # replace decimals with 'p' character
+eventsfilename = startfilename + "_events.csv"  # positions of lost/corrupted samples
 startfilename = startfilename + ".wav"
 
 #startfilename = "AD2_" + "{:04d}".format(starttime.year) + "{:02d}".format(starttime.month) + "{:02d}".format(starttime.day) + "_" + "{:02d}".format(starttime.hour) + "{:02d}".format(starttime.minute) + "{:02d}".format(starttime.second) + ".wav";
 print("Writing WAV file '" + startfilename + "'");
-waveWrite = wave.open(startfilename, "wb");
-waveWrite.setnchannels(1);				# 1 channels 
-waveWrite.setsampwidth(2);				# 16 bit / sample
-waveWrite.setframerate(hzAcq.value);
-waveWrite.setcomptype("NONE","No compression");
 
+print("Starting oscilloscope")
+print("Generating "+str(hzSignal.value)+"Hz, recording "+str(hzAcq.value)+"Hz for "+str(nSamples/hzAcq.value)+"s, press Ctrl+C to stop...");
 
 # time the actual loop
 loop_timer = datetime.datetime.now()
 
-try:
-    loop_count = 0
-    while cSamples < nSamples:
-        dwf.FDwfAnalogInStatus(hdwf, c_int(1), byref(sts))
-        if cSamples == 0 and (sts == DwfStateConfig or sts == DwfStatePrefill or sts == DwfStateArmed) :
-            # Acquisition not yet started.
-            # TODO maybe could make this a separate loop to avoid 'if' statement in main loop...
-            continue
-
-        dwf.FDwfAnalogInStatusRecord(hdwf, byref(cAvailable), byref(cLost), byref(cCorrupted))
-        
-        cSamples += cLost.value
-
-
-
-        # trying to avoid 'if' branches - addition should be a little faster in tight loop. 
-        fLost += cLost.value
-        fCorrupted += cCorrupted.value
-
-        #if cLost.value :
-        #    fLost = 1
-        #if cCorrupted.value :
-        #    fCorrupted = 1
-
-
-
-
-        if cAvailable.value==0 :        # TODO maybe change this to <= 0? (that won't fix the negative index but might prevent crash?)
-            continue
-
-        if cSamples+cAvailable.value > nSamples :
-            cAvailable = c_int(nSamples-cSamples)
-
-        # TODO delete all print statements (loop timing!)
-        #print("Loop count: %d" % loop_count)
-        #print('cLost.value: ', cLost.value)
-        #print('cCorrupted.value: ', cCorrupted.value)
-        #
-        #print('type(cAvail): ', type(cAvailable))
-        #print('type(cAvail.value): ', type(cAvailable.value))
-        #print('cAvail: ', cAvailable.value)
-        
-        rgSamples = (c_int16*cAvailable.value)()    # TODO this becomes negative w/ sample rate > 8MHz - maybe overflowing int16 max value?
-
-
-        dwf.FDwfAnalogInStatusData16(hdwf, c_int(0), rgSamples, c_int(0), cAvailable) # get channel 1 data chunk
-        cSamples += cAvailable.value
-        waveWrite.writeframes(rgSamples)
-
-        loop_count = loop_count + 1
-        
-except KeyboardInterrupt:
-    pass	
+# Record loop: preallocated chunk ring + background WAV writer thread (see ad2_tools.RecordEngine)
+recorder = ad2.RecordEngine(dwf, hdwf, channels=[0], filepath=startfilename)
+recorder.run(sample_rate=hzAcq.value, duration=sampling_time)
 
 # time the actual loop
 loop_timer = datetime.datetime.now() - loop_timer
 
 print('\n')
-print("Loop count: %d" % loop_count)
+print("Loop count: %d" % recorder.n_reads)
 print("Loop time : %s" % str(loop_timer))
 print('\n')
 
@@ -257,18 +188,10 @@ dwf.FDwfDeviceCloseAll()
 
 print(" done")
 
-
-# percentage lost/corrupted:
-lost_pct = 100. * (float(fLost) / nSamples)
-corrupted_pct = 100. * (float(fCorrupted) / nSamples)
-
-
-if fLost:
-    print("%d Samples were lost! Reduce frequency (%.2f%%)" % (fLost, lost_pct))
-if fCorrupted:
-    print("%d Samples could be corrupted! Reduce frequency (%.2f%%)" % (fCorrupted, corrupted_pct))
-
-waveWrite.close();
+recorder.print_stats()
+if recorder.events:
+    print("Lost/corrupted sample positions: '%s'" % eventsfilename)
+    recorder.save_events(eventsfilename)
 
 #endfilename = "AD2_" + "{:04d}".format(starttime.year) + "{:02d}".format(starttime.month) + "{:02d}".format(starttime.day) + "_" + "{:02d}".format(starttime.hour) + "{:02d}".format(starttime.minute) + "{:02d}".format(starttime.second) + "-" + "{:02d}".format(endtime.hour) + "{:02d}".format(endtime.minute) + "{:02d}".format(endtime.second) + ".wav";
 #print("Renaming file from '" + startfilename + "' to '" + endfilename + "'");
@@ -60,7 +60,8 @@
 #       - FDwfAnalogInTriggerFilterInfo 
 #       - for narrow pulses: FDwfAnalogInTriggerLengthConditionInfo
 
-# TODO - could reshape to M-mode here... since we are capturing exact echo time windows here
+# DONE - could reshape to M-mode here... since we are capturing exact echo time windows here
+#       - ad2.reshape_to_M_mode() is a zero-copy view; ad2.MModeBuilder builds one column per acquisition
 #       and then arbitrarily displaying as A-mode (which is inaccurate anyway - see NOTES above)
 #       so we could just as easily convert/save as M-mode instead...
 #       May be more efficient to store as 16-bit files, (what about WAV files???) 
@@ -90,6 +91,7 @@ from dwfconstants import *
 
 import matplotlib.pyplot as plt
 import numpy as np
+import itertools
 import datetime
 import time
 import csv
@@ -98,6 +100,8 @@ import os
 import argparse
 
 import ad2_tools as ad2       # my library
+import waveforms
+import live_viewer
 
 
 
@@ -141,12 +145,29 @@ parser = argparse.ArgumentParser(description='Analog Discovery 2, 16-bit 2-ch  U
 parser.add_argument('-f', '--folder', required=True, help='directory to save files')
 parser.add_argument('-d', '--desc',   default='untitled', help='short description for filename')
 parser.add_argument('-p', '--pulseinfo', type=bool, default=False, help='append pulse info to filename')
+parser.add_argument('-s', '--stream', action='store_true', help='stream acquisitions to disk while acquiring (bounded memory; Ctrl+C to stop)')
+parser.add_argument('-n', '--n-acquisitions', type=int, default=None, help='number of acquisitions (default WAVEGEN_N_ACQUISITIONS); 0 = until Ctrl+C (needs -s)')
+parser.add_argument('--live', action='store_true', help='live A-mode/M-mode viewer in a separate process (see live_viewer.py)')
+parser.add_argument('--average', type=int, default=0, metavar='N', help='coherent average of the last N acquisitions while acquiring (see ad2.CoherentAverager)')
+parser.add_argument('--average-mode', choices=['window', 'ema'], default='window', help='averaging: exact mean of the last N, or exponential moving average')
+parser.add_argument('--save-averages', action='store_true', help='save only the averages (1 per N acquisitions) instead of every acquisition')
+parser.add_argument('--plan', type=float, default=None, metavar='DEPTH_MM', help='pick device config, sample rate, buffer size & trigger position for echoes down to DEPTH_MM at the current TR (see ad2.plan_acquisition)')
+parser.add_argument('--timing', default=None, help='bench_acquisition_loop.py trigger timing file (.npz) for the planner; default: measure on the device')
+parser.add_argument('--force', action='store_true', help='acquire even if the settings cannot service every trigger')
+parser.add_argument('--wait', choices=['spin', 'yield', 'predict'], default='spin', help='trigger wait: busy-wait, spin then yield the CPU, or sleep until just before the next expected trigger (see ad2.WAIT_STRATEGIES)')
 # TODO pulse args? ie. to modify pulse? maybe just a select few ie. voltage...
 
 args = parser.parse_args()
 folderPath = args.folder
 description = args.desc
 append_pulse_info = args.pulseinfo  # TODO not yet implemented
+STREAM_MODE = args.stream
+LIVE_MODE = args.live
+AVERAGE_N = args.average
+AVERAGE_MODE = args.average_mode
+AVERAGING = AVERAGE_N > 0
+SAVE_AVERAGES = AVERAGING and args.save_averages
+PLAN_DEPTH_MM = args.plan
 
 
 # Check User Input:
@@ -154,11 +175,41 @@ if not check_description(description):
     print('ERROR - INVALID FILENAME - Quitting.\n')
     sys.exit(1)
 
+if args.save_averages and not AVERAGING:
+    print('ERROR - --save-averages needs --average N - Quitting.\n')
+    sys.exit(1)
+
+if args.n_acquisitions is not None and (args.n_acquisitions < 0 or (args.n_acquisitions == 0 and not STREAM_MODE)):
+    print('ERROR - -n must be > 0 (0 = until Ctrl+C needs -s) - Quitting.\n')
+    sys.exit(1)
+
+if PLAN_DEPTH_MM is not None and not PLAN_DEPTH_MM > 0:
+    print('ERROR - --plan DEPTH_MM must be > 0 - Quitting.\n')
+    sys.exit(1)
+
+
+# Data file format:
+#   'bin' = fixed header + raw int16 blocks (fast, small; load with ad2.load_int16_bin())
+#   'csv' = legacy 1 row per sample (Index, Time, ch1_int16, ch2_int16); very slow for long sessions
+DATA_FILE_FORMAT = 'bin'
+
+# Streaming mode (-s): acquisitions go into a ring of STREAM_RING_SLOTS slots & are written
+# to disk by a background thread while acquiring, instead of 1 big buffer saved at the end.
+# Memory is bounded by the ring size, so WAVEGEN_N_ACQUISITIONS can be very large.
+STREAM_RING_SLOTS = 64
+STREAM_PLOT_N_ACQUISITIONS = 10     # number of acquisitions to load back for post-processing/plots
+
+if STREAM_MODE:
+    DATA_FILE_FORMAT = 'bin'    # streaming only supports binary files
+
 
 currentTime = datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
 
 fname_prefix = '%s_%s' % (currentTime, description)
-data_filename =   os.path.join(folderPath, (fname_prefix + '_data.csv'))    # actual acquisition data
+if DATA_FILE_FORMAT == 'bin':
+    data_filename = os.path.join(folderPath, (fname_prefix + '_data.bin'))  # actual acquisition data (binary int16, see ad2.write_int16_bin())
+else:
+    data_filename = os.path.join(folderPath, (fname_prefix + '_data.csv'))  # actual acquisition data (legacy CSV)
 vconv_filename = os.path.join(folderPath, (fname_prefix + '_vconv.csv'))    # voltage conversion settings
 settings_filename =  os.path.join(folderPath, (fname_prefix + '_settings.csv')) # all other settings
 # TODO filename for pulse/scope settings
@@ -172,8 +223,33 @@ print(data_filename)
 
 
 def saveData(myWave1, myWave2):
+    """Save both channels of raw int16 data to a binary session file.
+
+        myWave1,2 = ctypes c_int16 arrays, all acquisitions back to back (ch1, ch2)
+
+        Each channel is written in 1 bulk call along with a fixed header
+        (sample rate, buffer size, # of acquisitions, exact scope range/offset per channel).
+        See ad2.write_int16_bin() and ad2.load_int16_bin().
+    """
+    # TODO remove globals; make them input args
+
+    print('Saving Data to: %s' % data_filename)
+
+    ad2.write_int16_bin(data_filename,
+                        [myWave1, myWave2],
+                        INPUT_SAMPLE_RATE,
+                        INPUT_SAMPLE_SIZE,
+                        [scope_params.ch1_v_range, scope_params.ch2_v_range],
+                        [scope_params.ch1_v_offset, scope_params.ch2_v_offset],
+                        )
+    print('file written at ' + data_filename)
+
+
+def saveDataCSV(myWave1, myWave2):
     """ from custom1MHzWave_record_twochannel_16bit.py
 
+        Legacy CSV version of saveData() (1 row per sample - very slow for long sessions!)
+
         myWave1,2 = waveform data (TODO more specifics...)
 
 
@@ -233,8 +309,15 @@ WAVEGEN_PULSE_TYPE = 'SINE_N_CYCLES'
 # This is for a single positive-going rectangular pulse, that is repeated every 'wait time'
 # (some params are shared with sinewave N cycles)
 WAVEGEN_N_ACQUISITIONS = 10        # number of pulse/echo repetitions to acquire
+if args.n_acquisitions is not None:
+    WAVEGEN_N_ACQUISITIONS = args.n_acquisitions    # -n; 0 = until Ctrl+C (streaming mode only)
+# (with the other argument checks; needs the number of acquisitions)
+if SAVE_AVERAGES and 0 < WAVEGEN_N_ACQUISITIONS < AVERAGE_N:
+    print('ERROR - --save-averages with --average %d needs at least %d acquisitions (have %d) - Quitting.\n'
+          % (AVERAGE_N, AVERAGE_N, WAVEGEN_N_ACQUISITIONS))
+    sys.exit(1)
 WAVEGEN_WAIT_TIME = 0.02            # seconds between acquisiztions (== TR period, also serves as trigger/acquisition interval)
-# TODO NOTE - change wait time to 20ms to account for 16k buffer - make this adjust automatically/make warning work!
+# NOTE - the settings are checked against this TR before arming (ad2.check_acquisition); --plan DEPTH_MM picks them from the echo depth
 WAVEGEN_PULSE_WIDTH = 0.5e-6          # pulse width in seconds (???) TODO CHECK THIS (confirm w/ scope)
 #WAVEGEN_PULSE_WIDTH = 1e-6          # pulse width in seconds
 # TODO should pulse width be 1/2 usec?
@@ -280,6 +363,68 @@ SCOPE_VOLT_OFFSET_CH1 = 0.      # oscilloscope ch1 offset (volts)  # TODO not ye
 SCOPE_VOLT_RANGE_CH2 = 5.0      # ch2 - volts
 SCOPE_VOLT_OFFSET_CH2 = 0.      # ch2 - volts   # TODO not yet implemented
 
+DEVICE_CONFIG = 1               # FDwfDeviceConfigOpen memory config: 1 = 16k scope samples
+
+
+# setup hardware device:
+dwf = ad2.load_dwf()
+hdwf = c_int()
+
+version = create_string_buffer(16)
+dwf.FDwfGetVersion(version)
+print("DWF Version: "+str(version.value))
+
+dwf.FDwfParamSet(DwfParamOnClose, c_int(0)) # 0 = run, 1 = stop, 2 = shutdown
+
+#open device
+print("Opening first device...")
+#dwf.FDwfDeviceOpen(c_int(-1), byref(hdwf)) # default settings
+dwf.FDwfDeviceConfigOpen(c_int(-1),c_int(DEVICE_CONFIG),byref(hdwf))    # memory config #2 - 16k samples
+
+# TODO set config for memory (see AnalogIn_Trigger.py)
+# TODO try FDwfDeviceConfigOpen
+
+
+# TODO print buffer sizes!
+
+if hdwf.value == hdwfNone.value:
+    szError = create_string_buffer(512)
+    dwf.FDwfGetLastErrorMsg(szError);
+    print("failed to open device\n"+str(szError.value))
+    quit()
+
+scope_params = ad2.ScopeParams(dwf, hdwf)
+
+# transfer rate for the planner & the pre-arm check (both use the same model)
+if args.timing is None:
+    print('Measuring USB transfer rate...')
+    transfer_model = ad2.measure_transfer(dwf, hdwf, n_channels=2, sample_rate=INPUT_SAMPLE_RATE,
+                                          n_samples=None if PLAN_DEPTH_MM is not None else INPUT_SAMPLE_SIZE)
+else:
+    transfer_model = ad2.TransferModel.from_loop_timing(args.timing)
+print(transfer_model)
+
+
+
+# --plan: settings from the echo depth & TR instead of the values above
+# (checked again before arming)
+if PLAN_DEPTH_MM is not None:
+    acq_plan = ad2.plan_acquisition(PLAN_DEPTH_MM, WAVEGEN_WAIT_TIME, ad2.list_device_configs(dwf),
+                                    n_channels=2, transfer=transfer_model)
+    acq_plan.print_summary()
+    if acq_plan.config_index != DEVICE_CONFIG:
+        # the USB transfer rate doesn't depend on the memory config; keep the measured model
+        print('Re-opening device with memory config %d...' % acq_plan.config_index)
+        dwf.FDwfDeviceClose(hdwf)
+        dwf.FDwfDeviceConfigOpen(c_int(-1), c_int(acq_plan.config_index), byref(hdwf))
+        if hdwf.value == hdwfNone.value:
+            print("failed to open device\n" + ad2.get_error(dwf))
+            quit()
+    DEVICE_CONFIG = acq_plan.config_index
+    INPUT_SAMPLE_RATE = acq_plan.sample_rate
+    INPUT_SAMPLE_SIZE = acq_plan.samples_per_acq
+    INPUT_TRIGGER_POSITION_INDEX = acq_plan.trigger_position_index
+
 # TODO adjust voltage range for smaller echos? (ie. trigger-only channel can be 5V, but is scope more sensitive for echos if we use lower range? Or is this only for post-processing reconstruction of the voltage values?) 
 # ie. does this have any bearing on the int16 values or not???
 
@@ -304,12 +449,17 @@ scope_status = c_byte()  # scope channel 1 status
 
 
 
+# number of acquisitions kept (--save-averages: 1 averaged acquisition per AVERAGE_N acquired)
+N_SAVED_ACQUISITIONS = WAVEGEN_N_ACQUISITIONS // AVERAGE_N if SAVE_AVERAGES else WAVEGEN_N_ACQUISITIONS
+
 # number of samples for all repetitions (for 1 channel):
-big_output_len = int(int(INPUT_SAMPLE_SIZE) * int(WAVEGEN_N_ACQUISITIONS))
+big_output_len = int(int(INPUT_SAMPLE_SIZE) * int(N_SAVED_ACQUISITIONS))
 
 # NOTE - we are recording int16 type samples; needs to be converted to voltage/double type in post-processing.
-acquisition_data_ch1 = (c_int16 * big_output_len)()    # channel 1 main acquisition buffer (over full recording time)
-acquisition_data_ch2 = (c_int16 * big_output_len)()    # channel 2 main acquisition buffer (over full recording time)
+if not STREAM_MODE:
+    acquisition_data_ch1 = (c_int16 * big_output_len)()    # channel 1 main acquisition buffer (over full recording time)
+    acquisition_data_ch2 = (c_int16 * big_output_len)()    # channel 2 main acquisition buffer (over full recording time)
+# (streaming mode uses ad2.StreamingSessionWriter ring slots instead; see below)
 
 # troubleshooting: record double-formatted data too to check voltage computation:
 #double_data_ch1 = (c_double * big_output_len)()    # channel 1
@@ -330,38 +480,11 @@ if INPUT_SAMPLE_RATE > 100e6:
 
 
 
-print('Acquiring %d periods over %.2f seconds...' %  (WAVEGEN_N_ACQUISITIONS, total_record_time))
-
-
-# setup hardware device:
-dwf = ad2.load_dwf()
-hdwf = c_int()
-
-
-version = create_string_buffer(16)
-dwf.FDwfGetVersion(version)
-print("DWF Version: "+str(version.value))
-
-dwf.FDwfParamSet(DwfParamOnClose, c_int(0)) # 0 = run, 1 = stop, 2 = shutdown
-
-#open device
-print("Opening first device...")
-#dwf.FDwfDeviceOpen(c_int(-1), byref(hdwf)) # default settings
-dwf.FDwfDeviceConfigOpen(c_int(-1),c_int(1),byref(hdwf))    # memory config #2 - 16k samples
-
-# TODO set config for memory (see AnalogIn_Trigger.py)
-# TODO try FDwfDeviceConfigOpen
-
-
-# TODO print buffer sizes!
-
-if hdwf.value == hdwfNone.value:
-    szError = create_string_buffer(512)
-    dwf.FDwfGetLastErrorMsg(szError);
-    print("failed to open device\n"+str(szError.value))
-    quit()
+if WAVEGEN_N_ACQUISITIONS > 0:
+    print('Acquiring %d periods over %.2f seconds...' %  (WAVEGEN_N_ACQUISITIONS, total_record_time))
+else:
+    print('Acquiring until Ctrl+C...')
 
-scope_params = ad2.ScopeParams(dwf, hdwf)
 
 print('Testing error function: ' + ad2.get_error(dwf) + '\n')
 
@@ -417,6 +540,11 @@ def save_ad2_settings(filepath):
         # computed params:
         'INPUT_SAMPLE_SIZE',
         'INPUT_SAMPLE_PERIOD',
+        # averaging (saved data is averages if SAVE_AVERAGES):
+        'AVERAGE_N',
+        'AVERAGE_MODE',
+        'SAVE_AVERAGES',
+        'DEVICE_CONFIG',
         ])
 
     csv_data = ','.join([ str(val) for val in [
@@ -440,6 +568,11 @@ def save_ad2_settings(filepath):
         # computed params:
         INPUT_SAMPLE_SIZE,
         INPUT_SAMPLE_PERIOD,
+        # averaging:
+        AVERAGE_N,
+        AVERAGE_MODE,
+        SAVE_AVERAGES,
+        DEVICE_CONFIG,
         ]])
 
     with open(filepath, 'w') as f:
@@ -465,7 +598,7 @@ def setpulse_single_square_pulse(dwf, hdwf, channel, width, wait, n_acq, amplitu
         channel = which waveform generator channel to set (0 or 1, python-int)
         width = pulse width (seconds)
         wait  = wait/delay time (aka. TR; seconds)
-        n_acq = number of acquisition cycles (int)
+        n_acq = number of acquisition cycles (int; 0 = repeat until stopped)
         amplitude = pulse amplitude (volts, 0-5)
         v_offset = voltage offset (volts, optional)
 
@@ -497,36 +630,27 @@ def setpulse_sine_n_cycles(dwf, hdwf, channel, n_cycles, amplitude, v_offset=0,
     waveBufferLen = 1024 
     waveFreq = 1e6
     wavePeriod = 1.0/waveFreq
-    waveformSamples = (c_double*waveBufferLen)()
 
     pulseWidth = c_double(n_cycles * wavePeriod) # convert n_cycles to time window (seconds)
 
-    # create buffer samples for one period of sine wave
-    timespots = np.linspace(0,wavePeriod,num=waveBufferLen)
-    index = 0
-    for t in timespots:
-        waveformSamples[index] = np.sin(t*2*np.pi*waveFreq)
-        index = index+1
-        # TODO this can be a numpy oneliner but may be tricky casting back to ctypes array...
+    # buffer samples for one period of sine wave (vectorized & cached; see waveforms.py)
+    # endpoint=True: same samples as the original per-sample np.sin() loop
+    waveformSamples = waveforms.sine_period(waveBufferLen, endpoint=True)
 
     # **** PLOT TO DOUBLE CHECK IF THE TIME FORM IS CORRECT ****
     if plot:
+        timespots = np.linspace(0,wavePeriod,num=waveBufferLen)
         plt.plot(timespots,waveformSamples,marker='.')
         plt.title('wavesamples at ' + str(waveFreq))
         plt.show()
     print("Generating custom waveform...")
     
-    # settings for output
-    # TODO change to 'channel' var:
-    dwf.FDwfAnalogOutNodeEnableSet(hdwf, c_int(0), AnalogOutNodeCarrier, c_bool(True))
-    dwf.FDwfAnalogOutNodeFunctionSet(hdwf, c_int(0), AnalogOutNodeCarrier, funcCustom)
-    dwf.FDwfAnalogOutNodeDataSet(hdwf, c_int(0), AnalogOutNodeCarrier, waveformSamples, c_int(waveBufferLen))
-    # set 
-    dwf.FDwfAnalogOutNodeFrequencySet(hdwf, c_int(0), AnalogOutNodeCarrier, c_double(waveFreq))
-    dwf.FDwfAnalogOutNodeAmplitudeSet(hdwf, c_int(0), AnalogOutNodeCarrier, c_double(amplitude))
+    # settings for output (passes the array memory directly to FDwfAnalogOutNodeDataSet)
+    waveforms.set_custom_waveform(dwf, hdwf, channel.value, waveformSamples, waveFreq, amplitude, v_offset)
     
     # 40000 times to repeat is to be able to have it run for at least a few seconds
-    timesToRepeat = c_int(40000)  # no unit
+    # (at least 1 pulse per acquisition; 0 = repeat until stopped, for -n 0)
+    timesToRepeat = c_int(max(40000, WAVEGEN_N_ACQUISITIONS + 1) if WAVEGEN_N_ACQUISITIONS > 0 else 0)  # no unit
     #pulseWidth = c_double(10e-6)  # in seconds  # TODO does this control # of cycles???
 
     #pulseWait = c_double(900e-6)  # in seconds [ORIGINAL]
@@ -642,6 +766,18 @@ dwf.FDwfAnalogInTriggerPositionSet(hdwf, c_double(INPUT_TRIGGER_POSITION_TIME))
 
 print('\n')
 
+# check the settings before arming (replaces the warning after the run):
+acq_check = ad2.check_acquisition(INPUT_SAMPLE_RATE, INPUT_SAMPLE_SIZE, WAVEGEN_WAIT_TIME, n_channels=2,
+                                  trigger_position_index=INPUT_TRIGGER_POSITION_INDEX, transfer=transfer_model,
+                                  config=ad2.list_device_configs(dwf)[DEVICE_CONFIG])
+acq_check.depth_mm = PLAN_DEPTH_MM
+acq_check.validate(dwf, hdwf)
+acq_check.print_summary()
+if not acq_check.ok and not args.force:
+    print('ERROR - settings cannot service every trigger (use --plan DEPTH_MM, a longer WAVEGEN_WAIT_TIME, or --force) - Quitting.\n')
+    dwf.FDwfDeviceClose(hdwf)
+    sys.exit(1)
+
 # TODO does this start the actualy thing 
 print("Starting repeated acquisitions")
 dwf.FDwfAnalogInConfigure(hdwf, c_bool(False), c_bool(True))    # This starts the actual acquisition
@@ -660,10 +796,6 @@ dwf.FDwfAnalogOutConfigure(hdwf, c_int(WAVEGEN_CHANNEL), c_bool(True))     # thi
 
 
 
-# using same index for both ch1/ch2 to keep in sync.
-acquisition_data_index = 0  # pointer into acquisition_data_ch1 to write full (single) acquisition blocks
-acquisition_data_stride = INPUT_SAMPLE_SIZE * sizeof(c_int16)
-
 # for troubleshooting:
 double_ptr = 0 # 
 double_stride = INPUT_SAMPLE_SIZE * sizeof(c_double)
@@ -671,8 +803,22 @@ double_stride = INPUT_SAMPLE_SIZE * sizeof(c_double)
 
 # TODO loop optimization (test with profiling!)
 # TODO - look into Python JIT compiling - maybe some of these aren't necessary if the compiler will do them automatically:
-# - TODO remove all unnecessary function calls (eg. c_int() on constants)
-# - TODO pre-compute any constant math values 
+# - DONE remove all unnecessary function calls (eg. c_int() on constants)
+# - DONE pre-compute any constant math values 
+#   - SDK functions are pre-resolved (ad2.FastDwf) & all args/pointers are built before the loop,
+#     so the loop only makes the SDK calls (see bench_fast_calls.py for before/after numbers)
+
+fast_dwf = ad2.FastDwf(dwf, hdwf, INPUT_SAMPLE_SIZE)
+analog_in_status = fast_dwf.status
+analog_in_status_data16 = fast_dwf.status_data16
+READ_DATA = fast_dwf.read_data      # FDwfAnalogInStatus flag to actually transfer data; NOT a channel #.
+CH1, CH2 = fast_dwf.ch
+ZERO = fast_dwf.zero
+N_SAMPLES = fast_dwf.n_samples
+
+# waits for Done (--wait): FDwfAnalogInStatus polling strategy; records polls & wake-up latency per trigger
+waiter = ad2.make_waiter(args.wait, dwf, hdwf, status=analog_in_status, tr=WAVEGEN_WAIT_TIME)
+wait_for_done = waiter.wait
 
 
 
@@ -681,66 +827,183 @@ double_stride = INPUT_SAMPLE_SIZE * sizeof(c_double)
 # TODO - will the buffer be zero'd on a timeout, or is it possible to have a false second reading of the previous buffer?
 
 
-amplitude = 5.0
-# From AnalogIn_Trigger.py:
-for iTrigger in range(WAVEGEN_N_ACQUISITIONS):  # TODO this should be until big_buffer is filled (or N_acquistions)
+if STREAM_MODE:
+    stream_writer = ad2.StreamingSessionWriter(data_filename,
+                                               2,
+                                               INPUT_SAMPLE_RATE,
+                                               INPUT_SAMPLE_SIZE,
+                                               [scope_params.ch1_v_range, scope_params.ch2_v_range],
+                                               [scope_params.ch1_v_offset, scope_params.ch2_v_offset],
+                                               n_slots=STREAM_RING_SLOTS,
+                                               )
+    print('Streaming to: %s (Ctrl+C to stop early)' % data_filename)
+
+
+# live viewer (--live): the loop copies its latest acquisition into a shared slot at most
+# live_viewer.LIVE_PUBLISH_RATE times/sec (~10 us each); the viewer process never blocks the loop.
+perf_counter = time.perf_counter
+if LIVE_MODE:
+    live = live_viewer.LivePublisher(2,
+                                     INPUT_SAMPLE_SIZE,
+                                     INPUT_SAMPLE_RATE,
+                                     [scope_params.ch1_v_range, scope_params.ch2_v_range],
+                                     [scope_params.ch1_v_offset, scope_params.ch2_v_offset],
+                                     )
+    live.start_viewer()
+    print('Live viewer slot: %s' % live.filepath)
+
+
+# coherent averaging (--average N): running average of the last AVERAGE_N acquisitions,
+# updated as each acquisition lands. With --save-averages the SDK writes straight into the
+# averager's ring & only 1 averaged acquisition per AVERAGE_N is kept/saved (rounded to int16).
+if AVERAGING:
+    averager = ad2.CoherentAverager(2, INPUT_SAMPLE_SIZE, AVERAGE_N, mode=AVERAGE_MODE)
+    average_ptrs = averager.ptrs(averager.n_slots)  # SDK destination of acquisition i: average_ptrs[i % averager.n_slots]
+    print('Averaging the last %d acquisitions (%s)%s' % (AVERAGE_N, AVERAGE_MODE, ', saving averages only' if SAVE_AVERAGES else ''))
+
+
+if not STREAM_MODE:
+    amplitude = 5.0
+    # destination pointer of every acquisition (same offsets for ch1/ch2 to keep in sync):
+    ch1_ptrs = ad2.slot_pointers(acquisition_data_ch1, WAVEGEN_N_ACQUISITIONS, INPUT_SAMPLE_SIZE)
+    ch2_ptrs = ad2.slot_pointers(acquisition_data_ch2, WAVEGEN_N_ACQUISITIONS, INPUT_SAMPLE_SIZE)
+    if SAVE_AVERAGES:
+        ch1_ptrs = [average_ptrs[i % averager.n_slots][0] for i in range(WAVEGEN_N_ACQUISITIONS)]
+        ch2_ptrs = [average_ptrs[i % averager.n_slots][1] for i in range(WAVEGEN_N_ACQUISITIONS)]
+        # saved averages, 1 row per block of AVERAGE_N acquisitions (views of the main buffers)
+        averages_ch1 = np.ctypeslib.as_array(acquisition_data_ch1).reshape(N_SAVED_ACQUISITIONS, INPUT_SAMPLE_SIZE)
+        averages_ch2 = np.ctypeslib.as_array(acquisition_data_ch2).reshape(N_SAVED_ACQUISITIONS, INPUT_SAMPLE_SIZE)
+        average_srcs = [None] * WAVEGEN_N_ACQUISITIONS
+    elif AVERAGING:
+        # acquisitions are copied into the averager from the main buffers
+        acqs_ch1 = np.ctypeslib.as_array(acquisition_data_ch1).reshape(WAVEGEN_N_ACQUISITIONS, INPUT_SAMPLE_SIZE)
+        acqs_ch2 = np.ctypeslib.as_array(acquisition_data_ch2).reshape(WAVEGEN_N_ACQUISITIONS, INPUT_SAMPLE_SIZE)
+        average_srcs = list(zip(acqs_ch1, acqs_ch2))
+
+    # From AnalogIn_Trigger.py:
+    for iTrigger in range(WAVEGEN_N_ACQUISITIONS):  # TODO this should be until big_buffer is filled (or N_acquistions)
+
+        # keep this for debugging (sometimes the trigger fails & the program hangs)
+        #print('start loop %d' % iTrigger)
+        #print('.', end='') # print a dot for every acquisition loop (comment out for faster loop)
+
+
+        # wait for buffer to finish filling for 1 acquisition (polls FDwfAnalogInStatus; see --wait)
+        # new acquisition is started automatically after done state 
+        wait_for_done()
 
-    # keep this for debugging (sometimes the trigger fails & the program hangs)
-    #print('start loop %d' % iTrigger)
-    #print('.', end='') # print a dot for every acquisition loop (comment out for faster loop)
+    
+        # TODO try capturing double-formatted data; see if the voltage values are correct there...
+        # TODO try profiling double voltages; or ask on forum... is int16 capture actually saving any time?
 
+        # save channel 1 data
+        analog_in_status_data16(hdwf, CH1, ch1_ptrs[iTrigger], ZERO, N_SAMPLES)
+        # save channel 2 data
+        analog_in_status_data16(hdwf, CH2, ch2_ptrs[iTrigger], ZERO, N_SAMPLES)
 
-    # busy wait loop for buffer to finish filling for 1 acquisition
-    # new acquisition is started automatically after done state 
-    while True:
-        dwf.FDwfAnalogInStatus(hdwf, c_int(1), byref(scope_status)) # c_int_(1) is a flag to actually transfer data; NOT a channel #.
-        if scope_status.value == DwfStateDone.value:
-            break
-        #time.sleep(0.001) # TODO THIS SHOULD BE MUCH SMALLER O(1-10 microseconds)
-        # TODO add this back in? or leave it? would be intersting to time this loop or count it especially at very high sample rates
+        if LIVE_MODE and perf_counter() >= live.next_publish_time:
+            live.publish([ch1_ptrs[iTrigger], ch2_ptrs[iTrigger]], iTrigger)
+        if AVERAGING and averager.commit(average_srcs[iTrigger]) and SAVE_AVERAGES:
+            averager.average_int16(0, out=averages_ch1[averager.n_blocks - 1])
+            averager.average_int16(1, out=averages_ch2[averager.n_blocks - 1])
+        # TODO could print ch2. status just to see if it's also complete or not... (since we're not actively checking it yet)
 
-    
-    # TODO try capturing double-formatted data; see if the voltage values are correct there...
-    # TODO try profiling double voltages; or ask on forum... is int16 capture actually saving any time?
-
-    # save channel 1 data
-    dwf.FDwfAnalogInStatusData16(hdwf, 
-                                 c_int(0),
-                                 byref(acquisition_data_ch1, acquisition_data_index),
-                                 0,
-                                 INPUT_SAMPLE_SIZE
-                                 )
-    # save channel 2 data
-    dwf.FDwfAnalogInStatusData16(hdwf, 
-                                 c_int(1),
-                                 byref(acquisition_data_ch2, acquisition_data_index),
-                                 0,
-                                 INPUT_SAMPLE_SIZE
-                                 )
-    # TODO could print ch2. status just to see if it's also complete or not... (since we're not actively checking it yet)
+        # troubleshooting (compare SDK voltage values to my computed voltages)
+        #dwf.FDwfAnalogInStatusData(hdwf, c_int(0), byref(double_data_ch1, double_ptr), INPUT_SAMPLE_SIZE)
+        #dwf.FDwfAnalogInStatusData(hdwf, c_int(1), byref(double_data_ch2, double_ptr), INPUT_SAMPLE_SIZE)
+        #double_ptr += double_stride
 
-    # troubleshooting (compare SDK voltage values to my computed voltages)
-    #dwf.FDwfAnalogInStatusData(hdwf, c_int(0), byref(double_data_ch1, double_ptr), INPUT_SAMPLE_SIZE)
-    #dwf.FDwfAnalogInStatusData(hdwf, c_int(1), byref(double_data_ch2, double_ptr), INPUT_SAMPLE_SIZE)
-    #double_ptr += double_stride
 
-    acquisition_data_index += acquisition_data_stride 
+        # try decreasing the voltage each iteration: (does not work!)
+        #amplitude /= 2.0
+        #dwf.FDwfAnalogOutNodeAmplitudeSet(hdwf, c_int(0), AnalogOutNodeCarrier, c_double(amplitude))
 
 
-    # try decreasing the voltage each iteration: (does not work!)
-    #amplitude /= 2.0
-    #dwf.FDwfAnalogOutNodeAmplitudeSet(hdwf, c_int(0), AnalogOutNodeCarrier, c_double(amplitude))
+
+else:
+    # streaming mode: same loop, but each acquisition goes into a free ring slot
+    # & is written to disk by the writer thread. (separate loop to keep 'if's out of the non-streaming loop)
+    # -n 0: until Ctrl+C
+    acquisition_indexes = range(WAVEGEN_N_ACQUISITIONS) if WAVEGEN_N_ACQUISITIONS > 0 else itertools.count()
+    iTrigger = 0
+    try:
+        for iTrigger in acquisition_indexes:
+
+            wait_for_done()
+
+            if SAVE_AVERAGES:
+                # every acquisition goes into the averager; 1 slot per AVERAGE_N is written to disk
+                acq_ptrs = average_ptrs[iTrigger % averager.n_slots]
+                analog_in_status_data16(hdwf, CH1, acq_ptrs[0], ZERO, N_SAMPLES)
+                analog_in_status_data16(hdwf, CH2, acq_ptrs[1], ZERO, N_SAMPLES)
+                if LIVE_MODE and perf_counter() >= live.next_publish_time:
+                    live.publish(acq_ptrs, iTrigger)
+                if averager.commit():
+                    slot = stream_writer.get_slot()
+                    if slot is not None:
+                        averages = stream_writer.slot_array(slot)
+                        averager.average_int16(0, out=averages[0])
+                        averager.average_int16(1, out=averages[1])
+                        stream_writer.commit_slot(slot)
+                continue
+
+            slot = stream_writer.get_slot()
+            if slot is None:
+                continue    # writer fell behind; acquisition dropped (counted by stream_writer)
+
+            analog_in_status_data16(hdwf, CH1, stream_writer.ptr(slot, 0), ZERO, N_SAMPLES)
+            analog_in_status_data16(hdwf, CH2, stream_writer.ptr(slot, 1), ZERO, N_SAMPLES)
+            if LIVE_MODE and perf_counter() >= live.next_publish_time:
+                live.publish([stream_writer.ptr(slot, 0), stream_writer.ptr(slot, 1)], iTrigger)
+            if AVERAGING:
+                averager.commit(stream_writer.slot_array(slot))
+            stream_writer.commit_slot(slot)
+
+    except KeyboardInterrupt:
+        print('Stopped by user.')
+    except OSError as e:
+        print('ERROR - %s - Quitting.\n' % e)
+        try:
+            stream_writer.close()   # header counts what was written
+        except OSError:
+            pass
+        stream_writer.print_stats()
+        dwf.FDwfDeviceCloseAll()
+        sys.exit(1)
+
+    stream_writer.close()
+    stream_writer.print_stats()
 
 
 
 print('Number of loops: %d' % iTrigger)
+waiter.print_summary()
+if AVERAGING:
+    print('Averaged acquisitions: %d (%d blocks of %d)' % (averager.n_added, averager.n_blocks, AVERAGE_N))
+if LIVE_MODE:
+    live.close()    # viewer window stays open
 print('Done...')
 dwf.FDwfAnalogOutConfigure(hdwf, c_int(WAVEGEN_CHANNEL), c_bool(False))
 # TODO close the scope too?
 
 
-print('int16 ch1 min: %d' % min(acquisition_data_ch1))
-print('int16 ch1 max: %d' % max(acquisition_data_ch1))
+if STREAM_MODE:
+    # load back (only) the first few acquisitions for post-processing & plots:
+    # (the full session is already on disk)
+    session = ad2.SessionReader(data_filename)
+    if session.n_acquisitions == 0:
+        print('No acquisitions written - nothing to post-process. (%s is empty)' % data_filename)
+        dwf.FDwfDeviceCloseAll()
+        sys.exit(1)
+    n_plot_acquisitions = min(session.n_acquisitions, STREAM_PLOT_N_ACQUISITIONS)
+    acquisition_data_ch1 = np.ravel(session.channel(0)[:n_plot_acquisitions])
+    acquisition_data_ch2 = np.ravel(session.channel(1)[:n_plot_acquisitions])
+    big_output_len = acquisition_data_ch1.shape[0]
+    BIG_BUFFER_FULL_TIME = big_output_len * INPUT_SINGLE_ACQUISITION_TIME
+    WAVEGEN_N_ACQUISITIONS = n_plot_acquisitions    # for plot titles
+
+print('int16 ch1 min: %d' % np.min(acquisition_data_ch1))
+print('int16 ch1 max: %d' % np.max(acquisition_data_ch1))
 
 
 # TODO are these 2 lines redundant?:
@@ -768,7 +1031,12 @@ voltage_ch2 = ad2.int16signal2voltage(acquisition_data_ch2,
 
 # saving 16bit data: 
 print('Saving raw int16 data...')
-saveData(acquisition_data_ch1, acquisition_data_ch2)
+if STREAM_MODE:
+    pass    # already written while acquiring
+elif DATA_FILE_FORMAT == 'bin':
+    saveData(acquisition_data_ch1, acquisition_data_ch2)
+else:
+    saveDataCSV(acquisition_data_ch1, acquisition_data_ch2)
 
 print('Saving scope params metadata...')
 scope_params.write_vconv_file(vconv_filename)
@@ -854,11 +1122,8 @@ print('\n\n')
 
 
 ### Plotting ###
-# speed of sound values from https://itis.swiss/virtual-population/tissue-properties/database/acoustic-properties/speed-of-sound/
-C_WATER = 1482.3    # m/s
-C_AIR = 343.0       # m/s
-
-C = C_WATER
+# speed of sound (m/s): ad2.C_WATER, ad2.C_AIR, ad2.C_TISSUE
+C = ad2.C_WATER
 
 def time2mm(t):
     """Convert time to millimeters using global C speed of sound.
@@ -894,9 +1159,16 @@ def mm2time(d):
 
 
 
+# min/max level-of-detail pyramids: plots only draw ~4000 points per line at any zoom
+# (raw samples with '.' markers once zoomed in), see ad2.plot_lod()
+lod_ch1 = ad2.MinMaxPyramid.build(voltage_ch1)
+lod_ch2 = ad2.MinMaxPyramid.build(voltage_ch2)
+
 # plot proper voltages against pseudo-time
-plt.plot(pseudotimescale, voltage_ch1, '.-', label='Ch. 1 (V)')
-plt.plot(pseudotimescale, voltage_ch2, '.-', label='Ch. 2 (V)')
+ax = plt.gca()
+lod_lines = [ad2.plot_lod(ax, lod_ch1, INPUT_SAMPLE_PERIOD, label='Ch. 1 (V)'),
+             ad2.plot_lod(ax, lod_ch2, INPUT_SAMPLE_PERIOD, label='Ch. 2 (V)'),
+             ]
 plt.title('%d Acq. @ %.2e Hz Sample Rate (%.2e s window)' % (WAVEGEN_N_ACQUISITIONS, INPUT_SAMPLE_RATE, INPUT_SINGLE_ACQUISITION_TIME))
 plt.xlabel('Seconds (TR delays not shown!)')
 plt.ylabel('Volts')
@@ -909,11 +1181,11 @@ plt.show()
 
 # plot distance and time together (voltage)
 fig, ax = plt.subplots()
-distscale = time2mm(pseudotimescale)
 #ax.plot(pseudotimescale, voltage_ch1, '.-', label='Ch. 1 (V)')
 #ax.plot(pseudotimescale, voltage_ch2, '.-', label='Ch. 2 (V)')
-ax.plot(distscale, voltage_ch1, '.-', label='Ch. 1 (V)')
-ax.plot(distscale, voltage_ch2, '.-', label='Ch. 2 (V)')
+lod_lines = [ad2.plot_lod(ax, lod_ch1, time2mm(INPUT_SAMPLE_PERIOD), label='Ch. 1 (V)'),
+             ad2.plot_lod(ax, lod_ch2, time2mm(INPUT_SAMPLE_PERIOD), label='Ch. 2 (V)'),
+             ]
 ax.legend()
 #plt.title('%d Acq. @ %.2e Hz Sample Rate (%.2e s window)' % (WAVEGEN_N_ACQUISITIONS, INPUT_SAMPLE_RATE, INPUT_SINGLE_ACQUISITION_TIME))
 #plt.title('%s @ SR=%.2e Hz (TR=%.2e s)' % (description, INPUT_SAMPLE_RATE, INPUT_SINGLE_ACQUISITION_TIME))
@@ -936,12 +1208,12 @@ plt.show()
 # distance as X axis; linked zoom on x axis:
 # https://stackoverflow.com/questions/4200586/matplotlib-pyplot-how-to-zoom-subplots-together
 ax_ch1 = plt.subplot(2, 1, 1)
-ax_ch1.plot(distscale, voltage_ch1, '.-', label='Ch. 1 (V)')
+lod_lines = [ad2.plot_lod(ax_ch1, lod_ch1, time2mm(INPUT_SAMPLE_PERIOD), label='Ch. 1 (V)')]
 
 plt.title('%s @ SR=%.2e Hz (TR=%.2e s)' % (description, INPUT_SAMPLE_RATE, INPUT_SINGLE_ACQUISITION_TIME))
 
 ax_ch2 = plt.subplot(2, 1, 2, sharex=ax_ch1)
-ax_ch2.plot(distscale, voltage_ch2, '.-', color='tab:orange', label='Ch. 2 (V)')
+lod_lines.append(ad2.plot_lod(ax_ch2, lod_ch2, time2mm(INPUT_SAMPLE_PERIOD), color='tab:orange', label='Ch. 2 (V)'))
 
 ax_ch1.set_xlabel('Distance [mm] (take diffs!)')
 ax_ch2.set_xlabel('Distance [mm] (take diffs!)')
@@ -952,6 +1224,62 @@ plt.show()
 
 
 
+# M-mode of ch2 (each acquisition is already exactly 1 echo window, so firstpeak=0)
+# this is a strided view of voltage_ch2 (no copy); shown as log-compressed envelope
+# (mode='rf' for the raw signal)
+ad2.plot_m_mode(ad2.reshape_to_M_mode(voltage_ch2, INPUT_SAMPLE_SIZE, 0),
+                title='Ch. 2 M-Mode (envelope, dB): %s' % description,
+                mode='log')
+
+
+
+# echo tracking (time of flight): arrival of the first ECHO_N echoes in every ch2 acquisition
+# (threshold crossing, sub-sample), skipping the excitation pulse; depth = C * t / 2 from the trigger position
+ECHO_N = 3
+ECHO_THRESHOLD = 0.1        # volts
+ECHO_DEAD_ZONE_TIME = 5e-6          # sec after the trigger position to skip (excitation pulse & ringing)
+ECHO_MIN_SEPARATION_TIME = 10e-6    # sec between 2 echoes (in time, so it holds for any --plan sample rate)
+
+echo_index, echo_amplitude = ad2.find_echoes(ad2.reshape_to_M_mode(voltage_ch2, INPUT_SAMPLE_SIZE, 0),
+                                             n_echoes=ECHO_N,
+                                             threshold=ECHO_THRESHOLD,
+                                             start_index=INPUT_TRIGGER_POSITION_INDEX + int(ECHO_DEAD_ZONE_TIME * INPUT_SAMPLE_RATE),
+                                             min_separation=int(ECHO_MIN_SEPARATION_TIME * INPUT_SAMPLE_RATE),
+                                             )
+echo_mm = ad2.echo_depth_mm(echo_index, INPUT_SAMPLE_RATE, c=C, t0_index=INPUT_TRIGGER_POSITION_INDEX)
+
+print('Ch2 echo depths (C = %.1f m/s):' % C)
+for k in range(ECHO_N):
+    found = ~np.isnan(echo_mm[:, k])
+    if np.any(found):
+        print('echo %d: %.3f mm (std %.3f mm), found in %d of %d acquisitions'
+              % (k + 1, np.mean(echo_mm[found, k]), np.std(echo_mm[found, k]), np.count_nonzero(found), echo_mm.shape[0]))
+
+plt.plot(echo_mm, '.-')
+plt.legend(['echo %d' % (k + 1) for k in range(ECHO_N)])
+plt.title('Ch. 2 Echo Depth: %s' % description)
+plt.xlabel('Repetition Index')
+plt.ylabel('Depth [mm] (C * t / 2)')
+plt.show()
+
+
+
+# averaged A-lines (--average N): average of the last N acquisitions, both channels
+if AVERAGING and averager.n_added > 0:
+    ax_ch1 = plt.subplot(2, 1, 1)
+    ax_ch1.plot(time2mm(INPUT_SAMPLE_PERIOD) * np.arange(INPUT_SAMPLE_SIZE),
+                averager.volts(0, scope_params.ch1_v_range, scope_params.ch1_v_offset), label='Ch. 1 (V)')
+    plt.title('%s: average of last %d acq. (%s)' % (description, len(averager) if AVERAGE_MODE == 'window' else AVERAGE_N, AVERAGE_MODE))
+    ax_ch2 = plt.subplot(2, 1, 2, sharex=ax_ch1)
+    ax_ch2.plot(time2mm(INPUT_SAMPLE_PERIOD) * np.arange(INPUT_SAMPLE_SIZE),
+                averager.volts(1, scope_params.ch2_v_range, scope_params.ch2_v_offset), color='tab:orange', label='Ch. 2 (V)')
+    ax_ch2.set_xlabel('Distance [mm] (take diffs!)')
+    ax_ch1.set_ylabel('Ch. 1 Volts')
+    ax_ch2.set_ylabel('Ch. 2 Volts')
+    plt.show()
+
+
+
 
 
 #################
@@ -16,10 +16,13 @@ import numpy as np
 import matplotlib.pyplot as plt
 from scipy.io import wavfile
 from scipy.signal import find_peaks
-from scipy.fft import fft, fftfreq
 import sys
+import os
 
-plot_waveform = True    # crashes with too many points
+import ad2_tools as ad2
+import spectral
+
+plot_waveform = True    # drawn from a cached min/max LOD pyramid (<file>.lod.npz); OK with any number of points
 
 try:
     filepath = sys.argv[1]
@@ -36,7 +39,7 @@ except IndexError:
     filter_peaks = False
 
 try:
-    samplerate, wavedata = wavfile.read(filepath)
+    samplerate, wavedata = wavfile.read(filepath, mmap=True)   # memory-mapped; samples are read as needed
 except FileNotFoundError:
     print("Invalid filename. Quitting.")
     sys.exit(1)
@@ -108,14 +111,18 @@ print('Zero count:\t%d' % zero_indexes.shape[0])
 
 
 # plotting
-time = np.linspace(0., record_length, wavedata.shape[0]) # TODO this assumes properly time samples...
+#time = np.linspace(0., record_length, wavedata.shape[0]) # TODO this assumes properly time samples... (not needed by plot_lod(); 8 bytes/sample)
 
 if plot_waveform:
     #plt.plot(time, -1*np.abs(wavedata), '.-', label='Mono Channel')
 
     #plt.plot(time, wavedata, '.-', label='Mono Channel')
 
-    plt.plot(time, wavedata, '.-', label='Mono Channel')
+    #plt.plot(time, wavedata, '.-', label='Mono Channel')
+    channels = [wavedata] if n_channels == 1 else [wavedata[:, ch] for ch in range(n_channels)]
+    pyramids = ad2.load_lod_pyramids(filepath, channels)
+    ax = plt.gca()
+    lod_lines = [ad2.plot_lod(ax, pyramid, sample_dt, label='Channel %d' % ch) for ch, pyramid in enumerate(pyramids)]
     #plt.plot(time[peak_indexes], wavedata[peak_indexes], 'o', label='Peaks')
     #plt.plot(time[zero_indexes], wavedata[zero_indexes], '*', label='Zeros')
     
@@ -134,19 +141,15 @@ if plot_waveform:
 
 
 
-# FFT Plot:
-# TODO basic version from here: https://docs.scipy.org/doc/scipy/reference/tutorial/fft.html
-# TODO maybe the windowed version would be more accurate?
-wave_fft = fft(wavedata)
-N = wavedata.shape[0]
-fft_freqs = fftfreq(N, sample_dt)[:N//2]    # TODO figure out this indexing/truncation
-
-#figure()
-plt.plot(fft_freqs, 2./N *  np.abs(wave_fft[0:N//2]))
-plt.grid()
-plt.title('FFT (basic)')
-plt.xlabel('Frequency (Hz)')
-plt.show()
+# Spectrum Plot:
+# Welch PSD, spectrogram & center frequency over time, computed 1 block at a time from the
+# memory-mapped file (see spectral.py) - previously 1 fft() over every sample (memory ~ recording length)
+analyzer = spectral.analyze_file(filepath,
+                                 band=(0.5 * wavefreq, 1.5 * wavefreq) if wavefreq else (None, None),
+                                 )
+for ch in range(n_channels):
+    print('Channel %d: PSD peak %f Hz, mean center frequency %f Hz'
+          % (ch, analyzer.freqs[np.argmax(analyzer.psd()[ch])], np.nanmean(analyzer.center_frequency()[ch])))
+    spectral.plot_spectral(analyzer, ch, os.path.basename(filepath))
 
-# TODO semilog plot?
 # TODO find peak frequencies?
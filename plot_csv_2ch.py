@@ -1,13 +1,24 @@
 """Plot a 2-channel raw int16 CSV file.
     (both channels on same plot)
 
+    Also accepts binary (.bin) session files; these are memory-mapped, so
+    only the acquisitions that are plotted get read from disk.
 
+    Plots are drawn from a min/max level-of-detail pyramid (ad2.plot_lod()):
+    only ~4000 points per line are drawn at any zoom, and finer levels (down to
+    the raw samples) are loaded when zooming in. For .bin files the pyramid is
+    cached next to the data file (<file>.lod.npz), so re-opening is instant.
+
+    USAGE:
+    python plot_csv_2ch.py <path to _data.csv or _data.bin file> [first_acq:last_acq]
+        (optional acquisition range is for .bin files only, ie. 0:10 = initial zoom on the first 10 acquisitions)
 """
 
 
 # TODO get correct voltage range/offset values
 
 import ad2_tools as ad2
+import session_catalog
 import matplotlib.pyplot as plt
 import pandas as pd
 import sys
@@ -31,7 +42,25 @@ filepath = sys.argv[1]
 
 
 
-data = ad2.load_2ch_int16_csv(filepath)
+if filepath.endswith('.bin'):
+    # binary session: vconv params are in the file header
+    session = ad2.SessionReader(filepath)
+    print('Session: %d acquisitions x %d samples' % (session.n_acquisitions, session.samples_per_acq))
+
+    try:
+        acq_start, acq_stop = [int(i) if i else None for i in sys.argv[2].split(':')]
+    except IndexError:
+        acq_start, acq_stop = None, None
+    acq_start, acq_stop, _ = slice(acq_start, acq_stop).indices(session.n_acquisitions)
+
+    # raw int16 pyramids; converted to volts when drawn:
+    plot_data = session.lod_pyramids()
+    y_scales = [ad2.int16_volts_scale(session.header.v_ranges[ch], session.header.v_offsets[ch]) for ch in range(2)]
+    dt = session.header.sample_period
+    t0 = 0.
+    time_range = (acq_start * session.samples_per_acq * dt, acq_stop * session.samples_per_acq * dt)
+else:
+    data = ad2.load_2ch_int16_csv(filepath)
 
 # TODO save voltage settings & load them here...
 
@@ -44,53 +73,63 @@ DEFAULT_CH2_OFFSET = -0.000028
 
 file_desc = filepath.split('_')[1]
 
-# try default voltage conversion filename:
-vconv_file = filepath.rsplit('_', 1)[0] + '_vconv.csv'
-try: 
-    vconv_data = pd.read_csv(vconv_file)
-    #print(vconv_data.head())
-
-    print('Using voltage conv. params from file:')
-    print('ch1_v_range: %s' % str(vconv_data.ch1_v_range[0]))
-    print('ch1_v_offset: %s' % str(vconv_data.ch1_v_offset[0]))
-    print('ch2_v_range: %s' % str(vconv_data.ch2_v_range[0]))
-    print('ch2_v_offset: %s' % str(vconv_data.ch2_v_offset[0]))
-
-    ad2.conv_volts_2ch_int16(data, 
-                             vconv_data.ch1_v_range[0],
-                             vconv_data.ch1_v_offset[0],
-                             vconv_data.ch2_v_range[0],
-                             vconv_data.ch2_v_offset[0]
-                             )
-
-except FileNotFoundError as e:
-    # use default values if file doesn't exist
-    print('File not found: %s' % vconv_file)
-    print('Using default voltage conversion parameters.')
-    print('\tNOTE: these may be approximate or wrong!')
-
-    vconv_data = None
-
-    # TODO use correct values not defaults:
-    ad2.conv_volts_2ch_int16(data, 
-                             DEFAULT_CH1_RANGE,
-                             DEFAULT_CH1_OFFSET,
-                             DEFAULT_CH2_RANGE,
-                             DEFAULT_CH2_OFFSET,
-                             )
+# (binary files are already converted w/ exact vconv params from the file header, see above)
+if not filepath.endswith('.bin'):
+    # look up the session's vconv params in the folder's session catalog (no data files are read;
+    # read-only folders: the _vconv.csv file directly)
+    vconv_data = session_catalog.vconv_for_file(filepath)
+
+    if vconv_data is not None and vconv_data.get('ch1_v_range') is not None:
+        print('Using voltage conv. params from file: %s' % vconv_data['vconv_file'])
+        print('ch1_v_range: %s' % str(vconv_data['ch1_v_range']))
+        print('ch1_v_offset: %s' % str(vconv_data['ch1_v_offset']))
+        print('ch2_v_range: %s' % str(vconv_data['ch2_v_range']))
+        print('ch2_v_offset: %s' % str(vconv_data['ch2_v_offset']))
+
+        ad2.conv_volts_2ch_int16(data, 
+                                 vconv_data['ch1_v_range'],
+                                 vconv_data['ch1_v_offset'],
+                                 vconv_data['ch2_v_range'],
+                                 vconv_data['ch2_v_offset'],
+                                 )
+
+    else:
+        # use default values if file doesn't exist
+        print('No vconv file for: %s' % filepath)
+        print('Using default voltage conversion parameters.')
+        print('\tNOTE: these may be approximate or wrong!')
+
+        vconv_data = None
+
+        # TODO use correct values not defaults:
+        ad2.conv_volts_2ch_int16(data, 
+                                 DEFAULT_CH1_RANGE,
+                                 DEFAULT_CH1_OFFSET,
+                                 DEFAULT_CH2_RANGE,
+                                 DEFAULT_CH2_OFFSET,
+                                 )
 
 
 #print(data.head())
 
+if not filepath.endswith('.bin'):
+    plot_data = [data.ch1_volts.to_numpy(), data.ch2_volts.to_numpy()]
+    y_scales = [(1., 0.), (1., 0.)]
+    dt = data.Time[1] - data.Time[0]    # pseudo-time: constant sample period
+    t0 = data.Time[0]
+    time_range = (t0, t0 + data.shape[0] * dt)
 
-distscale = 1000 * data.Time * C_WATER  # convert to mm
 
+mm_per_sec = 1000 * C_WATER     # convert to mm
 
 
 
 
-plt.plot(data.Time, data.ch1_volts, '.-', label='Ch1 (V)')
-plt.plot(data.Time, data.ch2_volts, '.-', label='Ch2 (V)')
+ax = plt.gca()
+lod_lines = [ad2.plot_lod(ax, plot_data[0], dt, t0, *y_scales[0], label='Ch1 (V)'),
+             ad2.plot_lod(ax, plot_data[1], dt, t0, *y_scales[1], label='Ch2 (V)'),
+             ]
+ax.set_xlim(time_range)
 plt.xlabel('Time (sec - TR delays omitted!)')
 plt.ylabel('Volts')
 #plt.title(os.path.basename(filepath))
@@ -104,13 +143,15 @@ plt.show()
 # distance as X axis; linked zoom on x axis:
 # https://stackoverflow.com/questions/4200586/matplotlib-pyplot-how-to-zoom-subplots-together
 ax_ch1 = plt.subplot(2, 1, 1)
-ax_ch1.plot(distscale, data.ch1_volts, '.-', label='Ch. 1 (V)')
+lod_lines = [ad2.plot_lod(ax_ch1, plot_data[0], mm_per_sec * dt, mm_per_sec * t0, *y_scales[0], label='Ch. 1 (V)')]
 
 #plt.title('%s @ SR=%.2e Hz (TR=%.2e s)' % (file_desc, INPUT_SAMPLE_RATE, INPUT_SINGLE_ACQUISITION_TIME))
 plt.title('%s' % file_desc)
 
 ax_ch2 = plt.subplot(2, 1, 2, sharex=ax_ch1)
-ax_ch2.plot(distscale, data.ch2_volts, '.-', color='tab:orange', label='Ch. 2 (V)')
+lod_lines.append(ad2.plot_lod(ax_ch2, plot_data[1], mm_per_sec * dt, mm_per_sec * t0, *y_scales[1],
+                              color='tab:orange', label='Ch. 2 (V)'))
+ax_ch1.set_xlim(mm_per_sec * time_range[0], mm_per_sec * time_range[1])
 
 ax_ch1.set_xlabel('Distance [mm] (take diffs!)')
 ax_ch2.set_xlabel('Distance [mm] (take diffs!)')
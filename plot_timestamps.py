@@ -1,12 +1,12 @@
 """Plot dt values from a timestamp file recorded with timestamp_logger.py
 
     USAGE:
-    python plot_timestamps.py <path to CSV file>
+    python plot_timestamps.py <path to .csv or .bin file>
 
     Doug Brantner 2/28/2022
 """
 
-# TODO differentiate ASCII file vs. binary file
+# DONE differentiate ASCII file vs. binary file (by extension; see ad2.load_timestamps())
 
 
 
@@ -16,6 +16,7 @@ import sys
 import os
 import datetime
 
+import ad2_tools as ad2
 
 # TODO look into pandas automatic handling of datetimes...
 
@@ -27,16 +28,9 @@ if not os.path.isfile(filepath):
     sys.exit(1)
 
 
-# Read ASCII comma-separated/newline data:
-data = pd.read_csv(filepath, 
-                   sep=',', 
-                   header=None,
-                   names=['trig_utc_sec', 'trig_ticks', 'ticks_per_sec'],
-                   dtype=float,     # TODO is this ok? or overflow/keep as int?
-                   )
-
-
-data['time'] = data.trig_utc_sec + data.trig_ticks/data.ticks_per_sec   # time in seconds.decimals
+# Read ASCII comma-separated/newline data, or binary records:
+# (adds data['time'] = time in seconds.decimals)
+data = ad2.load_timestamps(filepath)
 
 # zero the seconds (default is seconds since Unix Epoch)
 #data.trig_utc_sec -= data.trig_utc_sec[0]
@@ -4,6 +4,9 @@
 
     Makes 2 plots: file1-ch1 and file2-ch1; and 
                    file1-ch2 and file2-ch2
+
+    Lines are drawn from min/max level-of-detail pyramids (ad2.plot_lod()),
+    so only the points visible at the current zoom are drawn.
 """
 
 
@@ -60,12 +63,15 @@ ad2.conv_volts_2ch_int16(data2,
 
 # TODO assuming time scales are the same...
 distscale = 1000 * data1.Time * C_WATER  # convert to mm
+dist_step = distscale[1] - distscale[0]    # mm per sample (pseudo-time: constant sample period)
 
 
 #plt.plot(data1.Time, data1.ch1_volts, '.-', label='File1 Ch1 (V)')
 #plt.plot(data2.Time, data2.ch1_volts, '.-', label='File2 Ch1 (V)')
-plt.plot(distscale, data1.ch1_volts, '.-', label='File1 Ch1 (V)')
-plt.plot(distscale, data2.ch1_volts, '.-', label='File2 Ch1 (V)')
+ax = plt.gca()
+lod_lines = [ad2.plot_lod(ax, data1.ch1_volts.to_numpy(), dist_step, distscale[0], label='File1 Ch1 (V)'),
+             ad2.plot_lod(ax, data2.ch1_volts.to_numpy(), dist_step, distscale[0], label='File2 Ch1 (V)'),
+             ]
 
 #plt.xlabel('Time (sec - TR delays omitted!)')
 plt.xlabel('Distance [mm]')
@@ -78,8 +84,10 @@ plt.show()
 
 #plt.plot(data1.Time, data1.ch2_volts, '.-', label='File1 Ch2 (V)')
 #plt.plot(data2.Time, data2.ch2_volts, '.-', label='File2 Ch2 (V)')
-plt.plot(distscale, data1.ch2_volts, '.-', label='File1 Ch2 (V)')
-plt.plot(distscale, data2.ch2_volts, '.-', label='File2 Ch2 (V)')
+ax = plt.gca()
+lod_lines = [ad2.plot_lod(ax, data1.ch2_volts.to_numpy(), dist_step, distscale[0], label='File1 Ch2 (V)'),
+             ad2.plot_lod(ax, data2.ch2_volts.to_numpy(), dist_step, distscale[0], label='File2 Ch2 (V)'),
+             ]
 #plt.xlabel('Time (sec - TR delays omitted!)')
 plt.xlabel('Distance [mm]')
 plt.ylabel('Volts')
@@ -14,6 +14,7 @@ import time
 import matplotlib.pyplot as plt
 import sys
 import numpy as np
+import waveforms
 
 if sys.platform.startswith("win"):
     dwf = cdll.dwf
@@ -65,14 +66,8 @@ if hdwf.value == hdwfNone.value:
 # repeat every 200 us
 
 # generate waveform samples
-waveformSamples = (c_double*4096)()
-# create buffer samples for one period of sine wave
-timespots = np.linspace(0,1.0/3000,num=4096)
-# wvsamples = []
-index = 0
-for t in timespots:
-    waveformSamples[index] = math.sin(t*2*math.pi*3000)
-    index = index+1
+# one period of sine wave (vectorized; same samples as np.linspace(0, 1.0/3000, 4096) per-sample loop)
+waveformSamples = waveforms.sine_period(4096, endpoint=True)
 # plt.plot(waveformSamples)
 # plt.title('wavesamples')
 # plt.show()
@@ -81,7 +76,7 @@ print("Generating custom waveform...")
 # settings for output
 dwf.FDwfAnalogOutNodeEnableSet(hdwf, c_int(0), AnalogOutNodeCarrier, c_bool(True))
 dwf.FDwfAnalogOutNodeFunctionSet(hdwf, c_int(0), AnalogOutNodeCarrier, funcCustom)
-dwf.FDwfAnalogOutNodeDataSet(hdwf, c_int(0), AnalogOutNodeCarrier, waveformSamples, c_int(4096))
+dwf.FDwfAnalogOutNodeDataSet(hdwf, c_int(0), AnalogOutNodeCarrier, waveformSamples.ctypes.data_as(POINTER(c_double)), c_int(4096))
 # set 
 dwf.FDwfAnalogOutNodeFrequencySet(hdwf, c_int(0), AnalogOutNodeCarrier, c_double(3000))
 dwf.FDwfAnalogOutNodeAmplitudeSet(hdwf, c_int(0), AnalogOutNodeCarrier, c_double(2))
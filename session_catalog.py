@@ -0,0 +1,437 @@
+"""SQLite catalog of the acquisition sessions in a data folder.
+
+    Sessions are saved as <date>-<time>_<description>_<suffix> files
+    (see my_custom_trigger_16bit_2ch.py):
+        _data.bin / _data.csv   raw int16 data
+        _vconv.csv              exact scope range/offset (ScopeParams.write_vconv_file())
+        _settings.csv           pulse & scope settings (1 header row + 1 data row)
+
+    The catalog (<folder>/ad2_catalog.sqlite) has 1 row per session with:
+        - session name, start time (from the filename), description, file paths
+        - data file header info (channels, sample rate, samples per acquisition, # of acquisitions)
+        - every vconv & settings column (new settings columns are added as they appear)
+        - basic signal stats per channel (volts: min, max, mean, rms)
+    update() only re-reads files whose size/modification time changed, so re-indexing
+    a folder is cheap; queries never open any data file.
+
+    USAGE:
+        python session_catalog.py <folder>                                  # index & list all sessions
+        python session_catalog.py <folder> --since 2022-03-01 --rate 10e6 --pulse SINE_N_CYCLES
+        python session_catalog.py <folder> --where "ch2_rms_v > 0.1" --columns session,ch2_rms_v
+        python session_catalog.py <folder> --no-stats        # skip signal stats (no data files are read)
+
+    In code:
+        import session_catalog
+        catalog = session_catalog.SessionCatalog(folder)
+        catalog.update()
+        df = catalog.find(since='2022-03-01', INPUT_SAMPLE_RATE=10e6, WAVEGEN_PULSE_TYPE='SINE_N_CYCLES')
+"""
+
+# TODO index record mode (.wav + _events.csv) & timestamp logger sessions too
+
+
+import numpy as np
+import pandas as pd
+import datetime
+import sqlite3
+import csv
+import re
+import os
+
+import ad2_tools as ad2
+
+
+CATALOG_FILENAME = 'ad2_catalog.sqlite'
+
+# <date>-<time>_<description>_<suffix>.<ext>  (descriptions have no underscores, see check_description())
+SESSION_FILENAME_RE = re.compile(r'^(\d{8}-\d{6})_([^_]*)_(data|vconv|settings)\.(bin|csv)$')
+
+STATS_CHUNK_ACQUISITIONS = 256      # acquisitions per chunk when computing signal stats
+
+SESSION_COLUMNS = [('session', 'TEXT PRIMARY KEY'),     # <date>-<time>_<description>
+                   ('started', 'TEXT'),                 # 'YYYY-MM-DD HH:MM:SS' (sorts & compares as text)
+                   ('description', 'TEXT'),
+                   ('folder', 'TEXT'),
+                   ('data_file', 'TEXT'),
+                   ('vconv_file', 'TEXT'),
+                   ('settings_file', 'TEXT'),
+                   ('data_format', 'TEXT'),
+                   ('data_bytes', 'INTEGER'),
+                   ('n_channels', 'INTEGER'),
+                   ('sample_rate', 'REAL'),
+                   ('samples_per_acq', 'INTEGER'),
+                   ('n_acquisitions', 'INTEGER'),
+                   ('has_stats', 'INTEGER'),
+                   ]
+
+STATS_NAMES = ['min_v', 'max_v', 'mean_v', 'rms_v']    # per channel: ch1_min_v, ...
+
+_COLUMN_NAME_RE = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*$')
+
+
+def parse_session_filename(filename):
+    """Return (session, started, description, role) for a session file name, or None.
+
+        ie. '20220119-120000_test_data.bin' -> ('20220119-120000_test', '2022-01-19 12:00:00', 'test', 'data')
+    """
+    match = SESSION_FILENAME_RE.match(os.path.basename(filename))
+    if match is None:
+        return None
+    timestamp, description, role, ext = match.groups()
+    try:
+        started = datetime.datetime.strptime(timestamp, '%Y%m%d-%H%M%S').strftime('%Y-%m-%d %H:%M:%S')
+    except ValueError:
+        return None
+    return '%s_%s' % (timestamp, description), started, description, role
+
+
+def _parse_value(text):
+    """CSV field -> int, float or str."""
+    for cast in (int, float):
+        try:
+            return cast(text)
+        except ValueError:
+            pass
+    return text
+
+
+def read_row_csv(filepath):
+    """Read a 2-line (header + 1 data row) CSV file (ie. _settings.csv, _vconv.csv) as a dict."""
+    with open(filepath, newline='') as f:
+        rows = list(csv.reader(f))
+    if len(rows) < 2:
+        return {}
+    return {key: _parse_value(value) for key, value in zip(rows[0], rows[1])}
+
+
+def _channel_stats(chunks, v_range, v_offset):
+    """Return [min, max, mean, rms] (volts) of 1 int16 channel, given as an iterable of chunks."""
+    n = 0
+    lo = np.inf
+    hi = -np.inf
+    total = 0.
+    total_sq = 0.
+    for chunk in chunks:
+        chunk = np.asarray(chunk)
+        if chunk.size == 0:
+            continue
+        n += chunk.size
+        lo = min(lo, int(chunk.min()))
+        hi = max(hi, int(chunk.max()))
+        chunk = chunk.astype(np.float64)
+        total += float(chunk.sum())
+        total_sq += float(np.dot(chunk.ravel(), chunk.ravel()))
+    if n == 0:
+        return [None] * len(STATS_NAMES)
+
+    scale, offset = ad2.int16_volts_scale(v_range, v_offset)
+    mean_raw = total / n
+    mean_sq_raw = total_sq / n
+    # volts = offset + scale * raw:
+    rms = np.sqrt(max(offset**2 + 2 * offset * scale * mean_raw + scale**2 * mean_sq_raw, 0.))
+    return [offset + scale * lo, offset + scale * hi, offset + scale * mean_raw, float(rms)]
+
+
+class SessionCatalog():
+    """SQLite index of all sessions in 1 data folder (see module doc)."""
+
+    def __init__(self, folder, filepath=None):
+        """
+            folder = data folder (the -f folder of the acquisition scripts)
+            filepath = catalog file (default: <folder>/ad2_catalog.sqlite)
+        """
+        self.folder = os.path.abspath(folder)
+        self.filepath = filepath or os.path.join(self.folder, CATALOG_FILENAME)
+        self.db = sqlite3.connect(self.filepath)
+        self.db.execute('CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, session TEXT, role TEXT, '
+                        'size INTEGER, mtime_ns INTEGER)')
+        self.db.execute('CREATE TABLE IF NOT EXISTS sessions (%s)'
+                        % ', '.join('"%s" %s' % column for column in SESSION_COLUMNS))
+        self.db.execute('CREATE INDEX IF NOT EXISTS sessions_started ON sessions (started)')
+        self.db.execute('CREATE TABLE IF NOT EXISTS external (name TEXT PRIMARY KEY, path TEXT, '
+                        'size INTEGER, mtime_ns INTEGER)')
+        self.db.commit()
+        self._columns = self.columns()
+
+    def columns(self):
+        """Return list of session table column names."""
+        return [row[1] for row in self.db.execute('PRAGMA table_info(sessions)')]
+
+    def _add_columns(self, values):
+        """Add a column for every new key of values (type from the value)."""
+        for name, value in values.items():
+            if name in self._columns:
+                continue
+            if not _COLUMN_NAME_RE.match(name):
+                raise ValueError('Invalid catalog column name: %r' % name)
+            sql_type = 'INTEGER' if isinstance(value, int) else 'REAL' if isinstance(value, float) else 'TEXT'
+            self.db.execute('ALTER TABLE sessions ADD COLUMN "%s" %s' % (name, sql_type))
+            self._columns.append(name)
+
+    def update(self, stats=True, verbose=True):
+        """Index new/changed sessions & drop deleted ones.
+
+            stats = also compute signal stats (reads each new/changed data file once;
+                    sessions indexed earlier with stats=False get their stats now)
+
+            Returns (number of sessions (re)indexed, number removed).
+        """
+        known = {}      # path -> (size, mtime_ns)
+        known_sessions = {}     # path -> session
+        for path, session, size, mtime_ns in self.db.execute('SELECT path, session, size, mtime_ns FROM files'):
+            known[path] = (size, mtime_ns)
+            known_sessions[path] = session
+
+        sessions = {}   # session -> {role: DirEntry}
+        for entry in os.scandir(self.folder):
+            parsed = parse_session_filename(entry.name)
+            if parsed is not None and entry.is_file():
+                sessions.setdefault(parsed[0], {})[parsed[3]] = entry
+
+        changed = set()
+        seen = set()
+        for session, entries in sessions.items():
+            for role, entry in entries.items():
+                st = entry.stat()
+                seen.add(entry.path)
+                if known.get(entry.path) != (st.st_size, st.st_mtime_ns):
+                    changed.add(session)
+        # a file of a session was deleted (ie. its _vconv.csv): rebuild the row without it
+        changed.update(known_sessions[path] for path in known
+                       if path not in seen and known_sessions[path] in sessions)
+        if stats:
+            changed.update(row[0] for row in self.db.execute('SELECT session FROM sessions WHERE has_stats = 0')
+                           if row[0] in sessions)
+
+        for session in sorted(changed):
+            if verbose:
+                print('Indexing %s' % session)
+            self._index_session(session, sessions[session], stats)
+
+        removed = [row[0] for row in self.db.execute('SELECT session FROM sessions') if row[0] not in sessions]
+        for session in removed:
+            self.db.execute('DELETE FROM sessions WHERE session = ?', (session,))
+        self.db.executemany('DELETE FROM files WHERE path = ?', [(path,) for path in known if path not in seen])
+
+        self.db.commit()
+        return len(changed), len(removed)
+
+    def _index_session(self, session, entries, stats):
+        """(Re)build the catalog row of 1 session from its files."""
+        parsed = parse_session_filename(next(iter(entries.values())).name)
+        row = {'session': session,
+               'started': parsed[1],
+               'description': parsed[2],
+               'folder': self.folder,
+               'has_stats': int(stats),     # (also when there is no/unreadable data, so it is not retried every update)
+               }
+
+        if 'settings' in entries:
+            row['settings_file'] = entries['settings'].path
+            row.update(read_row_csv(entries['settings'].path))
+        if 'vconv' in entries:
+            row['vconv_file'] = entries['vconv'].path
+            row.update(read_row_csv(entries['vconv'].path))
+
+        if 'data' in entries:
+            data_path = entries['data'].path
+            row['data_file'] = data_path
+            row['data_bytes'] = entries['data'].stat().st_size
+            if data_path.endswith('.bin'):
+                row.update(self._bin_info(data_path, stats))
+            else:
+                row.update(self._csv_info(data_path, row, stats))
+
+        self._add_columns(row)
+        self.db.execute('INSERT OR REPLACE INTO sessions (%s) VALUES (%s)'
+                        % (', '.join('"%s"' % name for name in row), ', '.join('?' * len(row))),
+                        list(row.values()))
+        for role, entry in entries.items():
+            st = entry.stat()
+            self.db.execute('INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?)',
+                            (entry.path, session, role, st.st_size, st.st_mtime_ns))
+
+    def _bin_info(self, data_path, stats):
+        """Header info (& stats) of a binary session file."""
+        try:
+            reader = ad2.SessionReader(data_path)
+        except (ValueError, OSError) as e:
+            print('Skipping unreadable data file %s (%s)' % (data_path, e))
+            return {}
+        header = reader.header
+        info = {'data_format': 'bin',
+                'n_channels': header.n_channels,
+                'sample_rate': header.sample_rate,
+                'samples_per_acq': header.samples_per_acq,
+                'n_acquisitions': header.n_acquisitions,
+                }
+        if stats:
+            for ch in range(header.n_channels):
+                data = reader.channel(ch)
+                chunks = (data[i:i + STATS_CHUNK_ACQUISITIONS]
+                          for i in range(0, header.n_acquisitions, STATS_CHUNK_ACQUISITIONS))
+                values = _channel_stats(chunks, header.v_ranges[ch], header.v_offsets[ch])
+                info.update({'ch%d_%s' % (ch + 1, name): value for name, value in zip(STATS_NAMES, values)})
+        return info
+
+    def _csv_info(self, data_path, row, stats):
+        """Info (& stats) of a legacy 2-channel int16 CSV session (sizes come from the settings file)."""
+        info = {'data_format': 'csv',
+                'n_channels': 2,
+                'sample_rate': row.get('INPUT_SAMPLE_RATE'),
+                'samples_per_acq': row.get('INPUT_SAMPLE_SIZE'),
+                }
+        if stats:
+            data = ad2.load_2ch_int16_csv(data_path)
+            if row.get('INPUT_SAMPLE_SIZE'):
+                info['n_acquisitions'] = data.shape[0] // int(row['INPUT_SAMPLE_SIZE'])
+            for ch in range(2):
+                v_range = row.get('ch%d_v_range' % (ch + 1), row.get('SCOPE_VOLT_RANGE_CH%d' % (ch + 1), 5.0))
+                v_offset = row.get('ch%d_v_offset' % (ch + 1), 0.)
+                values = _channel_stats([data['ch%d_int16' % (ch + 1)].to_numpy()], v_range, v_offset)
+                info.update({'ch%d_%s' % (ch + 1, name): value for name, value in zip(STATS_NAMES, values)})
+        return info
+
+    def find(self, since=None, until=None, description=None, where=None, params=(), columns=None, **equals):
+        """Query sessions; returns a pandas DataFrame (newest first).
+
+            since, until = start time limits, 'YYYY-MM-DD' or 'YYYY-MM-DD HH:MM:SS' (inclusive, exclusive)
+            description = substring of the description
+            where = extra SQL condition (use ? placeholders + params)
+            columns = list of columns to return (default all)
+            equals = column=value conditions, ie. INPUT_SAMPLE_RATE=10e6, WAVEGEN_PULSE_TYPE='SINE_N_CYCLES'
+        """
+        conditions = []
+        values = []
+        if since is not None:
+            conditions.append('started >= ?')
+            values.append(since)
+        if until is not None:
+            conditions.append('started < ?')
+            values.append(until)
+        if description is not None:
+            conditions.append("description LIKE ?")
+            values.append('%' + description + '%')
+        for name, value in equals.items():
+            if name not in self._columns:
+                return pd.DataFrame(columns=columns or self._columns)     # nothing indexed with that column
+            conditions.append('"%s" = ?' % name)
+            values.append(value)
+        if where:
+            conditions.append('(%s)' % where)
+            values.extend(params)
+
+        sql = 'SELECT %s FROM sessions' % (', '.join('"%s"' % c for c in columns) if columns else '*')
+        if conditions:
+            sql += ' WHERE ' + ' AND '.join(conditions)
+        sql += ' ORDER BY started DESC'
+        return pd.read_sql_query(sql, self.db, params=values)
+
+    def external_table(self, name, filepath, read_func):
+        """Return a DataFrame read from an external file (ie. an Excel metadata sheet), cached in the catalog.
+
+            The file is only read (read_func(filepath)) when it is new or its size/modification
+            time changed; otherwise the table comes straight from the catalog.
+
+            name = table name (stored as ext_<name>)
+            filepath = external file
+            read_func = function(filepath) -> DataFrame, ie. lambda p: pd.read_excel(p, comment='#')
+        """
+        if not _COLUMN_NAME_RE.match(name):
+            raise ValueError('Invalid table name: %r' % name)
+        st = os.stat(filepath)
+        key = (os.path.abspath(filepath), st.st_size, st.st_mtime_ns)
+        row = self.db.execute('SELECT path, size, mtime_ns FROM external WHERE name = ?', (name,)).fetchone()
+        if row == key:
+            return pd.read_sql_query('SELECT * FROM "ext_%s"' % name, self.db)
+
+        table = read_func(filepath)
+        table.to_sql('ext_%s' % name, self.db, if_exists='replace', index=False)
+        self.db.execute('INSERT OR REPLACE INTO external VALUES (?, ?, ?, ?)', (name,) + key)
+        self.db.commit()
+        return table
+
+    def session_for_file(self, filepath):
+        """Return the catalog row (dict) of the session a file belongs to, or None."""
+        parsed = parse_session_filename(filepath)
+        if parsed is None:
+            return None
+        cursor = self.db.execute('SELECT * FROM sessions WHERE session = ?', (parsed[0],))
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        return dict(zip([d[0] for d in cursor.description], row))
+
+    def close(self):
+        self.db.close()
+
+
+def vconv_for_file(filepath):
+    """Vconv params (dict with vconv_file, ch1_v_range, ...) of the session a file belongs to, or None.
+
+        Looks the session up in the folder's catalog (updated first, without stats); if the
+        catalog can't be opened or written (ie. read-only/archived folder), reads the session's
+        _vconv.csv directly.
+    """
+    folder = os.path.dirname(os.path.abspath(filepath))
+    try:
+        catalog = SessionCatalog(folder)
+        try:
+            catalog.update(stats=False, verbose=False)
+            return catalog.session_for_file(filepath)
+        finally:
+            catalog.close()
+    except (sqlite3.Error, OSError):
+        pass
+
+    parsed = parse_session_filename(filepath)
+    if parsed is None:
+        return None
+    vconv_file = os.path.join(folder, parsed[0] + '_vconv.csv')
+    if not os.path.isfile(vconv_file):
+        return None
+    row = read_row_csv(vconv_file)
+    row['vconv_file'] = vconv_file
+    return row
+
+
+
+if __name__ == '__main__':
+    import argparse
+    import time
+
+    parser = argparse.ArgumentParser(description='Analog Discovery 2 - session catalog')
+    parser.add_argument('folder', help='data folder')
+    parser.add_argument('--no-stats', action='store_true', help='do not compute signal stats (no data files are read)')
+    parser.add_argument('--since', default=None, help="start date/time, ie. '2022-03-01'")
+    parser.add_argument('--until', default=None, help="end date/time (exclusive)")
+    parser.add_argument('--desc', default=None, help='description contains')
+    parser.add_argument('--rate', type=float, default=None, help='sample rate (Hz), ie. 10e6')
+    parser.add_argument('--pulse', default=None, help='WAVEGEN_PULSE_TYPE, ie. SINE_N_CYCLES')
+    parser.add_argument('--where', default=None, help='extra SQL condition')
+    parser.add_argument('--columns', default='session,started,sample_rate,n_acquisitions,WAVEGEN_PULSE_TYPE',
+                        help="comma separated columns to show ('*' for all)")
+    args = parser.parse_args()
+
+    catalog = SessionCatalog(args.folder)
+    t0 = time.perf_counter()
+    n_indexed, n_removed = catalog.update(stats=not args.no_stats)
+    t1 = time.perf_counter()
+
+    equals = {}
+    if args.rate is not None:
+        equals['sample_rate'] = args.rate
+    if args.pulse is not None:
+        equals['WAVEGEN_PULSE_TYPE'] = args.pulse
+    columns = None if args.columns == '*' else args.columns.split(',')
+    columns = [c for c in columns if c in catalog.columns()] if columns else None
+
+    result = catalog.find(since=args.since, until=args.until, description=args.desc, where=args.where,
+                          columns=columns, **equals)
+    t2 = time.perf_counter()
+
+    with pd.option_context('display.max_rows', None, 'display.max_columns', None, 'display.width', 200):
+        print(result)
+    print('\n%d sessions (indexed %d, removed %d in %.3f s; query %.1f ms)'
+          % (result.shape[0], n_indexed, n_removed, t1 - t0, 1e3 * (t2 - t1)))
+    catalog.close()
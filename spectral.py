@@ -0,0 +1,352 @@
+"""Spectral analysis (Welch PSD, STFT spectrogram, center frequency) of long recordings, in blocks.
+
+    Reads WAV files (record mode, memory-mapped), binary sessions (_data.bin, memory-mapped)
+    and legacy CSV sessions (_data.csv, read in chunks) SPECTRAL_BLOCK_SAMPLES at a time,
+    so memory use does not depend on the recording length:
+        - continuous signals (WAV): overlapping Hann segments of nperseg samples (Welch / STFT)
+        - triggered sessions (.bin/.csv, 1 acquisition = 1 echo window): 1 FFT per acquisition
+    The spectrogram is averaged down to at most max_columns time bins, and the center
+    frequency (power centroid within an optional band) is kept for every segment/acquisition,
+    ie. to see the transducer center frequency drift over a whole session.
+
+    USAGE:
+    python spectral.py <file.wav|_data.bin|_data.csv> [--channel N] [--nperseg N] [--band FMIN FMAX] [--window START STOP]
+
+    In code:
+        import spectral
+        analyzer = spectral.analyze_file(filepath, band=(0.5e6, 2e6))
+        freqs, psd = analyzer.freqs, analyzer.psd()
+        drift = analyzer.center_frequency()     # (n_channels, n_segments or n_acquisitions)
+"""
+
+# TODO peak frequency (parabolic) as an alternative to the centroid
+# TODO per-acquisition spectra of record mode WAV files, given the TR (samples_per_acq)
+
+
+import numpy as np
+import pandas as pd
+from scipy.io import wavfile
+from scipy.signal import get_window
+import sys
+import os
+
+import ad2_tools as ad2
+import session_catalog
+
+
+SPECTRAL_BLOCK_SAMPLES = 2**20  # samples per channel read at a time
+NPERSEG = 4096                  # Welch/STFT segment length (continuous signals)
+OVERLAP = 0.5                   # Welch/STFT segment overlap (fraction of nperseg)
+MAX_COLUMNS = 1000              # max. spectrogram time bins (segments/acquisitions are averaged into bins)
+CSV_SAMPLE_RATE_ROWS = 2        # rows used to get the sample rate from the Time column of CSV sessions
+
+
+
+class SpectralSource():
+    """Read a WAV file, binary session or CSV session in blocks of consecutive samples (bounded memory).
+
+        filepath = .wav, _data.bin or _data.csv
+        sample_rate, samples_per_acq = override/fill in missing values (CSV sessions use the folder's
+                                       session catalog; WAV files are continuous unless samples_per_acq is given)
+
+        Attributes: sample_rate, n_channels, n_samples (per channel), samples_per_acq (None = continuous), unit
+    """
+
+    def __init__(self, filepath, sample_rate=None, samples_per_acq=None):
+        self.filepath = filepath
+        self.samples_per_acq = samples_per_acq
+        self._scales = None     # volts = int16 * scale + offset, per channel (sessions)
+
+        if filepath.lower().endswith('.wav'):
+            self.format = 'wav'
+            self.sample_rate, data = wavfile.read(filepath, mmap=True)
+            self._data = data if data.ndim == 2 else data[:, None]     # (n_samples, n_channels)
+            self.n_channels = self._data.shape[1]
+            self.n_samples = self._data.shape[0]
+            self.unit = 'WAV units'
+
+        elif filepath.endswith('.bin'):
+            self.format = 'bin'
+            session = ad2.SessionReader(filepath)
+            header = session.header
+            self.sample_rate = header.sample_rate
+            self.samples_per_acq = header.samples_per_acq
+            self.n_channels = header.n_channels
+            self.n_samples = header.n_acquisitions * header.samples_per_acq
+            self._acqs = [session.channel(ch) for ch in range(self.n_channels)]    # (n_acquisitions, samples_per_acq)
+            self._scales = [ad2.int16_volts_scale(v_range, v_offset)
+                            for v_range, v_offset in zip(header.v_ranges, header.v_offsets)]
+            self.unit = 'V'
+
+        elif filepath.endswith('.csv'):
+            self.format = 'csv'
+            self.n_channels = 2
+            catalog = session_catalog.SessionCatalog(os.path.dirname(os.path.abspath(filepath)))
+            catalog.update(stats=False, verbose=False)
+            row = catalog.session_for_file(filepath) or {}
+            catalog.close()
+            self.sample_rate = row.get('sample_rate') or row.get('INPUT_SAMPLE_RATE')
+            self.samples_per_acq = self.samples_per_acq or row.get('samples_per_acq') or row.get('INPUT_SAMPLE_SIZE')
+            if not self.sample_rate:
+                time = pd.read_csv(filepath, header=None, usecols=[1], nrows=CSV_SAMPLE_RATE_ROWS)[1].to_numpy()
+                self.sample_rate = 1. / (time[1] - time[0])
+            with open(filepath, 'rb') as f:
+                self.n_samples = sum(1 for line in f)      # 1 row per sample (streamed, not loaded)
+            self._scales = [ad2.int16_volts_scale(row.get('ch%d_v_range' % (ch + 1)) or row.get('SCOPE_VOLT_RANGE_CH%d' % (ch + 1)) or 5.0,
+                                                  row.get('ch%d_v_offset' % (ch + 1)) or 0.)
+                            for ch in range(2)]
+            self.unit = 'V'
+
+        else:
+            raise ValueError('Unsupported file type: %s (.wav, _data.bin or _data.csv)' % filepath)
+
+        if sample_rate is not None:
+            self.sample_rate = sample_rate
+        self.sample_rate = float(self.sample_rate)
+        if self.samples_per_acq is not None:
+            self.samples_per_acq = int(self.samples_per_acq)
+            self.n_samples -= self.n_samples % self.samples_per_acq    # whole acquisitions only
+
+    @property
+    def n_acquisitions(self):
+        return self.n_samples // self.samples_per_acq if self.samples_per_acq else None
+
+    def blocks(self, block_samples=SPECTRAL_BLOCK_SAMPLES):
+        """Yield float32 arrays (n_channels, n) of consecutive samples (volts for sessions).
+
+            Triggered sources yield whole acquisitions (block_samples is rounded to a multiple of samples_per_acq).
+        """
+        if self.samples_per_acq:
+            block_samples = max(1, block_samples // self.samples_per_acq) * self.samples_per_acq
+
+        if self.format == 'wav':
+            for i in range(0, self.n_samples, block_samples):
+                yield np.asarray(self._data[i:i + block_samples].T, dtype=np.float32)
+
+        elif self.format == 'bin':
+            block_acqs = block_samples // self.samples_per_acq
+            for i in range(0, self.n_acquisitions, block_acqs):
+                yield self._volts([acqs[i:i + block_acqs].reshape(-1) for acqs in self._acqs])
+
+        else:
+            reader = pd.read_csv(self.filepath, header=None, usecols=[2, 3], dtype=np.float32, chunksize=block_samples)
+            n_read = 0
+            for chunk in reader:
+                chunk = chunk.to_numpy()[:self.n_samples - n_read]
+                n_read += chunk.shape[0]
+                if chunk.shape[0]:
+                    yield self._volts(chunk.T)
+
+    def _volts(self, channels):
+        """int16 channels -> float32 volts (n_channels, n)."""
+        out = np.empty((self.n_channels, len(channels[0])), dtype=np.float32)
+        for ch, (scale, offset) in enumerate(self._scales):
+            np.multiply(channels[ch], scale, out=out[ch], casting='unsafe')
+            out[ch] += offset
+        return out
+
+
+
+class SpectralAnalyzer():
+    """Incremental Welch PSD, binned spectrogram & center frequency; add() consecutive blocks of samples.
+
+        sample_rate = Hz
+        n_channels = channels per block
+        n_samples = total samples per channel that will be added (sets the spectrogram time bins)
+        samples_per_acq = None: continuous signal, overlapping segments of nperseg samples
+                          N: triggered acquisitions of N samples, 1 FFT per acquisition
+        nperseg, overlap, window = segment length, overlap fraction & window name (continuous signals)
+        max_columns = max. spectrogram time bins (consecutive segments/acquisitions are averaged)
+        band = (fmin, fmax) Hz for the center frequency (None = all frequencies)
+        acq_window = (start, stop) sample range of each acquisition to analyze, ie. skip the excitation pulse
+
+        Spectra are one-sided power spectral densities (unit^2/Hz), same scaling as scipy.signal.welch().
+    """
+
+    def __init__(self, sample_rate, n_channels, n_samples, samples_per_acq=None, nperseg=NPERSEG, overlap=OVERLAP,
+                 window='hann', max_columns=MAX_COLUMNS, band=(None, None), acq_window=(0, None)):
+        self.sample_rate = float(sample_rate)
+        self.n_channels = n_channels
+        self.samples_per_acq = samples_per_acq
+
+        if samples_per_acq:
+            start, stop = acq_window
+            stop = samples_per_acq if stop is None else min(stop, samples_per_acq)
+            self.acq_slice = slice(start, stop)
+            self.nperseg = stop - start
+            self.step = samples_per_acq
+            n_items = n_samples // samples_per_acq
+        else:
+            self.nperseg = min(nperseg, n_samples)
+            self.step = max(1, self.nperseg - int(overlap * self.nperseg))
+            n_items = max(0, (n_samples - self.nperseg) // self.step + 1)
+        self.n_items = n_items      # total segments (continuous) or acquisitions (triggered)
+
+        self.window = get_window(window, self.nperseg).astype(np.float32)
+        self.freqs = np.fft.rfftfreq(self.nperseg, 1. / self.sample_rate)
+        n_freqs = self.freqs.shape[0]
+
+        # one-sided PSD scaling (density, like scipy.signal.welch)
+        self._scale = np.full(n_freqs, 2. / (self.sample_rate * np.sum(self.window.astype(np.float64) ** 2)))
+        self._scale[0] /= 2
+        if self.nperseg % 2 == 0:
+            self._scale[-1] /= 2
+
+        fmin, fmax = band
+        self._band = (self.freqs >= (fmin if fmin is not None else 0.)) & (self.freqs <= (fmax if fmax is not None else np.inf))
+
+        self.items_per_column = max(1, -(-n_items // max_columns))
+        n_columns = max(1, -(-n_items // self.items_per_column))
+        self._psd_sum = np.zeros((n_channels, n_freqs))
+        self._columns = np.zeros((n_channels, n_columns, n_freqs))
+        self._center = np.full((n_channels, n_items), np.nan, dtype=np.float32)
+        self.n_added = 0        # segments/acquisitions added so far
+        self._tail = np.zeros((n_channels, 0), dtype=np.float32)   # continuous: samples carried into the next block
+
+    def add(self, block):
+        """Add the next block of consecutive samples, (n_channels, n) array (see SpectralSource.blocks())."""
+        if self.samples_per_acq:
+            segments = block.reshape(self.n_channels, -1, self.samples_per_acq)[:, :, self.acq_slice]
+        else:
+            data = np.concatenate([self._tail, block], axis=1) if self._tail.shape[1] else block
+            n_segments = max(0, (data.shape[1] - self.nperseg) // self.step + 1)
+            segments = np.lib.stride_tricks.sliding_window_view(data, self.nperseg, axis=1)[:, :n_segments * self.step:self.step]
+            self._tail = data[:, n_segments * self.step:].copy()
+        n = min(segments.shape[1], self.n_items - self.n_added)
+        if n <= 0:
+            return
+        segments = segments[:, :n]
+
+        # detrend (mean) & window all segments at once, then 1 FFT per segment
+        windowed = segments - segments.mean(axis=2, keepdims=True)
+        windowed *= self.window
+        power = np.abs(np.fft.rfft(windowed, axis=2)) ** 2
+        power *= self._scale
+
+        self._psd_sum += power.sum(axis=1)
+
+        # power centroid within the band, per segment/acquisition
+        band_power = power[:, :, self._band]
+        total = band_power.sum(axis=2)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            self._center[:, self.n_added:self.n_added + n] = (band_power @ self.freqs[self._band]) / total
+
+        # spectrogram: sum into time bins (consecutive items per column)
+        columns = (self.n_added + np.arange(n)) // self.items_per_column
+        starts = np.flatnonzero(np.r_[True, columns[1:] != columns[:-1]])
+        self._columns[:, columns[starts]] += np.add.reduceat(power, starts, axis=1)
+
+        self.n_added += n
+
+    def psd(self):
+        """Welch PSD, (n_channels, n_freqs): mean over all segments/acquisitions added."""
+        return self._psd_sum / max(self.n_added, 1)
+
+    def spectrogram(self):
+        """Binned spectrogram, (n_channels, n_columns, n_freqs): mean PSD of each time bin."""
+        n_columns = max(1, -(-self.n_added // self.items_per_column))
+        counts = np.minimum(self.items_per_column, self.n_added - np.arange(n_columns) * self.items_per_column)
+        return self._columns[:, :n_columns] / np.maximum(counts, 1)[None, :, None]
+
+    def column_positions(self):
+        """Center of each spectrogram column: seconds (continuous) or acquisition index (triggered)."""
+        n_columns = max(1, -(-self.n_added // self.items_per_column))
+        items = (np.arange(n_columns) + 0.5) * self.items_per_column - 0.5
+        if self.samples_per_acq:
+            return items
+        return (items * self.step + 0.5 * self.nperseg) / self.sample_rate
+
+    def center_frequency(self):
+        """Power centroid frequency (Hz) within the band, (n_channels, n_items); NaN = no power/not added."""
+        return self._center
+
+
+
+def analyze_file(filepath, sample_rate=None, samples_per_acq=None, block_samples=SPECTRAL_BLOCK_SAMPLES, **analyzer_kwargs):
+    """Run a SpectralAnalyzer over a whole file, 1 block at a time. Returns the analyzer (see its attributes)."""
+    source = SpectralSource(filepath, sample_rate=sample_rate, samples_per_acq=samples_per_acq)
+    analyzer = SpectralAnalyzer(source.sample_rate, source.n_channels, source.n_samples,
+                                samples_per_acq=source.samples_per_acq, **analyzer_kwargs)
+    analyzer.unit = source.unit
+    for block in source.blocks(block_samples):
+        analyzer.add(block)
+    return analyzer
+
+
+def plot_spectral(analyzer, ch=0, title=''):
+    """Plot Welch PSD, spectrogram (dB) & center frequency of 1 channel."""
+    import matplotlib.pyplot as plt
+
+    triggered = analyzer.samples_per_acq is not None
+    x_label = 'Acquisition Index' if triggered else 'Time (s)'
+    unit = getattr(analyzer, 'unit', 'units')
+
+    fig, (ax_psd, ax_spec, ax_center) = plt.subplots(3, 1, figsize=(9, 10))
+    ax_psd.semilogy(analyzer.freqs, analyzer.psd()[ch])
+    ax_psd.grid()
+    ax_psd.set_title('%s Ch%d Welch PSD (%d %s)' % (title, ch + 1, analyzer.n_added, 'acquisitions' if triggered else 'segments'))
+    ax_psd.set_xlabel('Frequency (Hz)')
+    ax_psd.set_ylabel('PSD (%s^2/Hz)' % unit)
+
+    spec = analyzer.spectrogram()[ch]
+    spec_db = 10 * np.log10(np.maximum(spec, np.max(spec) * 1e-12 if np.max(spec) > 0 else 1e-30))
+    positions = analyzer.column_positions()
+    image = ax_spec.imshow(spec_db.T, origin='lower', aspect='auto', cmap='viridis',
+                           extent=(positions[0], positions[-1] if len(positions) > 1 else positions[0] + 1,
+                                   analyzer.freqs[0], analyzer.freqs[-1]))
+    image.set_clim(spec_db.max() - ad2.DYNAMIC_RANGE_DB, spec_db.max())
+    fig.colorbar(image, ax=ax_spec, label='dB')
+    ax_spec.set_title('Spectrogram (%d per column)' % analyzer.items_per_column)
+    ax_spec.set_xlabel(x_label)
+    ax_spec.set_ylabel('Frequency (Hz)')
+
+    center = analyzer.center_frequency()[ch, :analyzer.n_added]
+    if triggered:
+        positions = np.arange(center.shape[0])
+    else:
+        positions = (np.arange(center.shape[0]) * analyzer.step + 0.5 * analyzer.nperseg) / analyzer.sample_rate
+    ax_center.plot(positions, center, '.', markersize=2)
+    ax_center.set_title('Center Frequency (power centroid)')
+    ax_center.set_xlabel(x_label)
+    ax_center.set_ylabel('Frequency (Hz)')
+    fig.tight_layout()
+    plt.show()
+
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Analog Discovery 2 - spectral analysis of WAV & session files')
+    parser.add_argument('filepath', help='.wav (record mode), _data.bin or _data.csv session file')
+    parser.add_argument('--channel', type=int, default=1, help='channel to plot (1, 2, ...)')
+    parser.add_argument('--nperseg', type=int, default=NPERSEG, help='segment length (continuous signals)')
+    parser.add_argument('--max-columns', type=int, default=MAX_COLUMNS, help='max. spectrogram time bins')
+    parser.add_argument('--band', type=float, nargs=2, default=(None, None), metavar=('FMIN', 'FMAX'), help='center frequency band (Hz)')
+    parser.add_argument('--window', type=int, nargs=2, default=(0, None), metavar=('START', 'STOP'), help='sample range of each acquisition (sessions)')
+    parser.add_argument('--samples-per-acq', type=int, default=None, help='analyze a WAV file as triggered acquisitions of N samples')
+    args = parser.parse_args()
+
+    try:
+        analyzer = analyze_file(args.filepath,
+                                samples_per_acq=args.samples_per_acq,
+                                nperseg=args.nperseg,
+                                max_columns=args.max_columns,
+                                band=tuple(args.band),
+                                acq_window=tuple(args.window),
+                                )
+    except (ValueError, OSError) as e:
+        print('ERROR - %s' % e)
+        sys.exit(1)
+
+    center = analyzer.center_frequency()[:, :analyzer.n_added]
+    print('Sample rate: %.6g Hz, %d channels, %d %s analyzed'
+          % (analyzer.sample_rate, analyzer.n_channels, analyzer.n_added,
+             'acquisitions' if analyzer.samples_per_acq else 'segments'))
+    for ch in range(analyzer.n_channels):
+        peak = analyzer.freqs[np.argmax(analyzer.psd()[ch])]
+        print('Ch%d: PSD peak %.6g Hz, center frequency mean %.6g Hz (std %.3g Hz, first-last drift %.3g Hz)'
+              % (ch + 1, peak, np.nanmean(center[ch]), np.nanstd(center[ch]),
+                 np.nanmean(center[ch, -10:]) - np.nanmean(center[ch, :10])))
+
+    plot_spectral(analyzer, args.channel - 1, os.path.basename(args.filepath))
@@ -0,0 +1,413 @@
+"""Live binary streaming of triggered acquisitions to network clients (plain TCP).
+
+    Live alternative to examples/graph_to_server.py (which records once & serves 1 PNG):
+    while the acquisition runs, the latest acquisition is decimated & pushed to every
+    connected client as a small binary frame.
+
+    The acquisition loop is ad2.TriggeredAcquisition (SDK calls in its own executor thread);
+    this server is just 1 more consumer of its blocks, so remote monitoring never runs in
+    (or waits in) the capture loop:
+        - 1 frame per block at most (the block's last acquisition), only when a client is due
+        - each frame is decimated/packed once & shared by every client wanting that dtype
+        - per-client rate limit (max. frames/sec, the client can lower it)
+        - per-client drop-oldest queue: a slow client (or network) only loses its own old
+          frames (counted in the header), it never holds acquisition buffers
+
+    Frame = header (STREAM_HEADER_FMT) + per channel (v_range, v_offset) (ad2.BIN_CHANNEL_FMT)
+            + data, little-endian, channel-major (n_channels x n_samples, int16 or float32 volts)
+        int16 -> volts: ad2.int16signal2voltage(data[ch], v_range, v_offset)
+    Client -> server commands (optional, 1 text line each):
+        rate <frames/sec>       (capped by the server's --rate)
+        dtype int16|float32
+
+    USAGE:
+        python stream_server.py [-n N_ACQUISITIONS] [--port 8765] [--decimation 4] [--rate 20] [--dtype int16]
+        python stream_server.py --client [--port 8765] [--rate 5] [--frames 100] [--delay 0.5]
+        AD2_BACKEND=sim python stream_server.py -n 0            # simulated device, until Ctrl+C
+"""
+
+# TODO WebSocket transport (browser clients) - needs a websockets package; the frame format stays the same
+# TODO optional sidecar writer (ad2.StreamingSessionWriter) as a 2nd consumer, to stream & save at once
+
+
+import numpy as np
+import collections
+import asyncio
+import socket
+import struct
+import signal
+import time
+import sys
+
+import ad2_tools as ad2
+
+
+STREAM_HOST = '127.0.0.1'           # local only by default (use --host 0.0.0.0 to serve the network)
+STREAM_PORT = 8765
+STREAM_MAX_RATE = 20.               # max. frames/sec per client
+STREAM_QUEUE_FRAMES = 4             # per-client queue (oldest frame dropped when full)
+STREAM_DECIMATION = 4               # samples per streamed sample
+STREAM_BLOCK_ACQUISITIONS = 4       # TriggeredAcquisition block size (small: frames follow the trigger rate)
+STREAM_WRITE_BUFFER = 2**16         # bytes buffered per socket (asyncio & OS) before the client's sender waits
+STREAM_CLOSE_TIMEOUT = 10.          # sec. the clients get to receive their queued frames when the acquisition ends
+
+STREAM_MAGIC = b'AD2F'
+STREAM_VERSION = 1
+STREAM_HEADER_FMT = '<4sHHHHdIQqQ'  # magic, version, dtype, n_channels, decimation, sample_rate (after decimation),
+                                    # n_samples, acq_index, timestamp_usec, n_dropped (frames this client lost)
+STREAM_HEADER_SIZE = struct.calcsize(STREAM_HEADER_FMT)
+STREAM_CHANNEL_SIZE = struct.calcsize(ad2.BIN_CHANNEL_FMT)
+STREAM_DTYPES = {'int16': (0, np.dtype('<i2')),
+                 'float32': (1, np.dtype('<f4')),
+                 }
+STREAM_DTYPE_CODES = {code: (name, dtype) for name, (code, dtype) in STREAM_DTYPES.items()}
+DECIMATION_METHODS = ['maxabs', 'mean', 'stride']
+
+
+def decimate(data, factor, method='maxabs'):
+    """Reduce the last axis by factor (new int16 array; the source block can be reused right after).
+
+        method = 'maxabs' (signed max-abs sample of each block: echoes stay visible, as in live_viewer.py)
+                 'mean' (block average) or 'stride' (every factor-th sample)
+    """
+    if factor <= 1:
+        return np.array(data)
+    n = data.shape[-1] // factor
+    blocks = data[..., :n * factor].reshape(data.shape[:-1] + (n, factor))
+    if method == 'stride':
+        return blocks[..., 0].copy()
+    if method == 'mean':
+        return np.rint(blocks.mean(axis=-1)).astype(data.dtype)
+    peak = np.argmax(np.abs(blocks.astype(np.int32)), axis=-1)     # int32: abs(-32768) overflows int16
+    return np.take_along_axis(blocks, peak[..., None], axis=-1)[..., 0]
+
+
+class Frame():
+    """1 received frame (see read_frame())."""
+
+    def __init__(self, header, channels, data):
+        (magic, version, dtype_code, self.n_channels, self.decimation, self.sample_rate,
+         self.n_samples, self.acq_index, self.timestamp_usec, self.n_dropped) = header
+        self.dtype = STREAM_DTYPE_CODES[dtype_code][0]
+        self.v_ranges = [v_range for v_range, v_offset in channels]
+        self.v_offsets = [v_offset for v_range, v_offset in channels]
+        self.data = data
+
+    def volts(self, ch):
+        if self.dtype == 'float32':
+            return self.data[ch]
+        return ad2.int16signal2voltage(self.data[ch], self.v_ranges[ch], self.v_offsets[ch], dtype=np.float32)
+
+
+async def read_frame(reader):
+    """Read the next frame from an asyncio StreamReader; None at the end of the stream (or a truncated frame)."""
+    try:
+        header = struct.unpack(STREAM_HEADER_FMT, await reader.readexactly(STREAM_HEADER_SIZE))
+        magic, version, dtype_code, n_channels, decimation, sample_rate, n_samples = header[:7]
+        if magic != STREAM_MAGIC or version != STREAM_VERSION:
+            raise ValueError('Not an AD2 stream frame (magic %r, version %d)' % (magic, version))
+        channels = [struct.unpack_from(ad2.BIN_CHANNEL_FMT, await reader.readexactly(STREAM_CHANNEL_SIZE))
+                    for ch in range(n_channels)]
+        dtype = STREAM_DTYPE_CODES[dtype_code][1]
+        raw = await reader.readexactly(n_channels * n_samples * dtype.itemsize)
+    except asyncio.IncompleteReadError:
+        return None
+    return Frame(header, channels, np.frombuffer(raw, dtype=dtype).reshape(n_channels, n_samples))
+
+
+class StreamClient():
+    """Server side of 1 connection: rate limit, drop-oldest frame queue & sender task."""
+
+    def __init__(self, server, reader, writer):
+        self.server = server
+        self.reader = reader
+        self.writer = writer
+        self.address = writer.get_extra_info('peername')
+        self.dtype = server.dtype
+        self.frames = collections.deque(maxlen=server.queue_frames)
+        self.ready = asyncio.Event()
+        self.closed = False
+        self.next_time = 0.
+        self.n_sent = 0
+        self.n_dropped = 0      # frames replaced by newer ones before they could be sent
+        self.set_rate(server.max_rate)
+
+    def set_rate(self, rate):
+        self.rate = min(rate, self.server.max_rate) if rate > 0 else self.server.max_rate
+        self.interval = 1. / self.rate
+
+    def due(self, now):
+        return not self.closed and now >= self.next_time
+
+    def offer(self, frame, now):
+        """Queue a frame (never waits; drops the oldest queued frame if the client is behind)."""
+        self.next_time = max(self.next_time + self.interval, now)
+        if len(self.frames) == self.frames.maxlen:
+            self.n_dropped += 1
+        self.frames.append(frame)
+        self.ready.set()
+
+    def close(self):
+        """Send what is queued, then disconnect."""
+        self.closed = True
+        self.ready.set()
+
+    async def send_loop(self):
+        writer = self.writer
+        try:
+            while True:
+                while not self.frames:
+                    if self.closed:
+                        return
+                    self.ready.clear()
+                    await self.ready.wait()
+                header, payload = self.frames.popleft()
+                writer.write(header + struct.pack('<Q', self.n_dropped))
+                writer.write(payload)
+                await writer.drain()        # only this client's task waits for a slow socket
+                self.n_sent += 1
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            self.closed = True
+            writer.close()
+
+    async def read_loop(self):
+        """Client commands ('rate 5', 'dtype float32'); the connection is closed at EOF."""
+        try:
+            while True:
+                line = await self.reader.readline()
+                if not line:
+                    break
+                words = line.decode('ascii', 'replace').split()
+                try:
+                    if len(words) == 2 and words[0] == 'rate':
+                        self.set_rate(float(words[1]))
+                    elif len(words) == 2 and words[0] == 'dtype' and words[1] in STREAM_DTYPES:
+                        self.dtype = words[1]
+                    else:
+                        print('Stream client %s: unknown command %r' % (self.address, line))
+                except ValueError:
+                    print('Stream client %s: bad command %r' % (self.address, line))
+        except (ConnectionError, OSError):
+            pass
+        self.close()
+
+
+class StreamServer():
+    """TCP server streaming the latest acquisition of a TriggeredAcquisition to every client.
+
+        acq = ad2.TriggeredAcquisition(config, block_size=STREAM_BLOCK_ACQUISITIONS)
+        server = StreamServer(acq)          # subscribes: create before acq.start()
+        await server.start()
+        async with acq:
+            await server.run()              # until the acquisition ends
+
+        decimation, method = see decimate()
+        dtype = default frame dtype ('int16' or 'float32' volts; each client can change it)
+        max_rate = max. frames/sec per client; queue_frames = per-client queue length
+    """
+
+    def __init__(self, acquisition, host=STREAM_HOST, port=STREAM_PORT, decimation=STREAM_DECIMATION,
+                 method='maxabs', dtype='int16', max_rate=STREAM_MAX_RATE, queue_frames=STREAM_QUEUE_FRAMES):
+        if method not in DECIMATION_METHODS:
+            raise ValueError('method must be one of %s (not %r)' % (DECIMATION_METHODS, method))
+        if dtype not in STREAM_DTYPES:
+            raise ValueError('dtype must be one of %s (not %r)' % (list(STREAM_DTYPES), dtype))
+        self.acquisition = acquisition
+        self.stream = acquisition.subscribe()
+        self.host = host
+        self.port = port
+        self.decimation = max(1, int(decimation))
+        self.method = method
+        self.dtype = dtype
+        self.max_rate = max_rate
+        self.queue_frames = queue_frames
+        self.sample_rate = acquisition.config.sample_rate / self.decimation
+        self.clients = []
+        self.tasks = set()      # 1 _handle_client task per connection
+        self.server = None
+        self.n_frames = 0       # frames packed (shared by the clients due at that block)
+
+    async def start(self):
+        self.server = await asyncio.start_server(self._handle_client, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]     # actual port (if 0 was given)
+
+    async def _handle_client(self, reader, writer):
+        sock = writer.get_extra_info('socket')
+        if sock is not None:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, STREAM_WRITE_BUFFER)   # OS buffer = stale frames
+        writer.transport.set_write_buffer_limits(high=STREAM_WRITE_BUFFER)
+        client = StreamClient(self, reader, writer)
+        self.clients.append(client)
+        task = asyncio.current_task()
+        self.tasks.add(task)
+        print('Stream client connected: %s' % (client.address,))
+        read_task = asyncio.ensure_future(client.read_loop())
+        try:
+            await client.send_loop()
+        finally:
+            read_task.cancel()
+            self.clients.remove(client)
+            self.tasks.discard(task)
+            print('Stream client disconnected: %s (%d frames sent, %d dropped)'
+                  % (client.address, client.n_sent, client.n_dropped))
+
+    def _pack(self, data, block, i, dtype):
+        """Shared frame for 1 dtype: (header without n_dropped, channels + data bytes)."""
+        code, np_dtype = STREAM_DTYPES[dtype]
+        n_channels, n_samples = data.shape
+        header = struct.pack(STREAM_HEADER_FMT[:-1], STREAM_MAGIC, STREAM_VERSION, code, n_channels, self.decimation,
+                             self.sample_rate, n_samples, block.index + i, int(block.timestamps_usec[i]))
+        channels = b''.join(struct.pack(ad2.BIN_CHANNEL_FMT, self.acquisition.v_ranges[ch], self.acquisition.v_offsets[ch])
+                            for ch in range(n_channels))
+        if dtype == 'float32':
+            data = np.stack([ad2.int16signal2voltage(data[ch], self.acquisition.v_ranges[ch],
+                                                     self.acquisition.v_offsets[ch], dtype=np.float32)
+                             for ch in range(n_channels)])
+        return header, channels + data.astype(np_dtype, copy=False).tobytes()
+
+    async def run(self):
+        """Consume the acquisition's blocks until it ends, then disconnect the clients."""
+        perf_counter = time.perf_counter
+        async for block in self.stream:
+            now = perf_counter()
+            due = [client for client in self.clients if client.due(now)]
+            if not due:
+                continue
+            i = block.n - 1
+            data = decimate(block.data[:, i], self.decimation, self.method)
+            frames = {}
+            for client in due:
+                frame = frames.get(client.dtype)
+                if frame is None:
+                    frame = frames[client.dtype] = self._pack(data, block, i, client.dtype)
+                    self.n_frames += 1
+                client.offer(frame, now)
+        for client in list(self.clients):
+            client.close()
+
+    async def close(self, timeout=STREAM_CLOSE_TIMEOUT):
+        """Let every client receive its queued frames (up to timeout sec.), then stop the server."""
+        for client in list(self.clients):
+            client.close()
+        if self.tasks:
+            pending = (await asyncio.wait(list(self.tasks), timeout=timeout))[1]
+            if pending:
+                for client in list(self.clients):
+                    client.writer.transport.abort()     # too slow: drop the connection (its sender sees ConnectionError)
+                await asyncio.wait(pending)
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+
+
+async def serve(config, host=STREAM_HOST, port=STREAM_PORT, **server_kwargs):
+    """Run the acquisition & stream it until it ends (or Ctrl+C)."""
+    acquisition = ad2.TriggeredAcquisition(config, block_size=STREAM_BLOCK_ACQUISITIONS)
+    server = StreamServer(acquisition, host, port, **server_kwargs)
+    await server.start()
+    print('Streaming on %s:%d (%d x decimation -> %.3g Hz, max. %.3g frames/sec per client)'
+          % (server.host, server.port, server.decimation, server.sample_rate, server.max_rate))
+    try:
+        asyncio.get_running_loop().add_signal_handler(signal.SIGINT, acquisition.stop)
+    except (NotImplementedError, RuntimeError):
+        pass    # Windows: Ctrl+C raises KeyboardInterrupt instead
+    try:
+        async with acquisition:
+            await server.run()
+    finally:
+        await server.close()
+    print('%d acquisitions (%d dropped by the acquisition loop) in %.2f s, %d frames packed'
+          % (acquisition.n_acquired, acquisition.n_dropped, acquisition.elapsed, server.n_frames))
+    return acquisition, server
+
+
+async def run_client(host=STREAM_HOST, port=STREAM_PORT, rate=None, dtype=None, n_frames=None, delay=0.):
+    """Test client: receive frames & print stats once per second.
+
+        rate, dtype = sent to the server (None = server defaults)
+        n_frames = stop after this many frames (None = until the server disconnects)
+        delay = sec to sleep after each frame (simulates a slow client: the server drops its old frames)
+    """
+    reader, writer = await asyncio.open_connection(host, port)
+    # small receive buffer: when behind, the server drops old frames instead of the OS queueing them
+    writer.get_extra_info('socket').setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, STREAM_WRITE_BUFFER)
+    if rate is not None:
+        writer.write(b'rate %g\n' % rate)
+    if dtype is not None:
+        writer.write(b'dtype %s\n' % dtype.encode('ascii'))
+    await writer.drain()
+
+    n = 0
+    n_bytes = 0
+    n_dropped = 0
+    n_skipped = 0       # acquisitions not streamed (rate limit, decimated blocks, drops)
+    last_index = None
+    t0 = t_print = time.perf_counter()
+    n_print = 0
+    frame = None
+    while n_frames is None or n < n_frames:
+        frame = await read_frame(reader)
+        if frame is None:
+            break
+        n += 1
+        n_bytes += STREAM_HEADER_SIZE + frame.n_channels * (STREAM_CHANNEL_SIZE + frame.data[0].nbytes)
+        n_dropped = frame.n_dropped
+        if last_index is not None:
+            n_skipped += frame.acq_index - last_index - 1
+        last_index = frame.acq_index
+        now = time.perf_counter()
+        if now - t_print >= 1.:
+            v_peak = float(np.max(np.abs(frame.volts(1))))
+            print('%6.1f frames/s | %7.1f kB/s | acq %d | %s %d x %d @ %.3g Hz | ch2 peak %.3f V | dropped %d'
+                  % ((n - n_print) / (now - t_print), n_bytes / (now - t0) / 1e3, frame.acq_index, frame.dtype,
+                     frame.n_channels, frame.n_samples, frame.sample_rate, v_peak, n_dropped))
+            t_print = now
+            n_print = n
+        if delay:
+            await asyncio.sleep(delay)
+    writer.close()
+    elapsed = time.perf_counter() - t0
+    print('Received %d frames (%.1f frames/s), %d dropped by the server, %d acquisitions not streamed'
+          % (n, n / elapsed if elapsed > 0 else 0., n_dropped, n_skipped))
+    return n, n_dropped
+
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Analog Discovery 2 - live acquisition streaming server (TCP)')
+    parser.add_argument('--client', action='store_true', help='run the test client instead of the server')
+    parser.add_argument('--host', default=STREAM_HOST, help='address to serve on / connect to')
+    parser.add_argument('--port', type=int, default=STREAM_PORT, help='TCP port')
+    parser.add_argument('--rate', type=float, default=None,
+                        help='max. frames/sec per client (server, default %g) / requested rate (client)' % STREAM_MAX_RATE)
+    parser.add_argument('--dtype', choices=list(STREAM_DTYPES), default=None, help='frame data type (default int16)')
+    # server:
+    parser.add_argument('-n', '--n-acquisitions', type=int, default=0, help='acquisitions (0 = until Ctrl+C)')
+    parser.add_argument('--trigger', choices=['ch1', 'external'], default='ch1', help='trigger source')
+    parser.add_argument('--no-pulse', action='store_true', help="don't generate the pulses (external pulses only)")
+    parser.add_argument('--decimation', type=int, default=STREAM_DECIMATION, help='samples per streamed sample')
+    parser.add_argument('--method', choices=DECIMATION_METHODS, default='maxabs', help='decimation method')
+    parser.add_argument('--queue', type=int, default=STREAM_QUEUE_FRAMES, help='per-client frame queue length')
+    # client:
+    parser.add_argument('--frames', type=int, default=None, help='client: stop after N frames')
+    parser.add_argument('--delay', type=float, default=0., help='client: sec to wait after each frame (slow client test)')
+    args = parser.parse_args()
+
+    if args.client:
+        asyncio.run(run_client(args.host, args.port, args.rate, args.dtype, args.frames, args.delay))
+        sys.exit(0)
+
+    config = ad2.AcquisitionConfig(n_acquisitions=args.n_acquisitions if args.n_acquisitions > 0 else None,
+                                   trigger_source=args.trigger,
+                                   pulse_device=None if args.no_pulse else 0,
+                                   )
+    try:
+        asyncio.run(serve(config, args.host, args.port, decimation=args.decimation, method=args.method,
+                          dtype=args.dtype or 'int16', max_rate=args.rate or STREAM_MAX_RATE, queue_frames=args.queue))
+    except KeyboardInterrupt:
+        print('Stopped.')
@@ -10,23 +10,24 @@ import datetime
 import os
 import pandas as pd
 
+import ad2_tools as ad2
 
 
 data_dir = 'tofcamsynctest1'
-ad2_times_file = '20220301-102012_timestamps.csv'   # direct output from timestamp_logger.py
+ad2_times_file = '20220301-102012_timestamps.csv'   # direct output from timestamp_logger.py (.csv or -b .bin)
 rrf_times_file = 'royale_20220301_102007.rrf.csv'   # already parsed from RRF file with Matlab
 
-# NOTE: AD2 times seem ok (units = seconds) as long as it's cast as int64
-#       RRF times need to be integer-divided by 1,000,000 (to convert usec -> whole sec)
-#           being careful to maintain datatype as int64
+# NOTE: all times are kept as int64 microseconds since Unix Epoch (full precision):
+#       AD2 times: ad2.timestamps_to_usec() (utc seconds + ticks, no float seconds)
+#       RRF times: already usec
 
-# TODO should main datatype be uint? or int64? (int64 seems to work so far)
+MAX_DIFF_USEC = 20000       # AD2 triggers further than this from any frame (after clock correction) are unmatched
 
 
 def print_timestamp(t, s='', f=None):
     """Pretty-print a timestamp with default or optional format string.
 
-        t = time to print (int64 seconds since unix epoch)
+        t = time to print (datetime, see usec_to_datetime())
         s = optional description string
         f = optional format string for strftime (omit for default)
     """
@@ -43,97 +44,66 @@ def print_timestamp(t, s='', f=None):
 def print_start_end(t):
     """Print human readable datetimes for beginning & end of time array.
 
-        NOTE: Times must be type=int64 
-                    and
-              in units of milliseconds (or Seconds???)
-
-        t = array of timestamps as seconds
-
+        t = array of timestamps, int64 microseconds since Unix Epoch
     """
     print(t.min())
     print(t.max())
-    
-    # TODO can this work with float datatypes??? losing fractions of seconds...
-
-    print(type(t[0]))
-    t0 = datetime.datetime.fromtimestamp(t.min())
-    t1 = datetime.datetime.fromtimestamp(t.max())
+    print_timestamp(usec_to_datetime(t.min()), 'Start:')
+    print_timestamp(usec_to_datetime(t.max()), 'End  :')
 
-    #print('Start: %s' % datetime.datetime.strftime(t0, "%Y-%m-%d_%H:%M:%S.%f"))
-    #print('End  : %s' % datetime.datetime.strftime(t1, "%Y-%m-%d_%H:%M:%S.%f"))
-    print_timestamp(t0, 'Start:')
-    print_timestamp(t1, 'End  :')
 
+def usec_to_datetime(t):
+    """int64 microseconds since Unix Epoch -> local datetime (keeps the microseconds)."""
+    return datetime.datetime.fromtimestamp(int(t) // 1000000) + datetime.timedelta(microseconds=int(t) % 1000000)
 
 
-ad2_times = pd.read_csv(os.path.join(data_dir, ad2_times_file), 
-                        sep=',', 
-                        header=None,
-                        names=['trig_utc_sec', 'trig_ticks', 'ticks_per_sec'],
-                        dtype=float,     # TODO is this ok? or overflow/keep as int?
-                            # TODO need float to convert the milliseconds... but int64 seems preferred by datetime.
-                        )
 
-ad2_times['time'] = ad2_times.trig_utc_sec + ad2_times.trig_ticks/ad2_times.ticks_per_sec   # time in seconds.decimals
-ad2_times['time_int'] = ad2_times['time'].astype('int64')
-#print('full column cast to int:')
-#print(type(ad2_times['time_int'][0]))
+# ASCII or binary timestamps
+ad2_times = ad2.load_timestamps(os.path.join(data_dir, ad2_times_file))
+ad2_times['time_usec'] = ad2.timestamps_to_usec(ad2_times)
 
 
 rrf_times = pd.read_csv(os.path.join(data_dir, rrf_times_file), 
                         #sep=',',
                         header=None,
-                        names=['time'],
+                        names=['time_usec'],
                         dtype='int64',
                         )
-rrf_times['time_int'] = rrf_times['time'] // 1000000    # convert usec -> sec but keep as int64
-
-# NOTE: from here on, the 'time_int' columns should be used
-#   datatype: int64
-#   units:    seconds
 
 print('ad2_times:')
-print(ad2_times['time'].head())
-print(ad2_times['time'].shape)
-#print_start_end((1000 * ad2_times['time']).astype(int))
-#print_start_end((1000 * ad2_times['time']))
-print_start_end((ad2_times['time_int']))
+print(ad2_times['time_usec'].head())
+print(ad2_times['time_usec'].shape)
+print_start_end(ad2_times['time_usec'].to_numpy())
 
 print()
 
 print('rrf_times:')
-print(rrf_times['time'].head())
-print(rrf_times['time'].shape)
-#print_start_end(1000000 * rrf_times['time'])
-#print_start_end(rrf_times['time'] // 1000000)
-print_start_end((rrf_times['time_int']))
+print(rrf_times['time_usec'].head())
+print(rrf_times['time_usec'].shape)
+print_start_end(rrf_times['time_usec'].to_numpy())
 
+print()
 
 
 
+# Match every AD2 trigger to its nearest RRF frame at once (sorted arrays + searchsorted),
+# fitting the offset & linear drift between the 2 clocks.
+# TODO offset_guess_usec if the PC clocks differ by more than ~1/2 frame period
 
-# TODO generalize this:
-# find the latest start time (whichever started 2nd)
-# then find the nearest timestamp in the other file, ie. to sync the first frame
-
-# assuming AD2 started after the RRF recording:
-
-# subtract the start time to search for (of later AD2 file in this case)
-# vectorwise from the full array of earlier start timestamps
-# then find the min(abs()) of the differences to find the *closest* matching timestamp.
-# UNITS MUST BE THE SAME!!!
-
-# TODO something is wrong.. rounding to seconds... because of strftime????
-# TODO need to keep fractinos of seconds!!!
-
+alignment = ad2.TimestampAlignment(ad2_times['time_usec'].to_numpy(),
+                                   rrf_times['time_usec'].to_numpy(),
+                                   max_diff_usec=MAX_DIFF_USEC,
+                                   )
+alignment.print_summary()
 
-searchtime = ad2_times['time_int'][0]
-timediffs = rrf_times['time_int'] - searchtime
-min_index = timediffs.abs().argmin()    # index into RRF array closest to AD2 start time
+# first AD2 trigger & its frame (same as the old single-trigger search, with fractions of seconds)
+searchtime = ad2_times['time_usec'][0]
+rrf_match_time = rrf_times['time_usec'][alignment.index[0]] if alignment.matched[0] else None
 
-rrf_match_time = rrf_times['time_int'][min_index]
+print_timestamp(usec_to_datetime(searchtime), 'AD2 time to find:')
+if rrf_match_time is not None:
+    print_timestamp(usec_to_datetime(rrf_match_time), 'RRF nearest time:')
+    print('Difference (sec): ', 1e-6 * (searchtime - rrf_match_time))
 
-print_timestamp(datetime.datetime.fromtimestamp(searchtime),     'AD2 time to find:')
-print_timestamp(datetime.datetime.fromtimestamp(rrf_match_time), 'RRF nearest time:')
-difference = searchtime - rrf_match_time
-print('Difference (sec): ', difference)
+matches = alignment.to_frame()
+matches.to_csv(os.path.join(data_dir, os.path.splitext(ad2_times_file)[0] + '_rrf_matches.csv'), index=False)
@@ -49,7 +49,7 @@ import os
 
 
 # MAJOR TODO LIST:
-# TODO  !!! write raw bytes to file instead of ASCII. !!!
+# DONE  !!! write raw bytes to file instead of ASCII. !!!  (-b option; see ad2_tools_basic.TimestampBuffer)
 #   - try code profiler to see how much difference this makes...
 # TODO triggerPosition - make trigger the LAST point in the acquisition
 #   - 100Mhz @ 16 samples min buffer = 1e-8 seconds per sample
@@ -133,11 +133,16 @@ parser = argparse.ArgumentParser(description='Analog Discovery 2 - Trigger Times
 parser.add_argument('-f', '--folder', required=True, help='directory to save files')
 # TODO make default 'this' folder?
 parser.add_argument('-d', '--desc',   default='timestamps', help='short description for filename')
+parser.add_argument('-b', '--binary', action='store_true', help='write binary fixed-width records (.bin) instead of ASCII CSV')
+parser.add_argument('--wait', choices=['spin', 'yield', 'predict'], default='spin', help='trigger wait: busy-wait, spin then yield the CPU, or sleep until just before the next expected trigger (TR measured; see ad2_tools_basic.WAIT_STRATEGIES)')
+parser.add_argument('--tr', type=float, default=None, help='expected TR (sec) for --wait predict (default: measured)')
 #parser.add_argument('-p', '--pulseinfo', type=bool, default=False, help='append pulse info to filename')
 
 args = parser.parse_args()
 out_folder = args.folder
 description = args.desc
+BINARY_MODE = args.binary
+WAIT_STRATEGY = args.wait
 
 
 # globals for loop stats (need to be global for signal_handler at end)
@@ -183,9 +188,14 @@ def signal_handler(signal, frame):
 
     close_AD2_device()
 
+    if BINARY_MODE:
+        # write the last partial block (file is closed by the 'with' block on exit)
+        ts_buffer.flush(f, loop_count)
+
 
     loop_time_duration = loop_end_time - loop_start_time
     print('Got %d triggers in %d seconds.' % (loop_count, loop_time_duration.total_seconds()))
+    waiter.print_summary()
 
     if loop_count > 0:
         tr = float(loop_time_duration.total_seconds()) / loop_count
@@ -256,7 +266,10 @@ pathlib.Path(out_folder).mkdir(parents=True, exist_ok=True)
 
 
 startTime = datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
-filename = '%s_%s.csv' % (startTime, description)
+if BINARY_MODE:
+    filename = '%s_%s.bin' % (startTime, description)
+else:
+    filename = '%s_%s.csv' % (startTime, description)
 
 
 print('Filename: %s' % filename)
@@ -286,6 +299,12 @@ trig_utc_sec  = c_uint()
 trig_ticks    = c_uint()
 ticks_per_sec = c_uint()
 
+# Binary mode: StatusTime writes straight into a preallocated block of records
+ts_buffer = ad2b.TimestampBuffer()
+ts_ptrs = ts_buffer.ptrs
+ts_block_len = ts_buffer.n_records
+ts_index = 0    # record index in the current block
+
 
 
 
@@ -323,7 +342,7 @@ buffersize_max = c_int()
 
 
 
-with open(fullpath, 'w') as f:
+with open(fullpath, 'wb' if BINARY_MODE else 'w') as f:
 
     print('Enabling Analog Input...')
     print('Please Wait at least 2 seconds to stabilize/warmup...')
@@ -355,59 +374,74 @@ with open(fullpath, 'w') as f:
     ad2b.check_and_print_error(dwf)
 
 
+    # FDwfAnalogInStatus polling (--wait); records polls & wake-up latency of every trigger
+    waiter = ad2b.make_waiter(WAIT_STRATEGY, dwf, hdwf, tr=args.tr)
+    wait_for_done = waiter.wait
+
     print('\nPress Ctrl+C to stop.\n')
     loop_start_time = datetime.datetime.now()
-    while True: # main loop
+    if BINARY_MODE:
+        while True: # main loop (binary)
+
+            wait_for_done()
 
+            # trigger time goes straight into the next record of the block buffer:
+            p_sec, p_ticks, p_tps = ts_ptrs[ts_index]
+            dwf.FDwfAnalogInStatusTime(hdwf, p_sec, p_ticks, p_tps)
+            loop_count += 1
 
-        # Check if scope triggered; do not copy data to PC (2nd arg)
-        # status check loop - busy wait until trigger/"Acquisition" is ready:
-        while True:
-            dwf.FDwfAnalogInStatus(hdwf, c_int(1), byref(scope_status)) # TODO change back to 0?
-            # TODO what does above c_int do? are the triggers still accurate with 0?
+            ts_index += 1
+            if ts_index == ts_block_len:
+                ts_buffer.flush(f, loop_count)
+                ts_index = 0
+
+    else:
+        while True: # main loop (ASCII)
+
+
+            # Check if scope triggered (FDwfAnalogInStatus fReadData=1)
+            # status check loop - wait until trigger/"Acquisition" is ready (see --wait):
+            # TODO read_data=False? are the triggers still accurate with 0?
             # TODO is it introducing a delay (by transferring acquired data over USB) and adding delay to triggers?
-            # TODO
-            if scope_status.value == DwfStateDone.value:
-                break
-                #print('|', end='', flush=True)  # DEBUG ONLY
-
-
-        # get time from trigger:
-        # (we are ignoring the actual data acquired, only need the time.)
-        dwf.FDwfAnalogInStatusTime(hdwf, byref(trig_utc_sec), byref(trig_ticks), byref(ticks_per_sec))
-
-
-        # Write ASCII Data to file (slower, larger file):
-        f.write(repr(trig_utc_sec.value)  + ',' + \
-                repr(trig_ticks.value)    + ',' + \
-                repr(ticks_per_sec.value) + '\n')
-        # TODO is \n sufficient or do we need Windows newline?
-        # TODO is repr necessary?
-
-        # TODO try to write raw bytes (maybe fixed bytes, no separators,
-        #   - ie. 3 values, each value is 4 bytes then AAAABBBBCCCCAAAABBBBCCCC...
-        #   - so no newlines, etc. and every 12th byte is the next set of values
-
-        # DEBUG ONLY: capture scope data
-        #if loop_count < debug_buffer_n_count:
-        #    # int 16 data:
-        #    #dwf.FDwfAnalogInStatusData16(hdwf, 
-        #    #                             c_int(0),
-        #    #                             byref(acquisition_data_ch1, acquisition_data_index),
-        #    #                             0,
-        #    #                             INPUT_SAMPLE_SIZE
-        #    #                             )
-
-        #    # double (actual voltage) data:
-        #    dwf.FDwfAnalogInStatusData(hdwf,
-        #                               c_int(0),
-        #                               byref(acquisition_data_ch1, acquisition_data_index),
-        #                               INPUT_SAMPLE_SIZE
-        #                               )
-
-        #    acquisition_data_index += acquisition_data_stride 
-
-        loop_count += 1
+            wait_for_done()
+
+
+            # get time from trigger:
+            # (we are ignoring the actual data acquired, only need the time.)
+            dwf.FDwfAnalogInStatusTime(hdwf, byref(trig_utc_sec), byref(trig_ticks), byref(ticks_per_sec))
+
+
+            # Write ASCII Data to file (slower, larger file):
+            f.write(repr(trig_utc_sec.value)  + ',' + \
+                    repr(trig_ticks.value)    + ',' + \
+                    repr(ticks_per_sec.value) + '\n')
+            # TODO is \n sufficient or do we need Windows newline?
+            # TODO is repr necessary?
+
+            # DONE (-b binary mode) try to write raw bytes (maybe fixed bytes, no separators,
+            #   - ie. 3 values, each value is 4 bytes then AAAABBBBCCCCAAAABBBBCCCC...
+            #   - so no newlines, etc. and every 12th byte is the next set of values
+
+            # DEBUG ONLY: capture scope data
+            #if loop_count < debug_buffer_n_count:
+            #    # int 16 data:
+            #    #dwf.FDwfAnalogInStatusData16(hdwf, 
+            #    #                             c_int(0),
+            #    #                             byref(acquisition_data_ch1, acquisition_data_index),
+            #    #                             0,
+            #    #                             INPUT_SAMPLE_SIZE
+            #    #                             )
+
+            #    # double (actual voltage) data:
+            #    dwf.FDwfAnalogInStatusData(hdwf,
+            #                               c_int(0),
+            #                               byref(acquisition_data_ch1, acquisition_data_index),
+            #                               INPUT_SAMPLE_SIZE
+            #                               )
+
+            #    acquisition_data_index += acquisition_data_stride 
+
+            loop_count += 1
 
 
 
@@ -0,0 +1,166 @@
+"""Custom wavegen waveforms for the Analog Discovery 2 (funcCustom).
+
+    Each function returns one wavegen buffer as a Numpy float64 array,
+    normalized to [-1, 1] (the AD2 scales it by FDwfAnalogOutNodeAmplitudeSet).
+    The wavegen plays the whole buffer once per period of FDwfAnalogOutNodeFrequencySet,
+    so eg. a 3-cycle tone burst at 1 MHz is played at 1e6/3 Hz for 3e-6 seconds (RunSet).
+
+    All samples are generated in one vectorized call, and results are cached by
+    their parameters (functools.lru_cache), so repeating or sweeping the same
+    excitation settings does not re-synthesize anything. Cached arrays are
+    read-only - use .copy() to modify one.
+
+    Use set_custom_waveform() to load a buffer into the wavegen; the array memory
+    is passed straight to FDwfAnalogOutNodeDataSet (no ctypes array copy).
+
+    NOTE: the max. custom buffer length depends on the device config,
+          ie. 4096 samples in the default config, 1024 in the 16k-scope config
+          (FDwfAnalogOutNodeDataInfo).
+
+    Usage:
+        import waveforms
+        data = waveforms.tone_burst(3, 1024, window='hann')
+        waveforms.set_custom_waveform(dwf, hdwf, 0, data, 1e6/3, 5.0)
+"""
+
+# TODO AM/FM node waveforms
+
+
+from ctypes import *
+from dwfconstants import *
+import numpy as np
+import functools
+
+
+WAVEFORM_CACHE_SIZE = 128   # max number of cached waveforms (per function)
+
+GAUSSIAN_SIGMA = 0.15       # default gaussian window width (fraction of the buffer length)
+
+
+def _read_only(data):
+    """Make a cached array read-only (callers share the same array)."""
+    data.setflags(write=False)
+    return data
+
+
+def _phase(n_samples, endpoint):
+    """Return n_samples phase values over one buffer period: [0, 1) or [0, 1] if endpoint."""
+    return np.linspace(0., 1., num=n_samples, endpoint=endpoint)
+
+
+@functools.lru_cache(maxsize=WAVEFORM_CACHE_SIZE)
+def sine_period(n_samples=1024, endpoint=False):
+    """One period of sine wave.
+
+        n_samples = buffer length
+        endpoint = include the last point (== first point) like np.linspace(0, period, n_samples)
+                   (this is what the original per-sample loops generated; False gives a seamless period)
+    """
+    return _read_only(np.sin(2*np.pi * _phase(n_samples, endpoint)))
+
+
+@functools.lru_cache(maxsize=WAVEFORM_CACHE_SIZE)
+def sine_burst(n_cycles, n_samples=1024):
+    """n_cycles of sine wave in one buffer (play at carrier_freq / n_cycles)."""
+    return _read_only(np.sin(2*np.pi * n_cycles * _phase(n_samples, False)))
+
+
+@functools.lru_cache(maxsize=WAVEFORM_CACHE_SIZE)
+def tone_burst(n_cycles, n_samples=1024, window='hann', sigma=GAUSSIAN_SIGMA):
+    """Windowed tone burst: n_cycles of sine wave with a smooth envelope (less ringing/bandwidth).
+
+        n_cycles = number of carrier cycles in the buffer (play at carrier_freq / n_cycles)
+        n_samples = buffer length
+        window = 'hann', 'gaussian' or None (rectangular, same as sine_burst)
+        sigma = gaussian window std. dev. as a fraction of the buffer length
+    """
+    phase = _phase(n_samples, False)
+    burst = np.sin(2*np.pi * n_cycles * phase)
+
+    if window == 'hann':
+        burst *= np.hanning(n_samples)
+    elif window == 'gaussian':
+        burst *= np.exp(-0.5 * ((phase - 0.5) / sigma)**2)
+    elif window is not None:
+        raise ValueError("Unknown window '%s' (use 'hann', 'gaussian' or None)" % window)
+
+    return _read_only(burst)
+
+
+@functools.lru_cache(maxsize=WAVEFORM_CACHE_SIZE)
+def chirp(f0, f1, duration, n_samples=1024, method='linear', window=None):
+    """Frequency sweep from f0 to f1 (Hz) over duration (sec); play at 1/duration Hz.
+
+        method = 'linear' or 'exponential' (f0, f1 > 0)
+        window = 'hann' or None
+    """
+    t = duration * _phase(n_samples, False)
+    if method == 'linear':
+        phase = f0*t + 0.5 * (f1 - f0) / duration * t**2
+    elif method == 'exponential':
+        # f(t) = f0 * (f1/f0)**(t/duration)
+        log_k = np.log(f1 / f0)
+        phase = f0 * duration / log_k * (np.exp(log_k * t / duration) - 1.)
+    else:
+        raise ValueError("Unknown chirp method '%s' (use 'linear' or 'exponential')" % method)
+
+    data = np.sin(2*np.pi * phase)
+    if window == 'hann':
+        data *= np.hanning(n_samples)
+    elif window is not None:
+        raise ValueError("Unknown window '%s' (use 'hann' or None)" % window)
+    return _read_only(data)
+
+
+@functools.lru_cache(maxsize=WAVEFORM_CACHE_SIZE)
+def square_pulse(width, n_samples=1024, bipolar=False):
+    """Single square pulse at the start of the buffer.
+
+        width = pulse width as a fraction of the buffer period (0-1)
+        bipolar = +1 for the first half of the pulse, -1 for the second half
+                  (otherwise +1 pulse, 0 elsewhere)
+    """
+    phase = _phase(n_samples, False)
+    data = np.where(phase < width, 1., 0.)
+    if bipolar:
+        data[(phase >= 0.5 * width) & (phase < width)] = -1.
+    return _read_only(data)
+
+
+def cache_info():
+    """Return dict of function name -> lru_cache info (hits/misses)."""
+    return {f.__name__: f.cache_info() for f in [sine_period, sine_burst, tone_burst, chirp, square_pulse]}
+
+
+def clear_cache():
+    """Empty all waveform caches."""
+    for f in [sine_period, sine_burst, tone_burst, chirp, square_pulse]:
+        f.cache_clear()
+
+
+
+# Wavegen setup:
+
+def set_custom_waveform(dwf, hdwf, channel, data, frequency, amplitude, v_offset=0.):
+    """Load a custom waveform buffer into a wavegen channel (carrier node).
+
+        The array memory is passed directly to the SDK (the SDK copies it to the device).
+
+        dwf
+        hdwf
+        channel = wavegen channel (0 or 1, python-int)
+        data = waveform buffer (float64 array, -1 to 1; ie. from this module)
+        frequency = buffer playback frequency (Hz; whole buffer per period)
+        amplitude = volts
+        v_offset = volts
+    """
+    data = np.ascontiguousarray(data, dtype=np.float64)     # no copy if already float64/contiguous
+    channel = c_int(channel)
+
+    dwf.FDwfAnalogOutNodeEnableSet(hdwf, channel, AnalogOutNodeCarrier, c_bool(True))
+    dwf.FDwfAnalogOutNodeFunctionSet(hdwf, channel, AnalogOutNodeCarrier, funcCustom)
+    dwf.FDwfAnalogOutNodeDataSet(hdwf, channel, AnalogOutNodeCarrier,
+                                 data.ctypes.data_as(POINTER(c_double)), c_int(data.shape[0]))
+    dwf.FDwfAnalogOutNodeFrequencySet(hdwf, channel, AnalogOutNodeCarrier, c_double(frequency))
+    dwf.FDwfAnalogOutNodeAmplitudeSet(hdwf, channel, AnalogOutNodeCarrier, c_double(amplitude))
+    dwf.FDwfAnalogOutNodeOffsetSet(hdwf, channel, AnalogOutNodeCarrier, c_double(v_offset))